@@ -23,6 +23,45 @@ from lasif.adjoint_sources import time_frequency, utils
 
 eps = np.spacing(1)
 
+# Frequencies at which the lowpass part of the time frequency weighting
+# drops below this value are neither computed nor stored. All contributions
+# scale with the square of the weight so this does not change the results.
+NEGLIGIBLE_WEIGHT = 1E-4
+
+
+def _count_phase_jumps(test_field, rows, row_count, column_count,
+                       threshold=0.7):
+    """
+    Counts the jumps larger than the threshold between neighbouring samples
+    in time and in frequency direction of a time frequency representation of
+    which only the given rows and the first ``test_field.shape[1]`` columns
+    are stored. All other values are zero.
+
+    >>> field = np.array([[0.0, 0.8], [0.9, 0.0]])
+    >>> int(_count_phase_jumps(field, np.array([0, 2]), 4, 3))
+    6
+    """
+    jumps = np.abs(test_field) > threshold
+
+    # Time direction. Rows without a stored predecessor or successor jump
+    # from or to zero.
+    adjacent = np.diff(rows) == 1
+    previous = np.zeros_like(test_field)
+    previous[1:][adjacent] = test_field[:-1][adjacent]
+    has_previous = rows > 0
+    criterion = np.sum(
+        np.abs(test_field - previous)[has_previous] > threshold)
+    gap_after = np.ones(len(rows), dtype=bool)
+    gap_after[:-1] = ~adjacent
+    gap_after &= rows < row_count - 1
+    criterion += np.sum(jumps[gap_after])
+
+    # Frequency direction.
+    criterion += np.sum(np.abs(np.diff(test_field, axis=1)) > threshold)
+    if test_field.shape[1] < column_count:
+        criterion += np.sum(jumps[:, -1])
+    return criterion
+
 
 def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
                           plot=False, max_criterion=7.0):
@@ -85,12 +124,26 @@ def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
     # Window width is twice the minimal period.
     width = 2.0 * min_period
 
+    # Only the rows above the threshold and the frequencies up to where the
+    # lowpass weighting becomes negligible are computed and stored. This
+    # reduces the memory from N^2 to a fraction of it.
+    max_frequency = (1.0 - np.log(NEGLIGIBLE_WEIGHT) / 10.0) / min_period
+
     # Compute time-frequency representation of the cross-correlation
     _, _, tf_cc = time_frequency.time_frequency_cc_difference(
-        t, data, synthetic, width)
+        t, data, synthetic, width, max_frequency=max_frequency, sparse=True)
     # Compute the time-frequency representation of the synthetic
-    tau, nu, tf_synth = time_frequency.time_frequency_transform(t, synthetic,
-                                                                width)
+    tau, nu, tf_synth = time_frequency.time_frequency_transform(
+        t, synthetic, width, max_frequency=max_frequency, sparse=True)
+
+    if not len(tf_cc.rows):
+        msg = "The time frequency representation is zero."
+        raise LASIFAdjointSourceCalculationError(msg)
+
+    tf_shape = tf_cc.shape
+    rows = tf_cc.rows
+    tf_synth = tf_synth.take_rows(rows)
+    tf_cc = tf_cc.data
 
     # -------------------------------------------------------------------------
     # compute tf window and weighting function
@@ -100,7 +153,7 @@ def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
     m = tf_cc_abs.max() / 10.0  # NOQA
     weight = ne.evaluate("1.0 - exp(-(tf_cc_abs ** 2) / (m ** 2))")
 
-    nu_t = nu.T
+    nu_t = nu[:tf_cc.shape[1]]
 
     # highpass filter (periods longer than max_period are suppressed
     # exponentially)
@@ -131,9 +184,7 @@ def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
     _x = abs_weighted_DP.max()  # NOQA
     test_field = ne.evaluate("weight * DP / _x")
 
-    criterion_1 = np.sum([np.abs(np.diff(test_field, axis=0)) > 0.7])
-    criterion_2 = np.sum([np.abs(np.diff(test_field, axis=1)) > 0.7])
-    criterion = np.sum([criterion_1, criterion_2])
+    criterion = _count_phase_jumps(test_field, rows, *tf_shape)
     # Compute the phase misfit
     dnu = nu[1] - nu[0]
 
@@ -168,7 +219,9 @@ def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
         "weight ** 2 * DP * tf_synth / (m + abs(tf_synth) ** 2)")
 
     # Invert tf transform and make adjoint source
-    ad_src, it, I = time_frequency.itfa(tau, idp, width)
+    ad_src, it, I = time_frequency.itfa(
+        tau, time_frequency.SparseTimeFrequencyRepresentation(
+            rows=rows, data=idp, shape=tf_shape), width)
 
     # Interpolate both signals to the new time axis
     ad_src = lanczos_interpolation(
@@ -220,7 +273,10 @@ def adsrc_tf_phase_misfit(t, data, synthetic, min_period, max_period,
         cm_axis = fig.add_axes(rect)
 
         # Plot the weighted phase difference.
-        weighted_phase_difference = (DP * weight).transpose()
+        weighted_phase_difference = \
+            time_frequency.SparseTimeFrequencyRepresentation(
+                rows=rows, data=DP * weight,
+                shape=tf_shape).toarray().transpose()
         mappable = tf_axis.pcolormesh(
             tau, nu, weighted_phase_difference, vmin=-1.0, vmax=1.0,
             cmap=get_colormap("tomo_full_scale_linear_lightness_r"),
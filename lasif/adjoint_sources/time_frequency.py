@@ -11,12 +11,141 @@ Time frequency functions.
 """
 import numpy as np
 import scipy.fftpack
-import scipy.interpolate
 
 from lasif.adjoint_sources import utils
 
 
-def time_frequency_transform(t, s, width, threshold=1E-2):
+# Maximum number of elements of the temporary 2-D arrays. Larger transforms
+# are computed in chunks of rows so the memory stays bounded.
+MAX_CHUNK_ELEMENTS = 2 ** 22
+
+
+def _row_chunks(row_count, column_count, chunk_size=None):
+    """
+    Yields slices over the rows of a 2-D array so that no chunk has more
+    than :data:`MAX_CHUNK_ELEMENTS` elements.
+
+    >>> list(_row_chunks(5, 10, chunk_size=2))
+    [slice(0, 2, None), slice(2, 4, None), slice(4, 5, None)]
+
+    :param row_count: The number of rows.
+    :param column_count: The number of columns.
+    :param chunk_size: Number of rows per chunk. Determined from
+        :data:`MAX_CHUNK_ELEMENTS` if not given.
+    """
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(column_count, 1))
+    for start in range(0, row_count, chunk_size):
+        yield slice(start, min(start + chunk_size, row_count))
+
+
+def _window_matrix(t_rows, t, width):
+    """
+    Gaussian windows centered at each of ``t_rows`` evaluated at ``t``. Every
+    row is one window.
+    """
+    return utils.gaussian_window(t[np.newaxis, :] - t_rows[:, np.newaxis],
+                                 width)
+
+
+class SparseTimeFrequencyRepresentation(object):
+    """
+    Time frequency representation only storing some rows, e.g. the windows
+    above the threshold, and the lowest frequencies of each row. All other
+    values are zero.
+
+    >>> tfr = SparseTimeFrequencyRepresentation(
+    ...     rows=np.array([1, 3]), data=np.ones((2, 2)), shape=(4, 4))
+    >>> tfr.toarray().real
+    array([[0., 0., 0., 0.],
+           [1., 1., 0., 0.],
+           [0., 0., 0., 0.],
+           [1., 1., 0., 0.]])
+    """
+    def __init__(self, rows, data, shape):
+        """
+        :param rows: Sorted indices of the stored rows.
+        :param data: The stored values with shape ``(len(rows), columns)``.
+        :param shape: The shape of the full representation.
+        """
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.data = data
+        self.shape = tuple(shape)
+
+    def __str__(self):
+        return ("Sparse time frequency representation with %i of %i rows "
+                "and %i of %i columns (%.1f MB)" % (
+                    len(self.rows), self.shape[0], self.column_count,
+                    self.shape[1], self.data.nbytes / 1024.0 ** 2))
+
+    @property
+    def column_count(self):
+        return self.data.shape[1]
+
+    def take_rows(self, rows):
+        """
+        Returns the stored columns of the given rows. Rows not stored are
+        zero.
+
+        :param rows: Sorted row indices.
+        """
+        data = np.zeros((len(rows), self.column_count),
+                        dtype=self.data.dtype)
+        idx = np.searchsorted(self.rows, rows)
+        idx[idx == len(self.rows)] = 0
+        found = self.rows[idx] == rows if len(self.rows) else \
+            np.zeros(len(rows), dtype=bool)
+        data[found] = self.data[idx[found]]
+        return data
+
+    def toarray(self):
+        """
+        Returns the full representation as a 2-D array.
+        """
+        array = np.zeros(self.shape, dtype=self.data.dtype)
+        array[self.rows, :self.column_count] = self.data
+        return array
+
+
+def _get_column_count(N, dt, max_frequency=None):
+    """
+    Number of frequencies of a discrete Fourier transform of length ``N`` up
+    to and including ``max_frequency``.
+    """
+    if max_frequency is None:
+        return N
+    return int(min(N, max(1, np.floor(max_frequency * N * dt) + 1)))
+
+
+def _assemble(chunks, shape, column_count, sparse):
+    """
+    Assembles the time frequency representation from chunks of rows.
+
+    :param chunks: Iterable of tuples of row indices and the corresponding
+        rows.
+    """
+    if sparse:
+        rows = []
+        data = []
+        for idx, values in chunks:
+            rows.append(idx)
+            data.append(values[:, :column_count])
+        if not rows:
+            return SparseTimeFrequencyRepresentation(
+                rows=[], data=np.zeros((0, column_count),
+                                       dtype="complex128"), shape=shape)
+        return SparseTimeFrequencyRepresentation(
+            rows=np.concatenate(rows), data=np.concatenate(data),
+            shape=shape)
+
+    tfs = np.zeros(shape, dtype="complex128")
+    for idx, values in chunks:
+        tfs[idx, :column_count] = values[:, :column_count]
+    return tfs
+
+
+def time_frequency_transform(t, s, width, threshold=1E-2, chunk_size=None,
+                             max_frequency=None, sparse=False):
     """
     Gabor transform (time frequency transform with Gaussian windows).
 
@@ -27,43 +156,80 @@ def time_frequency_transform(t, s, width, threshold=1E-2):
     :param width: width of the Gaussian window
     :param threshold: fraction of the absolute signal below which the Fourier
         transform is set to zero in order to reduce computation time
+    :param chunk_size: Number of windows transformed at once. Chosen to
+        bound the memory usage if not given.
+    :param max_frequency: Higher frequencies are set to zero.
+    :param sparse: Return a :class:`SparseTimeFrequencyRepresentation`
+        only storing the rows above the threshold and the frequencies up to
+        ``max_frequency``.
     """
     N = len(t)
     dt = t[1] - t[0]
 
     nu = np.linspace(0, float(N - 1) / (N * dt), N)
 
-    # Compute the time frequency representation
-    tfs = np.zeros((N, N), dtype="complex128")
-
     threshold = np.abs(s).max() * threshold
 
-    for k in range(N):
-        # Window the signals
-        f = utils.gaussian_window(t - t[k], width) * s
+    def chunks():
+        for rows in _row_chunks(N, N, chunk_size):
+            # Window the signals
+            f = _window_matrix(t[rows], t, width) * s
 
-        # No need to transform if nothing is there. Great speedup as lots of
-        # windowed functions have 0 everywhere.
-        if np.abs(f).max() < threshold:
-            continue
+            # No need to transform if nothing is there. Great speedup as lots
+            # of windowed functions have 0 everywhere.
+            mask = np.abs(f).max(axis=1) >= threshold
+            if not mask.any():
+                continue
 
-        tfs[k, :] = scipy.fftpack.fft(f)
+            yield (np.arange(rows.start, rows.stop)[mask],
+                   scipy.fftpack.fft(f[mask], axis=1) *
+                   (dt / np.sqrt(2.0 * np.pi)))
 
-    tfs *= dt / np.sqrt(2.0 * np.pi)
+    # Compute the time frequency representation
+    tfs = _assemble(chunks(), (N, N), _get_column_count(N, dt, max_frequency),
+                    sparse)
 
     return t, nu, tfs
 
 
-def time_frequency_cc_difference(t, s1, s2, width, threshold=1E-2):
+def _linear_interpolation_weights(x, x_new):
+    """
+    Indices and weights to linearly interpolate values given at the
+    possibly unsorted ``x`` at ``x_new``. The interpolated values are
+    ``y[..., idx_left] * (1 - w) + y[..., idx_right] * w``.
+    """
+    order = np.argsort(x)
+    x_sorted = x[order]
+    idx = np.clip(np.searchsorted(x_sorted, x_new) - 1, 0, len(x) - 2)
+    w = (x_new - x_sorted[idx]) / (x_sorted[idx + 1] - x_sorted[idx])
+    if np.any(w < 0.0) or np.any(w > 1.0):
+        raise ValueError("A value in x_new is outside of the interpolation "
+                         "range.")
+    return order[idx], order[idx + 1], w
+
+
+def time_frequency_cc_difference(t, s1, s2, width, threshold=1E-2,
+                                 chunk_size=None, max_frequency=None,
+                                 sparse=False):
     """
     Straight port of tfa_cc_new.m
 
+    The cross correlations of all windowed signals are computed in the
+    frequency domain and interpolated to the frequencies of the original
+    signals at once.
+
     :param t: discrete time
     :param s1: discrete signal 1
     :param s2: discrete signal 2
     :param width: width of the Gaussian window
     :param threshold: fraction of the absolute signal below which the Fourier
         transform is set to zero in order to reduce computation time
+    :param chunk_size: Number of windows transformed at once. Chosen to
+        bound the memory usage if not given.
+    :param max_frequency: Higher frequencies are set to zero.
+    :param sparse: Return a :class:`SparseTimeFrequencyRepresentation`
+        only storing the rows above the threshold and the frequencies up to
+        ``max_frequency``.
     """
     dt = t[1] - t[0]
 
@@ -77,53 +243,104 @@ def time_frequency_cc_difference(t, s1, s2, width, threshold=1E-2):
     nu = np.linspace(0, (N - 1) * dnu, N)
     tau = t_cc
 
-    cc_freqs = scipy.fftpack.fftfreq(len(t_cc), d=dt)
-    freqs = scipy.fftpack.fftfreq(len(t), d=dt)
+    column_count = _get_column_count(len(t), dt, max_frequency)
 
-    # Compute the time frequency representation
-    tfs = np.zeros((len(t), len(t)), dtype="complex128")
+    cc_freqs = scipy.fftpack.fftfreq(len(t_cc), d=dt)
+    freqs = scipy.fftpack.fftfreq(len(t), d=dt)[:column_count]
+    idx_left, idx_right, w_right = \
+        _linear_interpolation_weights(cc_freqs, freqs)
 
     threshold = np.abs(s1).max() * threshold
 
-    for k in range(len(t)):
-        # Window the signals
-        w = utils.gaussian_window(t - tau[k], width)
-        f1 = w * s1
-        f2 = w * s2
+    def chunks():
+        for rows in _row_chunks(len(t), len(t_cc), chunk_size):
+            # Window the signals
+            w = _window_matrix(tau[rows], t, width)
+            f1 = w * s1
+            f2 = w * s2
+
+            mask = np.minimum(np.abs(f1).max(axis=1),
+                              np.abs(f2).max(axis=1)) >= threshold
+            if not mask.any():
+                continue
+
+            # Spectrum of the cross correlation as computed by
+            # utils.cross_correlation(f2, f1). Zero padding to the full
+            # length of the correlation avoids any wrap around.
+            cc_spec = scipy.fftpack.fft(f2[mask], n=len(t_cc), axis=1) * \
+                np.conj(scipy.fftpack.fft(f1[mask], n=len(t_cc), axis=1))
+
+            yield (np.arange(rows.start, rows.stop)[mask],
+                   (cc_spec[:, idx_left] * (1.0 - w_right) +
+                    cc_spec[:, idx_right] * w_right) *
+                   (dt / np.sqrt(2.0 * np.pi)))
 
-        if min(np.abs(f1).max(), np.abs(f2).max()) < threshold:
-            continue
-
-        cc = utils.cross_correlation(f2, f1)
-        tfs[k, :] = \
-            scipy.interpolate.interp1d(cc_freqs, scipy.fftpack.fft(cc))(freqs)
-    tfs *= dt / np.sqrt(2.0 * np.pi)
+    # Compute the time frequency representation
+    tfs = _assemble(chunks(), (len(t), len(t)), column_count, sparse)
 
     return tau, nu, tfs
 
 
-def itfa(tau, tfs, width, threshold=1E-2):
-    N = len(tau)
-    dt = tau[1] - tau[0]
+def itfa(tau, tfs, width, threshold=1E-2, chunk_size=None):
+    """
+    Inverse of the Gabor transform.
 
-    threshold = np.abs(tfs).max() * threshold
+    If ``tfs`` is a :class:`SparseTimeFrequencyRepresentation`, only its
+    stored rows are transformed and the returned ``I`` is sparse as well.
+    Otherwise ``I`` is dense, also if ``tfs`` is zero everywhere.
 
-    # inverse fft
-    I = np.zeros((N, N), dtype="complex128")
+    :param tau: discrete time.
+    :param tfs: The time frequency representation.
+    :param width: width of the Gaussian window
+    :param threshold: fraction of the absolute time frequency representation
+        below which rows are not transformed.
+    :param chunk_size: Number of rows transformed at once. Chosen to bound
+        the memory usage if not given.
+    """
+    N = len(tau)
+    dt = tau[1] - tau[0]
 
-    # IFFT and scaling.
-    for k in range(N):
-        if np.abs(tfs[k, :]).max() < threshold:
-            continue
-        I[k, :] = scipy.fftpack.ifft(tfs[k, :])
+    if isinstance(tfs, SparseTimeFrequencyRepresentation):
+        rows, data = tfs.rows, tfs.data
+    else:
+        rows, data = np.arange(N), tfs
+
+    # Nothing to transform.
+    if not len(rows) or not np.abs(data).max():
+        if isinstance(tfs, SparseTimeFrequencyRepresentation):
+            I = SparseTimeFrequencyRepresentation(
+                rows=[], data=np.zeros((0, N), dtype="complex128"),
+                shape=(N, N))
+        else:
+            I = np.zeros((N, N), dtype="complex128")
+        return np.zeros(N, dtype="complex128"), tau, I
+
+    threshold = np.abs(data).max() * threshold
+    mask = np.abs(data).max(axis=1) >= threshold
+    rows = rows[mask]
+
+    # inverse fft and scaling. Missing high frequencies are zero.
+    I = np.zeros((len(rows), N), dtype="complex128")
+    idx = np.where(mask)[0]
+    for chunk in _row_chunks(len(rows), N, chunk_size):
+        I[chunk] = scipy.fftpack.ifft(data[idx[chunk]], n=N, axis=1)
     I *= 2.0 * np.pi / dt
 
-    # time integration
+    # time integration. Only the transformed rows contribute.
     s = np.zeros(N, dtype="complex128")
 
-    for k in range(N):
-        f = utils.gaussian_window(tau[k] - tau, width) * I[:, k].transpose()
-        s[k] = np.sum(f) * dt
+    for chunk in _row_chunks(N, len(rows), chunk_size):
+        f = _window_matrix(tau[chunk], tau[rows], width) * \
+            I[:, chunk].transpose()
+        s[chunk] = np.sum(f, axis=1) * dt
     s *= dt / np.sqrt(2.0 * np.pi)
 
+    if isinstance(tfs, SparseTimeFrequencyRepresentation):
+        I = SparseTimeFrequencyRepresentation(rows=rows, data=I,
+                                              shape=(N, N))
+    else:
+        full_I = np.zeros((N, N), dtype="complex128")
+        full_I[rows] = I
+        I = full_I
+
     return s, tau, I
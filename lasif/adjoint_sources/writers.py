@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Writers for the solver specific adjoint source files.
+
+Each writer formats a whole array with a single string formatting operation
+instead of formatting it line by line which dominates the time needed to
+finalize the adjoint sources of events with many stations. All writers
+return the number of bytes written.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import numpy as np
+
+
+# Maps the XYZ components of SES3D to ZNE.
+SES3D_CHANNEL_MAPPING = {"X": "N", "Y": "E", "Z": "Z"}
+
+
+def format_columns(columns, fmt):
+    """
+    Formats the columns with one row per line in one go.
+
+    :param columns: List of equally long arrays.
+    :param fmt: The format of a single value.
+
+    >>> print(format_columns([[1.0, 2.0], [3.0, 4.0]], "%.1f"), end="")
+    1.0 3.0
+    2.0 4.0
+    """
+    data = np.column_stack([np.asarray(_i, dtype=np.float64)
+                            for _i in columns])
+    line = " ".join([fmt] * data.shape[1]) + "\n"
+    return (line * data.shape[0]) % tuple(data.ravel().tolist())
+
+
+def _write(filename, contents):
+    with open(filename, "wt") as fh:
+        fh.write(contents)
+    return os.path.getsize(filename)
+
+
+def write_ses3d_adjoint_source(filename, coordinates, channels):
+    """
+    Writes an adjoint source file in the SES3D format.
+
+    :param filename: The output filename.
+    :param coordinates: Tuple of colatitude, longitude, and depth of the
+        adjoint source in the possibly rotated frame of the solver.
+    :param channels: Dictionary with the Z, N, and E components.
+    """
+    # Revert the X component as it has to point south in SES3D.
+    contents = "".join([
+        "-- adjoint source ------------------\n",
+        "-- source coordinates (colat,lon,depth)\n",
+        "%f %f %f\n" % tuple(coordinates),
+        "-- source time function (x, y, z) --\n",
+        format_columns([-1.0 * channels[SES3D_CHANNEL_MAPPING["X"]],
+                        channels[SES3D_CHANNEL_MAPPING["Y"]],
+                        channels[SES3D_CHANNEL_MAPPING["Z"]]], "%e"),
+        "\n"])
+    return _write(filename, contents)
+
+
+def write_specfem_adjoint_source(filename, data, dt, time_shift=0.0):
+    """
+    Writes an adjoint source file of a single component in the two column
+    ASCII format of SPECFEM.
+
+    :param filename: The output filename.
+    :param data: The adjoint source as calculated by LASIF.
+    :param dt: The sampling interval.
+    :param time_shift: Time shift of the first sample.
+    """
+    npts = len(data)
+    times = np.linspace(0, (npts - 1) * dt, npts) + time_shift
+    # SPECFEM expects non-time reversed adjoint sources and the sign is
+    # different for some reason.
+    data = -1.0 * np.asarray(data)[::-1]
+    # Same format as np.savetxt().
+    return _write(filename, format_columns([times, data], "%.18e"))
+
+
+def write_adjoint_sources_for_station(solver, output_folder, station,
+                                      channels, filename=None,
+                                      coordinates=None, dt=None,
+                                      time_shift=0.0):
+    """
+    Writes all adjoint source files of one station.
+
+    :param solver: ``"ses3d"`` or ``"specfem"``.
+    :param output_folder: The output folder.
+    :param station: The station id in the form NET.STA.
+    :param channels: Dictionary with the Z, N, and E components.
+    :param filename: The filename within the output folder for SES3D.
+    :param coordinates: The adjoint source coordinates for SES3D.
+    :param dt: The sampling interval for SPECFEM.
+    :param time_shift: The time shift of the first sample for SPECFEM.
+    :returns: The number of bytes written.
+    """
+    if solver == "ses3d":
+        return write_ses3d_adjoint_source(
+            os.path.join(output_folder, filename), coordinates, channels)
+    elif solver == "specfem":
+        # XXX: M band code could be different.
+        return sum(write_specfem_adjoint_source(
+            os.path.join(output_folder, "%s.MX%s.adj" % (station, component)),
+            channels[component], dt, time_shift)
+            for component in ["Z", "N", "E"])
+    raise NotImplementedError(
+        "Adjoint source writing for solver '%s' not yet implemented." %
+        solver)
@@ -1,7 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-A class handling the adjoint sources.
+Classes handling the adjoint sources.
+
+All adjoint sources of one event and iteration are stored in two files
+managed by :class:`~AdjointSourceStore`: the samples of all adjoint sources
+are appended to a single binary file of little endian 64 bit floats and a
+SQLite database indexes them by their window and keeps the misfit values.
+This keeps the number of files independent of the number of windows.
+Replacing or deleting an adjoint source only updates the index, its old
+samples stay in the data file until the store is compacted with
+:meth:`AdjointSourceStore.vacuum`.
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
@@ -11,37 +20,273 @@ A class handling the adjoint sources.
 """
 import numpy as np
 import os
+import pickle
+import sqlite3
 
 
-class AdjointSourceManager(object):
+ADJOINT_SOURCE_INDEX_FILENAME = "adjoint_sources.sqlite"
+ADJOINT_SOURCE_DATA_FILENAME = "adjoint_sources.bin"
 
-    """ Class for reading and writing adjoint sources. """
+# Samples are always stored as little endian 64 bit floats just to be able
+# to handle any solver and what not.
+ADJOINT_SOURCE_DTYPE = np.dtype("<f8")
+
+
+class AdjointSourceStore(object):
+    """
+    Consolidated storage of all adjoint sources of one event and iteration.
 
+    Adjoint sources are identified by their channel, window, taper, and
+    adjoint source type. Looking one up is a single query on a unique
+    index, the samples are read lazily by memory mapping the data file.
+
+    Several processes can write to the same store. Each write appends the
+    samples and inserts the index row within one exclusive database
+    transaction so concurrent appends never overlap. Samples written by an
+    interrupted transaction are never referenced.
+
+    >>> import tempfile
+    >>> from obspy import UTCDateTime
+    >>> store = AdjointSourceStore(tempfile.mkdtemp())
+    >>> key = ("BW.ALTM..HHZ", UTCDateTime(2012, 1, 1),
+    ...        UTCDateTime(2012, 1, 1, 0, 1), "cosine", 0.05, "L2Norm")
+    >>> store.put(*key, adjoint_source={
+    ...     "adjoint_source": np.arange(3.0), "misfit_value": 0.5,
+    ...     "details": {}})
+    >>> len(store)
+    1
+    >>> store.get(*key)["adjoint_source"]
+    memmap([0., 1., 2.])
+    >>> print(store.get("BW.ALTM..HHN", *key[1:]))
+    None
+    """
     def __init__(self, directory):
+        """
+        :param directory: The directory of the store. Will be created if it
+            does not exist.
+        """
         self.directory = directory
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
+        self.data_filename = os.path.join(self.directory,
+                                          ADJOINT_SOURCE_DATA_FILENAME)
+        self.index_filename = os.path.join(self.directory,
+                                           ADJOINT_SOURCE_INDEX_FILENAME)
+        self._data = None
+        self._data_inode = None
+
+        # Transactions are managed explicitly.
+        self.db_conn = sqlite3.connect(self.index_filename, timeout=60.0,
+                                       isolation_level=None)
+        self.db_cursor = self.db_conn.cursor()
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS adjoint_sources (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id TEXT NOT NULL,
+                starttime_ns INTEGER NOT NULL,
+                endtime_ns INTEGER NOT NULL,
+                taper TEXT NOT NULL,
+                taper_percentage REAL NOT NULL,
+                ad_src_type TEXT NOT NULL,
+                misfit_value REAL NOT NULL,
+                details BLOB NOT NULL,
+                offset INTEGER NOT NULL,
+                npts INTEGER NOT NULL
+            );""")
+        self.db_cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS adjoint_sources_window ON "
+            "adjoint_sources(channel_id, starttime_ns, endtime_ns, taper, "
+            "taper_percentage, ad_src_type);")
 
-    def _get_tag(self, channel_id, starttime, endtime):
+    def __del__(self):
+        try:
+            self.db_conn.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return self.db_cursor.execute(
+            "SELECT COUNT(*) FROM adjoint_sources;").fetchone()[0]
+
+    @staticmethod
+    def _get_key(channel_id, starttime, endtime, taper, taper_percentage,
+                 ad_src_type):
+        # The taper percentage has always been identified with two digits.
+        return (channel_id, starttime.ns, endtime.ns, str(taper),
+                round(float(taper_percentage), 2), ad_src_type)
+
+    def _read_samples(self, offset, npts):
+        """
+        Returns a memory mapped view of the samples. The file is mapped
+        again if it grew since it has last been mapped or if it has been
+        replaced by :meth:`vacuum`.
+        """
+        end = offset + npts
+        inode = os.stat(self.data_filename).st_ino
+        if self._data is None or len(self._data) < end or \
+                inode != self._data_inode:
+            self._data = np.memmap(self.data_filename,
+                                   dtype=ADJOINT_SOURCE_DTYPE, mode="r")
+            self._data_inode = inode
+        return self._data[offset:end]
+
+    def get(self, channel_id, starttime, endtime, taper, taper_percentage,
+            ad_src_type):
+        """
+        Returns the adjoint source dictionary with the ``"adjoint_source"``,
+        ``"misfit_value"``, and ``"details"`` keys or None if it has not
+        been stored.
+
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA.
+        :param starttime: The starttime of the window.
+        :param endtime: The endtime of the window.
+        :param taper: The taper of the window.
+        :param taper_percentage: The taper percentage of the window.
+        :param ad_src_type: The type of adjoint source.
         """
-        Helper method returning the filename of the adjoint source.
+        row = self.db_cursor.execute(
+            "SELECT misfit_value, details, offset, npts FROM adjoint_sources "
+            "WHERE channel_id = ? AND starttime_ns = ? AND endtime_ns = ? "
+            "AND taper = ? AND taper_percentage = ? AND ad_src_type = ?;",
+            self._get_key(channel_id, starttime, endtime, taper,
+                          taper_percentage, ad_src_type)).fetchone()
+        if row is None:
+            return None
+        return {
+            "adjoint_source": self._read_samples(row[2], row[3]),
+            "misfit_value": row[0],
+            "details": pickle.loads(row[1])}
+
+    def put(self, channel_id, starttime, endtime, taper, taper_percentage,
+            ad_src_type, adjoint_source):
         """
-        return "adjoint_source_%s__%s__%s.npy" % (channel_id, str(starttime),
-                                                  str(endtime))
+        Stores an adjoint source. Replaces a previously stored adjoint
+        source of the same window. The samples of the replaced adjoint
+        source are only reclaimed by :meth:`vacuum`.
+
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA.
+        :param starttime: The starttime of the window.
+        :param endtime: The endtime of the window.
+        :param taper: The taper of the window.
+        :param taper_percentage: The taper percentage of the window.
+        :param ad_src_type: The type of adjoint source.
+        :param adjoint_source: The adjoint source dictionary.
+        """
+        samples = np.require(adjoint_source["adjoint_source"],
+                             dtype=ADJOINT_SOURCE_DTYPE, requirements="C")
+        details = pickle.dumps(adjoint_source["details"],
+                               protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Acquire the write lock before appending so the offset is not
+        # changed by another process until the row is committed.
+        self.db_cursor.execute("BEGIN IMMEDIATE;")
+        try:
+            with open(self.data_filename, "ab") as fh:
+                fh.seek(0, os.SEEK_END)
+                position = fh.tell()
+                # Pad a partially written sample of an interrupted write.
+                padding = -position % ADJOINT_SOURCE_DTYPE.itemsize
+                fh.write(b"\x00" * padding)
+                fh.write(samples.tobytes())
+            self.db_cursor.execute(
+                "INSERT OR REPLACE INTO adjoint_sources (channel_id, "
+                "starttime_ns, endtime_ns, taper, taper_percentage, "
+                "ad_src_type, misfit_value, details, offset, npts) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                self._get_key(channel_id, starttime, endtime, taper,
+                              taper_percentage, ad_src_type) +
+                (float(adjoint_source["misfit_value"]),
+                 sqlite3.Binary(details),
+                 (position + padding) // ADJOINT_SOURCE_DTYPE.itemsize,
+                 len(samples)))
+        except BaseException:
+            self.db_cursor.execute("ROLLBACK;")
+            raise
+        self.db_cursor.execute("COMMIT;")
+
+    def delete(self, channel_id, starttime, endtime, taper,
+               taper_percentage, ad_src_type):
+        """
+        Removes an adjoint source from the index. The samples are kept in
+        the data file until they are reclaimed by :meth:`vacuum`.
+        """
+        self.db_cursor.execute(
+            "DELETE FROM adjoint_sources WHERE channel_id = ? AND "
+            "starttime_ns = ? AND endtime_ns = ? AND taper = ? AND "
+            "taper_percentage = ? AND ad_src_type = ?;",
+            self._get_key(channel_id, starttime, endtime, taper,
+                          taper_percentage, ad_src_type))
+
+    def vacuum(self):
+        """
+        Reclaims the samples of replaced and deleted adjoint sources.
+        Returns the number of reclaimed samples.
+
+        The samples of all stored adjoint sources are copied to a new data
+        file which replaces the old one. The offsets are updated within the
+        same exclusive transaction so no other process can write to the
+        store in the meanwhile. Must not be called while other processes
+        read from the store, e.g. only after all adjoint sources of a bulk
+        calculation have been written.
+        """
+        itemsize = ADJOINT_SOURCE_DTYPE.itemsize
+        temp_filename = self.data_filename + ".vacuum"
+
+        self.db_cursor.execute("BEGIN IMMEDIATE;")
+        try:
+            rows = self.db_cursor.execute(
+                "SELECT id, offset, npts FROM adjoint_sources ORDER BY "
+                "offset;").fetchall()
+            try:
+                total = os.path.getsize(self.data_filename) // itemsize
+            except OSError:
+                total = 0
+            reclaimed = total - sum(_i[2] for _i in rows)
+            if reclaimed > 0:
+                data = np.memmap(self.data_filename,
+                                 dtype=ADJOINT_SOURCE_DTYPE, mode="r")
+                offsets = []
+                position = 0
+                with open(temp_filename, "wb") as fh:
+                    for row_id, offset, npts in rows:
+                        fh.write(data[offset:offset + npts].tobytes())
+                        offsets.append((position, row_id))
+                        position += npts
+                del data
+                self.db_cursor.executemany(
+                    "UPDATE adjoint_sources SET offset = ? WHERE id = ?;",
+                    offsets)
+                # Files cannot be replaced while mapped on some platforms.
+                self._data = None
+                os.replace(temp_filename, self.data_filename)
+        except BaseException:
+            self.db_cursor.execute("ROLLBACK;")
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        self.db_cursor.execute("COMMIT;")
+        return max(reclaimed, 0)
+
+
+class AdjointSourceManager(object):
+
+    """ Class for reading and writing adjoint sources. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._store = AdjointSourceStore(directory)
 
     def write_adjoint_src(self, data, channel_id, starttime, endtime):
         """
-        Writes the adjoint sources to a file.
+        Writes the adjoint sources to the store of the directory.
         """
-        filename = os.path.join(self.directory, self._get_tag(
-            channel_id, starttime, endtime))
-        # Save as 64bit floats just to be able to handle any solver and what
-        # not.
-        np.save(filename, np.require(data, "float64"))
+        self._store.put(channel_id, starttime, endtime, "none", 0.0, "raw",
+                        {"adjoint_source": data, "misfit_value": 0.0,
+                         "details": {}})
 
     def get_adjoint_src(self, channel_id, starttime, endtime):
-        filename = os.path.join(self.directory, self._get_tag(
-            channel_id, starttime, endtime))
-        if not os.path.exists(filename):
+        adsrc = self._store.get(channel_id, starttime, endtime, "none", 0.0,
+                                "raw")
+        if adsrc is None:
             return None
-        return np.load(filename)
+        return adsrc["adjoint_source"]
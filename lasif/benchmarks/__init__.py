@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of LASIF's most time consuming operations.
+
+The benchmarks run on synthetic projects of configurable size created by
+:func:`lasif.benchmarks.synthetic_project.create_synthetic_project` and
+time building the caches, the data preprocessing, the window selection,
+every type of adjoint source, the calculation and finalization of the
+adjoint sources, the window statistics, and the startup of the command
+line interface.
+
+Results are stored as JSON files so runs on different commits can be
+compared::
+
+    $ python -m lasif.benchmarks --sizes 1x10x3x1 4x10x3x1 4x40x3x1 \\
+        --output results.json
+    $ git checkout other_branch
+    $ python -m lasif.benchmarks --sizes 1x10x3x1 4x10x3x1 4x40x3x1 \\
+        --compare results.json
+
+Project sizes are given as ``EVENTSxSTATIONSxCOMPONENTSxITERATIONS``.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
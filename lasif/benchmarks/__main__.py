@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line interface of the LASIF benchmarks.
+
+    $ python -m lasif.benchmarks --sizes 1x10x3x1 2x10x3x1 \\
+        --output results.json
+    $ python -m lasif.benchmarks --sizes 1x10x3x1 2x10x3x1 \\
+        --output new.json --compare results.json
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+
+from lasif.benchmarks import runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m lasif.benchmarks",
+        description="Benchmark LASIF on synthetic projects.")
+    parser.add_argument(
+        "--sizes", nargs="+", default=["1x5x3x1", "2x5x3x1", "2x10x3x1"],
+        help="Project sizes as EVENTSxSTATIONSxCOMPONENTSxITERATIONS.")
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=list(runner.BENCHMARKS.keys()),
+        help="The benchmarks to run. Defaults to all.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of repetitions of each benchmark.")
+    parser.add_argument("--output", help="Write the results to this JSON "
+                                         "file.")
+    parser.add_argument("--compare", help="JSON file with reference "
+                                          "results to compare against.")
+    parser.add_argument(
+        "--threshold", type=float, default=runner.REGRESSION_THRESHOLD,
+        help="Relative slowdown above which a benchmark counts as a "
+             "regression.")
+    parser.add_argument(
+        "--work-dir", help="Folder for the synthetic projects. Existing "
+                           "projects in it are reused and kept. A "
+                           "temporary folder is used if not given.")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="lasif_benchmarks_")
+    try:
+        results = runner.run_benchmarks(
+            sizes=args.sizes, work_dir=work_dir, benchmarks=args.benchmarks,
+            repeat=args.repeat)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, "wt") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+        print("Results written to '%s'." % args.output)
+
+    if args.compare:
+        with open(args.compare, "rt") as fh:
+            reference = json.load(fh)
+        comparison = runner.compare_results(reference, results,
+                                            threshold=args.threshold)
+        runner.print_comparison(comparison)
+        if any(_i[-1] for _i in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
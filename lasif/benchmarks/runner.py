@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the benchmarks on synthetic projects and compares the results.
+
+Each benchmark resets the state it depends on before every repetition so
+all repetitions measure the same work, e.g. all caches are deleted before
+the caches are built and all windows are deleted before the windows are
+selected. Missing prerequisites like processed data for the window
+selection are created once without being timed.
+
+A failing benchmark does not abort the run but is stored with its error.
+Benchmarks producing nothing, e.g. because all stations failed, count as
+failing as their timings would be meaningless.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import collections
+import contextlib
+import functools
+import glob
+import io
+import os
+import shutil
+import subprocess
+import sys
+import time
+import traceback
+import warnings
+
+import numpy as np
+
+
+# Version of the format of the result files.
+FORMAT_VERSION = 1
+
+# Default relative slowdown above which a result counts as a regression.
+REGRESSION_THRESHOLD = 0.1
+
+# Registry of all benchmarks. Maps the name to a function running one
+# timed repetition and a function preparing it.
+BENCHMARKS = collections.OrderedDict()
+
+ProjectSize = collections.namedtuple(
+    "ProjectSize", ["event_count", "station_count", "component_count",
+                    "iteration_count"])
+
+
+def parse_project_size(size):
+    """
+    Parses a project size given as ``EVENTSxSTATIONSxCOMPONENTSxITERATIONS``.
+
+    >>> parse_project_size("2x10x3x1")  # doctest: +NORMALIZE_WHITESPACE
+    ProjectSize(event_count=2, station_count=10, component_count=3,
+                iteration_count=1)
+
+    :param size: The size string.
+    """
+    try:
+        values = [int(_i) for _i in size.lower().split("x")]
+        return ProjectSize(*values)
+    except (ValueError, TypeError):
+        raise ValueError("Project size '%s' is not of the form "
+                         "EVENTSxSTATIONSxCOMPONENTSxITERATIONS." % size)
+
+
+def format_project_size(size):
+    """
+    Inverse of :func:`parse_project_size`.
+
+    >>> format_project_size(ProjectSize(2, 10, 3, 1))
+    '2x10x3x1'
+    """
+    return "x".join(str(_i) for _i in size)
+
+
+def register_benchmark(name, setup=None):
+    """
+    Decorator registering a benchmark.
+
+    The decorated function is timed. It receives whatever the setup
+    function, which is called before every repetition, returns and returns
+    the number of items it produced, e.g. processed files or selected
+    windows. Without a setup function it receives a new communicator of the
+    project.
+
+    :param name: The name of the benchmark.
+    :param setup: Function receiving the project folder.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, setup or _get_communicator)
+        return func
+    return decorator
+
+
+def _get_communicator(folder):
+    from lasif.components.project import Project
+    return Project(project_root_path=folder).get_communicator()
+
+
+def _remove(pattern):
+    for path in glob.glob(pattern):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def _get_iterations_and_events(comm):
+    return [(iteration, event) for iteration in comm.iterations.list()
+            for event in comm.events.list()]
+
+
+def _count_raw_files(comm):
+    return sum(comm.project.get_filecounts_for_event(event)[
+        "raw_waveform_file_count"] for event in comm.events.list())
+
+
+def _count_files(pattern):
+    return len([_i for _i in glob.glob(pattern) if os.path.isfile(_i)])
+
+
+def _count_processed_files(comm):
+    return _count_files(os.path.join(comm.project.paths["data"], "*",
+                                     "preprocessed_*", "*"))
+
+
+def _count_windows(comm):
+    return sum(len(_i) for iteration, event in
+               _get_iterations_and_events(comm) for _i in
+               comm.windows.get(event, iteration).get_all_windows().values())
+
+
+def _count_adjoint_sources(comm):
+    return sum(len(comm.adjoint_sources.get_store(event, iteration))
+               for iteration, event in _get_iterations_and_events(comm))
+
+
+@contextlib.contextmanager
+def _quiet():
+    """
+    Silences everything LASIF prints and warns about while benchmarking.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+
+# Setup functions. They reset and create everything a benchmark depends on.
+def _setup_caches(folder):
+    _remove(os.path.join(folder, "CACHE", "*.sqlite"))
+    _remove(os.path.join(folder, "DATA", "*", "*_cache.sqlite"))
+    _remove(os.path.join(folder, "SYNTHETICS", "*", "*_cache.sqlite"))
+    return folder
+
+
+def _setup_preprocessing(folder):
+    _remove(os.path.join(folder, "DATA", "*", "preprocessed_*"))
+    return _get_communicator(folder)
+
+
+def _ensure_processed_data(folder):
+    comm = _get_communicator(folder)
+    if not glob.glob(os.path.join(folder, "DATA", "*", "preprocessed_*")):
+        for iteration in comm.iterations.list():
+            comm.actions.preprocess_data(iteration, backend="serial")
+    return comm
+
+
+def _setup_window_selection(folder):
+    _remove(os.path.join(folder, "ADJOINT_SOURCES_AND_WINDOWS", "*"))
+    return _ensure_processed_data(folder)
+
+
+def _ensure_windows(folder):
+    comm = _ensure_processed_data(folder)
+    if not glob.glob(os.path.join(comm.project.paths["windows"], "*")):
+        for iteration, event in _get_iterations_and_events(comm):
+            comm.actions.select_windows(event, iteration, backend="serial")
+    return comm
+
+
+def _setup_adjoint_sources(folder):
+    _remove(os.path.join(folder, "ADJOINT_SOURCES_AND_WINDOWS",
+                         "ADJOINT_SOURCES"))
+    return _ensure_windows(folder)
+
+
+def _setup_finalization(folder):
+    _remove(os.path.join(folder, "OUTPUT", "adjoint_sources"))
+    comm = _ensure_windows(folder)
+    if not glob.glob(os.path.join(comm.project.paths["adjoint_sources"],
+                                  "*")):
+        for iteration, event in _get_iterations_and_events(comm):
+            comm.actions.calculate_all_adjoint_sources(
+                iteration, event, backend="serial")
+    return comm
+
+
+@register_benchmark("build_all_caches", setup=_setup_caches)
+def benchmark_build_all_caches(folder):
+    # The event cache is built when the project is initialized.
+    comm = _get_communicator(folder)
+    comm.project.build_all_caches(quick=False)
+    return comm.stations.file_count + _count_raw_files(comm)
+
+
+@register_benchmark("preprocess_data", setup=_setup_preprocessing)
+def benchmark_preprocess_data(comm):
+    for iteration in comm.iterations.list():
+        comm.actions.preprocess_data(iteration, backend="serial")
+    return _count_processed_files(comm)
+
+
+@register_benchmark("select_windows", setup=_setup_window_selection)
+def benchmark_select_windows(comm):
+    for iteration, event in _get_iterations_and_events(comm):
+        comm.actions.select_windows(event, iteration, backend="serial")
+    return _count_windows(comm)
+
+
+def _setup_adjoint_source_pairs(folder):
+    """
+    Generates one windowed pair of data and synthetics per raw data file and
+    iteration with the parameters of the first iteration.
+    """
+    from lasif.benchmarks.synthetic_project import _pulses
+
+    comm = _get_communicator(folder)
+    params = comm.iterations.get(comm.iterations.list()[0]) \
+        .get_process_params()
+    min_period = 1.0 / params["lowpass"]
+    t = np.arange(params["npts"]) * params["dt"]
+    center = t[len(t) // 2]
+    # The pulses have decayed at the edges so no taper is needed.
+    window = np.where(np.abs(t - center) <= 2 * min_period, 1.0, 0.0)
+
+    rng = np.random.RandomState(12345)
+    pairs = []
+    for _ in range(_count_raw_files(comm) * comm.iterations.count()):
+        synth = _pulses(t, [center], [1.0], min_period)
+        data = _pulses(t, [center + rng.uniform(-2.0, 2.0)],
+                       [rng.uniform(0.8, 1.2)], min_period)
+        data += rng.normal(0.0, 0.02, len(t))
+        pairs.append((data * window, synth * window))
+    return {"t": t, "pairs": pairs, "min_period": min_period,
+            "max_period": 1.0 / params["highpass"],
+            "max_criterion": comm.project.config["misc_settings"][
+                "time_frequency_adjoint_source_criterion"]}
+
+
+# Adjoint source types without a benchmark. The cross correlation time
+# shift still calls the time frequency transforms with their old arguments
+# and fails for every input.
+EXCLUDED_ADJOINT_SOURCE_TYPES = ("CCTimeShift",)
+
+
+def _get_adjoint_source_arguments(ad_src_type, setup, data, synth):
+    """
+    Returns the arguments and keyword arguments of the misfit function of
+    an adjoint source type. The misfits have different signatures.
+    """
+    if ad_src_type == "L2Norm":
+        return (data, synth), {}
+    return ((setup["t"], data, synth, setup["min_period"],
+             setup["max_period"]),
+            {"plot": False, "max_criterion": setup["max_criterion"]})
+
+
+def _benchmark_adjoint_source(setup, ad_src_type):
+    from lasif.components.adjoint_sources import MISFIT_MAPPING
+
+    count = 0
+    for data, synth in setup["pairs"]:
+        args, kwargs = _get_adjoint_source_arguments(ad_src_type, setup,
+                                                     data, synth)
+        adsrc = MISFIT_MAPPING[ad_src_type](*args, **kwargs)
+        if adsrc["adjoint_source"] is not None and \
+                len(adsrc["adjoint_source"]):
+            count += 1
+    return count
+
+
+def _register_adjoint_source_benchmarks():
+    from lasif.components.adjoint_sources import MISFIT_MAPPING
+
+    for ad_src_type in sorted(MISFIT_MAPPING.keys()):
+        if ad_src_type in EXCLUDED_ADJOINT_SOURCE_TYPES:
+            continue
+        register_benchmark("adjoint_source_%s" % ad_src_type,
+                           setup=_setup_adjoint_source_pairs)(
+            functools.partial(_benchmark_adjoint_source,
+                              ad_src_type=ad_src_type))
+
+
+_register_adjoint_source_benchmarks()
+
+
+@register_benchmark("calculate_all_adjoint_sources",
+                    setup=_setup_adjoint_sources)
+def benchmark_calculate_all_adjoint_sources(comm):
+    for iteration, event in _get_iterations_and_events(comm):
+        comm.actions.calculate_all_adjoint_sources(iteration, event,
+                                                   backend="serial")
+    return _count_adjoint_sources(comm)
+
+
+@register_benchmark("finalize_adjoint_sources", setup=_setup_finalization)
+def benchmark_finalize_adjoint_sources(comm):
+    for iteration, event in _get_iterations_and_events(comm):
+        comm.actions.finalize_adjoint_sources(iteration, event,
+                                              backend="serial")
+    return _count_files(os.path.join(comm.project.paths["output"],
+                                     "adjoint_sources", "*", "*"))
+
+
+@register_benchmark("get_window_statistics", setup=_ensure_windows)
+def benchmark_get_window_statistics(comm):
+    for iteration in comm.iterations.list():
+        comm.windows.get_window_statistics(iteration, cache=False)
+    return _count_windows(comm)
+
+
+@register_benchmark("cli_startup", setup=lambda folder: folder)
+def benchmark_cli_startup(folder):
+    # Equal to running "lasif info" in the project folder.
+    subprocess.check_call(
+        [sys.executable, "-c",
+         "from lasif.scripts.lasif_cli import main; main()", "info"],
+        cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return 1
+
+
+def get_project_folder(work_dir, size):
+    """
+    Returns the folder of the synthetic project of the given size and
+    creates it if it does not yet exist.
+
+    :param work_dir: The folder containing the synthetic projects.
+    :param size: The :class:`ProjectSize`.
+    """
+    from lasif.benchmarks.synthetic_project import create_synthetic_project
+
+    folder = os.path.join(work_dir, "project_%s" % format_project_size(size))
+    if not os.path.exists(folder):
+        with _quiet():
+            create_synthetic_project(folder, *size)
+    return folder
+
+
+def run_benchmark(name, folder, repeat=3):
+    """
+    Runs a single benchmark. Returns a dictionary with the time of each
+    repetition in seconds, the fastest time, the number of produced items,
+    and the error if it failed. Failed benchmarks have no fastest time.
+
+    :param name: The name of the benchmark.
+    :param folder: The project folder.
+    :param repeat: The number of repetitions.
+    """
+    func, setup = BENCHMARKS[name]
+    result = {"benchmark": name, "times": [], "best": None,
+              "item_count": None, "error": None}
+    try:
+        for _ in range(repeat):
+            with _quiet():
+                argument = setup(folder)
+                start = time.perf_counter()
+                result["item_count"] = func(argument)
+                result["times"].append(time.perf_counter() - start)
+            if not result["item_count"]:
+                result["error"] = "Nothing has been produced."
+                break
+    except Exception:
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+    if result["times"] and not result["error"]:
+        result["best"] = min(result["times"])
+    return result
+
+
+def _get_environment():
+    import platform
+
+    import obspy
+    import scipy
+
+    import lasif
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        commit = None
+
+    return {
+        "git_commit": commit,
+        "lasif_version": lasif.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy_version": np.__version__,
+        "scipy_version": scipy.__version__,
+        "obspy_version": obspy.__version__}
+
+
+def run_benchmarks(sizes, work_dir, benchmarks=None, repeat=3,
+                   verbose=True):
+    """
+    Runs the benchmarks for all project sizes. Returns a JSON serializable
+    dictionary.
+
+    :param sizes: List of :class:`ProjectSize` objects or strings.
+    :param work_dir: The folder containing the synthetic projects. Existing
+        projects are reused.
+    :param benchmarks: The names of the benchmarks to run. Defaults to all.
+    :param repeat: The number of repetitions of each benchmark.
+    :param verbose: Print the results while running.
+    """
+    import obspy
+
+    benchmarks = benchmarks or list(BENCHMARKS.keys())
+    unknown = set(benchmarks) - set(BENCHMARKS.keys())
+    if unknown:
+        raise ValueError("Unknown benchmark(s): %s. Available: %s" % (
+            ", ".join(sorted(unknown)), ", ".join(BENCHMARKS.keys())))
+
+    results = []
+    for size in sizes:
+        if not isinstance(size, ProjectSize):
+            size = parse_project_size(size)
+        folder = get_project_folder(work_dir, size)
+        for name in benchmarks:
+            result = run_benchmark(name, folder, repeat=repeat)
+            result["project_size"] = format_project_size(size)
+            results.append(result)
+            if verbose:
+                print(_format_result(result))
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "created": str(obspy.UTCDateTime()),
+        "environment": _get_environment(),
+        "results": results}
+
+
+def _format_result(result):
+    if result["error"]:
+        return "%-52s %-12s FAILED: %s" % (
+            result["benchmark"], result["project_size"], result["error"])
+    return "%-52s %-12s %10.4f s  (%s items)" % (
+        result["benchmark"], result["project_size"], result["best"],
+        result["item_count"])
+
+
+def compare_results(old, new, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares the fastest times of two benchmark runs. Returns a list of
+    ``(benchmark, project_size, old_time, new_time, ratio, regression)``
+    tuples for all benchmarks in both runs.
+
+    >>> old = {"results": [{"benchmark": "a", "project_size": "1x1x1x1",
+    ...                     "best": 2.0}]}
+    >>> new = {"results": [{"benchmark": "a", "project_size": "1x1x1x1",
+    ...                     "best": 3.0}]}
+    >>> compare_results(old, new)
+    [('a', '1x1x1x1', 2.0, 3.0, 1.5, True)]
+
+    :param old: The results of the reference run.
+    :param new: The results of the new run.
+    :param threshold: Relative slowdown above which a benchmark counts as
+        a regression.
+    """
+    old_results = dict(((_i["benchmark"], _i["project_size"]), _i["best"])
+                       for _i in old["results"])
+    comparison = []
+    for result in new["results"]:
+        key = (result["benchmark"], result["project_size"])
+        old_time = old_results.get(key)
+        new_time = result["best"]
+        if old_time is None or new_time is None:
+            continue
+        ratio = new_time / old_time if old_time else float("inf")
+        comparison.append(key + (old_time, new_time, ratio,
+                                 ratio > 1.0 + threshold))
+    return comparison
+
+
+def print_comparison(comparison):
+    """
+    Prints the output of :func:`compare_results` as a table.
+    """
+    from lasif.tools.prettytable import PrettyTable
+
+    tab = PrettyTable(["Benchmark", "Project Size", "Old [s]", "New [s]",
+                       "Ratio", ""])
+    tab.align["Benchmark"] = "l"
+    for name, size, old_time, new_time, ratio, regression in comparison:
+        tab.add_row([name, size, "%.4f" % old_time, "%.4f" % new_time,
+                     "%.2f" % ratio, "REGRESSION" if regression else ""])
+    print(tab)
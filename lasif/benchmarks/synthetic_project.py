@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generator for synthetic LASIF projects of arbitrary size.
+
+The projects contain everything needed to run the full workflow from the
+data preprocessing to the adjoint sources: QuakeML files, StationXML files
+with a flat broadband response, raw data, iterations, and synthetics. Data
+and synthetics contain P and S wave pulses at the first arrival times of
+ak135 so the window selection has something to pick. The data are slightly
+shifted, scaled, and noisy versions of the synthetics.
+
+All random numbers stem from a seeded generator so the same parameters
+always result in the same project.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import numpy as np
+
+
+# Seconds of raw data recorded before the origin time.
+SECONDS_BEFORE_EVENT = 100.0
+
+# Overall sensitivity of the synthetic instruments in counts per m/s.
+SENSITIVITY = 6E8
+
+# Components of the data. Synthetics use the same last letter.
+COMPONENTS = ["Z", "N", "E"]
+
+
+def get_iteration_name(index):
+    """
+    Name of the iteration with the given index.
+
+    >>> get_iteration_name(0)
+    '1'
+    """
+    return str(index + 1)
+
+
+def _random_points_in_domain(domain, count, rng):
+    """
+    Returns latitudes and longitudes of random points inside the inner,
+    unbuffered part of the rotated domain.
+    """
+    from lasif import rotations
+
+    boundary = domain.boundary_width_in_degree
+    lats = rng.uniform(domain.min_latitude + 2 * boundary,
+                       domain.max_latitude - 2 * boundary, count)
+    lngs = rng.uniform(domain.min_longitude + 2 * boundary,
+                       domain.max_longitude - 2 * boundary, count)
+    if domain.rotation_angle_in_degree:
+        points = [rotations.rotate_lat_lon(
+            lat, lng, domain.rotation_axis, domain.rotation_angle_in_degree)
+            for lat, lng in zip(lats, lngs)]
+        lats = np.array([_i[0] for _i in points])
+        lngs = np.array([_i[1] for _i in points])
+    return lats, lngs
+
+
+def _write_event(filename, event_name, latitude, longitude, depth_in_km,
+                 origin_time, magnitude, rng):
+    import obspy
+    from obspy.core.event import (Catalog, Event, FocalMechanism, Magnitude,
+                                  MomentTensor, Origin, Tensor)
+
+    tensor = Tensor(**dict(
+        (_i, float(rng.uniform(-1.0, 1.0)) * 10 ** (1.5 * magnitude + 9.1))
+        for _i in ["m_rr", "m_tt", "m_pp", "m_rt", "m_rp", "m_tp"]))
+    origin = Origin(latitude=latitude, longitude=longitude,
+                    depth=depth_in_km * 1000.0,
+                    time=obspy.UTCDateTime(origin_time))
+    event = Event(
+        origins=[origin],
+        magnitudes=[Magnitude(mag=magnitude, magnitude_type="Mw")],
+        focal_mechanisms=[FocalMechanism(
+            moment_tensor=MomentTensor(tensor=tensor))])
+    event.resource_id = "smi:local/event/%s" % event_name
+    Catalog(events=[event]).write(filename, format="quakeml")
+
+
+def _write_station(filename, network, station, latitude, longitude,
+                   components, sampling_rate):
+    import obspy
+    from obspy.core.inventory import (Channel, Inventory, Network, Response,
+                                      Station)
+
+    # Flat to velocity between 120 seconds and the Nyquist frequency.
+    response = Response.from_paz(
+        zeros=[0j, 0j], poles=[-0.037 + 0.037j, -0.037 - 0.037j],
+        stage_gain=SENSITIVITY, input_units="M/S", output_units="COUNTS",
+        normalization_frequency=1.0)
+    start_date = obspy.UTCDateTime(2000, 1, 1)
+    channels = [Channel(
+        code="BH%s" % component, location_code="", latitude=latitude,
+        longitude=longitude, elevation=0.0, depth=0.0,
+        azimuth={"Z": 0.0, "N": 0.0, "E": 90.0}[component],
+        dip={"Z": -90.0, "N": 0.0, "E": 0.0}[component],
+        sample_rate=sampling_rate, start_date=start_date, response=response)
+        for component in components]
+    inv = Inventory(networks=[Network(code=network, stations=[Station(
+        code=station, latitude=latitude, longitude=longitude,
+        elevation=0.0, start_date=start_date, channels=channels)])],
+        source="LASIF benchmarks")
+    inv.write(filename, format="stationxml")
+
+
+def _pulses(times, arrivals, amplitudes, period):
+    """
+    Sum of first derivatives of Gaussians centered at the arrivals.
+    """
+    data = np.zeros_like(times)
+    for arrival, amplitude in zip(arrivals, amplitudes):
+        if not np.isfinite(arrival):
+            continue
+        x = (times - arrival) / (0.5 * period)
+        data += amplitude * -x * np.exp(-0.5 * x ** 2)
+    return data
+
+
+def create_synthetic_project(folder, event_count=2, station_count=5,
+                             component_count=3, iteration_count=1,
+                             npts=3000, dt=0.5, sampling_rate=10.0,
+                             min_period=20.0, max_period=100.0, seed=12345,
+                             quiet=True):
+    """
+    Creates a new synthetic LASIF project. Returns the communicator of the
+    project.
+
+    Every station records every event and every iteration contains all
+    events and stations.
+
+    :param folder: The project folder. Must not yet exist.
+    :param event_count: The number of events.
+    :param station_count: The number of stations.
+    :param component_count: The number of components per station, between
+        one and three.
+    :param iteration_count: The number of iterations with synthetics.
+    :param npts: The number of samples of the synthetics.
+    :param dt: The sampling interval of the synthetics.
+    :param sampling_rate: The sampling rate of the raw data.
+    :param min_period: The minimum period of the iterations.
+    :param max_period: The maximum period of the iterations.
+    :param seed: The seed of the random number generator.
+    :param quiet: Do not print anything if set to `True`.
+    """
+    import obspy
+    from lxml import etree
+    from obspy.geodetics import locations2degrees
+
+    from lasif.components.project import Project
+    from lasif.iteration_xml import create_iteration_xml_string
+    from lasif.tools.travel_time_table import TravelTimeTable
+
+    if os.path.exists(folder):
+        raise ValueError("Folder '%s' already exists." % folder)
+    if not 1 <= component_count <= len(COMPONENTS):
+        raise ValueError("Between 1 and %i components are supported." %
+                         len(COMPONENTS))
+    components = COMPONENTS[:component_count]
+    rng = np.random.RandomState(seed)
+
+    os.makedirs(folder)
+    project = Project(project_root_path=folder,
+                      init_project=os.path.basename(os.path.abspath(folder)))
+    paths = project.paths
+    domain = project.domain
+
+    # Events.
+    events = []
+    lats, lngs = _random_points_in_domain(domain, event_count, rng)
+    for _i, (lat, lng) in enumerate(zip(lats, lngs)):
+        origin_time = obspy.UTCDateTime(2012, 1, 1) + _i * 86400 + \
+            int(rng.randint(0, 86400))
+        event = {
+            "event_name": "SYNTHETIC_EVENT_%05i" % _i,
+            "latitude": float(lat), "longitude": float(lng),
+            "depth_in_km": float(rng.uniform(5.0, 50.0)),
+            "origin_time": origin_time,
+            "magnitude": float(np.round(rng.uniform(5.0, 6.5), 1))}
+        _write_event(os.path.join(paths["events"],
+                                  event["event_name"] + ".xml"), rng=rng,
+                     **event)
+        events.append(event)
+
+    # Stations.
+    stations = []
+    lats, lngs = _random_points_in_domain(domain, station_count, rng)
+    for _i, (lat, lng) in enumerate(zip(lats, lngs)):
+        network, station = "XX", "S%04i" % _i
+        _write_station(
+            os.path.join(paths["station_xml"],
+                         "station.%s_%s.xml" % (network, station)),
+            network, station, float(lat), float(lng), components,
+            sampling_rate)
+        stations.append({"station_id": "%s.%s" % (network, station),
+                         "latitude": float(lat), "longitude": float(lng)})
+    station_ids = [_i["station_id"] for _i in stations]
+
+    # Iterations.
+    iterations = [get_iteration_name(_i) for _i in range(iteration_count)]
+    for iteration_name in iterations:
+        xml_string = create_iteration_xml_string(
+            iteration_name, "specfem3d_globe_cem",
+            dict((_i["event_name"], station_ids) for _i in events),
+            min_period, max_period, seconds_prior_arrival=5.0,
+            window_length_in_sec=50.0, quiet=True)
+        doc = etree.fromstring(xml_string)
+        doc.find(".//number_of_time_steps").text = str(npts)
+        doc.find(".//time_increment").text = str(dt)
+        with open(os.path.join(paths["iterations"], "ITERATION_%s.xml" %
+                               iteration_name), "wb") as fh:
+            fh.write(etree.tostring(doc, pretty_print=True,
+                                    xml_declaration=True, encoding="UTF-8"))
+
+    # Waveforms.
+    p_table = TravelTimeTable(phase="P")
+    s_table = TravelTimeTable(phase="S")
+    raw_npts = int((SECONDS_BEFORE_EVENT + npts * dt + max_period) *
+                   sampling_rate)
+    raw_times = np.arange(raw_npts) / sampling_rate - SECONDS_BEFORE_EVENT
+    synth_times = np.arange(npts) * dt
+
+    for event in events:
+        distances = locations2degrees(
+            event["latitude"], event["longitude"],
+            np.array([_i["latitude"] for _i in stations]),
+            np.array([_i["longitude"] for _i in stations]))
+        p_arrivals = p_table.get_first_arrival(event["depth_in_km"],
+                                               distances)
+        s_arrivals = s_table.get_first_arrival(event["depth_in_km"],
+                                               distances)
+
+        raw_folder = os.path.join(paths["data"], event["event_name"], "raw")
+        os.makedirs(raw_folder)
+        synthetic_folders = []
+        for iteration_name in iterations:
+            synthetic_folder = os.path.join(
+                paths["synthetics"], event["event_name"],
+                "ITERATION_%s" % iteration_name)
+            os.makedirs(synthetic_folder)
+            synthetic_folders.append(synthetic_folder)
+
+        for station, p, s in zip(stations, p_arrivals, s_arrivals):
+            network, station_code = station["station_id"].split(".")
+            for component in components:
+                amplitudes = rng.uniform(0.5, 1.0, 2) * 1E-6
+                if component == "Z":
+                    amplitudes[1] *= 0.3
+                else:
+                    amplitudes[0] *= 0.3
+                shift = rng.uniform(-2.0, 2.0)
+
+                data = _pulses(raw_times, [p + shift, s + 2 * shift],
+                               amplitudes * rng.uniform(0.8, 1.2), min_period)
+                data += rng.normal(0.0, 0.02 * amplitudes.max(), raw_npts)
+                tr = obspy.Trace(
+                    data=np.require(data * SENSITIVITY, dtype=np.int32),
+                    header={"network": network, "station": station_code,
+                            "location": "", "channel": "BH%s" % component,
+                            "sampling_rate": sampling_rate,
+                            "starttime": event["origin_time"] -
+                            SECONDS_BEFORE_EVENT})
+                tr.write(os.path.join(raw_folder, "%s.mseed" % tr.id),
+                         format="mseed")
+
+                for synthetic_folder in synthetic_folders:
+                    synth = _pulses(synth_times, [p, s], amplitudes,
+                                    min_period)
+                    tr = obspy.Trace(
+                        data=np.require(synth, dtype=np.float32),
+                        header={"network": network,
+                                "station": station_code, "location": "",
+                                "channel": "MX%s" % component, "delta": dt,
+                                "starttime": event["origin_time"]})
+                    tr.write(os.path.join(synthetic_folder,
+                                          "%s.mseed" % tr.id),
+                             format="mseed")
+
+    if not quiet:
+        print("Created synthetic project with %i events, %i stations, "
+              "%i components, and %i iterations in '%s'." % (
+                  event_count, station_count, component_count,
+                  iteration_count, folder))
+
+    return Project(project_root_path=folder).get_communicator()
@@ -2,18 +2,220 @@
 # -*- coding: utf-8 -*-
 
 
+import inspect
 import itertools
 import numpy as np
 import os
+import shutil
 import warnings
 
 from lasif import LASIFError, LASIFWarning, LASIFNotFoundError
 from lasif import rotations
 from .component import Component
-from obspy.taup import TauPyModel
 from obspy.geodetics import locations2degrees
 
 
+# Communicators usable by the worker functions below, keyed by project root
+# and process id. Forked processes thus never reuse the database
+# connections of their parent.
+_WORKER_COMMUNICATORS = {}
+
+
+def _get_worker_communicator(project_root):
+    """
+    Returns a communicator for the given project in the current process.
+    Opens the project with read-only caches if the process does not yet
+    have one.
+    """
+    key = (project_root, os.getpid())
+    if key not in _WORKER_COMMUNICATORS:
+        from .project import Project
+        _WORKER_COMMUNICATORS[key] = Project(
+            project_root, read_only_caches=True).get_communicator()
+    return _WORKER_COMMUNICATORS[key]
+
+
+# Number of stations of which the windows are selected in one go by each
+# rank or process.
+WINDOW_SELECTION_BATCH_SIZE = 25
+
+
+def _select_windows_for_stations(project_root, event, iteration, stations):
+    """
+    Picklable wrapper around
+    :meth:`ActionsComponent.select_windows_for_event` so it can be
+    distributed across ranks or processes.
+    """
+    comm = _get_worker_communicator(project_root)
+    comm.actions.select_windows_for_event(event, iteration,
+                                          stations=stations)
+
+
+def _calculate_adjoint_sources_for_station(project_root, event, iteration,
+                                           station):
+    """
+    Picklable function calculating the adjoint sources of all windows of
+    one station so it can be distributed across ranks or processes.
+    """
+    comm = _get_worker_communicator(project_root)
+    windows = {
+        _i.channel_id: _i.windows for _i in
+        comm.windows.get(event, iteration).get_windows_for_station(station)}
+    comm.adjoint_sources.calculate_adjoint_sources_for_station(
+        event, iteration, station, windows)
+
+
+# Number of files of an event that are processed together by each rank or
+# process.
+PREPROCESSING_BATCH_SIZE = 50
+
+
+def _accepts_preloaded_input(function):
+    """
+    Whether a project's preprocessing function can use the input files
+    read ahead of time, which it signals with a ``preloaded`` parameter.
+    Older preprocessing functions read the input files themselves so
+    reading them ahead would only double the I/O.
+
+    >>> _accepts_preloaded_input(lambda processing_info, iteration,
+    ...                          preloaded=False: None)
+    True
+    >>> _accepts_preloaded_input(lambda processing_info, iteration: None)
+    False
+    """
+    try:
+        return "preloaded" in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _preprocess_batch(project_root, processing_infos, iteration,
+                      preloaded=False):
+    """
+    Picklable function processing many files of an event with the
+    project's batch preprocessing function so it can be distributed across
+    ranks or processes. Returns the results of the single files so files
+    that cannot be processed are logged and counted as failures. Warnings
+    the batch preprocessing function raised for single files with
+    :func:`~lasif.tools.parallel_helpers.item_warnings` are attached to the
+    results of these files.
+
+    ``preloaded`` is passed on to the batch preprocessing function if the
+    input files have been read ahead.
+    """
+    import traceback
+    from lasif.tools.parallel_helpers import BatchResults, FunctionInfo, \
+        split_warnings
+
+    comm = _get_worker_communicator(project_root)
+    preprocessing_function_batch = comm.project.get_project_function(
+        "preprocessing_function_batch")
+
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        try:
+            if preloaded:
+                results = preprocessing_function_batch(
+                    processing_infos, iteration, preloaded=True)
+            else:
+                results = preprocessing_function_batch(processing_infos,
+                                                       iteration)
+        except Exception as e:
+            results = [e] * len(processing_infos)
+    file_warnings, batch_warnings = split_warnings(w, len(processing_infos))
+    # Logged for the whole batch.
+    for warning in batch_warnings:
+        warnings.warn_explicit(warning.message, warning.category,
+                               warning.filename, warning.lineno)
+
+    infos = BatchResults()
+    for processing_info, result, file_warning_list in zip(
+            processing_infos, results, file_warnings):
+        if isinstance(result, Exception):
+            infos.append(FunctionInfo(
+                func_args={"processing_info": processing_info}, result=None,
+                warnings=file_warning_list, exception=result,
+                traceback="".join(traceback.format_exception(
+                    type(result), result, result.__traceback__))))
+        else:
+            infos.append(FunctionInfo(
+                func_args={"processing_info": processing_info},
+                result=result, warnings=file_warning_list, exception=None,
+                traceback=None))
+    return infos
+
+
+def _get_processing_infos(item):
+    if "processing_infos" in item:
+        return item["processing_infos"]
+    return [item["processing_info"]]
+
+
+def _read_input_file(item):
+    """
+    Read-ahead stage of the data preprocessing. Returns a copy of the item
+    with the contents of the input files and asks the preprocessing
+    function to return its output instead of writing it. Only used for
+    preprocessing functions accepting preloaded input files.
+    """
+    processing_infos = []
+    for processing_info in _get_processing_infos(item):
+        processing_info = dict(processing_info, defer_output=True)
+        try:
+            with open(processing_info["input_filename"], "rb") as fh:
+                processing_info["input_data"] = fh.read()
+        except IOError:
+            # Files of a batch that cannot be read fail on their own once
+            # the preprocessing function reads them.
+            if "processing_infos" not in item:
+                raise
+        processing_infos.append(processing_info)
+    if "processing_infos" in item:
+        return dict(item, processing_infos=processing_infos, preloaded=True)
+    return dict(item, processing_info=processing_infos[0], preloaded=True)
+
+
+def _write_output_file(info):
+    """
+    Write-behind stage of the data preprocessing. Writes the output
+    returned by the preprocessing function and drops all waveform data
+    from the logged function arguments.
+    """
+    import traceback
+    from lasif.tools.parallel_helpers import BatchResults
+
+    def write(output):
+        if not isinstance(output, dict) or "output_data" not in output:
+            return
+        # Write to a temporary file first as existing files are not
+        # processed again.
+        filename = output["output_filename"]
+        temp_filename = "%s.%i.part" % (filename, os.getpid())
+        with open(temp_filename, "wb") as fh:
+            fh.write(output["output_data"])
+        os.rename(temp_filename, filename)
+
+    for processing_info in _get_processing_infos(info.func_args):
+        processing_info.pop("input_data", None)
+
+    if not isinstance(info.result, BatchResults):
+        write(info.result)
+        return info._replace(result=None)
+
+    # Each file of a batch fails on its own.
+    results = BatchResults()
+    for file_info in info.result:
+        file_info.func_args["processing_info"].pop("input_data", None)
+        if not file_info.exception:
+            try:
+                write(file_info.result)
+            except Exception as e:
+                file_info = file_info._replace(
+                    exception=e, traceback=traceback.format_exc())
+        results.append(file_info._replace(result=None))
+    return info._replace(result=results)
+
+
 class ActionsComponent(Component):
     """
     Component implementing actions on the data. Requires most other
@@ -23,6 +225,33 @@ class ActionsComponent(Component):
     :param component_name: The name of this component for the communicator.
     """
 
+    def _get_first_arrivals(self, event, stations, phase="P"):
+        """
+        Epicentral distances and first arrival times of a phase for all
+        given stations with a single lookup in the project's travel time
+        table.
+
+        Returns a dictionary mapping the station names to tuples of the
+        distance in degree and the travel time in seconds. The travel time
+        is NaN if the phase does not exist at that distance.
+
+        :param event: The event dictionary.
+        :param stations: Dictionary of station coordinates as returned by
+            ``comm.query.get_all_stations_for_event()``.
+        :param phase: The phase name.
+        """
+        names = sorted(stations.keys())
+        if not names:
+            return {}
+        distances = locations2degrees(
+            np.array([stations[_i]["latitude"] for _i in names]),
+            np.array([stations[_i]["longitude"] for _i in names]),
+            event["latitude"], event["longitude"])
+        times = self.comm.project.get_travel_time_table(
+            phase=phase).get_first_arrival(event["depth_in_km"], distances)
+        return {name: (float(dist), float(tt)) for name, dist, tt in
+                zip(names, np.atleast_1d(distances), np.atleast_1d(times))}
+
     def preprocess_data(
             self,
             iteration_name,
@@ -32,14 +261,27 @@ class ActionsComponent(Component):
                 'Z'],
             svd_selection=False,
             noise_threshold=None,
-            event_names=None):
+            event_names=None,
+            backend=None,
+            processes=None):
         """
         Preprocesses all data for a given iteration.
 
-        This function works with and without MPI.
+        This function works with and without MPI. Work items are generated
+        while the data is being processed. Each rank or process reads the
+        input files of the next items and writes the processed files in the
+        background. The files of each event are processed in batches of
+        :data:`PREPROCESSING_BATCH_SIZE` if the project's preprocessing
+        function file contains a ``preprocessing_function_batch`` function.
 
         :param event_names: event_ids is a list of events to process in this
             run. It will process all events if not given.
+        :param backend: The backend used to distribute the work. See
+            :func:`lasif.tools.parallel_helpers.distribute_across_ranks`.
+            Defaults to the project's ``parallel_backend`` setting.
+        :param processes: The number of processes for the ``"process_pool"``
+            backend. Defaults to the project's ``parallel_processes``
+            setting.
         """
         from mpi4py import MPI
         from lasif.tools.parallel_helpers import distribute_across_ranks
@@ -49,7 +291,9 @@ class ActionsComponent(Component):
         process_params = iteration.get_process_params()
         processing_tag = iteration.processing_tag
 
-        earth_model = TauPyModel("ak135")
+        # Inverted instrument responses are shared across iterations.
+        response_cache_folder = os.path.join(
+            self.comm.project.paths["cache"], "response_spectra")
 
         def processing_data_generator():
             """
@@ -88,6 +332,9 @@ class ActionsComponent(Component):
                         "after the iteration has been created?" % event_name)
                     continue
 
+                first_arrivals = self._get_first_arrivals(event, stations)
+                event_items = []
+
                 # Group by station name.
                 def func(x):
                     return ".".join(x["channel_id"].split(".")[:2])
@@ -135,30 +382,15 @@ class ActionsComponent(Component):
                         if os.path.exists(output_filename):
                             continue
 
-                        # compute the P-wave arrival time to be used for SNR
+                        # P-wave arrival time to be used for SNR
                         # calculation
-                        dist_in_deg = locations2degrees(
-                            channel["latitude"],
-                            channel["longitude"],
-                            event["latitude"],
-                            event["longitude"])
-                        tts = earth_model.get_travel_times(
-                            source_depth_in_km=event["depth_in_km"],
-                            distance_in_degree=dist_in_deg,
-                            phase_list=['P'])
-
-                        if len(tts) == 0:
+                        dist_in_deg, first_tt_arrival = \
+                            first_arrivals[station_name]
+                        if np.isnan(first_tt_arrival):
                             print(
                                 "No P wave for epicentral distance %f" %
                                 dist_in_deg)
                             continue
-                        else:
-                            # check the purist name
-                            if len(tts) > 1:
-                                first_tt_arrival = tts[[i for i, j in enumerate(
-                                    tts) if j.purist_name == 'P'][0]].time
-                            else:
-                                first_tt_arrival = tts[0].time
 
                         ret_dict = {
                             "process_params": process_params,
@@ -174,36 +406,112 @@ class ActionsComponent(Component):
                                 "local_depth_in_m": channel[
                                     "local_depth_in_m"],
                             },
-                            "station_filename": self.comm.stations.
-                            get_channel_filename(channel["channel_id"],
-                                                 channel["starttime"]),
                             "event_information": event,
                             "event_name": event_name,
                             "noise_threshold": noise_threshold,
-                            "first_P_arrival": first_tt_arrival
+                            "first_P_arrival": first_tt_arrival,
+                            "response_cache_folder": response_cache_folder
                         }
 
-                        yield ret_dict
-
-        # Only rank 0 needs to know what has to be processsed.
-        if MPI.COMM_WORLD.rank == 0:
-            to_be_processed = [{"processing_info": _i, "iteration": iteration}
-                               for _i in processing_data_generator()]
-        else:
-            to_be_processed = None
+                        event_items.append(
+                            (ret_dict, channel["channel_id"],
+                             channel["starttime"]))
+
+                # Resolve all station files of the event at once.
+                station_files = self.comm.stations.\
+                    get_channel_files_and_coordinates(
+                        [(_i[1], _i[2]) for _i in event_items])
+                for (ret_dict, channel_id, starttime), info in zip(
+                        event_items, station_files):
+                    if info is None:
+                        raise LASIFNotFoundError(
+                            "Could not find a station file for channel '%s' "
+                            "at %s." % (channel_id, str(starttime)))
+                    ret_dict["station_filename"] = info["filename"]
+                    yield ret_dict
+
+        # Only rank 0 needs to know what has to be processsed. Items are
+        # generated while the first ones are already being processed.
+        to_be_processed = []
+
+        def items_generator():
+            for processing_info in processing_data_generator():
+                item = {"processing_info": processing_info,
+                        "iteration": iteration}
+                if svd_selection:
+                    to_be_processed.append(item)
+                yield item
 
         # Load project specific data preprocessing function.
         preprocessing_function = self.comm.project.get_project_function(
             "preprocessing_function")
+        try:
+            preprocessing_function_batch = \
+                self.comm.project.get_project_function(
+                    "preprocessing_function_batch")
+        except LASIFNotFoundError:
+            batched = False
+        else:
+            batched = True
+
+        # Input files are only read ahead if the preprocessing function
+        # uses them.
+        read_ahead = None
+        if _accepts_preloaded_input(preprocessing_function_batch
+                                    if batched else preprocessing_function):
+            read_ahead = _read_input_file
+
+        project_root = self.comm.project.paths["root"]
+        # Workers in this process reuse this communicator.
+        _WORKER_COMMUNICATORS[(project_root, os.getpid())] = self.comm
+
+        def batches_generator():
+            for _, items in itertools.groupby(
+                    items_generator(),
+                    lambda x: x["processing_info"]["event_name"]):
+                while True:
+                    batch = list(itertools.islice(
+                        items, PREPROCESSING_BATCH_SIZE))
+                    if not batch:
+                        break
+                    yield {"project_root": project_root,
+                           "processing_infos": [_i["processing_info"]
+                                                for _i in batch],
+                           "iteration": iteration}
+
+        def get_batch_name(item):
+            # Also names the single files of a batch.
+            if "processing_info" in item:
+                return item["processing_info"]["input_filename"]
+            return "%s: %s - %s" % (
+                item["processing_infos"][0]["event_name"],
+                os.path.basename(
+                    item["processing_infos"][0]["input_filename"]),
+                os.path.basename(
+                    item["processing_infos"][-1]["input_filename"]))
 
         logfile = self.comm.project.get_log_file(
             "DATA_PREPROCESSING", "processing_iteration_%s" % (str(
                 iteration.name)))
 
-        distribute_across_ranks(
-            function=preprocessing_function, items=to_be_processed,
-            get_name=lambda x: x["processing_info"]["input_filename"],
-            logfile=logfile)
+        backend, processes = self._get_parallel_settings(backend, processes)
+
+        if batched:
+            distribute_across_ranks(
+                function=_preprocess_batch,
+                items=batches_generator() if MPI.COMM_WORLD.rank == 0
+                else None,
+                get_name=get_batch_name, logfile=logfile, backend=backend,
+                processes=processes, read_ahead=read_ahead,
+                write_behind=_write_output_file)
+        else:
+            distribute_across_ranks(
+                function=preprocessing_function,
+                items=items_generator() if MPI.COMM_WORLD.rank == 0
+                else None,
+                get_name=lambda x: x["processing_info"]["input_filename"],
+                logfile=logfile, backend=backend, processes=processes,
+                read_ahead=read_ahead, write_behind=_write_output_file)
 
         ###################################################
         # svd to be computed only for teleseismic events :
@@ -250,7 +558,6 @@ class ActionsComponent(Component):
         process_params = iteration.get_process_params()
         processing_tag = iteration.processing_tag
 
-        earth_model = TauPyModel("ak135")
         db = instaseis.open_db("syngine://ak135f_2s")
 
         def processing_instaseis_synthetics_generator():
@@ -294,6 +601,8 @@ class ActionsComponent(Component):
                         "after the iteration has been created?" % event_name)
                     continue
 
+                first_arrivals = self._get_first_arrivals(event, stations)
+
                 # Group by station name.
                 def func(x):
                     return ".".join(x["channel_id"].split(".")[:2])
@@ -345,30 +654,15 @@ class ActionsComponent(Component):
                         receiver = instaseis.Receiver.parse(
                             station_filename)[0]
 
-                        # compute the P-wave arrival time to be used for SNR
+                        # P-wave arrival time to be used for SNR
                         # calculation
-                        dist_in_deg = locations2degrees(
-                            channel["latitude"],
-                            channel["longitude"],
-                            event["latitude"],
-                            event["longitude"])
-                        tts = earth_model.get_travel_times(
-                            source_depth_in_km=event["depth_in_km"],
-                            distance_in_degree=dist_in_deg,
-                            phase_list=['P'])
-
-                        if len(tts) == 0:
+                        dist_in_deg, first_tt_arrival = \
+                            first_arrivals[station_name]
+                        if np.isnan(first_tt_arrival):
                             print(
                                 "No P wave for epicentral distance %f" %
                                 dist_in_deg)
                             continue
-                        else:
-                            # check the purist name
-                            if len(tts) > 1:
-                                first_tt_arrival = tts[[i for i, j in enumerate(
-                                    tts) if j.purist_name == 'P'][0]].time
-                            else:
-                                first_tt_arrival = tts[0].time
 
                         ret_dict = {
                             "process_params": process_params,
@@ -439,7 +733,26 @@ class ActionsComponent(Component):
                 output_folder,
                 components)
 
-    def select_windows(self, event, iteration):
+    def _get_parallel_settings(self, backend=None, processes=None):
+        """
+        Returns the backend and number of processes used to distribute work.
+
+        Explicitly passed values take precedence over the settings in the
+        project's config file. Running with MPI always uses the MPI backend.
+        """
+        from mpi4py import MPI
+
+        if MPI.COMM_WORLD.size > 1:
+            return "mpi", None
+
+        settings = self.comm.project.config["misc_settings"]
+        if backend is None:
+            backend = settings.get("parallel_backend", "mpi")
+        if processes is None:
+            processes = settings.get("parallel_processes", None)
+        return backend, processes
+
+    def select_windows(self, event, iteration, backend=None, processes=None):
         """
         Automatically select the windows for the given event and iteration.
 
@@ -451,25 +764,23 @@ class ActionsComponent(Component):
 
         :param event: The event.
         :param iteration: The iteration.
+        :param backend: The backend used to distribute the work. See
+            :func:`lasif.tools.parallel_helpers.distribute_across_ranks`.
+            Defaults to the project's ``parallel_backend`` setting.
+        :param processes: The number of processes for the ``"process_pool"``
+            backend. Defaults to the project's ``parallel_processes``
+            setting.
         """
         from lasif.utils import channel2station
+        from lasif.tools.parallel_helpers import distribute_across_ranks
         from mpi4py import MPI
 
         event = self.comm.events.get(event)
         iteration = self.comm.iterations.get(iteration)
+        project_root = self.comm.project.paths["root"]
 
-        def split(container, count):
-            """
-            Simple and elegant function splitting a container into count
-            equal chunks.
-
-            Order is not preserved but for the use case at hand this is
-            potentially an advantage as data sitting in the same folder thus
-            have a higher at being processed at the same time thus the disc
-            head does not have to jump around so much. Of course very
-            architecture dependent.
-            """
-            return [container[_i::count] for _i in range(count)]
+        # Workers in this process reuse this communicator.
+        _WORKER_COMMUNICATORS[(project_root, os.getpid())] = self.comm
 
         # Only rank 0 needs to know what has to be processsed.
         if MPI.COMM_WORLD.rank == 0:
@@ -481,9 +792,6 @@ class ActionsComponent(Component):
             windows = self.comm.windows.get(event, iteration).list()
             stations_without_windows = \
                 stations - set(map(channel2station, windows))
-            total_size = len(stations_without_windows)
-            stations_without_windows = split(list(stations_without_windows),
-                                             MPI.COMM_WORLD.size)
 
             # Initialize station cache on rank 0.
             self.comm.stations.file_count
@@ -499,61 +807,71 @@ class ActionsComponent(Component):
                     event["event_name"], "synthetic", iteration)
             except LASIFNotFoundError:
                 pass
+
+            # Stations are processed in batches so the per station overhead
+            # of looking up coordinates and caches is paid only once per
+            # batch.
+            stations_without_windows = sorted(stations_without_windows)
+            to_be_processed = [
+                {"project_root": project_root,
+                 "event": event["event_name"],
+                 "iteration": iteration.name,
+                 "stations": stations_without_windows[
+                     _i: _i + WINDOW_SELECTION_BATCH_SIZE]}
+                for _i in range(0, len(stations_without_windows),
+                                WINDOW_SELECTION_BATCH_SIZE)]
         else:
-            stations_without_windows = None
+            to_be_processed = None
 
-        # Distribute on a per-station basis.
-        stations_without_windows = MPI.COMM_WORLD.scatter(
-            stations_without_windows, root=0)
+        logfile = self.comm.project.get_log_file(
+            "WINDOW_SELECTION", "window_selection_iteration_%s__%s" % (
+                iteration.name, event["event_name"]))
 
-        for _i, station in enumerate(stations_without_windows):
-            try:
-                self.select_windows_for_station(event, iteration, station)
-            except LASIFNotFoundError as e:
-                warnings.warn(str(e), LASIFWarning)
-            except Exception as e:
-                warnings.warn(
-                    "Exception occured for iteration %s, event %s, and "
-                    "station %s: %s" % (iteration.name, event["event_name"],
-                                        station, str(e)), LASIFWarning)
-            if MPI.COMM_WORLD.rank == 0:
-                print(("Window picking process: Picked windows for approx. %i "
-                       "of %i stations." % (
-                           min(_i * MPI.COMM_WORLD.size, total_size),
-                           total_size)))
+        backend, processes = self._get_parallel_settings(backend, processes)
+
+        distribute_across_ranks(
+            function=_select_windows_for_stations, items=to_be_processed,
+            get_name=lambda x: "%s - %s" % (x["stations"][0],
+                                            x["stations"][-1]),
+            logfile=logfile, backend=backend, processes=processes)
 
         # Barrier at the end useful for running this in a loop.
         MPI.COMM_WORLD.barrier()
 
-    def select_windows_for_station(self, event, iteration, station, **kwargs):
+    def _get_window_selection_settings(self, iteration, kwargs):
         """
-        Selects windows for the given event, iteration, and station. Will
-        delete any previously existing windows for that station if any.
-
-        :param event: The event.
-        :param iteration: The iteration.
-        :param station: The station id in the form NET.STA.
+        Returns the project's window picking function and the keyword
+        arguments passed to it.
         """
-        from lasif.utils import select_component_from_stream
+        process_params = iteration.get_process_params()
+        kwargs = dict(kwargs)
+        kwargs["minimum_period"] = 1.0 / process_params["lowpass"]
+        kwargs["maximum_period"] = 1.0 / process_params["highpass"]
+        kwargs["iteration"] = iteration
 
-        # Load project specific window selection function.
-        select_windows = self.comm.project.get_project_function(
-            "window_picking_function")
+        # The default window selection looks up the first arrival in the
+        # project's travel time table.
+        kwargs.setdefault("travel_time_table",
+                          self.comm.project.get_travel_time_table(
+                              phase="ttp"))
 
-        event = self.comm.events.get(event)
-        iteration = self.comm.iterations.get(iteration)
-        data = self.comm.query.get_matching_waveforms(event, iteration,
-                                                      station)
+        return self.comm.project.get_project_function(
+            "window_picking_function"), kwargs
 
-        process_params = iteration.get_process_params()
-        minimum_period = 1.0 / process_params["lowpass"]
-        maximum_period = 1.0 / process_params["highpass"]
+    def _pick_windows(self, event, data, select_windows, **kwargs):
+        """
+        Picks the windows for all components of one station.
 
-        window_group_manager = self.comm.windows.get(event, iteration)
-        # Delete the windows for this stations.
-        window_group_manager.delete_windows_for_station(station)
+        :param event: The event.
+        :param data: The :class:`~lasif.components.query.DataTuple` with the
+            data and synthetics of the station.
+        :param select_windows: The window picking function.
+        :returns: A dictionary with the list of windows per channel id or
+            ``None`` if no component has data and synthetics.
+        """
+        from lasif.utils import select_component_from_stream
 
-        found_something = False
+        windows = None
         for component in ["E", "N", "Z"]:
             try:
                 data_tr = select_component_from_stream(data.data, component)
@@ -561,29 +879,95 @@ class ActionsComponent(Component):
                                                         component)
             except LASIFNotFoundError:
                 continue
-            found_something = True
-
-            windows = select_windows(data_tr, synth_tr, event["latitude"],
-                                     event["longitude"], event["depth_in_km"],
-                                     data.coordinates["latitude"],
-                                     data.coordinates["longitude"],
-                                     minimum_period=minimum_period,
-                                     maximum_period=maximum_period,
-                                     iteration=iteration, **kwargs)
-            if not windows:
-                continue
+            if windows is None:
+                windows = {}
 
-            window_group = window_group_manager.get(data_tr.id)
-            for starttime, endtime in windows:
-                window_group.add_window(starttime=starttime, endtime=endtime)
-            window_group.write()
+            windows[data_tr.id] = select_windows(
+                data_tr, synth_tr, event["latitude"], event["longitude"],
+                event["depth_in_km"], data.coordinates["latitude"],
+                data.coordinates["longitude"], **kwargs)
+        return windows
 
-        if found_something is False:
+    def select_windows_for_station(self, event, iteration, station, **kwargs):
+        """
+        Selects windows for the given event, iteration, and station. Will
+        delete any previously existing windows for that station if any.
+
+        :param event: The event.
+        :param iteration: The iteration.
+        :param station: The station id in the form NET.STA.
+        """
+        event = self.comm.events.get(event)
+        iteration = self.comm.iterations.get(iteration)
+        data = self.comm.query.get_matching_waveforms(event, iteration,
+                                                      station)
+
+        select_windows, kwargs = self._get_window_selection_settings(
+            iteration, kwargs)
+        windows = self._pick_windows(event, data, select_windows, **kwargs)
+
+        if windows is None:
             raise LASIFNotFoundError(
                 "No matching data found for event '%s', iteration '%s', and "
                 "station '%s'." % (event["event_name"], iteration.name,
                                    station))
 
+        self.comm.windows.get(event, iteration).replace_windows(
+            windows, stations=[station])
+
+    def select_windows_for_event(self, event, iteration, stations=None,
+                                 **kwargs):
+        """
+        Selects windows for many stations of the given event and iteration.
+        Will delete any previously existing windows for these stations.
+
+        The waveforms of all stations are loaded at once and the windows are
+        only written after all of them have been picked which is much faster
+        than calling :meth:`select_windows_for_station` for every station.
+        Stations without matching data or for which the window picking
+        fails are skipped with a warning. The existing windows of skipped
+        stations are kept.
+
+        :param event: The event.
+        :param iteration: The iteration.
+        :param stations: The station ids in the form NET.STA. Defaults to
+            all stations of the event in the iteration with processed data
+            and synthetics.
+        """
+        event = self.comm.events.get(event)
+        iteration = self.comm.iterations.get(iteration)
+        all_data = self.comm.query.get_matching_waveforms_for_event(
+            event, iteration, stations=stations)
+
+        select_windows, kwargs = self._get_window_selection_settings(
+            iteration, kwargs)
+
+        windows = {}
+        stations = []
+        for station in sorted(all_data.keys()):
+            try:
+                station_windows = self._pick_windows(
+                    event, all_data[station], select_windows, **kwargs)
+            except Exception as e:
+                warnings.warn(
+                    "Failed to select windows for event '%s', iteration "
+                    "'%s', and station '%s': %s: %s" % (
+                        event["event_name"], iteration.name, station,
+                        e.__class__.__name__, str(e)), LASIFWarning)
+                continue
+            if station_windows is None:
+                warnings.warn(
+                    "No matching data found for event '%s', iteration '%s', "
+                    "and station '%s'." % (event["event_name"],
+                                           iteration.name, station),
+                    LASIFWarning)
+                continue
+            stations.append(station)
+            windows.update(station_windows)
+
+        self.comm.windows.get(event, iteration).replace_windows(
+            windows, stations=stations)
+
     def generate_input_files(self, iteration_name, event_name,
                              simulation_type):
         """
@@ -855,41 +1239,111 @@ class ActionsComponent(Component):
         gen.write(format=solver_format, output_dir=output_dir)
         print("Written files to '%s'." % output_dir)
 
-    def calculate_all_adjoint_sources(self, iteration_name, event_name):
+    def calculate_all_adjoint_sources(self, iteration_name, event_name,
+                                      backend=None, processes=None):
         """
         Function to calculate all adjoint sources for a certain iteration
         and event.
+
+        The work is distributed per station so the data and synthetics of
+        each station are only read once for all its windows. Function can be
+        called with and without MPI.
+
+        :param iteration_name: The iteration.
+        :param event_name: The event.
+        :param backend: The backend used to distribute the work. See
+            :func:`lasif.tools.parallel_helpers.distribute_across_ranks`.
+            Defaults to the project's ``parallel_backend`` setting.
+        :param processes: The number of processes for the ``"process_pool"``
+            backend. Defaults to the project's ``parallel_processes``
+            setting.
+        :returns: On rank 0 a list with one
+            :class:`~lasif.tools.parallel_helpers.FunctionInfo` object per
+            station. Stations that failed have their exception set instead
+            of raising it. ``None`` on all other ranks.
         """
-        window_manager = self.comm.windows.get(event_name, iteration_name)
+        from lasif.utils import channel2station
+        from lasif.tools.parallel_helpers import distribute_across_ranks
+        from mpi4py import MPI
+
         event = self.comm.events.get(event_name)
         iteration = self.comm.iterations.get(iteration_name)
-        iteration_event_def = iteration.events[event["event_name"]]
-        iteration_stations = iteration_event_def["stations"]
+        project_root = self.comm.project.paths["root"]
 
-        l = sorted(window_manager.list())
-        for station, windows in itertools.groupby(
-                l, key=lambda x: ".".join(x.split(".")[:2])):
-            if station not in iteration_stations:
-                continue
-            try:
-                for w in windows:
-                    w = window_manager.get(w)
-                    for window in w:
-                        # Access the property will trigger an adjoint source
-                        # calculation.
-                        window.adjoint_source
-            except LASIFError as e:
+        # Workers in this process reuse this communicator.
+        _WORKER_COMMUNICATORS[(project_root, os.getpid())] = self.comm
+
+        if MPI.COMM_WORLD.rank == 0:
+            window_manager = self.comm.windows.get(event, iteration)
+            iteration_stations = \
+                iteration.events[event["event_name"]]["stations"]
+            stations = sorted(set(
+                _i for _i in map(channel2station, window_manager.list())
+                if _i in iteration_stations))
+            to_be_processed = [
+                {"project_root": project_root,
+                 "event": event["event_name"],
+                 "iteration": iteration.name,
+                 "station": station} for station in stations]
+        else:
+            to_be_processed = None
+
+        logfile = self.comm.project.get_log_file(
+            "ADJOINT_SOURCES", "adjoint_sources_iteration_%s__%s" % (
+                iteration.name, event["event_name"]))
+
+        backend, processes = self._get_parallel_settings(backend, processes)
+
+        results = distribute_across_ranks(
+            function=_calculate_adjoint_sources_for_station,
+            items=to_be_processed, get_name=lambda x: x["station"],
+            logfile=logfile, backend=backend, processes=processes)
+
+        if MPI.COMM_WORLD.rank == 0:
+            for result in results:
+                if result.exception is None:
+                    continue
                 print(("Could not calculate adjoint source for iteration %s "
                        "and station %s. Repick windows? Reason: %s" % (
-                           iteration.name, station, str(e))))
+                           iteration.name, result.func_args["station"],
+                           str(result.exception))))
+
+            # All workers are done writing. Reclaim the samples of
+            # recalculated adjoint sources.
+            self.comm.adjoint_sources.get_store(
+                event["event_name"], iteration.name).vacuum()
+
+        # Barrier at the end useful for running this in a loop.
+        MPI.COMM_WORLD.barrier()
+        return results
 
-    def finalize_adjoint_sources(self, iteration_name, event_name):
+    def finalize_adjoint_sources(self, iteration_name, event_name,
+                                 backend=None, processes=None):
         """
         Finalizes the adjoint sources.
+
+        The weighted adjoint sources of all stations are assembled first and
+        then written in the solver specific format, distributed across
+        processes if requested. Function can be called with and without
+        MPI.
+
+        :param iteration_name: The iteration.
+        :param event_name: The event.
+        :param backend: The backend used to distribute the writing. See
+            :func:`lasif.tools.parallel_helpers.distribute_across_ranks`.
+            Defaults to the project's ``parallel_backend`` setting.
+        :param processes: The number of processes for the ``"process_pool"``
+            backend. Defaults to the project's ``parallel_processes``
+            setting.
         """
+        import time
 
         import numpy as np
         from lasif import rotations
+        from lasif.adjoint_sources.writers import \
+            write_adjoint_sources_for_station
+        from lasif.tools.parallel_helpers import distribute_across_ranks
+        from mpi4py import MPI
 
         window_manager = self.comm.windows.get(event_name, iteration_name)
         event = self.comm.events.get(event_name)
@@ -906,10 +1360,25 @@ class ActionsComponent(Component):
         domain = self.comm.project.domain
         solver = iteration.solver_settings["solver"].lower()
 
-        adjoint_source_stations = set()
-
         if "ses3d" in solver:
+            solver_type = "ses3d"
             ses3d_all_coordinates = []
+        elif "specfem" in solver:
+            solver_type = "specfem"
+            s_set = iteration.solver_settings["solver_settings"]
+            if "adjoint_source_time_shift" not in s_set:
+                warnings.warn("No <adjoint_source_time_shift> tag in the "
+                              "iteration XML file. No time shift for the "
+                              "adjoint sources will be applied.",
+                              LASIFWarning)
+                src_time_shift = 0
+            else:
+                src_time_shift = float(s_set["adjoint_source_time_shift"])
+        else:
+            solver_type = None
+
+        adjoint_source_stations = set()
+        to_be_written = []
 
         event_weight = iteration_event_def["event_weight"]
 
@@ -932,7 +1401,7 @@ class ActionsComponent(Component):
                     srcs = []
                     for window in w:
                         ad_src = window.adjoint_source
-                        if not ad_src["adjoint_source"].ptp():
+                        if not np.ptp(ad_src["adjoint_source"]):
                             continue
                         srcs.append(ad_src["adjoint_source"] * window.weight)
                         channel_weight += window.weight
@@ -968,8 +1437,11 @@ class ActionsComponent(Component):
             rec_lat = coords["latitude"]
             rec_lng = coords["longitude"]
 
+            item = {"solver": solver_type, "output_folder": output_folder,
+                    "station": station, "channels": channels}
+
             # The adjoint sources depend on the solver.
-            if "ses3d" in solver:
+            if solver_type == "ses3d":
                 # Rotate if needed.
                 if domain.rotation_angle_in_degree:
                     # Rotate the adjoint source location.
@@ -989,73 +1461,59 @@ class ActionsComponent(Component):
                 r_rec_depth = 0.0
                 r_rec_colat = rotations.lat2colat(r_rec_lat)
 
-                # Now once again map from ZNE to the XYZ of SES3D.
-                CHANNEL_MAPPING = {"X": "N", "Y": "E", "Z": "Z"}
                 adjoint_source_stations.add(station)
-                adjoint_src_filename = os.path.join(
-                    output_folder, "ad_src_%i" % len(adjoint_source_stations))
-                ses3d_all_coordinates.append(
-                    (r_rec_colat, r_rec_lng, r_rec_depth))
-
-                # Actually write the adjoint source file in SES3D specific
-                # format.
-                with open(adjoint_src_filename, "wt") as open_file:
-                    open_file.write("-- adjoint source ------------------\n")
-                    open_file.write(
-                        "-- source coordinates (colat,lon,depth)\n")
-                    open_file.write("%f %f %f\n" % (r_rec_colat, r_rec_lng,
-                                                    r_rec_depth))
-                    open_file.write("-- source time function (x, y, z) --\n")
-                    # Revert the X component as it has to point south in SES3D.
-                    for x, y, z in zip(-1.0 * channels[CHANNEL_MAPPING["X"]],
-                                       channels[CHANNEL_MAPPING["Y"]],
-                                       channels[CHANNEL_MAPPING["Z"]]):
-                        open_file.write("%e %e %e\n" % (x, y, z))
-                    open_file.write("\n")
-            elif "specfem" in solver:
-                s_set = iteration.solver_settings["solver_settings"]
-                if "adjoint_source_time_shift" not in s_set:
-                    warnings.warn("No <adjoint_source_time_shift> tag in the "
-                                  "iteration XML file. No time shift for the "
-                                  "adjoint sources will be applied.",
-                                  LASIFWarning)
-                    src_time_shift = 0
-                else:
-                    src_time_shift = float(s_set["adjoint_source_time_shift"])
+                item["filename"] = "ad_src_%i" % len(adjoint_source_stations)
+                item["coordinates"] = (r_rec_colat, r_rec_lng, r_rec_depth)
+                ses3d_all_coordinates.append(item["coordinates"])
+            elif solver_type == "specfem":
                 adjoint_source_stations.add(station)
-                # Write all components. The adjoint sources right now are
-                # not time shifted.
-                for component in ["Z", "N", "E"]:
-                    # XXX: M band code could be different.
-                    adjoint_src_filename = os.path.join(
-                        output_folder, "%s.MX%s.adj" % (station, component))
-                    adj_src = channels[component]
-                    l = len(adj_src)
-                    to_write = np.empty((l, 2))
-                    to_write[:, 0] = \
-                        np.linspace(0, (l - 1) * dt, l) + src_time_shift
-
-                    # SPECFEM expects non-time reversed adjoint sources and
-                    # the sign is different for some reason.
-                    to_write[:, 1] = -1.0 * adj_src[::-1]
-
-                    np.savetxt(adjoint_src_filename, to_write)
+                # The adjoint sources right now are not time shifted.
+                item["dt"] = dt
+                item["time_shift"] = src_time_shift
             else:
                 raise NotImplementedError(
                     "Adjoint source writing for solver '%s' not yet "
                     "implemented." % iteration.solver_settings["solver"])
+            to_be_written.append(item)
 
         if not adjoint_source_stations:
             print("Could not create a single adjoint source.")
             return
 
-        if "ses3d" in solver:
+        # Formatting the files is what takes time so they are written in
+        # parallel.
+        logfile = self.comm.project.get_log_file(
+            "ADJOINT_SOURCES", "finalize_adjoint_sources_iteration_%s__%s" % (
+                iteration.name, event["event_name"]))
+        backend, processes = self._get_parallel_settings(backend, processes)
+
+        a = time.time()
+        results = distribute_across_ranks(
+            function=write_adjoint_sources_for_station, items=to_be_written,
+            get_name=lambda x: x["station"], logfile=logfile,
+            backend=backend, processes=processes)
+        # Only rank 0 has the results. Failures are raised on all ranks.
+        failed = None
+        if MPI.COMM_WORLD.rank == 0:
+            failed = ["%s (%s)" % (_i.func_args["station"], _i.exception)
+                      for _i in results if _i.exception is not None]
+        failed = MPI.COMM_WORLD.bcast(failed, root=0)
+        if failed:
+            raise LASIFError(
+                "Failed to write the adjoint sources of %i station(s): %s" % (
+                    len(failed), ", ".join(failed)))
+        if MPI.COMM_WORLD.rank != 0:
+            return
+        total_bytes = sum(_i.result for _i in results)
+
+        if solver_type == "ses3d":
             with open(os.path.join(output_folder, "ad_srcfile"), "wt") as fh:
                 fh.write("%i\n" % len(adjoint_source_stations))
                 for line in ses3d_all_coordinates:
                     fh.write("%.6f %.6f %.6f\n" % (line[0], line[1], line[2]))
                 fh.write("\n")
-        elif "specfem" in solver:
+            total_bytes += os.path.getsize(fh.name)
+        elif solver_type == "specfem":
             adjoint_source_stations = sorted(list(adjoint_source_stations))
             with open(os.path.join(output_folder, "STATIONS_ADJOINT"),
                       "wt") as fh:
@@ -1069,6 +1527,145 @@ class ActionsComponent(Component):
                         lng=coords["longitude"],
                         ele=coords["elevation_in_m"],
                         dep=coords["local_depth_in_m"]))
+            total_bytes += os.path.getsize(fh.name)
+        b = time.time()
+
+        print("Wrote adjoint sources for %i station(s) to %s (%.2f MB in "
+              "%.2f seconds)." % (
+                  len(adjoint_source_stations),
+                  os.path.relpath(output_folder),
+                  total_bytes / 1024.0 ** 2, b - a))
+
+    def sum_kernels(self, iteration_name, events=None,
+                    horizontal_smoothing_in_degree=None,
+                    vertical_smoothing_in_km=None, backend=None,
+                    processes=None):
+        """
+        Sums the kernels of the events of an iteration and optionally
+        smooths the sum with a separable Gaussian on the GLL grid.
+
+        The box files of all events are memory-mapped and accumulated one
+        subdomain at a time so only a single box is in memory per rank or
+        process. The work is distributed by subdomain. Function can be
+        called with and without MPI.
+
+        The sum is written in the SES3D format together with the boxfile to
+        the ``SUMMED`` folder next to the kernels of the events, the
+        smoothed sum to the ``SUMMED_SMOOTHED`` folder. Returns the folder
+        of the final kernel.
+
+        :param iteration_name: The iteration.
+        :param events: The events whose kernels are summed. Defaults to all
+            events with a kernel.
+        :param horizontal_smoothing_in_degree: The standard deviation of the
+            Gaussian along the latitude and longitude axes of the grid.
+        :param vertical_smoothing_in_km: The standard deviation of the
+            Gaussian along the depth axis of the grid.
+        :param backend: The backend used to distribute the work. See
+            :func:`lasif.tools.parallel_helpers.distribute_across_ranks`.
+            Defaults to the project's ``parallel_backend`` setting.
+        :param processes: The number of processes for the ``"process_pool"``
+            backend. Defaults to the project's ``parallel_processes``
+            setting.
+        """
+        from lasif.ses3d_models import RawSES3DModelHandler
+        from lasif.tools.parallel_helpers import distribute_across_ranks
+        from lasif.tools.ses3d_kernels import smooth_kernel_subdomain, \
+            sum_kernel_subdomain
+        from mpi4py import MPI
+
+        iteration = self.comm.iterations.get(iteration_name)
+        if events is None:
+            events = self.comm.kernels.list_events(iteration.name)
+        if not events:
+            raise LASIFNotFoundError("No kernels found for iteration %s." %
+                                     iteration.name)
+
+        # Only rank 0 copies missing boxfiles. Its errors are raised on all
+        # ranks so none of them is left waiting.
+        handlers = []
+        for event in events:
+            error = None
+            if MPI.COMM_WORLD.rank == 0:
+                try:
+                    self.comm.kernels.assert_has_boxfile(iteration.name,
+                                                         event)
+                except Exception as e:
+                    error = e
+            error = MPI.COMM_WORLD.bcast(error, root=0)
+            if error is not None:
+                raise error
+            handlers.append(RawSES3DModelHandler(
+                self.comm.kernels.get(iteration.name, event), domain=None,
+                model_type="kernel"))
+        reference = handlers[0]
+        for event, handler in zip(events, handlers):
+            if sorted(handler.components) != sorted(reference.components) \
+                    or handler.setup != reference.setup:
+                raise LASIFError(
+                    "The kernel of event '%s' does not have the same "
+                    "components and subdomains as the kernel of event "
+                    "'%s'." % (event, events[0]))
+
+        smoothing = bool(horizontal_smoothing_in_degree or
+                         vertical_smoothing_in_km)
+        summed_folder = self.comm.kernels.get_summed_kernel_folder(
+            iteration.name)
+        smoothed_folder = self.comm.kernels.get_summed_kernel_folder(
+            iteration.name, smoothed=True)
+        if MPI.COMM_WORLD.rank == 0:
+            for folder in [summed_folder] + \
+                    ([smoothed_folder] if smoothing else []):
+                if os.path.exists(folder):
+                    shutil.rmtree(folder)
+                os.makedirs(folder)
+                shutil.copyfile(reference.boxfile,
+                                os.path.join(folder, "boxfile"))
+        MPI.COMM_WORLD.barrier()
 
-        print("Wrote adjoint sources for %i station(s) to %s." % (
-            len(adjoint_source_stations), os.path.relpath(output_folder)))
+        backend, processes = self._get_parallel_settings(backend, processes)
+        subdomains = range(len(reference.setup["subdomains"]))
+
+        def _distribute(function, items, description):
+            logfile = self.comm.project.get_log_file(
+                "KERNELS", "%s_iteration_%s" % (description, iteration.name))
+            results = distribute_across_ranks(
+                function=function,
+                items=items if MPI.COMM_WORLD.rank == 0 else None,
+                get_name=lambda x: "subdomain %i" % x["subdomain"],
+                logfile=logfile, backend=backend, processes=processes)
+            failed = None
+            if MPI.COMM_WORLD.rank == 0:
+                failed = ["%i (%s)" % (_i.func_args["subdomain"],
+                                       _i.exception)
+                          for _i in results if _i.exception is not None]
+            failed = MPI.COMM_WORLD.bcast(failed, root=0)
+            if failed:
+                raise LASIFError("Failed to %s the kernels of %i "
+                                 "subdomain(s): %s" % (
+                                     description.split("_")[0], len(failed),
+                                     ", ".join(failed)))
+
+        _distribute(sum_kernel_subdomain, [
+            {"subdomain": _i,
+             "filenames": {
+                 os.path.basename(info["filenames"][_i]):
+                     [_h.components[component]["filenames"][_i]
+                      for _h in handlers]
+                 for component, info in reference.components.items()},
+             "output_folder": summed_folder} for _i in subdomains],
+            "sum_kernels")
+
+        if not smoothing:
+            return summed_folder
+
+        _distribute(smooth_kernel_subdomain, [
+            {"subdomain": _i,
+             "input_folder": summed_folder,
+             "output_folder": smoothed_folder,
+             "horizontal_smoothing_in_degree":
+                 horizontal_smoothing_in_degree,
+             "vertical_smoothing_in_km": vertical_smoothing_in_km}
+            for _i in subdomains], "smooth_kernels")
+
+        return smoothed_folder
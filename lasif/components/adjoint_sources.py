@@ -3,12 +3,13 @@
 
 
 import copy
-import joblib
 import numpy as np
 import os
 
-from lasif import LASIFNotFoundError, LASIFAdjointSourceCalculationError
+from lasif import LASIFError, LASIFNotFoundError, \
+    LASIFAdjointSourceCalculationError
 from .component import Component
+from ..adjoint_src_manager import AdjointSourceStore
 from ..adjoint_sources.ad_src_tf_phase_misfit import adsrc_tf_phase_misfit
 from ..adjoint_sources.ad_src_l2_norm_misfit import adsrc_l2_norm_misfit
 from ..adjoint_sources.ad_src_cc_time_shift import adsrc_cc_time_shift
@@ -33,67 +34,53 @@ class AdjointSourcesComponent(Component):
 
     def __init__(self, ad_src_folder, communicator, component_name):
         self._folder = ad_src_folder
+        self._stores = {}
         super(AdjointSourcesComponent, self).__init__(
             communicator, component_name)
 
-    def calculate_adjoint_source(self, event_name, iteration_name,
-                                 channel_id, starttime, endtime, taper,
-                                 taper_percentage, ad_src_type, plot=False):
+    def _get_store(self, event_name, long_iteration_name):
         """
-        Calculates an adjoint source for a single window.
+        Returns the store of an event and iteration. Stores are not shared
+        between processes.
+        """
+        key = (event_name, long_iteration_name, os.getpid())
+        if key not in self._stores:
+            self._stores[key] = AdjointSourceStore(os.path.join(
+                self._folder, event_name, long_iteration_name))
+        return self._stores[key]
+
+    def get_store(self, event_name, iteration_name):
+        """
+        Returns the :class:`~lasif.adjoint_src_manager.AdjointSourceStore`
+        with all adjoint sources of an event and iteration.
 
         :param event_name: The name of the event.
         :param iteration_name: The name of the iteration.
-        :param channel_id: The channel id in the form NET.STA.NET.CHA.
-        :param starttime: The starttime of the window.
-        :param endtime: The endtime of the window.
-        :param taper: How to taper the window.
-        :param taper_percentage: The taper percentage at one end as a
-            decimal number ranging from 0.0 to 0.5 for a full width taper.
-        :param ad_src_type: The type of adjoint source. Currently supported
-            are ``"TimeFrequencyPhaseMisfitFichtner2008"`` and ``"L2Norm"``.
         """
-        iteration = self.comm.iterations.get(iteration_name)
-        iteration_name = iteration.long_name
-        event = self.comm.events.get(event_name)
-        event_name = event["event_name"]
+        return self._get_store(
+            self.comm.events.get(event_name)["event_name"],
+            self.comm.iterations.get(iteration_name).long_name)
 
-        folder = os.path.join(self._folder, event_name, iteration_name)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = os.path.join(folder, "%s_%s_%s_%s_%.2f_%s" % (
-            channel_id, str(starttime), str(endtime), str(taper),
-            taper_percentage, ad_src_type))
-
-        if not plot and os.path.exists(filename):
-            adsrc = joblib.load(filename)
-            if not self._validate_return_value(adsrc):
-                os.remove(filename)
-            else:
-                return adsrc
+    def _load_cached(self, store, key):
+        """
+        Returns the stored adjoint source or None if not available.
+        """
+        adsrc = store.get(*key)
+        if adsrc is None or not self._validate_return_value(adsrc):
+            return None
+        return adsrc
 
+    def _calculate(self, data, synth, iteration, starttime, endtime, taper,
+                   taper_percentage, ad_src_type, plot=False):
+        """
+        Calculates the misfit and adjoint source of one window from the
+        given data and synthetic traces. The traces are not modified.
+        """
         if ad_src_type not in MISFIT_MAPPING:
             raise LASIFAdjointSourceCalculationError(
                 "Adjoint source type '%s' not supported. Supported types: %s"
                 % (ad_src_type, ", ".join(list(MISFIT_MAPPING.keys()))))
 
-        waveforms = self.comm.query.get_matching_waveforms(
-            event=event_name, iteration=iteration_name,
-            station_or_channel_id=channel_id)
-        data = waveforms.data
-        synth = waveforms.synthetics
-
-        if len(data) != 1:
-            raise LASIFNotFoundError(
-                "Data not found for event '%s', iteration '%s', and channel "
-                "'%s'." % (event_name, iteration_name, channel_id))
-        if len(synth) != 1:
-            raise LASIFNotFoundError(
-                "Synthetics not found for event '%s', iteration '%s', "
-                "and channel '%s'." % (event_name, iteration_name, channel_id))
-        data = data[0]
-        synth = synth[0]
-
         # Make sure they are equal enough.
         if abs(data.stats.starttime - synth.stats.starttime) > 0.1:
             raise LASIFAdjointSourceCalculationError(
@@ -108,6 +95,8 @@ class AdjointSourcesComponent(Component):
 
         original_stats = copy.deepcopy(data.stats)
 
+        data = data.copy()
+        synth = synth.copy()
         for trace in [data, synth]:
             trace.trim(starttime, endtime)
             trace.taper(type=taper.lower(), max_percentage=taper_percentage)
@@ -137,12 +126,16 @@ class AdjointSourcesComponent(Component):
             return
 
         # Recreate dictionary for clarity.
-        ret_val = {
+        return {
             "adjoint_source": adsrc["adjoint_source"],
             "misfit_value": adsrc["misfit_value"],
             "details": adsrc["details"]
         }
 
+    def _store(self, ret_val, store, key):
+        """
+        Stores a calculated adjoint source and returns it.
+        """
         # If the adjoint source has not been calculated, the misfit might
         # still have. Don't store the adjoint source in that case.
         if ret_val["adjoint_source"] is None and \
@@ -153,9 +146,145 @@ class AdjointSourcesComponent(Component):
             raise LASIFAdjointSourceCalculationError(
                 "Could not calculate adjoint source due to mismatching types.")
 
-        joblib.dump(ret_val, filename)
+        store.put(*key, adjoint_source=ret_val)
         return ret_val
 
+    def _select_traces(self, waveforms, event_name, iteration_name,
+                       channel_id):
+        """
+        Selects the data and synthetic trace of a channel.
+        """
+        component = channel_id.split(".")[-1][-1].upper()
+        data = [tr for tr in waveforms.data
+                if tr.stats.channel[-1].upper() == component]
+        synth = [tr for tr in waveforms.synthetics
+                 if tr.stats.channel[-1].upper() == component]
+
+        if len(data) != 1:
+            raise LASIFNotFoundError(
+                "Data not found for event '%s', iteration '%s', and channel "
+                "'%s'." % (event_name, iteration_name, channel_id))
+        if len(synth) != 1:
+            raise LASIFNotFoundError(
+                "Synthetics not found for event '%s', iteration '%s', "
+                "and channel '%s'." % (event_name, iteration_name, channel_id))
+        return data[0], synth[0]
+
+    def calculate_adjoint_source(self, event_name, iteration_name,
+                                 channel_id, starttime, endtime, taper,
+                                 taper_percentage, ad_src_type, plot=False):
+        """
+        Calculates an adjoint source for a single window.
+
+        :param event_name: The name of the event.
+        :param iteration_name: The name of the iteration.
+        :param channel_id: The channel id in the form NET.STA.NET.CHA.
+        :param starttime: The starttime of the window.
+        :param endtime: The endtime of the window.
+        :param taper: How to taper the window.
+        :param taper_percentage: The taper percentage at one end as a
+            decimal number ranging from 0.0 to 0.5 for a full width taper.
+        :param ad_src_type: The type of adjoint source. Currently supported
+            are ``"TimeFrequencyPhaseMisfitFichtner2008"`` and ``"L2Norm"``.
+        """
+        iteration = self.comm.iterations.get(iteration_name)
+        iteration_name = iteration.long_name
+        event = self.comm.events.get(event_name)
+        event_name = event["event_name"]
+
+        store = self._get_store(event_name, iteration_name)
+        key = (channel_id, starttime, endtime, taper, taper_percentage,
+               ad_src_type)
+
+        if not plot:
+            adsrc = self._load_cached(store, key)
+            if adsrc is not None:
+                return adsrc
+
+        if ad_src_type not in MISFIT_MAPPING:
+            raise LASIFAdjointSourceCalculationError(
+                "Adjoint source type '%s' not supported. Supported types: %s"
+                % (ad_src_type, ", ".join(list(MISFIT_MAPPING.keys()))))
+
+        waveforms = self.comm.query.get_matching_waveforms(
+            event=event_name, iteration=iteration_name,
+            station_or_channel_id=channel_id)
+        data, synth = self._select_traces(waveforms, event_name,
+                                          iteration_name, channel_id)
+
+        ret_val = self._calculate(data, synth, iteration, starttime, endtime,
+                                  taper, taper_percentage, ad_src_type,
+                                  plot=plot)
+        if plot:
+            return
+        return self._store(ret_val, store, key)
+
+    def calculate_adjoint_sources_for_station(self, event_name,
+                                              iteration_name, station_id,
+                                              windows):
+        """
+        Calculates the adjoint sources of all given windows of one station.
+
+        The data and synthetics of the station are read at most once, and
+        only if not all adjoint sources are already cached. All windows are
+        attempted even if some of them fail.
+
+        :param event_name: The name of the event.
+        :param iteration_name: The name of the iteration.
+        :param station_id: The station id in the form NET.STA.
+        :param windows: A dictionary with a list of
+            :class:`~lasif.window_manager.Window` objects per channel id.
+        :returns: A dictionary with the list of adjoint sources per channel
+            id in the same order as the windows.
+
+        Raises a :class:`~lasif.LASIFAdjointSourceCalculationError` listing
+        all failed windows after all windows have been processed.
+        """
+        from lasif.window_manager import DEFAULT_AD_SRC_TYPE
+
+        iteration = self.comm.iterations.get(iteration_name)
+        long_iteration_name = iteration.long_name
+        event_name = self.comm.events.get(event_name)["event_name"]
+
+        store = self._get_store(event_name, long_iteration_name)
+        waveforms = None
+        adjoint_sources = {}
+        failures = []
+        for channel_id in sorted(windows.keys()):
+            adjoint_sources[channel_id] = []
+            for window in windows[channel_id]:
+                ad_src_type = window.misfit_type or DEFAULT_AD_SRC_TYPE
+                key = (channel_id, window.starttime, window.endtime,
+                       window.taper, window.taper_percentage, ad_src_type)
+                try:
+                    adsrc = self._load_cached(store, key)
+                    if adsrc is None:
+                        if waveforms is None:
+                            waveforms = self.comm.query.get_matching_waveforms(
+                                event_name, iteration, station_id)
+                        data, synth = self._select_traces(
+                            waveforms, event_name, long_iteration_name,
+                            channel_id)
+                        adsrc = self._store(self._calculate(
+                            data, synth, iteration, window.starttime,
+                            window.endtime, window.taper,
+                            window.taper_percentage, ad_src_type), store, key)
+                    if adsrc["adjoint_source"] is None:
+                        raise LASIFAdjointSourceCalculationError(
+                            "Could not calculate adjoint source!")
+                except LASIFError as e:
+                    failures.append("%s (%s - %s): %s" % (
+                        channel_id, window.starttime, window.endtime,
+                        str(e)))
+                    adsrc = None
+                adjoint_sources[channel_id].append(adsrc)
+
+        if failures:
+            raise LASIFAdjointSourceCalculationError(
+                "Failed to calculate %i adjoint source(s): %s" % (
+                    len(failures), "; ".join(failures)))
+        return adjoint_sources
+
     def _validate_return_value(self, adsrc):
         if not isinstance(adsrc, dict):
             return False
@@ -32,6 +32,13 @@ class InventoryDBComponent(Component):
         super(InventoryDBComponent, self).__init__(communicator,
                                                    component_name)
 
+    @property
+    def db_file(self):
+        """
+        The filename of the inventory database.
+        """
+        return self._db_file
+
     @property
     def _conn(self):
         """
@@ -54,6 +54,34 @@ class KernelsComponent(Component):
                                                     event))
         return kernel_dir
 
+    def list_events(self, iteration):
+        """
+        Returns a sorted list of all events with a kernel for an iteration.
+        Other folders in the kernel folder of the iteration are ignored.
+
+        :param iteration: The iteration.
+        """
+        iteration = self.comm.iterations.get(iteration)
+        folder = os.path.join(self._folder, iteration.long_name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            _i for _i in os.listdir(folder)
+            if os.path.isdir(os.path.join(folder, _i)) and
+            self.comm.events.has_event(_i))
+
+    def get_summed_kernel_folder(self, iteration, smoothed=False):
+        """
+        Returns the folder of the sum of the kernels of all events of an
+        iteration. It lives next to the kernels of the single events.
+
+        :param iteration: The iteration.
+        :param smoothed: Return the folder of the smoothed sum.
+        """
+        iteration = self.comm.iterations.get(iteration)
+        return os.path.join(self._folder, iteration.long_name,
+                            "SUMMED_SMOOTHED" if smoothed else "SUMMED")
+
     def assert_has_boxfile(self, iteration, event):
         """
         Makes sure the kernel in question has a boxfile. Otherwise it will
@@ -118,7 +146,10 @@ class KernelsComponent(Component):
 
         from lasif.ses3d_models import RawSES3DModelHandler  # NOQA
 
+        directory = self.get(iteration=iteration, event=event)
         return RawSES3DModelHandler(
-            directory=self.get(iteration=iteration, event=event),
+            directory=directory,
             domain=self.comm.project.domain,
-            model_type="kernel")
+            model_type="kernel",
+            cache_folder=self.comm.project.get_depth_slice_cache_folder(
+                directory))
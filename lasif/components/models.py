@@ -46,7 +46,10 @@ class ModelsComponent(Component):
         :param model_name: The name of the model.
         """
         from lasif.ses3d_models import RawSES3DModelHandler  # NOQA
+        directory = self.get(model_name)
         return RawSES3DModelHandler(
-            directory=self.get(model_name),
+            directory=directory,
             domain=self.comm.project.domain,
-            model_type="earth_model")
+            model_type="earth_model",
+            cache_folder=self.comm.project.get_depth_slice_cache_folder(
+                directory))
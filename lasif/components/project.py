@@ -89,6 +89,7 @@ class Project(Component):
             raise LASIFError(msg)
 
         self.__project_function_cache = {}
+        self.__travel_time_table_cache = {}
 
         # Setup the communicator and register this component.
         self.__comm = Communicator()
@@ -196,6 +197,13 @@ class Project(Component):
             "location_priorities": ["", "00", "10", "20", "01", "02"]
         }
 
+        # Settings that older config files might not have.
+        default_misc_settings = {
+            "parallel_backend": "mpi",
+            "parallel_processes": None,
+            "materialize_synthetics": False
+        }
+
         # Attempt to read the cached config file. This might seem excessive but
         # since this file is read every single time a LASIF command is used it
         # makes difference at least in the perceived speed of LASIF.
@@ -214,6 +222,8 @@ class Project(Component):
                     if "misc_settings" not in self.config:
                         self.config["misc_settings"] = {
                             "time_frequency_adjoint_source_criterion": 7.0}
+                    for key, value in default_misc_settings.items():
+                        self.config["misc_settings"].setdefault(key, value)
 
                     self.config["download_settings"] = \
                         default_download_settings
@@ -295,6 +305,21 @@ class Project(Component):
         else:
             self.config["misc_settings"] = {
                 "time_frequency_adjoint_source_criterion": 7.0}
+        self.config["misc_settings"].update(default_misc_settings)
+        # Only add if available, otherwise use defaults.
+        if misc is not None:
+            backend = misc.find("parallel_backend")
+            if backend is not None and backend.text:
+                self.config["misc_settings"]["parallel_backend"] = \
+                    backend.text.strip().lower()
+            processes = misc.find("parallel_processes")
+            if processes is not None and processes.text:
+                self.config["misc_settings"]["parallel_processes"] = \
+                    int(processes.text)
+            materialize = misc.find("materialize_synthetics")
+            if materialize is not None and materialize.text:
+                self.config["misc_settings"]["materialize_synthetics"] = \
+                    materialize.text.strip().lower() == "true"
 
         # Write cache file.
         cf_cache = {}
@@ -308,6 +333,9 @@ class Project(Component):
     def build_all_caches(self, quick=False):
         """
         Command to build/update all caches.
+
+        Unless ``quick`` is given, all waveform files are checked, even in
+        folders that have not been modified since the last update.
         """
         # The event cache is always up to date and does not have to be updated.
 
@@ -322,25 +350,22 @@ class Project(Component):
         for event in self.comm.events.list():
             print(("Building/updating data cache for event '%s'..." % event))
             # Get all caches which will build them.
-            try:
-                self.comm.waveforms.get_waveform_cache(event, "raw",
-                                                       dont_update=quick)
-            except LASIFNotFoundError:
-                pass
-            p_tags = self.comm.waveforms.get_available_processing_tags(event)
-            s_tags = self.comm.waveforms.get_available_synthetics(event)
-            for tag in p_tags:
-                try:
-                    self.comm.waveforms.get_waveform_cache(
-                        event, "processed", tag, dont_update=quick)
-                except LASIFNotFoundError:
-                    pass
-            for tag in s_tags:
+            caches = [(event, "raw", None)]
+            caches.extend(
+                (event, "processed", tag) for tag in
+                self.comm.waveforms.get_available_processing_tags(event))
+            caches.extend(
+                (event, "synthetic", tag) for tag in
+                self.comm.waveforms.get_available_synthetics(event))
+            for event_name, data_type, tag in caches:
                 try:
-                    self.comm.waveforms.get_waveform_cache(
-                        event, "synthetic", tag, dont_update=quick)
+                    cache = self.comm.waveforms.get_waveform_cache(
+                        event_name, data_type, tag, dont_update=quick)
                 except LASIFNotFoundError:
-                    pass
+                    continue
+                # Also finds files modified in place.
+                if not quick and not cache.read_only:
+                    cache.update(use_journal=False)
 
     def get_filecounts_for_event(self, event_name):
         """
@@ -585,6 +610,7 @@ class Project(Component):
         fct_type_map = {
             "window_picking_function": "window_picking_function.py",
             "preprocessing_function": "preprocessing_function.py",
+            "preprocessing_function_batch": "preprocessing_function.py",
             "data_svd_selection": "data_svd_selection.py",
             "process_synthetics": "process_synthetics.py",
             "source_time_function": "source_time_function.py",
@@ -603,7 +629,10 @@ class Project(Component):
             msg = "No file '%s' in existence." % filename
             raise LASIFNotFoundError(msg)
 
-        fct_template = imp.load_source("_lasif_fct_template", filename)
+        # Use a distinct module name per function so the functions can be
+        # pickled by reference to be sent to other processes.
+        fct_template = imp.load_source("_lasif_fct_template_%s" % fct_type,
+                                       filename)
         try:
             fct = getattr(fct_template, fct_type)
         except AttributeError:
@@ -618,6 +647,39 @@ class Project(Component):
         self.__project_function_cache[fct_type] = fct
         return fct
 
+    def get_travel_time_table(self, phase="P", model="ak135"):
+        """
+        Returns the travel time table for the given phase and model. It is
+        stored in the cache folder of the project so TauP only has to be
+        run once for every source depth.
+
+        :param phase: The phase name, e.g. ``"P"`` or ``"ttp"``.
+        :param model: The name of the 1D Earth model.
+        """
+        from lasif.tools.travel_time_table import TravelTimeTable
+
+        key = (model.lower(), phase)
+        if key not in self.__travel_time_table_cache:
+            filename = os.path.join(
+                self.paths["cache"],
+                "travel_times_%s_%s.npz" % (model.lower(), phase))
+            self.__travel_time_table_cache[key] = TravelTimeTable(
+                model=model.lower(), phase=phase, filename=filename)
+        return self.__travel_time_table_cache[key]
+
+    def get_depth_slice_cache_folder(self, model_directory):
+        """
+        Returns the folder storing the depth slice pyramids of a model or
+        kernel in the project. It mirrors the location of the model in the
+        project.
+
+        :param model_directory: The directory of the model or kernel.
+        """
+        return os.path.join(
+            self.paths["cache"], "depth_slices",
+            os.path.relpath(os.path.abspath(model_directory),
+                            os.path.abspath(self.paths["root"])))
+
     def get_output_folder(self, type, tag):
         """
         Generates a output folder in a unified way.
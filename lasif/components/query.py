@@ -3,6 +3,7 @@
 
 
 import collections
+import copy
 import os
 import warnings
 
@@ -26,6 +27,97 @@ class QueryComponent(Component):
     of other components via the communicator.
     """
 
+    def __init__(self, communicator, component_name):
+        # Resolved station coordinates per waveform cache.
+        self._station_coordinates = {}
+        super(QueryComponent, self).__init__(communicator, component_name)
+
+    def _get_cache_state(self, waveform_cache):
+        """
+        Returns a token that changes whenever one of the databases the
+        station coordinates are resolved from is modified.
+        """
+        state = []
+        for filename in [waveform_cache.cache_db_file,
+                         self.comm.stations.cache_file,
+                         self.comm.inventory_db.db_file]:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                state.append(None)
+                continue
+            state.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(state)
+
+    def _get_station_coordinates(self, event_name, waveform_cache,
+                                 get_metadata):
+        """
+        Returns the coordinates of all stations with waveforms in the given
+        cache.
+
+        The result is memoized per waveform cache and invalidated as soon as
+        the waveform cache, the station cache, or the inventory database
+        changes. Callers get a deep copy so modifying it does not change the
+        memoized coordinates.
+
+        :param event_name: The name of the event.
+        :param waveform_cache: The waveform cache.
+        :param get_metadata: Function returning the waveform metadata.
+        """
+        event = self.comm.events.get(event_name)
+
+        key = waveform_cache.cache_db_file
+        if key in self._station_coordinates:
+            state, stations = self._station_coordinates[key]
+            if state == self._get_cache_state(waveform_cache):
+                return copy.deepcopy(stations)
+
+        # Collect information from all the different places.
+        waveform_metadata = get_metadata()
+        station_coordinates = self.comm.stations.get_all_channels_at_time(
+            event["origin_time"])
+        inventory_coordinates = self.comm.inventory_db.get_all_coordinates()
+
+        stations = {}
+        for waveform in waveform_metadata:
+            station_id = "%s.%s" % (waveform["network"], waveform["station"])
+            if station_id in stations:
+                continue
+
+            try:
+                stat_coords = station_coordinates[waveform["channel_id"]]
+            except KeyError:
+                # No station file for channel.
+                continue
+
+            # First attempt to retrieve from the station files.
+            if stat_coords["latitude"] is not None:
+                stations[station_id] = stat_coords
+                continue
+            # Then from the waveform metadata in the case of a sac file.
+            elif waveform["latitude"] is not None:
+                stations[station_id] = waveform
+                continue
+            # If that still does not work, check if the inventory database
+            # has an entry.
+            elif station_id in inventory_coordinates:
+                coords = inventory_coordinates[station_id]
+                # Otherwise already queried for, but no coordinates found.
+                if coords["latitude"]:
+                    stations[station_id] = coords
+                continue
+
+            # The last resort is a new query via the inventory database.
+            coords = self.comm.inventory_db.get_coordinates(station_id)
+            if coords["latitude"]:
+                stations[station_id] = coords
+
+        # Determine the state afterwards as the inventory database might
+        # have been updated in the meanwhile.
+        self._station_coordinates[key] = (
+            self._get_cache_state(waveform_cache), stations)
+        return copy.deepcopy(stations)
+
     def get_all_stations(self):
         """
         Returns a list of all stations available for all events.
@@ -113,48 +205,12 @@ class QueryComponent(Component):
             ...
         LASIFNotFoundError: ...
         """
-        event = self.comm.events.get(event_name)
-
-        # Collect information from all the different places.
-        waveform_metadata = self.comm.waveforms.get_metadata_raw(event_name)
-        station_coordinates = self.comm.stations.get_all_channels_at_time(
-            event["origin_time"])
-        inventory_coordinates = self.comm.inventory_db.get_all_coordinates()
-
-        stations = {}
-        for waveform in waveform_metadata:
-            station_id = "%s.%s" % (waveform["network"], waveform["station"])
-            if station_id in stations:
-                continue
-
-            try:
-                stat_coords = station_coordinates[waveform["channel_id"]]
-            except KeyError:
-                # No station file for channel.
-                continue
-
-            # First attempt to retrieve from the station files.
-            if stat_coords["latitude"] is not None:
-                stations[station_id] = stat_coords
-                continue
-            # Then from the waveform metadata in the case of a sac file.
-            elif waveform["latitude"] is not None:
-                stations[station_id] = waveform
-                continue
-            # If that still does not work, check if the inventory database
-            # has an entry.
-            elif station_id in inventory_coordinates:
-                coords = inventory_coordinates[station_id]
-                # Otherwise already queried for, but no coordinates found.
-                if coords["latitude"]:
-                    stations[station_id] = coords
-                continue
-
-            # The last resort is a new query via the inventory database.
-            coords = self.comm.inventory_db.get_coordinates(station_id)
-            if coords["latitude"]:
-                stations[station_id] = coords
-        return stations
+        self.comm.events.get(event_name)
+        waveform_cache = self.comm.waveforms.get_waveform_cache(
+            event_name, "raw")
+        return self._get_station_coordinates(
+            event_name, waveform_cache,
+            lambda: self.comm.waveforms.get_metadata_raw(event_name))
 
     def get_all_stations_for_event_for_iteration(
             self, event_name, iteration_name):
@@ -192,59 +248,29 @@ class QueryComponent(Component):
             ...
         LASIFNotFoundError: ...
         """
-        event = self.comm.events.get(event_name)
-
-        iteration = self.comm.iterations.get(iteration_name)
-        processing_tag = iteration.processing_tag
-
-        # Collect information from all the different places.
-        waveform_metadata = self.comm.waveforms.get_metadata_processed(
-            event_name, processing_tag)
-        station_coordinates = self.comm.stations.get_all_channels_at_time(
-            event["origin_time"])
-        inventory_coordinates = self.comm.inventory_db.get_all_coordinates()
-
-        stations = {}
-        for waveform in waveform_metadata:
-            station_id = "%s.%s" % (waveform["network"], waveform["station"])
-            if station_id in stations:
-                continue
-
-            try:
-                stat_coords = station_coordinates[waveform["channel_id"]]
-            except KeyError:
-                # No station file for channel.
-                continue
-
-            # First attempt to retrieve from the station files.
-            if stat_coords["latitude"] is not None:
-                stations[station_id] = stat_coords
-                continue
-            # Then from the waveform metadata in the case of a sac file.
-            elif waveform["latitude"] is not None:
-                stations[station_id] = waveform
-                continue
-            # If that still does not work, check if the inventory database
-            # has an entry.
-            elif station_id in inventory_coordinates:
-                coords = inventory_coordinates[station_id]
-                # Otherwise already queried for, but no coordinates found.
-                if coords["latitude"]:
-                    stations[station_id] = coords
-                continue
-
-            # The last resort is a new query via the inventory database.
-            coords = self.comm.inventory_db.get_coordinates(station_id)
-            if coords["latitude"]:
-                stations[station_id] = coords
-        return stations
+        self.comm.events.get(event_name)
+        processing_tag = self.comm.iterations.get(
+            iteration_name).processing_tag
+        waveform_cache = self.comm.waveforms.get_waveform_cache(
+            event_name, "processed", processing_tag)
+        return self._get_station_coordinates(
+            event_name, waveform_cache,
+            lambda: self.comm.waveforms.get_metadata_processed(
+                event_name, processing_tag))
 
     def get_coordinates_for_station(self, event_name, station_id):
         """
         Get the coordinates for one station.
 
-        Must be in sync with :meth:`~.get_all_stations_for_event`.
+        Must be in sync with :meth:`~.get_all_stations_for_event`. Uses its
+        memoized results so looking up many stations one after another does
+        not scan the station cache each time.
         """
+        stations = self.get_all_stations_for_event(event_name)
+        if station_id in stations:
+            return stations[station_id]
+
+        # Otherwise raise a more specific error.
         event = self.comm.events.get(event_name)
 
         # Collect information from all the different places.
@@ -401,7 +427,68 @@ class QueryComponent(Component):
         from ..tools.data_synthetics_iterator import DataSyntheticIterator
         return DataSyntheticIterator(self.comm, iteration, event)
 
-    def get_matching_waveforms(self, event, iteration, station_or_channel_id):
+    def get_matching_waveforms_for_event(self, event, iteration,
+                                         stations=None):
+        """
+        Get the processed data and matching synthetics for many stations of
+        one event at once.
+
+        The station coordinates of the event are only looked up once which
+        is much cheaper than calling :meth:`get_matching_waveforms` for each
+        station. Stations for which no matching waveforms can be found are
+        skipped with a warning.
+
+        :param event: The event.
+        :param iteration: The iteration.
+        :param stations: The station ids in the form ``NET.STA``. Defaults to
+            all stations of the event in the iteration that have processed
+            data and synthetics.
+        :rtype: dict
+        :returns: A dictionary of :class:`DataTuple` objects keyed by
+            station id.
+        """
+        iteration = self.comm.iterations.get(iteration)
+        event = self.comm.events.get(event)
+
+        if stations is None:
+            stations = self.get_data_and_synthetics_iterator(
+                iteration, event).stations
+
+        all_coordinates = self.get_all_stations_for_event(
+            event["event_name"])
+
+        waveforms = {}
+        for station_id in stations:
+            if station_id not in all_coordinates:
+                warnings.warn(
+                    "Could not find coordinates for station '%s' and event "
+                    "'%s'." % (station_id, event["event_name"]),
+                    LASIFWarning)
+                continue
+            try:
+                waveforms[station_id] = self.get_matching_waveforms(
+                    event, iteration, station_id,
+                    coordinates=all_coordinates[station_id])
+            except LASIFError as e:
+                warnings.warn(
+                    "Could not get waveforms for station '%s' and event "
+                    "'%s': %s" % (station_id, event["event_name"], str(e)),
+                    LASIFWarning)
+        return waveforms
+
+    def get_matching_waveforms(self, event, iteration, station_or_channel_id,
+                               coordinates=None):
+        """
+        Get the processed data and matching synthetics for a station or a
+        single channel.
+
+        :param event: The event.
+        :param iteration: The iteration.
+        :param station_or_channel_id: The station id in the form
+            ``NET.STA`` or the channel id in the form ``NET.STA.LOC.CHA``.
+        :param coordinates: The coordinates of the station. Will be looked
+            up if not given.
+        """
         seed_id = station_or_channel_id.split(".")
         if len(seed_id) == 2:
             channel = None
@@ -424,8 +511,9 @@ class QueryComponent(Component):
         synthetics = self.comm.waveforms.get_waveforms_synthetic(
             event["event_name"], station_id,
             long_iteration_name=iteration.long_name)
-        coordinates = self.comm.query.get_coordinates_for_station(
-            event["event_name"], station_id)
+        if coordinates is None:
+            coordinates = self.comm.query.get_coordinates_for_station(
+                event["event_name"], station_id)
 
         # Clear data and synthetics!
         for _st, name in ((data, "observed"), (synthetics, "synthetic")):
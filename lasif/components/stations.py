@@ -253,6 +253,32 @@ class StationsComponent(Component):
                     channel_id, str(time)))
         return filename
 
+    def get_channel_files_and_coordinates(self, channels):
+        """
+        Returns the station files and coordinates for many channel and time
+        combinations at once. Much faster than calling
+        :meth:`.get_channel_filename` for each channel.
+
+        :param channels: List of tuples of channel ids and times. The times
+            can be timestamps or :class:`~obspy.core.utcdatetime.UTCDateTime`
+            objects.
+        :returns: A list with one dictionary per channel with the absolute
+            ``"filename"`` and the coordinates. Channels without a station
+            file result in ``None``.
+
+        >>> import obspy
+        >>> comm = getfixture('stations_comm')
+        >>> info = comm.stations.get_channel_files_and_coordinates([
+        ...     ("IU.ANMO.10.BHZ", obspy.UTCDateTime(2012, 3, 14)),
+        ...     ("AA.BB.CC.DD", 1331683200)])
+        >>> info[0]["filename"]  # doctest: +ELLIPSIS
+        '/.../IRIS_single_channel_with_response.xml'
+        >>> print(info[1])
+        None
+        """
+        return self._station_cache.get_station_files_and_coordinates(
+            channels)
+
     def get_station_filename(self, network, station, location, channel,
                              file_format):
         """
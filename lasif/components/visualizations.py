@@ -1113,9 +1113,9 @@ class VisualizationsComponent(Component):
                 raise ValueError
             return _map[channel]
 
-        for channel in window_manager.list():
+        for channel, collection in window_manager.get_all_windows().items():
             station = ".".join(channel.split(".")[:2])
-            for win in window_manager.get(channel):
+            for win in collection:
                 image[
                     _space_index(stations[station]["epicentral_distance"]),
                     _time_index(win.starttime):_time_index(win.endtime),
@@ -4,6 +4,7 @@
 
 import collections
 import fnmatch
+import glob
 import itertools
 import os
 import warnings
@@ -11,6 +12,8 @@ import warnings
 import obspy
 
 from lasif import LASIFError, LASIFNotFoundError, LASIFWarning
+from ..file_handling.ses3d_file_parser import convert_folder_to_binary, \
+    read_waveform_file
 from ..tools.cache_helpers.waveform_cache import WaveformCache
 from .component import Component
 
@@ -185,14 +188,14 @@ class WaveformsComponent(Component):
                                   read_only=True)
         elif data_type == "synthetic" \
                 and not os.path.exists(waveform_db_file) \
-                and os.listdir(data_path):
+                and glob.glob(os.path.join(data_path, "*")):
             # If it is synthetic, read a file and assume all other files
             # have the same length. This has the huge advantage that the
             # files no longer have to be opened but only the filename has to
             # be parsed. Only works for SES3D files.
-            files = sorted(os.listdir(data_path))
-            filename = os.path.join(data_path, files[len(files) // 2])
-            tr = obspy.read(filename)[0]
+            files = sorted(glob.glob(os.path.join(data_path, "*")))
+            filename = files[len(files) // 2]
+            tr = read_waveform_file(filename, headonly=True)[0]
             synthetic_info = {
                 "starttime_timestamp": tr.stats.starttime.timestamp,
                 "endtime_timestamp": tr.stats.endtime.timestamp
@@ -297,15 +300,97 @@ class WaveformsComponent(Component):
         Gets the synthetic waveforms for the given event and station as a
         :class:`~obspy.core.stream.Stream` object.
 
+        If the project's ``materialize_synthetics`` setting is enabled, the
+        final synthetics are stored in the cache folder and memory-mapped
+        by all further calls until the synthetic files, the
+        ``process_synthetics`` function, the event, the iteration, or the
+        domain change.
+
         :param event_name: The name of the event.
         :param station_id: The id of the station in the form ``NET.STA``.
         :param long_iteration_name: The long form of an iteration name.
         """
+        iteration = self.comm.iterations.get(long_iteration_name)
+
+        if not self.comm.project.config["misc_settings"][
+                "materialize_synthetics"]:
+            return self._assemble_synthetics(event_name, station_id,
+                                             iteration)
+
+        from lasif.tools.synthetics_cache import SyntheticsCache
+
+        cache = SyntheticsCache(os.path.join(
+            self.comm.project.paths["cache"], "synthetics"))
+        key = self._get_synthetics_key(event_name, station_id, iteration)
+        st = cache.get(event_name, iteration.long_name, station_id, key)
+        if st is None:
+            st = self._assemble_synthetics(event_name, station_id, iteration)
+            cache.put(event_name, iteration.long_name, station_id, key, st)
+        return st
+
+    def convert_synthetics_to_binary(self, event_name, long_iteration_name):
+        """
+        Stores the samples of all SES3D synthetics of an event and an
+        iteration in binary sidecar files which are read instead of the
+        ASCII files from then on. Files with up-to-date sidecars are
+        skipped.
+
+        Returns the number of converted files.
+
+        :param event_name: The name of the event.
+        :param long_iteration_name: The long form of an iteration name.
+        """
+        folder = self.get_waveform_folder(event_name, "synthetic",
+                                          long_iteration_name)
+        if not os.path.exists(folder):
+            msg = ("No synthetic data for event '%s' and iteration '%s' "
+                   "found." % (event_name, long_iteration_name))
+            raise LASIFNotFoundError(msg)
+        return convert_folder_to_binary(folder)
+
+    def _get_synthetics_key(self, event_name, station_id, iteration):
+        """
+        Key identifying everything the final synthetics of a station depend
+        on.
+        """
+        from lasif.tools.synthetics_cache import get_file_hash, get_key
+
+        waveform_cache = self.get_waveform_cache(
+            event_name, "synthetic", iteration.long_name)
+        network, station = station_id.split(".")
+        files = []
+        for filename, crc32_hash in sorted(
+                waveform_cache.get_file_hashes_for_station(
+                    network, station).items()):
+            # Also catches files modified after the last cache update.
+            stat = os.stat(filename)
+            files.append((os.path.basename(filename), crc32_hash,
+                          stat.st_size, stat.st_mtime_ns))
+
+        domain = self.comm.project.domain
+        coordinates = None
+        if getattr(domain, "rotation_angle_in_degree", None) and \
+                "ses3d" in iteration.solver_settings["solver"].lower():
+            coordinates = self.comm.query.get_coordinates_for_station(
+                event_name, station_id)
+
+        return get_key(
+            files,
+            get_file_hash(os.path.join(self.comm.project.paths["functions"],
+                                       "process_synthetics.py")),
+            get_file_hash(self.comm.iterations.get_filename_for_iteration(
+                iteration.name)),
+            self.comm.events.get(event_name),
+            [type(domain).__name__, vars(domain)],
+            coordinates)
+
+    def _assemble_synthetics(self, event_name, station_id, iteration):
+        """
+        Reads the synthetics of a station and applies all modifications.
+        """
         from lasif import rotations
         import lasif.domain
 
-        iteration = self.comm.iterations.get(long_iteration_name)
-
         st = self._get_waveforms(event_name, station_id,
                                  data_type="synthetic",
                                  tag_or_iteration=iteration.long_name)
@@ -398,7 +483,10 @@ class WaveformsComponent(Component):
             files = locations[keys[0]]
         st = obspy.Stream()
         for single_file in files:
-            st += obspy.read(single_file["filename"])
+            if data_type == "synthetic":
+                st += read_waveform_file(single_file["filename"])
+            else:
+                st += obspy.read(single_file["filename"])
         st.sort()
         return st
 
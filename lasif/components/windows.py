@@ -135,6 +135,11 @@ class WindowsComponent(Component):
                 _i + 1, len(it.events))))
 
             wm = self.get(event=event, iteration=iteration)
+            # Load all windows of the event at once.
+            windows_per_station = {}
+            for coll in wm.get_all_windows().values():
+                windows_per_station.setdefault(
+                    ".".join(coll.channel_id.split(".")[:2]), []).append(coll)
 
             event_obj = self.comm.events.get(event)
             station_details = copy.deepcopy(
@@ -157,7 +162,7 @@ class WindowsComponent(Component):
 
                 s["windows"] = {"Z": [], "E": [], "N": []}
 
-                wins = wm.get_windows_for_station(station)
+                wins = windows_per_station.get(station, [])
                 has_windows = False
                 for coll in wins:
                     component = coll.channel_id[-1].upper()
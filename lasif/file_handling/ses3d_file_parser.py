@@ -7,15 +7,21 @@ objects.
 Can be tied directly into ObsPy's plugin system by setting the correct entry
 points in the setup.py.
 
+Parsing the ASCII samples dominates reading SES3D files. Repeatedly read
+files can be converted to binary sidecars with
+:func:`convert_folder_to_binary`.
+
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012-2013
 :license:
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-import numpy as np
+import os
 import warnings
 
+import numpy as np
+
 from lasif import rotations
 
 
@@ -32,6 +38,15 @@ COMPONENT_MAP = {
     "r": "Z"
 }
 
+# Name of the subfolder with the binary sidecars of the SES3D files of a
+# folder.
+BINARY_FOLDER = ".binary"
+
+# Sidecars start with the size and the modification time of their SES3D
+# file followed by the samples.
+SIDECAR_HEADER_DTYPE = np.dtype("<i8")
+SIDECAR_DATA_DTYPE = np.dtype("<f4")
+
 
 def is_SES3D(filename_or_file_object):
     """
@@ -79,57 +94,137 @@ def read_SES3D(file_or_file_object, headonly=False, *args, **kwargs):
     The network, station, and location attributes of the trace will be empty,
     and the channel will be set to either 'X' (south component), 'Y' (east
     component), or 'Z' (vertical component).
+
+    If the file has an up-to-date binary sidecar written by
+    :func:`write_binary_sidecar`, the samples are read from it instead of
+    being parsed.
     """
     if not hasattr(file_or_file_object, "read"):
         with open(file_or_file_object, "rb") as fh:
-            return _read_SES3D(fh, headonly=headonly)
+            return _read_SES3D(fh, headonly=headonly,
+                               filename=file_or_file_object)
     else:
         return _read_SES3D(file_or_file_object, headonly=headonly)
 
 
-def _read_SES3D(fh, headonly=False):
+def read_SES3D_header(filename_or_file_object):
+    """
+    Reads only the header of a SES3D file. Reading stops after the header
+    lines so it is independent of the number of samples.
+
+    Returns a dictionary with the ``channel``, ``npts``, and ``delta`` of
+    the trace and the ``ses3d`` dictionary described in :func:`read_SES3D`.
+
+    :param filename_or_file_object: The filename or an open file.
+    """
+    if not hasattr(filename_or_file_object, "read"):
+        with open(filename_or_file_object, "rb") as fh:
+            return _read_header(fh)
+    return _read_header(filename_or_file_object)
+
+
+def read_waveform_file(filename, headonly=False):
+    """
+    Reads a waveform file into a obspy.core.Stream object.
+
+    SES3D files are read with :func:`read_SES3D` without going through
+    ObsPy's format detection. All other files are read with
+    :func:`obspy.read`.
+
+    :param filename: The waveform file.
+    :param headonly: Only read the header.
+    """
+    if not is_SES3D(filename):
+        import obspy
+        return obspy.read(filename, headonly=headonly)
+    st = read_SES3D(filename, headonly=headonly)
+    # Same as set by ObsPy's plugin system.
+    st[0].stats._format = "SES3D"
+    return st
+
+
+def get_binary_sidecar_filename(filename):
+    """
+    Returns the filename of the binary sidecar of a SES3D file. The
+    sidecars are stored in the hidden ``.binary`` subfolder so they are
+    not picked up as waveform files.
+
+    :param filename: The SES3D file.
+
+    >>> print(get_binary_sidecar_filename("/a/b/XX.STA.__.x"))
+    /a/b/.binary/XX.STA.__.x.bin
+    """
+    return os.path.join(os.path.dirname(filename), BINARY_FOLDER,
+                        os.path.basename(filename) + ".bin")
+
+
+def write_binary_sidecar(filename):
+    """
+    Stores the samples of a SES3D file as float32 values in a binary file.
+    The sidecar records the size and the modification time of the SES3D
+    file and is only used as long as both are unchanged and it has as many
+    samples as given in the header of the SES3D file.
+
+    Returns the filename of the sidecar.
+
+    :param filename: The SES3D file.
+    """
+    stat = os.stat(filename)
+    with open(filename, "rb") as fh:
+        _read_header(fh)
+        data = _read_data(fh)
+
+    sidecar = get_binary_sidecar_filename(filename)
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    temp_filename = sidecar + "_%i.tmp" % os.getpid()
+    with open(temp_filename, "wb") as fh:
+        fh.write(np.array([stat.st_size, stat.st_mtime_ns],
+                          dtype=SIDECAR_HEADER_DTYPE).tobytes())
+        fh.write(data.astype(SIDECAR_DATA_DTYPE).tobytes())
+    os.rename(temp_filename, sidecar)
+    return sidecar
+
+
+def convert_folder_to_binary(folder):
+    """
+    Writes binary sidecars for all SES3D files in a folder that do not yet
+    have an up-to-date one. Returns the number of written sidecars.
+
+    :param folder: The folder with the SES3D files.
+    """
+    count = 0
+    for name in sorted(os.listdir(folder)):
+        filename = os.path.join(folder, name)
+        if not os.path.isfile(filename) or not is_SES3D(filename):
+            continue
+        if _read_binary_sidecar(
+                filename, read_SES3D_header(filename)["npts"]) is not None:
+            continue
+        write_binary_sidecar(filename)
+        count += 1
+    return count
+
+
+def _read_SES3D(fh, headonly=False, filename=None):
     """
     Internal SES3D parsing routine.
     """
     # Import here to avoid circular imports.
     from obspy.core import AttribDict, Trace, Stream
 
-    # Read the header.
-    component = fh.readline().split()[0].lower()
-    npts = int(fh.readline().split()[-1])
-    delta = float(fh.readline().split()[-1])
-    # Skip receiver location line.
-    fh.readline()
-    rec_loc = fh.readline().split()
-    rec_x, rec_y, rec_z = list(
-        map(float, [rec_loc[1], rec_loc[3], rec_loc[5]]))
-    # Skip the source location line.
-    fh.readline()
-    src_loc = fh.readline().split()
-    src_x, src_y, src_z = list(
-        map(float, [src_loc[1], src_loc[3], src_loc[5]]))
+    header = _read_header(fh)
+    header["ses3d"] = AttribDict(header["ses3d"])
 
     # Read the data.
     if headonly is False:
-        data = np.array(list(map(float, fh.readlines())),
-                        dtype="float32")
+        data = None
+        if filename is not None:
+            data = _read_binary_sidecar(filename, header["npts"])
+        if data is None:
+            data = _read_data(fh)
     else:
         data = np.array([])
-
-    ses3d = AttribDict()
-    ses3d.receiver_latitude = rotations.colat2lat(rec_x)
-    ses3d.receiver_longitude = rec_y
-    ses3d.receiver_depth_in_m = rec_z
-    ses3d.source_latitude = rotations.colat2lat(src_x)
-    ses3d.source_longitude = src_y
-    ses3d.source_depth_in_m = src_z
-
-    header = {
-        "delta": delta,
-        "channel": COMPONENT_MAP[component],
-        "ses3d": ses3d,
-        "npts": npts
-    }
+    npts = header["npts"]
 
     # Setup Obspy Stream/Trace structure.
     tr = Trace(data=data, header=header)
@@ -140,3 +235,79 @@ def _read_SES3D(fh, headonly=False):
             "the actual data count."
         warnings.warn(msg)
     return Stream(traces=[tr])
+
+
+def _read_header(fh):
+    """
+    Reads the seven header lines of an open SES3D file.
+    """
+    def read_fields():
+        line = fh.readline()
+        if isinstance(line, bytes):
+            line = line.decode("ascii")
+        return line.split()
+
+    component = read_fields()[0].lower()
+    npts = int(read_fields()[-1])
+    delta = float(read_fields()[-1])
+    # Skip receiver location line.
+    read_fields()
+    rec_loc = read_fields()
+    rec_x, rec_y, rec_z = list(
+        map(float, [rec_loc[1], rec_loc[3], rec_loc[5]]))
+    # Skip the source location line.
+    read_fields()
+    src_loc = read_fields()
+    src_x, src_y, src_z = list(
+        map(float, [src_loc[1], src_loc[3], src_loc[5]]))
+
+    return {
+        "delta": delta,
+        "channel": COMPONENT_MAP[component],
+        "npts": npts,
+        "ses3d": {
+            "receiver_latitude": rotations.colat2lat(rec_x),
+            "receiver_longitude": rec_y,
+            "receiver_depth_in_m": rec_z,
+            "source_latitude": rotations.colat2lat(src_x),
+            "source_longitude": src_y,
+            "source_depth_in_m": src_z}}
+
+
+def _read_data(fh):
+    """
+    Parses all remaining samples of an open SES3D file at once.
+    """
+    # Older numpy versions only warn and return the samples up to the first
+    # value that is not a number.
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            data = np.fromstring(fh.read(), sep=" ")
+        except (DeprecationWarning, ValueError):
+            msg = "The samples of the SES3D file are not all numbers."
+            raise ValueError(msg)
+    # Parse in double precision to get exactly the same values as Python's
+    # float().
+    return data.astype(np.float32)
+
+
+def _read_binary_sidecar(filename, npts):
+    """
+    Returns the samples of an up-to-date binary sidecar of a SES3D file or
+    None.
+    """
+    sidecar = get_binary_sidecar_filename(filename)
+    try:
+        stat = os.stat(filename)
+        with open(sidecar, "rb") as fh:
+            header = np.fromfile(fh, dtype=SIDECAR_HEADER_DTYPE, count=2)
+            data = np.fromfile(fh, dtype=SIDECAR_DATA_DTYPE)
+    except (OSError, ValueError):
+        return None
+    # Also catches files rewritten within the resolution of the
+    # modification times.
+    if len(header) != 2 or header[0] != stat.st_size or \
+            header[1] != stat.st_mtime_ns or len(data) != npts:
+        return None
+    return data.astype(np.float32)
@@ -9,17 +9,20 @@ Project specific function processing observed data.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
+import io
 import numpy as np
 import obspy
 from obspy.core.util import AttribDict
-from obspy.io.xseed import Parser
-from scipy import signal
 import warnings
 
 from lasif import LASIFError
+from lasif.tools import batch_processing
+from lasif.tools.parallel_helpers import item_warnings
+from lasif.tools.response_cache import get_response_cache
 
 
-def preprocessing_function(processing_info, iteration):  # NOQA
+def preprocessing_function(processing_info, iteration,  # NOQA
+                           preloaded=False):
     """
     Function to perform the actual preprocessing for one individual seismogram.
     This is part of the project so it can change depending on the project.
@@ -71,7 +74,17 @@ def preprocessing_function(processing_info, iteration):  # NOQA
             'latitude': 46.882,
             'local_depth_in_m': None,
             'longitude': -124.3337},
-         'station_filename': u'/.../STATIONS/RESP/RESP.7D.FN01A..HH*'}
+         'station_filename': u'/.../STATIONS/RESP/RESP.7D.FN01A..HH*',
+         'response_cache_folder': u'/.../CACHE/response_spectra'}
+
+    If the function has a ``preloaded`` parameter, LASIF reads the input
+    files ahead of time and writes the output files in the background to
+    keep the processors busy. ``preloaded`` is then ``True``,
+    ``processing_info`` additionally contains the contents of the input
+    file as ``"input_data"``, and ``"defer_output"`` is ``True``. The
+    function then returns a dictionary with the ``"output_filename"`` and
+    the ``"output_data"`` to be written instead of writing the file itself.
+    Functions without the parameter read and write their files themselves.
 
     Please note that you also got the iteration object here, so if you
     want some parameters to change depending on the iteration, just use
@@ -88,38 +101,42 @@ def preprocessing_function(processing_info, iteration):  # NOQA
     Use ``$ lasif shell`` to play around and figure out what the iteration
     objects can do.
 
-    """
-
-    def zerophase_chebychev_lowpass_filter(trace, freqmax):
-        """
-        Custom Chebychev type two zerophase lowpass filter useful for
-        decimation filtering.
-
-        This filter is stable up to a reduction in frequency with a factor of
-        10. If more reduction is desired, simply decimate in steps.
+    This processes a single file with
+    :func:`preprocessing_function_batch` which LASIF uses to process many
+    files of an event at once.
 
-        Partly based on a filter in ObsPy.
-
-        :param trace: The trace to be filtered.
-        :param freqmax: The desired lowpass frequency.
-
-        Will be replaced once ObsPy has a proper decimation filter.
-        """
-        # rp - maximum ripple of passband, rs - attenuation of stopband
-        rp, rs, order = 1, 96, 1e99
-        ws = freqmax / (trace.stats.sampling_rate * 0.5)  # stop band frequency
-        wp = ws  # pass band frequency
-
-        while True:
-            if order <= 12:
-                break
-            wp *= 0.99
-            order, wn = signal.cheb2ord(wp, ws, rp, rs, analog=0)
+    """
+    result = preprocessing_function_batch([processing_info], iteration,
+                                          preloaded=preloaded)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
-        b, a = signal.cheby2(order, rs, wn, btype="low", analog=0, output="ba")
 
-        # Apply twice to get rid of the phase distortion.
-        trace.data = signal.filtfilt(b, a, trace.data)
+def preprocessing_function_batch(processing_infos, iteration,  # NOQA
+                                 preloaded=False):
+    """
+    Function to perform the actual preprocessing for many seismograms of an
+    event at once. This is part of the project so it can change depending on
+    the project.
+
+    Traces with the same sampling rate, number of samples, and processing
+    parameters are filtered, tapered, and resampled together as one 2-D
+    array. The filters are only designed once.
+
+    :param processing_infos: A list of dictionaries as described in
+        :func:`preprocessing_function`.
+    :type processing_infos: list
+    :param iteration: The iteration object.
+    :param preloaded: Whether the input files have been read ahead as
+        described in :func:`preprocessing_function`.
+
+    Returns a list with one entry per file. Each is either the return value
+    of :func:`preprocessing_function` for the file or the exception that
+    prevented the file from being processed. Warnings raised within
+    :func:`~lasif.tools.parallel_helpers.item_warnings` are counted for the
+    given files, all others for the whole batch.
+    """
 
     def signal_to_noise_ratio(data, first_tt_arrival, process_params):
 
@@ -148,64 +165,254 @@ def preprocessing_function(processing_info, iteration):  # NOQA
 
         return noise_relative, noise_absolute
 
-    # =========================================================================
-    # Define noise_theshold by default if not given in argument
-    # =========================================================================
-    if processing_info["noise_threshold"] is None:
-        noise_threshold = 0.1
-    else:
-        noise_threshold = processing_info["noise_threshold"]
+    def get_time_span(processing_info):
+        # starttime is the origin time of the event
+        # endtime is the origin time plus the length of the synthetics
+        starttime = processing_info["event_information"]["origin_time"]
+        endtime = starttime + processing_info["process_params"]["dt"] * \
+            (processing_info["process_params"]["npts"] - 1)
+        return starttime, endtime
+
+    def get_pre_filt(processing_info):
+        # This is really necessary as other filters are just not sharp
+        # enough and lots of energy from other frequency bands leaks into
+        # the frequency band of interest
+        f2 = 0.9 * processing_info["process_params"]["highpass"]
+        f3 = 1.1 * processing_info["process_params"]["lowpass"]
+        # Recommendations from the SAC manual.
+        f1 = 0.5 * f2
+        f4 = 2.0 * f3
+        return (f1, f2, f3, f4)
+
+    def read_trace(processing_info):
+        """
+        Read the seismogram and trim it to the time span of interest.
+        """
+        starttime, endtime = get_time_span(processing_info)
+        duration = endtime - starttime
 
-    # =========================================================================
-    # Read seismograms and gather basic information.
-    # =========================================================================
-    starttime = processing_info["event_information"]["origin_time"]
-    endtime = starttime + processing_info["process_params"]["dt"] * \
-        (processing_info["process_params"]["npts"] - 1)
-    duration = endtime - starttime
-
-    st = obspy.read(processing_info["input_filename"])
-
-    if len(st) != 1:
-        warnings.warn("The file '%s' has %i traces and not 1. "
-                      "Skip all but the first" % (
-                          processing_info["input_filename"], len(st)))
-    tr = st[0]
-
-    # fill the data file header with station coordinates
-    receiver = processing_info["station_coordinates"]
-    tr.stats.coordinates = AttribDict({
-        'latitude': receiver["latitude"],
-        'elevation': receiver["elevation_in_m"],
-        'longitude': receiver["longitude"]})
-
-    # Make sure the seismograms are long enough. If not, skip them.
-    if starttime < tr.stats.starttime or endtime > tr.stats.endtime:
-
-        msg = ("The seismogram does not cover the required time span.\n"
-               "Seismogram time span: %s - %s\n"
-               "Requested time span: %s - %s" % (
-                   tr.stats.starttime, tr.stats.endtime, starttime, endtime))
-        print(msg)
-        raise LASIFError(msg)
-
-    # Trim to reduce processing cost.
-    # starttime is the origin time of the event
-    # endtime is the origin time plus the length of the synthetics
-    tr.trim(starttime - 0.2 * duration, endtime + 0.2 * duration)
+        if "input_data" in processing_info:
+            st = obspy.read(io.BytesIO(processing_info["input_data"]))
+        else:
+            st = obspy.read(processing_info["input_filename"])
+
+        if len(st) != 1:
+            warnings.warn("The file '%s' has %i traces and not 1. "
+                          "Skip all but the first" % (
+                              processing_info["input_filename"], len(st)))
+        tr = st[0]
+
+        # fill the data file header with station coordinates
+        receiver = processing_info["station_coordinates"]
+        tr.stats.coordinates = AttribDict({
+            'latitude': receiver["latitude"],
+            'elevation': receiver["elevation_in_m"],
+            'longitude': receiver["longitude"]})
+
+        # Make sure the seismograms are long enough. If not, skip them.
+        if starttime < tr.stats.starttime or endtime > tr.stats.endtime:
+
+            msg = ("The seismogram does not cover the required time span.\n"
+                   "Seismogram time span: %s - %s\n"
+                   "Requested time span: %s - %s" % (
+                       tr.stats.starttime, tr.stats.endtime, starttime,
+                       endtime))
+            print(msg)
+            raise LASIFError(msg)
+
+        # Trim to reduce processing cost.
+        tr.trim(starttime - 0.2 * duration, endtime + 0.2 * duration)
+
+        # =====================================================================
+        # Some basic checks on the data.
+        # =====================================================================
+        # Non-zero length
+        if not len(tr):
+            msg = "No data found in time window around the event. File " \
+                "skipped."
+            raise LASIFError(msg)
+
+        # No nans or infinity values allowed.
+        if not np.isfinite(tr.data).all():
+            msg = "Data contains NaNs or Infs. File skipped"
+            raise LASIFError(msg)
+
+        return tr
+
+    def correct_instrument(tr, processing_info):
+        """
+        Correct the seismogram to velocity in m/s.
+        """
+        output_units = "VEL"
+        station_file = processing_info["station_filename"]
+        pre_filt = get_pre_filt(processing_info)
+
+        # check if the station file actually exists ==========================
+        if not processing_info["station_filename"]:
+            msg = "No station file found for the relevant time span. File " \
+                "skipped"
+            raise LASIFError(msg)
+
+        # Parsed station files and inverted responses are cached across
+        # calls.
+        response_cache = get_response_cache(
+            processing_info.get("response_cache_folder"))
+
+        # processing for seed files ==========================================
+        if "/SEED/" in station_file:
+            # XXX: Check if this is m/s. In all cases encountered so far it
+            # always is, but SEED is in theory also able to specify
+            # corrections to other units...
+            parser = response_cache.get_station_file(station_file)
+            try:
+                # The simulate might fail but might still modify the data.
+                # The backup is needed for the backup plan to only correct
+                # using poles and zeros.
+                backup_tr = tr.copy()
+                try:
+                    tr.simulate(seedresp={"filename": parser,
+                                          "units": output_units,
+                                          "date": tr.stats.starttime},
+                                pre_filt=pre_filt, zero_mean=False,
+                                taper=False)
+                except ValueError:
+                    warnings.warn("Evalresp failed, will only use the Poles "
+                                  "and Zeros stage")
+                    tr = backup_tr
+                    paz = parser.get_paz(tr.id, tr.stats.starttime)
+                    if paz["sensitivity"] == 0:
+                        warnings.warn("Sensitivity is 0 in SEED file and "
+                                      "will not be taken into account!")
+                        tr.simulate(paz_remove=paz, remove_sensitivity=False,
+                                    pre_filt=pre_filt, zero_mean=False,
+                                    taper=False)
+                    else:
+                        tr.simulate(paz_remove=paz, pre_filt=pre_filt,
+                                    zero_mean=False, taper=False)
+            except Exception as e:
+                msg = ("File  could not be corrected with the help of the "
+                       "SEED file '%s'. Will be skipped due to: %s") \
+                    % (processing_info["station_filename"], str(e))
+                raise LASIFError(msg)
+        # processing with RESP files =========================================
+        elif "/RESP/" in station_file:
+            try:
+                tr.simulate(seedresp={"filename": station_file,
+                                      "units": output_units,
+                                      "date": tr.stats.starttime},
+                            pre_filt=pre_filt, zero_mean=False, taper=False)
+            except ValueError as e:
+                msg = ("File  could not be corrected with the help of the "
+                       "RESP file '%s'. Will be skipped. Due to: %s") \
+                    % (processing_info["station_filename"], str(e))
+                raise LASIFError(msg)
+        elif "/StationXML/" in station_file:
+            try:
+                response_cache.get_station_file(station_file)
+            except Exception as e:
+                msg = ("Could not open StationXML file '%s'. Due to: %s. Will "
+                       "be skipped." % (station_file, str(e)))
+                raise LASIFError(msg)
+            try:
+                response_cache.remove_response(tr, station_file,
+                                               output=output_units,
+                                               pre_filt=pre_filt)
+            except Exception as e:
+                msg = ("File  could not be corrected with the help of the "
+                       "StationXML file '%s'. Due to: '%s'  Will be "
+                       "skipped.") \
+                    % (processing_info["station_filename"], e.__repr__()),
+                raise LASIFError(msg)
+        else:
+            raise NotImplementedError
+
+        return tr
+
+    def select_and_save(tr, processing_info):
+        """
+        Waveform selection based on the SNR and saving of the processed
+        data.
+        """
+        if processing_info["noise_threshold"] is None:
+            noise_threshold = 0.1
+        else:
+            noise_threshold = processing_info["noise_threshold"]
+
+        # compute the noise_relative level
+        snr = signal_to_noise_ratio(
+            tr.data, processing_info["first_P_arrival"],
+            processing_info["process_params"])[0]
+        # selection
+        if snr >= noise_threshold:
+            return None
+
+        # Convert to single precision to save some space.
+        tr.data = np.require(tr.data, dtype="float32", requirements="C")
+        if hasattr(tr.stats, "mseed"):
+            tr.stats.mseed.encoding = "FLOAT32"
+
+        if processing_info.get("defer_output"):
+            output = io.BytesIO()
+            tr.write(output, format=tr.stats._format)
+            return {"output_filename": processing_info["output_filename"],
+                    "output_data": output.getvalue()}
+        tr.write(processing_info["output_filename"], format=tr.stats._format)
+
+    results = [None] * len(processing_infos)
+    traces = [None] * len(processing_infos)
+
+    def for_each_trace(function):
+        """
+        Applies a function to every trace that has not failed yet.
+        """
+        for _i, tr in enumerate(traces):
+            if tr is None:
+                continue
+            try:
+                with item_warnings(_i):
+                    traces[_i] = function(tr, processing_infos[_i])
+            except Exception as e:
+                traces[_i] = None
+                results[_i] = e
+
+    def for_each_group(function):
+        """
+        Applies a function to the 2-D arrays of traces with the same
+        sampling rate, number of samples, and processing parameters. The
+        function is called with the data, the sampling rate, and the
+        processing parameters and returns the new data and sampling rate.
+        """
+        indices = [_i for _i, tr in enumerate(traces) if tr is not None]
+        keys = [sorted(processing_infos[_i]["process_params"].items())
+                for _i in indices]
+        for group in batch_processing.group_traces(
+                [traces[_i] for _i in indices], keys=keys):
+            group = [indices[_i] for _i in group]
+            data = np.array([traces[_i].data for _i in group],
+                            dtype=np.float64)
+            try:
+                with item_warnings(*group):
+                    data, sampling_rate = function(
+                        data, traces[group[0]].stats.sampling_rate,
+                        processing_infos[group[0]]["process_params"])
+            except Exception as e:
+                for _i in group:
+                    traces[_i] = None
+                    results[_i] = e
+                continue
+            for _i, row in zip(group, data):
+                traces[_i].data = row
+                traces[_i].stats.sampling_rate = sampling_rate
 
     # =========================================================================
-    # Some basic checks on the data.
+    # Read seismograms and gather basic information.
     # =========================================================================
-    # Non-zero length
-    if not len(tr):
-        msg = "No data found in time window around the event. File skipped."
-        raise LASIFError(msg)
-
-    # No nans or infinity values allowed.
-    if not np.isfinite(tr.data).all():
-        msg = "Data contains NaNs or Infs. File skipped"
-        raise LASIFError(msg)
+    for _i, processing_info in enumerate(processing_infos):
+        try:
+            with item_warnings(_i):
+                traces[_i] = read_trace(processing_info)
+        except Exception as e:
+            results[_i] = e
 
     # =========================================================================
     # Step 1: Decimation
@@ -213,159 +420,83 @@ def preprocessing_function(processing_info, iteration):  # NOQA
     # The data is still oversampled by a large amount so there should be no
     # problems. This has to be done here so that the instrument correction is
     # reasonably fast even for input data with a large sampling rate.
-    # =========================================================================
-    while True:
-        decimation_factor = int(processing_info["process_params"]["dt"] /
-                                tr.stats.delta)
-        # Decimate in steps for large sample rate reductions.
-        if decimation_factor > 8:
-            decimation_factor = 8
-        if decimation_factor > 1:
-            new_nyquist = tr.stats.sampling_rate / 2.0 / float(
-                decimation_factor)
-            zerophase_chebychev_lowpass_filter(tr, new_nyquist)
-            tr.decimate(factor=decimation_factor, no_filter=True)
-        else:
-            break
-
-    # =========================================================================
+    #
     # Step 2: Detrend and taper.
     # =========================================================================
-    tr.detrend("linear")
-    tr.detrend("demean")
-    tr.taper(max_percentage=0.05, type="hann")
+    def decimate_detrend_and_taper(data, sampling_rate, process_params):
+        data, sampling_rate = batch_processing.decimate(
+            data, sampling_rate, process_params["dt"])
+        batch_processing.detrend_and_taper(
+            data, sampling_rate, max_percentage=0.05, taper_type="hann")
+        return data, sampling_rate
+
+    for_each_group(decimate_detrend_and_taper)
 
     # =========================================================================
     # Step 3: Instrument correction
     # Correct seismograms to velocity in m/s.
     # =========================================================================
-    output_units = "VEL"
-    station_file = processing_info["station_filename"]
-
-    # check if the station file actually exists ==============================
-    if not processing_info["station_filename"]:
-        msg = "No station file found for the relevant time span. File skipped"
-        raise LASIFError(msg)
-
-    # This is really necessary as other filters are just not sharp enough
-    # and lots of energy from other frequency bands leaks into the frequency
-    # band of interest
-    freqmin = processing_info["process_params"]["highpass"]
-    freqmax = processing_info["process_params"]["lowpass"]
-
-    f2 = 0.9 * freqmin
-    f3 = 1.1 * freqmax
-    # Recommendations from the SAC manual.
-    f1 = 0.5 * f2
-    f4 = 2.0 * f3
-    pre_filt = (f1, f2, f3, f4)
-
-    # processing for seed files ==============================================
-    if "/SEED/" in station_file:
-        # XXX: Check if this is m/s. In all cases encountered so far it
-        # always is, but SEED is in theory also able to specify corrections
-        # to other units...
-        parser = Parser(station_file)
-        try:
-            # The simulate might fail but might still modify the data. The
-            # backup is needed for the backup plan to only correct using
-            # poles and zeros.
-            backup_tr = tr.copy()
-            try:
-                tr.simulate(seedresp={"filename": parser,
-                                      "units": output_units,
-                                      "date": tr.stats.starttime},
-                            pre_filt=pre_filt, zero_mean=False, taper=False)
-            except ValueError:
-                warnings.warn("Evalresp failed, will only use the Poles and "
-                              "Zeros stage")
-                tr = backup_tr
-                paz = parser.get_paz(tr.id, tr.stats.starttime)
-                if paz["sensitivity"] == 0:
-                    warnings.warn("Sensitivity is 0 in SEED file and will "
-                                  "not be taken into account!")
-                    tr.simulate(paz_remove=paz, remove_sensitivity=False,
-                                pre_filt=pre_filt, zero_mean=False,
-                                taper=False)
-                else:
-                    tr.simulate(paz_remove=paz, pre_filt=pre_filt,
-                                zero_mean=False, taper=False)
-        except Exception as e:
-            msg = ("File  could not be corrected with the help of the "
-                   "SEED file '%s'. Will be skipped due to: %s") \
-                % (processing_info["station_filename"], str(e))
-            raise LASIFError(msg)
-    # processing with RESP files =============================================
-    elif "/RESP/" in station_file:
-        try:
-            tr.simulate(seedresp={"filename": station_file,
-                                  "units": output_units,
-                                  "date": tr.stats.starttime},
-                        pre_filt=pre_filt, zero_mean=False, taper=False)
-        except ValueError as e:
-            msg = ("File  could not be corrected with the help of the "
-                   "RESP file '%s'. Will be skipped. Due to: %s") \
-                % (processing_info["station_filename"], str(e))
-            raise LASIFError(msg)
-    elif "/StationXML/" in station_file:
-        try:
-            inv = obspy.read_inventory(station_file, format="stationxml")
-        except Exception as e:
-            msg = ("Could not open StationXML file '%s'. Due to: %s. Will be "
-                   "skipped." % (station_file, str(e)))
-            raise LASIFError(msg)
-        tr.attach_response(inv)
-        try:
-            tr.remove_response(output=output_units, pre_filt=pre_filt,
-                               zero_mean=False, taper=False)
-        except Exception as e:
-            msg = ("File  could not be corrected with the help of the "
-                   "StationXML file '%s'. Due to: '%s'  Will be skipped.") \
-                % (processing_info["station_filename"], e.__repr__()),
-            raise LASIFError(msg)
-    else:
-        raise NotImplementedError
+    for_each_trace(correct_instrument)
 
     # =========================================================================
     # Step 4: Bandpass filtering
     # This has to be exactly the same filter as in the source time function
     # in the case of SES3D.
     # =========================================================================
-    tr.detrend("linear")
-    tr.detrend("demean")
-    tr.taper(0.05, type="cosine")
-    tr.filter("bandpass", freqmin=freqmin, freqmax=freqmax, corners=3,
-              zerophase=False)
-    tr.detrend("linear")
-    tr.detrend("demean")
-    tr.taper(0.05, type="cosine")
-    tr.filter("bandpass", freqmin=freqmin, freqmax=freqmax, corners=3,
-              zerophase=False)
+    def bandpass(data, sampling_rate, process_params):
+        for _ in range(2):
+            batch_processing.detrend_and_taper(
+                data, sampling_rate, max_percentage=0.05, taper_type="cosine")
+            data = batch_processing.bandpass(
+                data, sampling_rate, freqmin=process_params["highpass"],
+                freqmax=process_params["lowpass"], corners=3)
+        return data, sampling_rate
+
+    for_each_group(bandpass)
 
     # =========================================================================
     # Step 5: Sinc interpolation
     # =========================================================================
     # Make sure that the data array is at least as long as the
-    # synthetics array.
-    tr.interpolate(
-        sampling_rate=1.0 / processing_info["process_params"]["dt"],
-        method="lanczos", starttime=starttime, window="blackman", a=12,
-        npts=processing_info["process_params"]["npts"])
+    # synthetics array. The traces of a group generally start at different
+    # times but end up with the same samples.
+    indices = [_i for _i, tr in enumerate(traces) if tr is not None]
+    keys = [(str(get_time_span(processing_infos[_i])[0]),
+             sorted(processing_infos[_i]["process_params"].items()))
+            for _i in indices]
+    for group in batch_processing.group_traces(
+            [traces[_i] for _i in indices], keys=keys):
+        group = [indices[_i] for _i in group]
+        process_params = processing_infos[group[0]]["process_params"]
+        starttime = get_time_span(processing_infos[group[0]])[0]
+        try:
+            with item_warnings(*group):
+                data = batch_processing.lanczos_resample(
+                    [traces[_i].data for _i in group],
+                    [traces[_i].stats.starttime.timestamp for _i in group],
+                    traces[group[0]].stats.delta, starttime.timestamp,
+                    process_params["dt"], process_params["npts"], a=12,
+                    window="blackman")
+        except Exception as e:
+            for _i in group:
+                traces[_i] = None
+                results[_i] = e
+            continue
+        for _i, row in zip(group, data):
+            traces[_i].data = row
+            traces[_i].stats.starttime = starttime
+            traces[_i].stats.delta = process_params["dt"]
 
     # =========================================================================
-    # Step 6: Waveform selection based on SNR
+    # Step 6: Waveform selection based on SNR and saving.
     # =========================================================================
-    # compute the noise_relative level
-    snr = signal_to_noise_ratio(tr.data, processing_info["first_P_arrival"],
-                                processing_info["process_params"])[0]
-    # selection
-    if snr < noise_threshold:
-        # =========================================================================
-        # Save processed data and clean up.
-        # =========================================================================
-        # Convert to single precision to save some space.
-        tr.data = np.require(tr.data, dtype="float32", requirements="C")
-        if hasattr(tr.stats, "mseed"):
-            tr.stats.mseed.encoding = "FLOAT32"
+    for _i, tr in enumerate(traces):
+        if tr is None:
+            continue
+        try:
+            with item_warnings(_i):
+                results[_i] = select_and_save(tr, processing_infos[_i])
+        except Exception as e:
+            results[_i] = e
 
-        tr.write(processing_info["output_filename"], format=tr.stats._format)
+    return results
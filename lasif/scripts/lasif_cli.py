@@ -167,6 +167,23 @@ def _find_project_comm_mpi(folder, read_only_caches):
     return comm
 
 
+def _add_parallel_arguments(parser):
+    """
+    Adds the arguments to choose the backend distributing the work.
+    """
+    from lasif.tools.parallel_helpers import BACKENDS
+
+    parser.add_argument(
+        "--parallel_backend", choices=BACKENDS, default=None,
+        help="how to distribute the work if not launched with MPI. "
+             "Defaults to the 'parallel_backend' setting in the project's "
+             "config file (or 'mpi' which runs in serial without MPI).")
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="number of processes for the 'process_pool' backend. Defaults "
+             "to the number of cores.")
+
+
 def split(container, count):
     """
     Simple and elegant function splitting a container into count
@@ -838,30 +855,135 @@ def lasif_init_project(parser, args):
 def lasif_finalize_adjoint_sources(parser, args):
     """
     Finalize the adjoint sources.
+
+    Writing the files for many stations can be distributed across all local
+    cores with "--parallel_backend process_pool".
     """
     parser.add_argument("iteration_name", help="name of the iteration")
     parser.add_argument("event_name", help="name of the event")
+    _add_parallel_arguments(parser)
     args = parser.parse_args(args)
     iteration_name = args.iteration_name
     event_name = args.event_name
 
     comm = _find_project_comm(".", args.read_only_caches)
-    comm.actions.finalize_adjoint_sources(iteration_name, event_name)
+    comm.actions.finalize_adjoint_sources(
+        iteration_name, event_name, backend=args.parallel_backend,
+        processes=args.processes)
 
 
+@mpi_enabled
 @command_group("Iteration Management")
 def lasif_calculate_all_adjoint_sources(parser, args):
     """
     Calculates all adjoint sources for a given iteration and event.
+
+    This function works with MPI. Without MPI it uses all local cores with
+    "--parallel_backend process_pool". Pass "--all-events" instead of an
+    event name to calculate the adjoint sources of all events of the
+    iteration.
     """
     parser.add_argument("iteration_name", help="name of the iteration")
-    parser.add_argument("event_name", help="name of the event")
+    parser.add_argument("event_name", help="name of the event", nargs="?")
+    parser.add_argument("--all-events", action="store_true",
+                        help="calculate the adjoint sources of all events "
+                             "of the iteration")
+    _add_parallel_arguments(parser)
     args = parser.parse_args(args)
     iteration_name = args.iteration_name
     event_name = args.event_name
 
+    if bool(event_name) == bool(args.all_events):
+        parser.error("Pass either an event name or '--all-events'.")
+
+    comm = _find_project_comm_mpi(".", args.read_only_caches)
+
+    if not args.all_events:
+        comm.actions.calculate_all_adjoint_sources(
+            iteration_name, event_name, backend=args.parallel_backend,
+            processes=args.processes)
+        return
+
+    events = sorted(comm.iterations.get(iteration_name).events.keys())
+
+    for _i, event in enumerate(events):
+        if MPI.COMM_WORLD.rank == 0:
+            print(("\n{green}"
+                   "=========================================================="
+                   "={reset}".format(green=colorama.Fore.GREEN,
+                                     reset=colorama.Style.RESET_ALL)))
+            print(("Calculating adjoint sources for event %i of %i..." % (
+                  _i + 1, len(events))))
+            print(("{green}"
+                   "=========================================================="
+                   "={reset}\n".format(green=colorama.Fore.GREEN,
+                                       reset=colorama.Style.RESET_ALL)))
+        MPI.COMM_WORLD.barrier()
+        comm.actions.calculate_all_adjoint_sources(
+            iteration_name, event, backend=args.parallel_backend,
+            processes=args.processes)
+
+
+@mpi_enabled
+@command_group("Iteration Management")
+def lasif_sum_kernels(parser, args):
+    """
+    Sums the kernels of all events of an iteration.
+
+    The sum is written in the SES3D format to the SUMMED folder next to the
+    kernels of the events. Pass a smoothing width to additionally write a
+    sum smoothed with a Gaussian to the SUMMED_SMOOTHED folder. This
+    function works with MPI. Without MPI it uses all local cores with
+    "--parallel_backend process_pool".
+    """
+    parser.add_argument("iteration_name", help="name of the iteration")
+    parser.add_argument("--events", nargs="+", default=None,
+                        help="only sum the kernels of these events. "
+                             "Defaults to all events with a kernel.")
+    parser.add_argument("--horizontal_smoothing", type=float, default=None,
+                        help="standard deviation of the horizontal Gaussian "
+                             "smoothing in degree")
+    parser.add_argument("--vertical_smoothing", type=float, default=None,
+                        help="standard deviation of the vertical Gaussian "
+                             "smoothing in km")
+    _add_parallel_arguments(parser)
+    args = parser.parse_args(args)
+
+    comm = _find_project_comm_mpi(".", args.read_only_caches)
+    folder = comm.actions.sum_kernels(
+        args.iteration_name, events=args.events,
+        horizontal_smoothing_in_degree=args.horizontal_smoothing,
+        vertical_smoothing_in_km=args.vertical_smoothing,
+        backend=args.parallel_backend, processes=args.processes)
+
+    if MPI.COMM_WORLD.rank == 0:
+        print("Wrote the kernel to '%s'." % os.path.relpath(folder))
+
+
+@command_group("Iteration Management")
+def lasif_convert_synthetics_to_binary(parser, args):
+    """
+    Converts the SES3D synthetics of an iteration to binary files.
+
+    The samples of each ASCII file are stored in a binary file in the hidden
+    ".binary" subfolder and read from there afterwards. Only files changed
+    since the last conversion are converted again.
+    """
+    parser.add_argument("iteration_name", help="name of the iteration")
+    parser.add_argument("--events", nargs="+", default=None,
+                        help="only convert the synthetics of these events. "
+                             "Defaults to all events of the iteration.")
+    args = parser.parse_args(args)
+
     comm = _find_project_comm(".", args.read_only_caches)
-    comm.actions.calculate_all_adjoint_sources(iteration_name, event_name)
+    it = comm.iterations.get(args.iteration_name)
+    events = args.events if args.events else sorted(it.events.keys())
+    for _i, event in enumerate(events):
+        print("Converting synthetics of event %i of %i..." % (
+            _i + 1, len(events)))
+        count = comm.waveforms.convert_synthetics_to_binary(event,
+                                                            it.long_name)
+        print("\tConverted %i files." % count)
 
 
 @mpi_enabled
@@ -871,11 +993,13 @@ def lasif_select_windows(parser, args):
     Autoselect windows for a given event and iteration combination.
 
     This function works with MPI. Don't use too many cores, I/O quickly
-    becomes the limiting factor. It also works without MPI but then only one
-    core actually does any work.
+    becomes the limiting factor. Without MPI it uses all local cores with
+    "--parallel_backend process_pool", otherwise only one core actually does
+    any work.
     """
     parser.add_argument("iteration_name", help="name of the iteration")
     parser.add_argument("event_name", help="name of the event")
+    _add_parallel_arguments(parser)
     args = parser.parse_args(args)
 
     iteration = args.iteration_name
@@ -883,7 +1007,9 @@ def lasif_select_windows(parser, args):
 
     comm = _find_project_comm_mpi(".", args.read_only_caches)
 
-    comm.actions.select_windows(event, iteration)
+    comm.actions.select_windows(event, iteration,
+                                backend=args.parallel_backend,
+                                processes=args.processes)
 
 
 @mpi_enabled
@@ -893,10 +1019,12 @@ def lasif_select_all_windows(parser, args):
     Autoselect all windows for a given iteration.
 
     This function works with MPI. Don't use too many cores, I/O quickly
-    becomes the limiting factor. It also works without MPI but then only one
-    core actually does any work.
+    becomes the limiting factor. Without MPI it uses all local cores with
+    "--parallel_backend process_pool", otherwise only one core actually does
+    any work.
     """
     parser.add_argument("iteration_name", help="name of the iteration")
+    _add_parallel_arguments(parser)
     args = parser.parse_args(args)
 
     iteration = args.iteration_name
@@ -918,7 +1046,9 @@ def lasif_select_all_windows(parser, args):
                    "{reset}\n".format(green=colorama.Fore.GREEN,
                                       reset=colorama.Style.RESET_ALL)))
         MPI.COMM_WORLD.barrier()
-        comm.actions.select_windows(event, iteration)
+        comm.actions.select_windows(event, iteration,
+                                    backend=args.parallel_backend,
+                                    processes=args.processes)
 
 
 @command_group("Iteration Management")
@@ -975,7 +1105,6 @@ def lasif_plot_model(parser, args):
     plt.figure(figsize=(15, 15))
 
     model = comm.models.get_model_handler(args.model_name)
-    model.parse_component(args.component)
 
     m = comm.project.domain.plot()
     im = model.plot_depth_slice(component=args.component,
@@ -1022,8 +1151,6 @@ def lasif_plot_kernel(parser, args):
         directory=args.folder, domain=comm.project.domain,
         model_type="kernel")
 
-    model.parse_component(args.component)
-
     m = comm.project.domain.plot()
     im = model.plot_depth_slice(component=args.component,
                                 depth_in_km=args.depth, m=m)["mesh"]
@@ -1212,9 +1339,12 @@ def lasif_compare_misfits(parser, args):
 
         event_weight = from_it.events[event]["event_weight"]
 
-        # Get a list of channels shared amongst both.
-        shared_channels = set(window_group_to.list()).intersection(
-            set(window_group_from.list()))
+        # Get all windows of both at once and a list of channels shared
+        # amongst both.
+        all_windows_to = window_group_to.get_all_windows()
+        all_windows_from = window_group_from.get_all_windows()
+        shared_channels = set(all_windows_to.keys()).intersection(
+            set(all_windows_from.keys()))
 
         # On rank 0, show a progressbar because it can take forever.
         if MPI.COMM_WORLD.rank == 0:
@@ -1230,8 +1360,8 @@ def lasif_compare_misfits(parser, args):
         for _i, channel in enumerate(shared_channels):
             if MPI.COMM_WORLD.rank == 0:
                 pbar.update(_i)
-            window_collection_from = window_group_from.get(channel)
-            window_collection_to = window_group_to.get(channel)
+            window_collection_from = all_windows_from[channel]
+            window_collection_to = all_windows_to[channel]
 
             station_weight = from_it.events[event]["stations"][
                 ".".join(channel.split(".")[:2])]["station_weight"]
@@ -1371,12 +1501,9 @@ def lasif_migrate_windows(parser, args):
             lambda x: ".".join(x.split(".")[:2]) in stations,
             contents)
 
-        for channel_id in filtered_contents:
-            coll = window_group_from.get(channel_id)
-            coll.synthetics_tag = to_it.name
-            f = window_group_to._get_window_filename(channel_id)
-            coll.filename = f
-            coll.write()
+        window_group_to.replace_windows({
+            channel_id: window_group_from.get(channel_id).windows
+            for channel_id in filtered_contents})
 
 
 @command_group("Iteration Management")
@@ -1436,8 +1563,9 @@ def lasif_preprocess_data(parser, args):
     Launch data preprocessing.
 
     This function works with MPI. Don't use too many cores, I/O quickly
-    becomes the limiting factor. It also works without MPI but then only one
-    core actually does any work.
+    becomes the limiting factor. Without MPI it uses all local cores with
+    "--parallel_backend process_pool", otherwise only one core actually does
+    any work.
     """
     parser.add_argument("iteration_name", help="name of the iteration")
     parser.add_argument(
@@ -1458,6 +1586,7 @@ def lasif_preprocess_data(parser, args):
             "False"],
         help="``True``: for teleseismic configuration and waveform selection based on their similarity, "
         "``False``: preferred for regional waveforms, no selection applied ")
+    _add_parallel_arguments(parser)
 
     args = parser.parse_args(args)
     iteration_name = args.iteration_name
@@ -1498,7 +1627,9 @@ def lasif_preprocess_data(parser, args):
         components,
         svd_selection,
         noise_threshold,
-        events)
+        events,
+        backend=args.parallel_backend,
+        processes=args.processes)
 
 
 @mpi_enabled
@@ -14,8 +14,8 @@ special purpose tool that does what I need it to do.
 """
 
 
-from PyQt5 import QtGui, QtWidgets
-from PyQt5.QtCore import pyqtSlot
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
 
 from glob import iglob
 import imp
@@ -67,6 +67,27 @@ def compile_and_import_ui_files():
             print(e.message)
 
 
+class DepthSliceLoader(QtCore.QThread):
+    """
+    Loads a depth slice and its statistics on a worker thread. The first
+    request for a component builds its depth slice pyramid. Emits
+    ``loaded`` with the request tuple once done.
+    """
+    loaded = pyqtSignal(object)
+
+    def __init__(self, model, request, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.model = model
+        # (model name, component, depth index, level)
+        self.request = request
+
+    def run(self):
+        _, component, depth_index, level = self.request
+        self.model.get_depth_slice(component, depth_index, level=level)
+        self.model.get_depth_slice_statistics(component, depth_index)
+        self.loaded.emit(self.request)
+
+
 class Window(QtWidgets.QMainWindow):
     def __init__(self, comm):
         QtGui.QMainWindow.__init__(self)
@@ -84,9 +105,18 @@ class Window(QtWidgets.QMainWindow):
             "depth": None,
             "model": None,
             "style": None,
+            "level": None,
         }
         self.model = None
 
+        # Depth slices are loaded on worker threads. Only the result of the
+        # latest request is plotted.
+        self.loaders = []
+        self.latest_request = None
+        # Model and component combinations whose slices have already been
+        # loaded once and can thus be previewed without delay.
+        self.loaded_components = set()
+
         # Keeping track of random plotted stuff.
         self.plot_state = {
             "depth_markers": [],
@@ -219,7 +249,8 @@ class Window(QtWidgets.QMainWindow):
             "component": self._gui_component,
             "depth": self._gui_depth,
             "model": self._gui_model,
-            "style": self._gui_style
+            "style": self._gui_style,
+            "level": self._gui_level
         }
         return state == self.current_state
 
@@ -243,16 +274,57 @@ class Window(QtWidgets.QMainWindow):
         self.current_state["component"] = component
         self.current_state["depth"] = depth
         self.current_state["style"] = style
+        self.current_state["level"] = self._gui_level
 
         if None in list(self.current_state.values()):
             return
 
-        self.model.parse_component(component)
+        self.ui.depth_label.setText("Desired Depth: %.1f km" % depth)
+
+        # Coarse previews while dragging the slider are plotted right away,
+        # everything else is loaded in the background first.
+        if self.current_state["level"] and \
+                (model, component) in self.loaded_components:
+            self._plot_depth_slice()
+            return
+
+        request = (model, component,
+                   self.model.get_closest_gll_index("depth", depth),
+                   self.current_state["level"])
+        self.latest_request = request
+        self.ui.status_label.setText("Loading %s..." % component)
+        loader = DepthSliceLoader(self.model, request, parent=self)
+        loader.loaded.connect(self._on_depth_slice_loaded)
+        loader.finished.connect(self._on_loader_finished)
+        self.loaders.append(loader)
+        loader.start()
+
+    def _on_depth_slice_loaded(self, request):
+        """
+        Fired in the GUI thread once a worker thread loaded a depth slice.
+        """
+        self.loaded_components.add(request[:2])
+        if request != self.latest_request or request[0] != self._gui_model:
+            return
+        self.ui.status_label.setText("")
+        self._plot_depth_slice()
+
+    def _on_loader_finished(self):
+        self.loaders = [_i for _i in self.loaders if not _i.isFinished()]
+
+    def _plot_depth_slice(self):
+        """
+        Plots the depth slice of the current state.
+        """
+        depth = self.current_state["depth"]
+        component = self.current_state["component"]
+        style = self.current_state["style"]
 
         # Plot model and colorbar.
         ret_val = self.model.plot_depth_slice(
             component, depth, self.basemap,
-            absolute_values=True if style == "absolute" else False)
+            absolute_values=True if style == "absolute" else False,
+            level=self.current_state["level"])
 
         if ret_val is None:
             self.ui.depth_label.setText("Desired Depth: %.1f km" % depth)
@@ -354,6 +426,13 @@ class Window(QtWidgets.QMainWindow):
         mod = str(self.ui.model_selection_comboBox.currentText()).strip()
         return mod if mod else None
 
+    @property
+    def _gui_level(self):
+        # Use the coarsest resolution while dragging the slider.
+        if self.ui.depth_slider.isSliderDown() and self.model:
+            return self.model.depth_slice_level_count - 1
+        return 0
+
     @property
     def _gui_style(self):
         if self.ui.radio_button_absolute.isChecked():
@@ -372,6 +451,10 @@ class Window(QtWidgets.QMainWindow):
     def on_depth_slider_valueChanged(self, value):
         self._update()
 
+    @pyqtSlot()
+    def on_depth_slider_sliderReleased(self):
+        self._update()
+
     @pyqtSlot(str)
     def on_variable_selection_comboBox_currentIndexChanged(self, value):
         self._update()
@@ -17,6 +17,7 @@ import math
 import numpy as np
 import os
 import re
+import threading
 import warnings
 
 import lasif.colors
@@ -65,7 +66,8 @@ class RawSES3DModelHandler(object):
         * vz_[xx]_[timestep]
     """
 
-    def __init__(self, directory, domain, model_type="earth_model"):
+    def __init__(self, directory, domain, model_type="earth_model",
+                 cache_folder=None):
         """
         The init function.
 
@@ -76,6 +78,9 @@ class RawSES3DModelHandler(object):
                 * earth_model - The standard SES3D model files (default)
                 * kernel - The kernels. Identifies by lots of grad_* files.
                 * wavefield - The raw wavefields.
+        :param cache_folder: If given, the depth slices and profiles are
+            served from pyramids of precomputed depth slices stored in this
+            folder. See :mod:`lasif.tools.depth_slice_pyramid`.
         """
         self.directory = directory
         self.boxfile = os.path.join(self.directory, "boxfile")
@@ -217,12 +222,51 @@ class RawSES3DModelHandler(object):
                 self.depth_bounds[1], self.depth_bounds[0],
                 self.setup["point_count_in_z"])[::-1]
 
-    def _read_single_box(self, component, file_number):
+        from lasif.tools.depth_slice_pyramid import (
+            DepthSlicePyramidStore, get_level_count)
+
+        # Number of resolution levels of the depth slices.
+        self.depth_slice_level_count = get_level_count((
+            self.setup["point_count_in_x"], self.setup["point_count_in_y"]))
+        self._depth_slice_pyramid_store = DepthSlicePyramidStore(
+            cache_folder) if cache_folder else None
+        self._depth_slice_pyramids = {}
+        # Pyramids might be requested from multiple threads. Each component
+        # has its own lock so building one pyramid does not block access
+        # to the others.
+        self._depth_slice_pyramid_locks = {}
+        self._depth_slice_pyramid_locks_lock = threading.Lock()
+
+    def _get_gll_point_indices(self, element_count):
+        """
+        Returns the element and the GLL point index of every point along an
+        axis of a box with ``element_count`` elements. Points shared by
+        neighbouring elements only appear once and are taken from the first
+        element.
+
+        :param element_count: The number of elements along the axis.
+        """
+        lpd = self.lagrange_polynomial_degree
+        points = np.arange(element_count * lpd + 1)
+        elements = np.maximum(points - 1, 0) // lpd
+        return elements, points - elements * lpd
+
+    def _read_single_box(self, component, file_number, x_indices=None,
+                         y_indices=None, z_indices=None):
         """
         This function reads Ses3ds raw binary files, e.g. 3d velocity field
         snapshots, as well as model parameter files or sensitivity kernels. It
         returns the field as an array of rank 3 with shape (nx*lpd+1, ny*lpd+1,
         nz*lpd+1), discarding the duplicates by default.
+
+        The file is memory-mapped and only the requested points are read
+        from it.
+
+        :param component: The component name.
+        :param file_number: The number of the box.
+        :param x_indices: Indices of the points along x in the box. All
+            points if not given. The same holds for ``y_indices`` and
+            ``z_indices``.
         """
         # Get the file and the corresponding domain.
         filename = self.components[component]["filenames"][file_number]
@@ -235,32 +279,92 @@ class RawSES3DModelHandler(object):
 
         # Take care: The first and last four bytes in the arrays are invalid
         #  due to them being written by Fortran.
-        with open(filename, "rb") as open_file:
-            field = np.ndarray(shape, buffer=open_file.read()[4:-4],
-                               dtype="float32", order="F")
+        field = np.memmap(filename, dtype="float32", mode="r", offset=4,
+                          shape=shape, order="F")
+
+        # Element and GLL point index of each requested point. The z axis is
+        # stored upside down.
+        indices = []
+        for axis, selection in enumerate((x_indices, y_indices, z_indices)):
+            elements, points = self._get_gll_point_indices(shape[axis])
+            if axis == 2:
+                elements, points = elements[::-1], points[::-1]
+            if selection is not None:
+                elements, points = elements[selection], points[selection]
+            indices.append((elements, points))
+
+        (x_e, x_p), (y_e, y_p), (z_e, z_p) = indices
+        x_e, x_p = x_e[:, None, None], x_p[:, None, None]
+        y_e, y_p = y_e[None, :, None], y_p[None, :, None]
+        z_e, z_p = z_e[None, None, :], z_p[None, None, :]
+        return np.asarray(field[x_e, y_e, z_e, x_p, y_p, z_p])
+
+    def _assemble_component(self, component, x_range=None, y_range=None,
+                            z_range=None):
+        """
+        Assembles a component from the boxes.
 
-        # Calculate the new shape by multiplying every dimension with lpd + 1
-        # value for every dimension.
-        new_shape = [_i * _j for _i, _j in zip(shape[:3], shape[3:])]
+        Returns an array with shape (point_count_in_x, point_count_in_y,
+        point_count_in_z). Each given range restricts the corresponding axis,
+        only the boxes overlapping all ranges are read.
 
-        # Reorder the axes:
-        # v[x, y, z, lpd + 1 ,lpd + 1, lpd + 1] -> v[x, lpd + 1, y, z,
-        # lpd + 1, lpd + 1] -> v[x, lpd + 1, y, lpd + 1, z, lpd + 1]
-        field = np.rollaxis(np.rollaxis(field, 3, 1), 3, lpd + 1)
+        :param component: The component name.
+        :param x_range: Start and stop index of the points along x.
+        :param y_range: Start and stop index of the points along y.
+        :param z_range: Start and stop index of the points along z.
+        """
+        lpd = self.lagrange_polynomial_degree
+        ranges = [
+            (0, self.setup["point_count_in_%s" % axis]) if _r is None else _r
+            for axis, _r in zip("xyz", (x_range, y_range, z_range))]
 
-        # Reshape the data:
-        # v[nx,lpd+1,ny,lpd+1,nz,lpd+1] to v[nx*(lpd+1),ny*(lpd+1),nz*(lpd+1)]
-        field = field.reshape(new_shape, order="C")
+        # Allocate empty array with the necessary dimensions.
+        data = np.empty([_r[1] - _r[0] for _r in ranges], dtype="float32")
 
-        # XXX: Attempt to do this in one step.
-        for axis, count in enumerate(new_shape):
-            # Mask the duplicate values.
-            mask = np.ones(count, dtype="bool")
-            mask[::lpd + 1][1:] = False
-            # Remove them by compressing the array.
-            field = field.compress(mask, axis=axis)
+        for _i, domain in enumerate(self.setup["subdomains"]):
+            local_indices = []
+            target = []
+            for axis, (start, stop) in zip("xyz", ranges):
+                # Minimum and maximum indices.
+                i_min = lpd * domain["boundaries_%s" % axis][0]
+                i_max = lpd * (domain["boundaries_%s" % axis][1] + 1)
+                first, last = max(start, i_min), min(stop - 1, i_max)
+                if first > last:
+                    break
+                local_indices.append(np.arange(first - i_min,
+                                               last - i_min + 1))
+                target.append(slice(first - start, last - start + 1))
+            else:
+                # Merge into data.
+                data[tuple(target)] = self._read_single_box(
+                    component, _i, *local_indices)
 
-        return field[:, :, ::-1]
+        return data
+
+    def _derive_component(self, component, get_component):
+        """
+        Calculates a derived component.
+
+        :param component: The name of the derived component.
+        :param get_component: Function returning the data of a component.
+        """
+        if component == "vp":
+            lambda_ = get_component("lambda")
+            mu = get_component("mu")
+            rhoinv = get_component("rhoinv")
+            return np.sqrt(((lambda_ + 2.0 * mu) * rhoinv)) / 1000.0
+        elif component == "vsh":
+            mu = get_component("mu")
+            rhoinv = get_component("rhoinv")
+            return np.sqrt((mu * rhoinv)) / 1000.0
+        elif component == "vsv":
+            mu = get_component("mu")
+            rhoinv = get_component("rhoinv")
+            b = get_component("B")
+            return np.sqrt((mu + b) * rhoinv) / 1000.0
+        elif component == "rho":
+            rhoinv = get_component("rhoinv")
+            return 1.0 / rhoinv
 
     def parse_component(self, component):
         """
@@ -277,64 +381,133 @@ class RawSES3DModelHandler(object):
             msg = "Component %s is unknown" % component
             raise ValueError(msg)
 
-        if component == "vp":
-            self._parse_component("lambda")
-            self._parse_component("mu")
-            self._parse_component("rhoinv")
-            lambda_ = self.parsed_components["lambda"]
-            mu = self.parsed_components["mu"]
-            rhoinv = self.parsed_components["rhoinv"]
-            self.parsed_components["vp"] = \
-                np.sqrt(((lambda_ + 2.0 * mu) * rhoinv)) / 1000.0
-        elif component == "vsh":
-            self._parse_component("mu")
-            self._parse_component("rhoinv")
-            mu = self.parsed_components["mu"]
-            rhoinv = self.parsed_components["rhoinv"]
-            self.parsed_components["vsh"] = np.sqrt((mu * rhoinv)) / 1000.0
-        elif component == "vsv":
-            self._parse_component("mu")
-            self._parse_component("rhoinv")
-            self._parse_component("B")
-            mu = self.parsed_components["mu"]
-            rhoinv = self.parsed_components["rhoinv"]
-            b = self.parsed_components["B"]
-            self.parsed_components["vsv"] = \
-                np.sqrt((mu + b) * rhoinv) / 1000.0
-        elif component == "rho":
-            self._parse_component("rhoinv")
-            rhoinv = self.parsed_components["rhoinv"]
-            self.parsed_components["rho"] = 1.0 / rhoinv
+        self.parsed_components[component] = self._derive_component(
+            component, self._parse_component)
 
     def _parse_component(self, component):
         """
         Parses the specified component.
         """
+        if component not in self.parsed_components:
+            self.parsed_components[component] = \
+                self._assemble_component(component)
+        return self.parsed_components[component]
+
+    def get_region(self, component, x_range=None, y_range=None,
+                   z_range=None):
+        """
+        Returns a component restricted to ranges of points along any axis
+        without parsing it. Only the boxes overlapping the region are read.
+        Already parsed components are used if available.
+
+        :param component: The component name.
+        :param x_range: Start and stop index of the points along x. All
+            points if not given. The same holds for ``y_range`` and
+            ``z_range``.
+        """
         if component in self.parsed_components:
-            return
-        # Allocate empty array with the necessary dimensions.
-        data = np.empty((
-            self.setup["point_count_in_x"],
-            self.setup["point_count_in_y"], self.setup["point_count_in_z"]),
-            dtype="float32")
+            return self.parsed_components[component][tuple(
+                slice(None) if _r is None else slice(*_r)
+                for _r in (x_range, y_range, z_range))]
+        elif component in self.components:
+            return self._assemble_component(component, x_range, y_range,
+                                            z_range)
+        elif component not in self.available_derived_components:
+            msg = "Component %s is unknown" % component
+            raise ValueError(msg)
 
-        for _i, domain in enumerate(self.setup["subdomains"]):
-            x_min, x_max = domain["boundaries_x"]
-            y_min, y_max = domain["boundaries_y"]
-            z_min, z_max = domain["boundaries_z"]
+        return self._derive_component(
+            component, lambda x: self.get_region(x, x_range, y_range,
+                                                 z_range))
 
-            # Minimum indices
-            x_min, y_min, z_min = [self.lagrange_polynomial_degree * _j
-                                   for _j in (x_min, y_min, z_min)]
-            # Maximum indices
-            x_max, y_max, z_max = [self.lagrange_polynomial_degree * (_j + 1)
-                                   for _j in (x_max, y_max, z_max)]
+    def get_depth_slice_pyramid(self, component):
+        """
+        Returns the
+        :class:`~lasif.tools.depth_slice_pyramid.DepthSlicePyramid` of a
+        component, building it if necessary, or ``None`` if the handler has
+        no cache folder.
 
-            # Merge into data.
-            data[x_min: x_max + 1, y_min: y_max + 1, z_min: z_max + 1] = \
-                self._read_single_box(component, _i)
+        :param component: The component name.
+        """
+        if self._depth_slice_pyramid_store is None:
+            return None
+        if component in self._depth_slice_pyramids:
+            return self._depth_slice_pyramids[component]
+
+        with self._depth_slice_pyramid_locks_lock:
+            lock = self._depth_slice_pyramid_locks.setdefault(
+                component, threading.Lock())
+        with lock:
+            if component in self._depth_slice_pyramids:
+                return self._depth_slice_pyramids[component]
+
+            # Only validate the component before building the pyramid.
+            if component not in self.components and \
+                    component not in self.available_derived_components:
+                msg = "Component %s is unknown" % component
+                raise ValueError(msg)
+
+            from lasif.tools.depth_slice_pyramid import get_files_key
+
+            key = get_files_key([self.boxfile] + [
+                _j for _i in self.components.values()
+                for _j in _i["filenames"]])
+            store = self._depth_slice_pyramid_store
+            pyramid = store.get(component, key)
+            if pyramid is None:
+                pyramid = store.build(
+                    component, key, shape=(
+                        self.setup["point_count_in_x"],
+                        self.setup["point_count_in_y"],
+                        self.setup["point_count_in_z"]),
+                    get_slice=lambda x: self.get_region(
+                        component, z_range=(x, x + 1))[:, :, 0])
+            self._depth_slice_pyramids[component] = pyramid
+            return pyramid
+
+    def get_depth_slice(self, component, depth_index, level=0):
+        """
+        Returns the values of a component at all collocation points of a
+        certain depth as an array with shape (point_count_in_x,
+        point_count_in_y).
 
-        self.parsed_components[component] = data
+        Only the boxes containing the depth are read and the component does
+        not have to be parsed. Handlers with a cache folder serve the slice
+        from the component's depth slice pyramid.
+
+        :param component: The component name.
+        :param depth_index: The index of the depth in
+            ``collocation_points_depth``.
+        :param level: The resolution level. Level ``n`` only contains every
+            ``2 ** n``-th point along both axes. Levels beyond
+            ``depth_slice_level_count - 1`` are clipped.
+        """
+        level = min(level, self.depth_slice_level_count - 1)
+        if component not in self.parsed_components:
+            pyramid = self.get_depth_slice_pyramid(component)
+            if pyramid is not None:
+                return pyramid.get_slice(depth_index, level=level)
+        step = 2 ** level
+        return self.get_region(
+            component, z_range=(depth_index, depth_index + 1))[
+                ::step, ::step, 0]
+
+    def get_depth_slice_statistics(self, component, depth_index):
+        """
+        Returns the minimum, maximum, and median of a full resolution depth
+        slice as a dictionary. Precomputed for handlers with a cache folder.
+
+        :param component: The component name.
+        :param depth_index: The index of the depth in
+            ``collocation_points_depth``.
+        """
+        if component not in self.parsed_components:
+            pyramid = self.get_depth_slice_pyramid(component)
+            if pyramid is not None:
+                return pyramid.get_statistics(depth_index)
+        data = self.get_depth_slice(component, depth_index)
+        return {"min": data.min(), "max": data.max(),
+                "median": np.median(data)}
 
     def _calculate_final_dimensions(self):
         """
@@ -384,7 +557,7 @@ class RawSES3DModelHandler(object):
         # needed.
         points = np.empty(count)
         lpd = self.lagrange_polynomial_degree
-        p_view = points[:count - 1].view().reshape(((count - 1) / lpd, lpd))
+        p_view = points[:count - 1].view().reshape(((count - 1) // lpd, lpd))
         for _i in range(p_view.shape[0]):
             p_view[_i] = _i
         points[-1] = points[-2] + 1
@@ -407,7 +580,7 @@ class RawSES3DModelHandler(object):
                                     value))
 
     def plot_depth_slice(self, component, depth_in_km, m,
-                         absolute_values=True):
+                         absolute_values=True, level=0):
         """
         Plots a depth slice.
 
@@ -417,8 +590,11 @@ class RawSES3DModelHandler(object):
              not exists, the nearest neighbour will be plotted.
         :type depth_in_km: integer or float
         :param m: Basemap instance.
+        :param level: The resolution level of the plotted slice. See
+            :meth:`get_depth_slice`.
         """
         depth_index = self.get_closest_gll_index("depth", depth_in_km)
+        level = min(level, self.depth_slice_level_count - 1)
 
         # No need to do anything if the currently plotted slice is already
         # plotted. This is useful for interactive use when the desired depth
@@ -426,14 +602,14 @@ class RawSES3DModelHandler(object):
         if hasattr(m, "_plotted_depth_slice"):
             # Use a tuple of relevant parameters.
             if m._plotted_depth_slice == (self.directory, depth_index,
-                                          component, absolute_values):
+                                          component, absolute_values, level):
                 return None
 
-        data = self.parsed_components[component]
-
+        # The x axis of the data runs from north to south.
+        step = 2 ** level
         depth = self.collocation_points_depth[depth_index]
-        lngs = self.collocation_points_lngs
-        lats = self.collocation_points_lats
+        lngs = self.collocation_points_lngs[::step]
+        lats = self.collocation_points_lats[::-1][::step][::-1]
 
         # Rotate data if needed.
         lon, lat = np.meshgrid(lngs, lats)
@@ -451,7 +627,9 @@ class RawSES3DModelHandler(object):
             lat.shape = lat_shape
 
         x, y = m(lon, lat)
-        depth_data = data[::-1, :, depth_index]
+        depth_data = self.get_depth_slice(component, depth_index,
+                                          level=level)[::-1]
+        statistics = self.get_depth_slice_statistics(component, depth_index)
 
         # Plot values relative to AK135.
         if not absolute_values:
@@ -470,8 +648,8 @@ class RawSES3DModelHandler(object):
             }
 
             if component not in cmp_map:
-                vmin, vmax = depth_data.min(), depth_data.max()
-                vmedian = np.median(depth_data)
+                vmin, vmax = statistics["min"], statistics["max"]
+                vmedian = statistics["median"]
                 offset = max(abs(vmax - vmedian), abs(vmedian - vmin))
 
                 if vmax - vmin == 0:
@@ -493,8 +671,8 @@ class RawSES3DModelHandler(object):
                 vmin = -offset
                 vmax = offset
         else:
-            vmin, vmax = depth_data.min(), depth_data.max()
-            vmedian = np.median(depth_data)
+            vmin, vmax = statistics["min"], statistics["max"]
+            vmedian = statistics["median"]
             offset = max(abs(vmax - vmedian), abs(vmedian - vmin))
 
             min_delta = abs(vmax * 0.005)
@@ -516,7 +694,7 @@ class RawSES3DModelHandler(object):
 
         # Store what is currently plotted.
         m._plotted_depth_slice = (self.directory, depth_index, component,
-                                  absolute_values)
+                                  absolute_values, level)
 
         return {
             "depth": depth,
@@ -544,9 +722,16 @@ class RawSES3DModelHandler(object):
         x_index = self.get_closest_gll_index("latitude", latitude)
         y_index = self.get_closest_gll_index("longitude", longitude)
 
-        data = self.parsed_components[component]
         depths = self.collocation_points_depth
-        values = data[x_index, y_index, :]
+        pyramid = None
+        if component not in self.parsed_components:
+            pyramid = self.get_depth_slice_pyramid(component)
+        if pyramid is not None:
+            values = pyramid.get_profile(x_index, y_index)
+        else:
+            values = self.get_region(
+                component, x_range=(x_index, x_index + 1),
+                y_range=(y_index, y_index + 1))[0, 0, :]
 
         lat = self.collocation_points_lats[::-1][x_index]
         lng = self.collocation_points_lngs[y_index]
@@ -599,7 +784,7 @@ class RawSES3DModelHandler(object):
 
     def _read_boxfile(self):
         setup = {"subdomains": []}
-        with open(self.boxfile, "rU") as fh:
+        with open(self.boxfile, "rt") as fh:
             # The first 14 lines denote the header
             lines = fh.readlines()[14:]
             # Strip lines and remove empty lines.
@@ -2,14 +2,17 @@
 # -*- coding: utf-8 -*-
 
 
+import glob
 import inspect
 import mock
 import numpy as np
 import os
 import pytest
 import shutil
+import warnings
 
-from lasif import LASIFError
+from lasif import LASIFError, LASIFNotFoundError, LASIFWarning
+from lasif.components.actions import _read_input_file
 from lasif.components.project import Project
 from lasif import rotations
 
@@ -537,9 +540,7 @@ def test_calculate_all_adjoint_sources_with_failing_adjoint_src_calculation(
     assert "Could not calculate adjoint source for iteration 1" in out
 
     # Make sure nothing is actually written.
-    out = os.path.join(comm.project.paths["adjoint_sources"], event_name,
-                       it.long_name)
-    assert os.listdir(out) == []
+    assert len(comm.adjoint_sources.get_store(event_name, it.name)) == 0
 
 
 @mock.patch("lasif.tools.Q_discrete.calculate_Q_model")
@@ -605,9 +606,496 @@ def test_calculate_all_adjoint_sources_rotated_domain(patch, comm, capsys):
     out, _ = capsys.readouterr()
     assert out == ""
 
-    # Make sure that three adjoint sources are written in the end.
+    # Make sure that three adjoint sources are written in the end. They all
+    # end up in one store.
+    assert len(comm.adjoint_sources.get_store(event_name, it.name)) == 3
     out = os.path.join(comm.project.paths["adjoint_sources"], event_name,
                        it.long_name)
-    # Joblib dumps one or two files per written array, depending on the
-    # version.
-    assert len(os.listdir(out)) >= 3
+    assert sorted(os.listdir(out)) == ["adjoint_sources.bin",
+                                       "adjoint_sources.sqlite"]
+
+
+@mock.patch("lasif.tools.Q_discrete.calculate_Q_model")
+def test_select_windows_for_whole_event(patch, comm):
+    """
+    Windows are selected for all stations of an event in batches and only
+    written once all of them have been picked.
+    """
+    # Speed up this test.
+    patch.return_value = (np.array([1.6341, 1.0513, 1.5257]),
+                          np.array([0.59496, 3.7119, 22.2171]))
+
+    comm.iterations.create_new_iteration(
+        "1", "ses3d_4_1", comm.query.get_stations_for_all_events(), 8, 100)
+
+    event_name = "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11"
+    it = comm.iterations.get("1")
+    it.solver_settings["solver_settings"]["simulation_parameters"][
+        "time_increment"] = 0.13
+    it.solver_settings["solver_settings"]["simulation_parameters"][
+        "number_of_time_steps"] = 4000
+    comm.actions.preprocess_data(it)
+
+    picked = []
+
+    def window_picking_function(data_tr, synth_tr, *args, **kwargs):
+        picked.append(data_tr.id)
+        return [(data_tr.stats.starttime + 100,
+                 data_tr.stats.starttime + 200)]
+
+    get_project_function = comm.project.get_project_function
+
+    def get_function(name):
+        if name == "window_picking_function":
+            return window_picking_function
+        return get_project_function(name)
+
+    with mock.patch.object(comm.project, "get_project_function",
+                           side_effect=get_function):
+        comm.actions.select_windows(event_name, it, backend="serial")
+
+    # Only HL.ARG has synthetics.
+    channels = ["HL.ARG..BHE", "HL.ARG..BHN", "HL.ARG..BHZ"]
+    assert sorted(picked) == channels
+    window_group_manager = comm.windows.get(event_name, it)
+    assert sorted(window_group_manager.list()) == channels
+    for channel in channels:
+        assert len(window_group_manager.get(channel)) == 1
+
+    # Selecting again replaces the existing windows.
+    with mock.patch.object(comm.project, "get_project_function",
+                           side_effect=get_function):
+        comm.actions.select_windows_for_event(event_name, it,
+                                              stations=["HL.ARG"])
+    assert len(picked) == 6
+    for channel in channels:
+        assert len(window_group_manager.get(channel)) == 1
+
+
+def test_preprocess_data_in_batches_counts_failed_files(synthetic_comm,
+                                                        capsys):
+    """
+    Files of a batch that cannot be processed are logged and counted as
+    failures one by one.
+    """
+    comm = synthetic_comm
+    it = comm.iterations.get(comm.iterations.list()[0])
+
+    get_project_function = comm.project.get_project_function
+    batch_function = get_project_function("preprocessing_function_batch")
+
+    def failing_batch_function(processing_infos, iteration):
+        results = batch_function(processing_infos, iteration)
+        results[1] = ValueError("Processing failed.")
+        return results
+
+    def get_function(name):
+        if name == "preprocessing_function_batch":
+            return failing_batch_function
+        return get_project_function(name)
+
+    with mock.patch("lasif.components.project.Project."
+                    "get_project_function", side_effect=get_function):
+        comm.actions.preprocess_data(it, backend="serial")
+
+    out, _ = capsys.readouterr()
+    assert "1 files failed being processed." in out
+    assert "3 files have been processed without errors" in out
+    event_name = comm.events.list()[0]
+    assert len(os.listdir(os.path.join(
+        comm.project.paths["data"], event_name, it.processing_tag))) == 3
+    logfile = glob.glob(os.path.join(
+        comm.project.paths["logs"], "DATA_PREPROCESSING", "*.log"))[0]
+    with open(logfile, "rt") as fh:
+        log = fh.read()
+    assert log.count("ValueError: Processing failed.") == 1
+    assert log.count("SUCCESS") == 3
+
+
+def test_preprocess_data_in_batches_counts_warnings(synthetic_comm, capsys):
+    """
+    Warnings raised for single files of a batch are counted for these
+    files, all others are only logged for the whole batch.
+    """
+    from lasif.tools.parallel_helpers import item_warnings
+
+    comm = synthetic_comm
+    it = comm.iterations.get(comm.iterations.list()[0])
+
+    get_project_function = comm.project.get_project_function
+    batch_function = get_project_function("preprocessing_function_batch")
+
+    def warning_batch_function(processing_infos, iteration):
+        with item_warnings(1):
+            warnings.warn("File warning.")
+        warnings.warn("Batch warning.")
+        return batch_function(processing_infos, iteration)
+
+    def get_function(name):
+        if name == "preprocessing_function_batch":
+            return warning_batch_function
+        return get_project_function(name)
+
+    with mock.patch("lasif.components.project.Project."
+                    "get_project_function", side_effect=get_function):
+        comm.actions.preprocess_data(it, backend="serial")
+
+    out, _ = capsys.readouterr()
+    assert "0 files failed being processed." in out
+    assert "1 files raised warnings" in out
+    assert "3 files have been processed without errors" in out
+    logfile = glob.glob(os.path.join(
+        comm.project.paths["logs"], "DATA_PREPROCESSING", "*.log"))[0]
+    with open(logfile, "rt") as fh:
+        log = fh.read()
+    assert log.count("File warning.") == 1
+    assert log.count("Batch warning.") == 1
+    assert log.count("SUCCESS") == 3
+
+
+@pytest.mark.parametrize("preloaded", [False, True])
+def test_preprocess_data_reads_ahead_only_for_preloaded_input(
+        synthetic_comm, preloaded):
+    """
+    Input files are only read ahead for preprocessing functions with a
+    ``preloaded`` parameter. Older functions read them themselves.
+    """
+    comm = synthetic_comm
+    it = comm.iterations.get(comm.iterations.list()[0])
+
+    get_project_function = comm.project.get_project_function
+    batch_function = get_project_function("preprocessing_function_batch")
+    received = []
+
+    def legacy_batch_function(processing_infos, iteration):
+        received.extend(("input_data" in _i, False)
+                        for _i in processing_infos)
+        return batch_function(processing_infos, iteration)
+
+    def preloaded_batch_function(processing_infos, iteration,
+                                 preloaded=False):
+        received.extend(("input_data" in _i, preloaded)
+                        for _i in processing_infos)
+        return batch_function(processing_infos, iteration,
+                              preloaded=preloaded)
+
+    def get_function(name):
+        if name == "preprocessing_function_batch":
+            return preloaded_batch_function if preloaded \
+                else legacy_batch_function
+        return get_project_function(name)
+
+    with mock.patch("lasif.components.project.Project."
+                    "get_project_function", side_effect=get_function), \
+            mock.patch("lasif.components.actions._read_input_file",
+                       side_effect=_read_input_file) as read_input_file:
+        comm.actions.preprocess_data(it, backend="serial")
+
+    assert read_input_file.called == preloaded
+    assert len(received) == 4
+    assert received == [(preloaded, preloaded)] * 4
+    event_name = comm.events.list()[0]
+    assert len(os.listdir(os.path.join(
+        comm.project.paths["data"], event_name, it.processing_tag))) == 4
+
+
+def test_select_windows_for_event_with_failing_station(synthetic_comm):
+    """
+    A station for which the window picking fails is skipped with a warning
+    and does not affect the windows of the other stations of the batch.
+    """
+    comm = synthetic_comm
+    event_name = comm.events.list()[0]
+    it = comm.iterations.get(comm.iterations.list()[0])
+    comm.actions.preprocess_data(it, backend="serial")
+    # The windows do not depend on the amplitudes.
+    it.scale_data_to_synthetics = False
+    stations = sorted(comm.query.get_matching_waveforms_for_event(
+        event_name, it).keys())
+    assert len(stations) >= 2
+
+    def window_picking_function(data_tr, synth_tr, *args, **kwargs):
+        if "%s.%s" % (data_tr.stats.network,
+                      data_tr.stats.station) == stations[0]:
+            raise ValueError("Picking failed.")
+        return [(data_tr.stats.starttime + 10,
+                 data_tr.stats.starttime + 20)]
+
+    get_project_function = comm.project.get_project_function
+
+    def get_function(name):
+        if name == "window_picking_function":
+            return window_picking_function
+        return get_project_function(name)
+
+    with mock.patch("lasif.components.project.Project."
+                    "get_project_function", side_effect=get_function):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            comm.actions.select_windows_for_event(event_name, it)
+
+    messages = [str(_i.message) for _i in w
+                if issubclass(_i.category, LASIFWarning)]
+    assert len(messages) == 1
+    assert stations[0] in messages[0]
+    assert "ValueError: Picking failed." in messages[0]
+    channels = comm.windows.get(event_name, it).list()
+    assert sorted(set(_i.rsplit(".", 2)[0] for _i in channels)) == \
+        stations[1:]
+
+
+def test_select_windows_for_event_keeps_windows_without_data(
+        synthetic_comm):
+    """
+    The existing windows of a station without matching data are kept.
+    """
+    import obspy
+    from lasif.components.query import DataTuple
+    from lasif.tests.testing_helpers import add_windows_to_synthetic_project
+
+    comm = synthetic_comm
+    event_name = comm.events.list()[0]
+    it = comm.iterations.get(comm.iterations.list()[0])
+    comm.actions.preprocess_data(it, backend="serial")
+    add_windows_to_synthetic_project(comm, it)
+    window_manager = comm.windows.get(event_name, it)
+    existing = {_i: [(_j.starttime, _j.endtime) for _j in
+                     window_manager.get(_i).windows]
+                for _i in window_manager.list()}
+    stations = sorted(it.events[event_name]["stations"])
+
+    get_matching_waveforms_for_event = \
+        comm.query.get_matching_waveforms_for_event
+
+    def no_synthetics_for_first_station(*args, **kwargs):
+        all_data = get_matching_waveforms_for_event(*args, **kwargs)
+        all_data[stations[0]] = all_data[stations[0]]._replace(
+            synthetics=obspy.Stream())
+        assert isinstance(all_data[stations[0]], DataTuple)
+        return all_data
+
+    def window_picking_function(data_tr, synth_tr, *args, **kwargs):
+        return [(data_tr.stats.starttime + 10,
+                 data_tr.stats.starttime + 20)]
+
+    get_project_function = comm.project.get_project_function
+
+    def get_function(name):
+        if name == "window_picking_function":
+            return window_picking_function
+        return get_project_function(name)
+
+    with mock.patch("lasif.components.project.Project."
+                    "get_project_function", side_effect=get_function), \
+            mock.patch("lasif.components.query.QueryComponent."
+                       "get_matching_waveforms_for_event",
+                       side_effect=no_synthetics_for_first_station):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            comm.actions.select_windows_for_event(event_name, it)
+
+    messages = [str(_i.message) for _i in w
+                if issubclass(_i.category, LASIFWarning)]
+    assert len(messages) == 1
+    assert "No matching data found" in messages[0]
+    assert stations[0] in messages[0]
+
+    assert sorted(window_manager.list()) == sorted(existing.keys())
+    for channel_id, windows in existing.items():
+        actual = [(_i.starttime, _i.endtime) for _i in
+                  window_manager.get(channel_id).windows]
+        if channel_id.startswith(stations[0] + "."):
+            assert actual == windows
+        else:
+            assert actual != windows
+            assert len(actual) == 1
+
+
+@pytest.mark.parametrize("synthetic_comm", [{
+    "event_count": 3, "station_count": 1, "npts": 100,
+    "sampling_rate": 1.0}], indirect=True)
+def test_sum_kernels(synthetic_comm):
+    """
+    The kernels of all events are summed and optionally smoothed.
+    """
+    from lasif.tests.testing_helpers import get_ses3d_model_values, \
+        write_ses3d_model
+
+    comm = synthetic_comm
+    components = ["grad_cp_", "grad_csh_", "grad_csv_", "grad_rho_"]
+    events = comm.events.list()
+    kernels_folder = os.path.join(comm.project.paths["kernels"],
+                                  "ITERATION_1")
+    for event in events:
+        os.makedirs(os.path.join(kernels_folder, event))
+        write_ses3d_model(os.path.join(kernels_folder, event), components)
+    # Folders not named after events are ignored.
+    os.makedirs(os.path.join(kernels_folder, "other"))
+
+    assert comm.kernels.list_events("1") == events
+    folder = comm.actions.sum_kernels("1", backend="serial")
+    assert folder == comm.kernels.get_summed_kernel_folder("1")
+    assert sorted(os.listdir(folder)) == sorted(
+        ["boxfile"] + ["%s%i" % (_i, _j) for _i in components
+                       for _j in range(4)])
+    handler = comm.kernels.get_model_handler("1", "SUMMED")
+    np.testing.assert_equal(handler.get_depth_slice("grad_rho", 3),
+                            3.0 * get_ses3d_model_values(3)[:, :, 3])
+
+    folder = comm.actions.sum_kernels(
+        "1", events=events[:2], horizontal_smoothing_in_degree=2.0,
+        backend="serial")
+    assert folder == comm.kernels.get_summed_kernel_folder(
+        "1", smoothed=True)
+    handler = comm.kernels.get_model_handler("1", "SUMMED")
+    np.testing.assert_equal(handler.get_depth_slice("grad_rho", 3),
+                            2.0 * get_ses3d_model_values(3)[:, :, 3])
+    # Only smoothed horizontally.
+    handler = comm.kernels.get_model_handler("1", "SUMMED_SMOOTHED")
+    values = handler.get_depth_slice("grad_cp", 7)
+    assert np.ptp(values[:, 0]) < np.ptp(2.0 * get_ses3d_model_values(0)[
+        :, 0, 7])
+    np.testing.assert_allclose(
+        handler.get_depth_profile("grad_cp", 45.0, 15.0)["values"][1:] -
+        handler.get_depth_profile("grad_cp", 45.0, 15.0)["values"][:-1],
+        2.0, rtol=1E-4)
+
+    os.remove(os.path.join(kernels_folder, events[0], "grad_cp_0"))
+    with pytest.raises(LASIFError):
+        comm.actions.sum_kernels("1", backend="serial")
+
+    # No boxfile and no model to get it from.
+    os.remove(os.path.join(kernels_folder, events[1], "boxfile"))
+    with pytest.raises(LASIFNotFoundError):
+        comm.actions.sum_kernels("1", events=events[1:], backend="serial")
+
+
+def _assert_same_adjoint_sources(actual, expected):
+    assert sorted(actual.keys()) == sorted(expected.keys())
+    for key, (samples, misfit_value) in expected.items():
+        np.testing.assert_allclose(actual[key][0], samples)
+        assert actual[key][1] == misfit_value
+
+
+@pytest.mark.parametrize("synthetic_comm", [{
+    "event_count": 2, "station_count": 3}], indirect=True)
+def test_calculate_all_adjoint_sources(synthetic_comm):
+    """
+    All backends calculate the same adjoint sources as calculating them
+    station by station.
+    """
+    from lasif.tests.testing_helpers import \
+        add_windows_to_synthetic_project, \
+        fake_processed_data_of_synthetic_project, pop_adjoint_sources
+
+    comm = synthetic_comm
+    it = comm.iterations.get(comm.iterations.list()[0])
+    fake_processed_data_of_synthetic_project(comm, it)
+    windows = add_windows_to_synthetic_project(comm, it)
+
+    for (event_name, station), station_windows in windows.items():
+        comm.adjoint_sources.calculate_adjoint_sources_for_station(
+            event_name, it.name, station, station_windows)
+    expected = pop_adjoint_sources(comm, it, windows)
+    assert len(expected) == 6
+
+    for backend in ("serial", "process_pool"):
+        for event_name in sorted(it.events.keys()):
+            results = comm.actions.calculate_all_adjoint_sources(
+                it.name, event_name, backend=backend, processes=2)
+            assert sorted(_i.func_args["station"] for _i in results) == \
+                sorted(it.events[event_name]["stations"])
+            assert [_i.exception for _i in results] == [None] * 3
+
+            event_windows = dict(
+                _i for _i in windows.items() if _i[0][0] == event_name)
+            _assert_same_adjoint_sources(
+                pop_adjoint_sources(comm, it, event_windows),
+                dict(_i for _i in expected.items()
+                     if _i[0][0] == event_name))
+
+
+def test_calculate_all_adjoint_sources_with_failing_station(synthetic_comm):
+    """
+    A station that fails is returned as a failed function execution and
+    does not affect the other stations.
+    """
+    from lasif import LASIFAdjointSourceCalculationError
+    from lasif.components.adjoint_sources import AdjointSourcesComponent
+    from lasif.tests.testing_helpers import \
+        add_windows_to_synthetic_project, \
+        fake_processed_data_of_synthetic_project, pop_adjoint_sources
+
+    comm = synthetic_comm
+    event_name = comm.events.list()[0]
+    it = comm.iterations.get(comm.iterations.list()[0])
+    fake_processed_data_of_synthetic_project(comm, it)
+    windows = add_windows_to_synthetic_project(comm, it)
+    stations = sorted(it.events[event_name]["stations"])
+
+    select_traces = AdjointSourcesComponent._select_traces
+
+    def failing_select_traces(self, waveforms, event_name, iteration_name,
+                              channel_id):
+        if channel_id.startswith(stations[0] + "."):
+            raise LASIFNotFoundError("No data for this station.")
+        return select_traces(self, waveforms, event_name, iteration_name,
+                             channel_id)
+
+    for backend in ("serial", "process_pool"):
+        with mock.patch.object(AdjointSourcesComponent, "_select_traces",
+                               failing_select_traces):
+            results = comm.actions.calculate_all_adjoint_sources(
+                it.name, event_name, backend=backend, processes=2)
+
+        assert len(results) == len(stations)
+        failed = [_i for _i in results if _i.exception is not None]
+        assert len(failed) == 1
+        assert failed[0].func_args["station"] == stations[0]
+        assert isinstance(failed[0].exception,
+                          LASIFAdjointSourceCalculationError)
+        assert "No data for this station." in str(failed[0].exception)
+
+        adjoint_sources = pop_adjoint_sources(comm, it, windows)
+        assert sorted(_i[1].rsplit(".", 2)[0]
+                      for _i in adjoint_sources.keys()) == stations[1:]
+
+
+def test_finalize_adjoint_sources_on_other_ranks(synthetic_comm, capsys):
+    """
+    Ranks other than 0 get no results from distributing the writing. They
+    raise the failures of rank 0 and leave the index files to rank 0.
+    """
+    from lasif.tests.testing_helpers import \
+        add_windows_to_synthetic_project, \
+        fake_processed_data_of_synthetic_project
+
+    comm = synthetic_comm
+    event_name = comm.events.list()[0]
+    it = comm.iterations.get(comm.iterations.list()[0])
+    fake_processed_data_of_synthetic_project(comm, it)
+    add_windows_to_synthetic_project(comm, it)
+    comm.actions.calculate_all_adjoint_sources(it.name, event_name,
+                                               backend="serial")
+    capsys.readouterr()
+
+    for failed in ([], ["XX.FAIL (Writing failed.)"]):
+        world = mock.MagicMock(rank=1, size=2)
+        world.bcast.return_value = failed
+        with mock.patch("mpi4py.MPI.COMM_WORLD", world), \
+                mock.patch("lasif.tools.parallel_helpers."
+                           "distribute_across_ranks", return_value=None):
+            if failed:
+                with pytest.raises(LASIFError) as err:
+                    comm.actions.finalize_adjoint_sources(it.name,
+                                                          event_name)
+                assert "XX.FAIL (Writing failed.)" in str(err.value)
+            else:
+                comm.actions.finalize_adjoint_sources(it.name, event_name)
+        world.bcast.assert_called_once_with(None, root=0)
+
+    out, _ = capsys.readouterr()
+    assert "Wrote adjoint sources" not in out
+    out = os.path.join(comm.project.paths["output"], "adjoint_sources")
+    for folder in os.listdir(out):
+        assert os.listdir(os.path.join(out, folder)) == []
@@ -147,3 +147,44 @@ def test_log_filename_creation(comm):
 
     assert (time - cur_time) <= 0.1
     assert desc == "some_event.log"
+
+
+def test_parallel_settings_in_config_file(tmpdir):
+    """
+    The parallel backend settings are optional in the config file.
+    """
+    pr = Project(str(tmpdir), init_project="TestProject")
+    assert pr.config["misc_settings"]["parallel_backend"] == "mpi"
+    assert pr.config["misc_settings"]["parallel_processes"] is None
+    del pr
+
+    config_file = os.path.join(str(tmpdir), "config.xml")
+    with open(config_file, "rt") as fh:
+        config = fh.read()
+    config = config.replace(
+        "</misc_settings>",
+        "<parallel_backend>process_pool</parallel_backend>"
+        "<parallel_processes>4</parallel_processes></misc_settings>")
+    with open(config_file, "wt") as fh:
+        fh.write(config)
+    # Make sure the cached config file is not used.
+    os.remove(os.path.join(str(tmpdir), "CACHE", "config.xml_cache.pickle"))
+
+    pr = Project(str(tmpdir))
+    assert pr.config["misc_settings"]["parallel_backend"] == "process_pool"
+    assert pr.config["misc_settings"]["parallel_processes"] == 4
+    assert pr.config["misc_settings"][
+        "time_frequency_adjoint_source_criterion"] == 7.0
+
+
+def test_travel_time_table_in_cache_folder(comm):
+    """
+    The travel time tables are stored in the cache folder and are only
+    created once per phase.
+    """
+    table = comm.project.get_travel_time_table(phase="ttp")
+    assert table.phase == "ttp"
+    assert table.filename == os.path.join(comm.project.paths["cache"],
+                                          "travel_times_ak135_ttp.npz")
+    assert comm.project.get_travel_time_table(phase="ttp") is table
+    assert comm.project.get_travel_time_table(phase="P") is not table
@@ -118,6 +118,46 @@ def test_get_coordinates_for_station(comm):
                        "elevation_in_m": 170.0, "longitude": 28.126}
 
 
+def test_station_coordinates_are_memoized(comm):
+    """
+    The station coordinates of an event are only resolved again once one
+    of the underlying databases changed.
+    """
+    event = "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11"
+    stations = comm.query.get_all_stations_for_event(event)
+
+    with mock.patch("lasif.components.stations.StationsComponent"
+                    ".get_all_channels_at_time") as p:
+        assert comm.query.get_all_stations_for_event(event) == stations
+        for station in sorted(stations.keys()):
+            assert comm.query.get_coordinates_for_station(
+                event, station) == stations[station]
+        assert p.call_count == 0
+
+        # Returned dictionaries can be modified.
+        comm.query.get_all_stations_for_event(event).clear()
+        assert comm.query.get_all_stations_for_event(event) == stations
+        # Also the coordinates of the single stations.
+        for key, value in comm.query.get_all_stations_for_event(
+                event).items():
+            value["station_name"] = key
+        comm.query.get_coordinates_for_station(
+            event, "HL.ARG")["latitude"] = 0.0
+        assert comm.query.get_all_stations_for_event(event) == stations
+        assert comm.query.get_coordinates_for_station(
+            event, "HL.ARG") == stations["HL.ARG"]
+
+    # Changing the inventory database invalidates the results.
+    comm.inventory_db.save_station_coordinates("XX.YY", 1.0, 2.0, 3.0, 4.0)
+    os.utime(comm.inventory_db.db_file, (1E9, 1E9))
+    get_all_channels_at_time = comm.stations.get_all_channels_at_time
+    with mock.patch("lasif.components.stations.StationsComponent"
+                    ".get_all_channels_at_time") as p:
+        p.side_effect = get_all_channels_at_time
+        assert comm.query.get_all_stations_for_event(event) == stations
+        assert p.call_count == 1
+
+
 def test_get_debug_information_for_file(comm):
     """
     Test the what_is() method.
@@ -4,6 +4,7 @@
 
 import inspect
 import mock
+import numpy as np
 import os
 import pytest
 import shutil
@@ -91,6 +92,51 @@ def test_reading_synthetics(comm):
     assert st[2].stats.starttime == origin_time
 
 
+def test_materialized_synthetics(comm):
+    """
+    Tests the optional materialized cache of the final synthetics.
+    """
+    comm.iterations.create_new_iteration(
+        "1", "ses3d_4_1", comm.query.get_stations_for_all_events(), 8, 100)
+    event_name = "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11"
+    cache_folder = os.path.join(comm.project.paths["cache"], "synthetics",
+                                event_name, "ITERATION_1")
+    comm.project.domain.rotation_angle_in_degree = 90.0
+    expected = comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+    # Off by default.
+    assert not os.path.exists(cache_folder)
+
+    comm.project.config["misc_settings"]["materialize_synthetics"] = True
+    st = comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+    assert sorted(os.listdir(cache_folder)) == ["HL.ARG.json", "HL.ARG.npy"]
+
+    # Read from the cache without rotating again.
+    with mock.patch("lasif.rotations.rotate_data") as patch:
+        st = comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+        assert patch.call_count == 0
+    assert [tr.id for tr in st] == [tr.id for tr in expected]
+    for tr, expected_tr in zip(st, expected):
+        assert isinstance(tr.data, np.memmap)
+        assert tr.stats == expected_tr.stats
+        np.testing.assert_allclose(tr.data, expected_tr.data)
+
+    # Changing the domain or the process_synthetics function invalidates
+    # the cache.
+    comm.project.domain.rotation_angle_in_degree = 45.0
+    with mock.patch("lasif.rotations.rotate_data") as patch:
+        patch.return_value = [tr.data for tr in st]
+        comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+        assert patch.call_count == 1
+    comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+    with open(os.path.join(comm.project.paths["functions"],
+                           "process_synthetics.py"), "at") as fh:
+        fh.write("\n")
+    with mock.patch("lasif.rotations.rotate_data") as patch:
+        patch.return_value = [tr.data for tr in st]
+        comm.waveforms.get_waveforms_synthetic(event_name, "HL.ARG", 1)
+        assert patch.call_count == 1
+
+
 def test_waveform_cache_usage(comm):
     """
     Tests the automatic creation and usage of the waveform caches.
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the test suites.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import pytest
+
+
+def pytest_collection_modifyitems(items):
+    # The rotations of the synthetic project use numpy matrices.
+    for item in items:
+        if "synthetic_comm" in getattr(item, "fixturenames", ()):
+            item.add_marker(pytest.mark.filterwarnings(
+                "ignore::PendingDeprecationWarning"))
+
+
+@pytest.fixture()
+def synthetic_comm(tmpdir, request):
+    """
+    Communicator of a small synthetic project with one event, four stations
+    with one component each, and one iteration. Other sizes can be
+    requested with the keyword arguments of
+    :func:`~lasif.benchmarks.synthetic_project.create_synthetic_project`
+    by indirectly parametrizing the fixture.
+    """
+    from lasif.benchmarks.synthetic_project import create_synthetic_project
+
+    kwargs = {"event_count": 1, "station_count": 4, "component_count": 1,
+              "npts": 500, "dt": 1.0, "sampling_rate": 2.0}
+    kwargs.update(getattr(request, "param", {}))
+
+    return create_synthetic_project(os.path.join(str(tmpdir), "project"),
+                                    **kwargs)
@@ -17,6 +17,7 @@ import obspy
 from scipy.io import loadmat
 
 from lasif.adjoint_sources import utils, time_frequency, ad_src_tf_phase_misfit
+from lasif.adjoint_sources import writers
 
 from .testing_helpers import images_are_identical, reset_matplotlib
 
@@ -112,6 +113,115 @@ def test_time_frequency_transform():
     np.testing.assert_allclose(np.angle(tfs), np.angle(tfs_matlab))
 
 
+def test_chunked_time_frequency_functions():
+    """
+    The time frequency functions process the windows in chunks. The chunk
+    size must not change the results.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    _, u0 = utils.get_dispersed_wavetrain(
+        dt=2.0, a=3.91, b=0.87, c=0.8, body_wave_factor=0.015,
+        body_wave_freq_scale=1.0 / 2.2)
+
+    _, _, tfs = time_frequency.time_frequency_transform(
+        t=t, s=u, width=10.0)
+    _, _, tfs_chunked = time_frequency.time_frequency_transform(
+        t=t, s=u, width=10.0, chunk_size=17)
+    np.testing.assert_allclose(tfs_chunked, tfs)
+
+    _, _, tf_cc = time_frequency.time_frequency_cc_difference(
+        t, u, u0, width=10.0)
+    _, _, tf_cc_chunked = time_frequency.time_frequency_cc_difference(
+        t, u, u0, width=10.0, chunk_size=17)
+    np.testing.assert_allclose(tf_cc_chunked, tf_cc)
+
+    # Compare a single window with the explicit cross correlation.
+    k = 250
+    w = utils.gaussian_window(t - t[k], 10.0)
+    cc = utils.cross_correlation(w * u0, w * u)
+    cc_spec = np.fft.fft(cc)
+    cc_freqs = np.fft.fftfreq(len(cc), d=t[1] - t[0])
+    freqs = np.fft.fftfreq(len(t), d=t[1] - t[0])
+    order = np.argsort(cc_freqs)
+    expected = np.interp(freqs, cc_freqs[order], cc_spec.real[order]) + \
+        1j * np.interp(freqs, cc_freqs[order], cc_spec.imag[order])
+    expected *= (t[1] - t[0]) / np.sqrt(2.0 * np.pi)
+    np.testing.assert_allclose(tf_cc[k], expected,
+                               atol=1E-10 * np.abs(expected).max())
+
+    s, _, _ = time_frequency.itfa(t, tfs, width=10.0)
+    s_chunked, _, _ = time_frequency.itfa(t, tfs, width=10.0, chunk_size=17)
+    np.testing.assert_allclose(s_chunked, s)
+
+
+def test_sparse_time_frequency_representation():
+    """
+    Sparse representations only store the rows above the threshold and the
+    frequencies up to the maximum frequency. They otherwise agree with the
+    dense ones.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    _, u0 = utils.get_dispersed_wavetrain(
+        dt=2.0, a=3.91, b=0.87, c=0.8, body_wave_factor=0.015,
+        body_wave_freq_scale=1.0 / 2.2)
+    max_frequency = 0.05
+
+    for dense, sparse in [
+            (time_frequency.time_frequency_transform(
+                t, u, width=10.0, max_frequency=max_frequency),
+             time_frequency.time_frequency_transform(
+                 t, u, width=10.0, max_frequency=max_frequency,
+                 sparse=True)),
+            (time_frequency.time_frequency_cc_difference(
+                t, u, u0, width=10.0, max_frequency=max_frequency),
+             time_frequency.time_frequency_cc_difference(
+                 t, u, u0, width=10.0, max_frequency=max_frequency,
+                 sparse=True))]:
+        _, _, tfs = dense
+        _, _, tfs_sparse = sparse
+        assert isinstance(tfs_sparse,
+                          time_frequency.SparseTimeFrequencyRepresentation)
+        assert tfs_sparse.shape == tfs.shape
+        freqs = np.arange(len(t)) / (len(t) * (t[1] - t[0]))
+        assert tfs_sparse.column_count == np.sum(freqs <= max_frequency)
+        assert len(tfs_sparse.rows) < len(t)
+        assert tfs_sparse.data.nbytes < tfs.nbytes / 10
+        assert not np.abs(tfs[:, tfs_sparse.column_count:]).any()
+        np.testing.assert_allclose(tfs_sparse.toarray(), tfs)
+
+        s, _, I_dense = time_frequency.itfa(t, tfs, width=10.0)
+        s_sparse, _, I_sparse = time_frequency.itfa(t, tfs_sparse,
+                                                    width=10.0)
+        np.testing.assert_allclose(s_sparse, s,
+                                   atol=1E-10 * np.abs(s).max())
+        np.testing.assert_allclose(I_sparse.toarray(), I_dense,
+                                   atol=1E-10 * np.abs(I_dense).max())
+
+
+def test_inverse_time_frequency_transform_of_empty_signals():
+    """
+    Signals without any rows to transform give zero signals and keep the
+    type of the time frequency representation.
+    """
+    t = np.arange(64) * 2.0
+    _, _, tfs = time_frequency.time_frequency_transform(
+        t, np.zeros(64), width=10.0)
+    s, tau, I = time_frequency.itfa(t, tfs, width=10.0)
+    assert isinstance(I, np.ndarray)
+    assert I.shape == (64, 64)
+    assert not I.any()
+    assert s.shape == (64,)
+    assert not s.any()
+    np.testing.assert_equal(tau, t)
+
+    empty = time_frequency.SparseTimeFrequencyRepresentation(
+        rows=[], data=np.zeros((0, 64), dtype="complex128"), shape=(64, 64))
+    s, _, I = time_frequency.itfa(t, empty, width=10.0)
+    assert isinstance(I, time_frequency.SparseTimeFrequencyRepresentation)
+    assert len(I.rows) == 0
+    assert not s.any()
+
+
 def test_adjoint_time_frequency_phase_misfit_source_plot(tmpdir):
     """
     Tests the plot for a time-frequency misfit adjoint source.
@@ -150,3 +260,43 @@ def test_time_frequency_adjoint_source():
         desired=adj_src_baseline,
         atol=1E-5 * abs(adj_src_baseline).max(),
         rtol=1E-5)
+
+
+def test_adjoint_source_writers(tmpdir):
+    """
+    The vectorized writers produce the same files as formatting every line
+    on its own.
+    """
+    np.random.seed(12345)
+    channels = {"Z": np.random.randn(100), "N": np.random.randn(100),
+                "E": np.random.randn(100)}
+    tmpdir = str(tmpdir)
+
+    # SPECFEM: the time reversed negative adjoint source with times.
+    filename = os.path.join(tmpdir, "specfem.adj")
+    size = writers.write_specfem_adjoint_source(filename, channels["Z"],
+                                                0.5, time_shift=-2.0)
+    expected = np.empty((100, 2))
+    expected[:, 0] = np.linspace(0, 99 * 0.5, 100) - 2.0
+    expected[:, 1] = -1.0 * channels["Z"][::-1]
+    np.savetxt(os.path.join(tmpdir, "expected.adj"), expected)
+    with open(filename, "rt") as fh:
+        contents = fh.read()
+    with open(os.path.join(tmpdir, "expected.adj"), "rt") as fh:
+        assert contents == fh.read()
+    assert size == len(contents)
+
+    # SES3D: Negative north component first.
+    size = writers.write_adjoint_sources_for_station(
+        "ses3d", tmpdir, "XX.TEST", channels, filename="ad_src_1",
+        coordinates=(10.0, 20.0, 0.0))
+    with open(os.path.join(tmpdir, "ad_src_1"), "rt") as fh:
+        lines = fh.read().splitlines()
+    assert size == os.path.getsize(os.path.join(tmpdir, "ad_src_1"))
+    assert lines[2] == "10.000000 20.000000 0.000000"
+    assert len(lines) == 105
+    assert lines[-1] == ""
+    assert lines[4] == "%e %e %e" % (-channels["N"][0], channels["E"][0],
+                                     channels["Z"][0])
+    assert lines[-2] == "%e %e %e" % (-channels["N"][-1], channels["E"][-1],
+                                      channels["Z"][-1])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the consolidated adjoint source storage.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import multiprocessing
+import os
+
+import numpy as np
+from obspy import UTCDateTime
+
+from lasif.adjoint_src_manager import AdjointSourceStore, \
+    AdjointSourceManager
+
+
+def _get_key(index):
+    return ("XX.S%03i..BHZ" % index, UTCDateTime(2012, 1, 1) + index,
+            UTCDateTime(2012, 1, 1, 0, 1) + index, "cosine", 0.05, "L2Norm")
+
+
+def _write(args):
+    directory, index = args
+    AdjointSourceStore(directory).put(*_get_key(index), adjoint_source={
+        "adjoint_source": np.arange(index + 1, dtype=np.float64),
+        "misfit_value": float(index),
+        "details": {"index": index}})
+
+
+def test_adjoint_source_store(tmpdir):
+    """
+    Adjoint sources are stored, replaced, and deleted per window.
+    """
+    store = AdjointSourceStore(str(tmpdir))
+    assert len(store) == 0
+    assert store.get(*_get_key(0)) is None
+
+    _write((str(tmpdir), 3))
+    _write((str(tmpdir), 1))
+    adsrc = store.get(*_get_key(3))
+    np.testing.assert_equal(adsrc["adjoint_source"], np.arange(4.0))
+    assert adsrc["misfit_value"] == 3.0
+    assert adsrc["details"] == {"index": 3}
+
+    # Differing in any part of the key is a different adjoint source.
+    key = list(_get_key(3))
+    key[4] = 0.1
+    assert store.get(*key) is None
+
+    # Replace one.
+    store.put(*_get_key(3), adjoint_source={
+        "adjoint_source": np.ones(2), "misfit_value": 2.0, "details": {}})
+    assert len(store) == 2
+    np.testing.assert_equal(store.get(*_get_key(3))["adjoint_source"],
+                            np.ones(2))
+    np.testing.assert_equal(store.get(*_get_key(1))["adjoint_source"],
+                            np.arange(2.0))
+
+    store.delete(*_get_key(3))
+    assert store.get(*_get_key(3)) is None
+    assert len(store) == 1
+
+    # Compacting reclaims the samples of the replaced and deleted ones.
+    assert os.path.getsize(store.data_filename) == 8 * 8
+    other_store = AdjointSourceStore(str(tmpdir))
+    np.testing.assert_equal(other_store.get(*_get_key(1))["adjoint_source"],
+                            np.arange(2.0))
+    assert store.vacuum() == 6
+    assert os.path.getsize(store.data_filename) == 2 * 8
+    assert store.vacuum() == 0
+    np.testing.assert_equal(store.get(*_get_key(1))["adjoint_source"],
+                            np.arange(2.0))
+    # Stores of other processes map the new file.
+    np.testing.assert_equal(other_store.get(*_get_key(1))["adjoint_source"],
+                            np.arange(2.0))
+    assert sorted(os.listdir(str(tmpdir))) == ["adjoint_sources.bin",
+                                               "adjoint_sources.sqlite"]
+
+    # Still readable after reopening.
+    np.testing.assert_equal(
+        AdjointSourceStore(str(tmpdir)).get(*_get_key(1))["adjoint_source"],
+        np.arange(2.0))
+
+    # The adjoint source manager uses the same storage.
+    manager = AdjointSourceManager(str(tmpdir))
+    manager.write_adjoint_src(np.arange(5), *_get_key(7)[:3])
+    np.testing.assert_equal(manager.get_adjoint_src(*_get_key(7)[:3]),
+                            np.arange(5.0))
+    assert manager.get_adjoint_src(*_get_key(8)[:3]) is None
+    assert sorted(os.listdir(str(tmpdir))) == ["adjoint_sources.bin",
+                                               "adjoint_sources.sqlite"]
+
+
+def test_adjoint_source_store_concurrent_writes(tmpdir):
+    """
+    Many processes can append to the same store at once.
+    """
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(_write, [(str(tmpdir), _i) for _i in range(40)])
+    finally:
+        pool.close()
+        pool.join()
+
+    store = AdjointSourceStore(str(tmpdir))
+    assert len(store) == 40
+    for _i in range(40):
+        adsrc = store.get(*_get_key(_i))
+        np.testing.assert_equal(adsrc["adjoint_source"],
+                                np.arange(_i + 1.0))
+        assert adsrc["misfit_value"] == float(_i)
+    assert os.path.getsize(store.data_filename) == \
+        sum(_i + 1 for _i in range(40)) * 8
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the processing of many traces at once.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import obspy
+import pytest
+from scipy import signal
+import warnings
+
+from lasif.tools import batch_processing
+
+
+def test_batch_processing_equals_processing_single_traces():
+    """
+    Processing a 2-D array gives the same results as processing every
+    trace on its own with ObsPy.
+    """
+    np.random.seed(12345)
+    traces = [obspy.Trace(data=np.random.randn(4000).cumsum(),
+                          header={"sampling_rate": 20.0,
+                                  "starttime": obspy.UTCDateTime(2012, 1, 1) +
+                                  _i * 0.0123})
+              for _i in range(3)]
+    data = np.array([_i.data for _i in traces])
+
+    # Decimation from 20 Hz to 2.5 Hz happens in a single step.
+    batch_processing.design_decimation_filter.cache_clear()
+    data, sampling_rate = batch_processing.decimate(data, 20.0, 0.4)
+    assert sampling_rate == 2.5
+    assert batch_processing.design_decimation_filter.cache_info().misses == 1
+    b, a = batch_processing.design_decimation_filter(20.0, 1.25)
+    for tr in traces:
+        tr.data = signal.filtfilt(b, a, tr.data)
+        tr.decimate(8, no_filter=True)
+    np.testing.assert_allclose(data, [_i.data for _i in traces])
+
+    batch_processing.detrend_and_taper(data, sampling_rate, 0.05, "cosine")
+    data = batch_processing.bandpass(data, sampling_rate, 0.01, 0.1,
+                                     corners=3)
+    for tr in traces:
+        tr.detrend("linear")
+        tr.detrend("demean")
+        tr.taper(0.05, type="cosine")
+        tr.filter("bandpass", freqmin=0.01, freqmax=0.1, corners=3,
+                  zerophase=False)
+    np.testing.assert_allclose(data, [_i.data for _i in traces],
+                               atol=1E-10 * np.abs(data).max())
+
+    starttime = obspy.UTCDateTime(2012, 1, 1, 0, 0, 30)
+    data = batch_processing.lanczos_resample(
+        data, [_i.stats.starttime.timestamp for _i in traces], 0.4,
+        starttime.timestamp, 0.75, 200)
+    for tr in traces:
+        tr.interpolate(sampling_rate=1.0 / 0.75, method="lanczos",
+                       starttime=starttime, window="blackman", a=12,
+                       npts=200)
+    np.testing.assert_allclose(data, [_i.data for _i in traces],
+                               atol=1E-10 * np.abs(data).max())
+
+
+def test_bandpass_above_nyquist_applies_highpass():
+    """
+    Like ObsPy, a bandpass with the high corner frequency at or above the
+    Nyquist frequency, e.g. a lowpass period of the iteration shorter than
+    twice the sampling interval, is applied as a highpass with a warning.
+    """
+    np.random.seed(12345)
+    traces = [obspy.Trace(data=np.random.randn(1000).cumsum(),
+                          header={"sampling_rate": 2.0}) for _ in range(2)]
+
+    for freqmax in (1.0, 1.5):
+        data = np.array([_i.data for _i in traces])
+        # Warns every time even though the filter is cached.
+        for _ in range(2):
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter("always")
+                filtered = batch_processing.bandpass(data, 2.0, 0.01,
+                                                     freqmax, corners=3)
+            assert len(w) == 1
+            assert "Applying a high-pass instead" in str(w[0].message)
+
+        expected = []
+        for tr in traces:
+            tr = tr.copy()
+            with warnings.catch_warnings(record=True):
+                warnings.simplefilter("always")
+                tr.filter("bandpass", freqmin=0.01, freqmax=freqmax,
+                          corners=3, zerophase=False)
+            expected.append(tr.data)
+        np.testing.assert_allclose(filtered, expected,
+                                   atol=1E-10 * np.abs(filtered).max())
+
+    with pytest.raises(ValueError):
+        batch_processing.bandpass(data, 2.0, 1.5, 3.0)
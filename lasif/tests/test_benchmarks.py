@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the benchmarks and the synthetic projects.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import pytest
+
+from lasif.benchmarks import runner
+from lasif.benchmarks.synthetic_project import create_synthetic_project
+
+
+@pytest.mark.parametrize("synthetic_comm", [{
+    "event_count": 2, "station_count": 3, "component_count": 2,
+    "iteration_count": 2}], indirect=True)
+def test_synthetic_project(synthetic_comm):
+    """
+    The synthetic project contains all events, stations, iterations, and
+    waveforms inside the domain.
+    """
+    comm = synthetic_comm
+
+    assert comm.events.count() == 2
+    assert comm.stations.file_count == 3
+    assert comm.iterations.list() == ["1", "2"]
+    domain = comm.project.domain
+    for event in comm.events.list():
+        ev = comm.events.get(event)
+        assert domain.point_in_domain(ev["longitude"], ev["latitude"])
+        stations = comm.query.get_all_stations_for_event(event)
+        assert len(stations) == 3
+        for station in stations.values():
+            assert domain.point_in_domain(station["longitude"],
+                                          station["latitude"])
+        count = comm.project.get_filecounts_for_event(event)
+        assert count["raw_waveform_file_count"] == 6
+        assert count["synthetic_waveform_file_count"] == 12
+
+    it = comm.iterations.get("1")
+    assert it.get_process_params()["npts"] == 500
+    assert sorted(it.events[comm.events.list()[0]]["stations"]) == \
+        sorted(stations.keys())
+    st = comm.waveforms.get_waveforms_synthetic(
+        comm.events.list()[0], sorted(stations.keys())[0], it.long_name)
+    assert sorted(tr.stats.channel for tr in st) == ["MXN", "MXZ"]
+    assert st[0].stats.npts == 500
+
+    with pytest.raises(ValueError):
+        create_synthetic_project(comm.project.paths["root"])
+
+
+def test_run_and_compare_benchmarks(tmpdir):
+    """
+    Failing benchmarks are recorded and not raised and the comparison flags
+    slower benchmarks.
+    """
+    work_dir = str(tmpdir)
+    results = runner.run_benchmarks(
+        ["1x2x1x1"], work_dir,
+        benchmarks=["build_all_caches", "adjoint_source_L2Norm",
+                    "adjoint_source_TimeFrequencyPhaseMisfitFichtner2008"],
+        repeat=2, verbose=False)
+    assert os.path.exists(os.path.join(work_dir, "project_1x2x1x1"))
+    assert results["format_version"] == runner.FORMAT_VERSION
+    assert len(results["results"]) == 3
+    for result in results["results"]:
+        assert result["project_size"] == "1x2x1x1"
+        assert result["error"] is None
+        assert len(result["times"]) == 2
+        assert result["best"] == min(result["times"])
+    # 2 station files and 2 raw data files.
+    assert results["results"][0]["item_count"] == 4
+    # One adjoint source per raw data file.
+    assert results["results"][1]["item_count"] == 2
+    assert results["results"][2]["item_count"] == 2
+    assert "adjoint_source_CCTimeShift" not in runner.BENCHMARKS
+
+    # Errors are stored.
+    runner.BENCHMARKS["failing"] = (lambda x: 1 / 0, lambda x: x)
+    try:
+        result = runner.run_benchmark("failing", work_dir, repeat=2)
+    finally:
+        del runner.BENCHMARKS["failing"]
+    assert result["error"] == "ZeroDivisionError: division by zero"
+    assert result["best"] is None
+
+    # As are benchmarks not producing anything.
+    runner.BENCHMARKS["empty"] = (lambda x: 0, lambda x: x)
+    try:
+        result = runner.run_benchmark("empty", work_dir, repeat=2)
+    finally:
+        del runner.BENCHMARKS["empty"]
+    assert result["error"] == "Nothing has been produced."
+    assert len(result["times"]) == 1
+    assert result["best"] is None
+
+    slower = {"results": [dict(_i, best=_i["best"] * 2.0)
+                          for _i in results["results"]]}
+    comparison = runner.compare_results(results, slower)
+    assert [_i[-1] for _i in comparison] == [True, True, True]
+    assert [_i[-1] for _i in runner.compare_results(slower, results)] == \
+        [False, False, False]
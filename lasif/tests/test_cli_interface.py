@@ -26,8 +26,10 @@ from lasif.scripts import lasif_cli
 import lasif
 import shutil
 import os
+import pytest
 import re
 import mock
+import sys
 import numpy as np
 import matplotlib as mpl
 mpl.use("agg")
@@ -491,9 +493,57 @@ def test_calculate_all_adjoint_sources(cli):
                       "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11")
     assert out.stderr == ""
     p.assert_called_once_with(
-        "1", "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11")
+        "1", "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11", backend=None,
+        processes=None)
     assert p.call_count == 1
 
+    # Either an event or all events.
+    with mock.patch("lasif.components.actions.ActionsComponent"
+                    ".calculate_all_adjoint_sources") as p:
+        out = cli.run("lasif calculate_all_adjoint_sources 1")
+    assert "--all-events" in out.stderr
+    assert p.call_count == 0
+
+
+@pytest.mark.parametrize("synthetic_comm", [{
+    "event_count": 2, "station_count": 2}], indirect=True)
+def test_calculate_all_adjoint_sources_for_all_events(synthetic_comm,
+                                                      monkeypatch):
+    """
+    The adjoint sources of all events are the same as when calculating them
+    station by station.
+    """
+    from lasif.tests.testing_helpers import \
+        add_windows_to_synthetic_project, \
+        fake_processed_data_of_synthetic_project, pop_adjoint_sources
+
+    comm = synthetic_comm
+    it = comm.iterations.get(comm.iterations.list()[0])
+    fake_processed_data_of_synthetic_project(comm, it)
+    windows = add_windows_to_synthetic_project(comm, it)
+    for (event_name, station), station_windows in windows.items():
+        comm.adjoint_sources.calculate_adjoint_sources_for_station(
+            event_name, it.name, station, station_windows)
+    expected = pop_adjoint_sources(comm, it, windows)
+    assert len(expected) == 4
+
+    monkeypatch.chdir(comm.project.paths["root"])
+    for backend in ("serial", "process_pool"):
+        monkeypatch.setattr(sys, "argv", [
+            "lasif", "calculate_all_adjoint_sources", it.name,
+            "--all-events", "--parallel_backend", backend,
+            "--processes", "2"])
+        try:
+            lasif_cli.main()
+        except SystemExit:
+            pass
+
+        actual = pop_adjoint_sources(comm, it, windows)
+        assert sorted(actual.keys()) == sorted(expected.keys())
+        for key, (samples, misfit_value) in expected.items():
+            np.testing.assert_allclose(actual[key][0], samples)
+            assert actual[key][1] == misfit_value
+
 
 def test_finalize_adjoint_sources(cli):
     """
@@ -505,7 +555,8 @@ def test_finalize_adjoint_sources(cli):
                       "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11")
     assert out.stderr == ""
     p.assert_called_once_with(
-        "1", "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11")
+        "1", "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14-11", backend=None,
+        processes=None)
     assert p.call_count == 1
 
 
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the generic file info cache.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import glob
+import os
+import warnings
+
+import pytest
+
+from lasif import LASIFWarning
+from lasif.tools.cache_helpers import file_info_cache
+from lasif.tools.cache_helpers.file_info_cache import FileInfoCache
+
+
+class TextFileCache(FileInfoCache):
+    """
+    Indexes the lines of text files. Files containing "fail" cannot be
+    indexed.
+    """
+    def __init__(self, cache_db_file, root_folder, read_only=False,
+                 processes=None):
+        self.index_values = [
+            ("line", "TEXT"),
+            ("number", "INTEGER")]
+        self.filetypes = ["text"]
+        super(TextFileCache, self).__init__(
+            cache_db_file=cache_db_file, root_folder=root_folder,
+            read_only=read_only, pretty_name="Text Cache",
+            show_progress=False, processes=processes)
+
+    def _find_files_text(self):
+        return glob.glob(os.path.join(self.root_folder, "*.txt"))
+
+    @staticmethod
+    def _extract_index_values_text(filename):
+        with open(filename, "rt") as fh:
+            lines = fh.read().splitlines()
+        if "fail" in lines:
+            raise ValueError("Invalid file")
+        return [[line, _i] for _i, line in enumerate(lines)]
+
+
+def _write_files(folder, count, fail_every=None):
+    for _i in range(count):
+        lines = ["file_%i" % _i, "value"]
+        if fail_every and not _i % fail_every:
+            lines.append("fail")
+        with open(os.path.join(folder, "%04i.txt" % _i), "wt") as fh:
+            fh.write("\n".join(lines))
+
+
+def _get_contents(cache):
+    return sorted((os.path.basename(_i["filename"]), _i["line"],
+                   _i["number"]) for _i in cache.get_values())
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_bulk_indexing(tmpdir, monkeypatch, processes):
+    """
+    Files are indexed in batches, potentially in parallel.
+    """
+    monkeypatch.setattr(file_info_cache, "PARALLEL_INDEXING_THRESHOLD", 10)
+    monkeypatch.setattr(file_info_cache, "INDEXING_BATCH_SIZE", 7)
+
+    data_folder = os.path.join(str(tmpdir), "data")
+    os.makedirs(data_folder)
+    cache_file = os.path.join(str(tmpdir), "cache.sqlite")
+
+    _write_files(data_folder, 50, fail_every=10)
+
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        cache = TextFileCache(cache_file, data_folder, processes=processes)
+    messages = sorted(str(_i.message) for _i in w
+                      if _i.category is LASIFWarning)
+    assert len(messages) == 5
+    assert all("Invalid file" in _i for _i in messages)
+
+    assert cache.file_count == 45
+    assert cache.index_count == 90
+    contents = _get_contents(cache)
+    assert contents[0] == ("0001.txt", "file_1", 0)
+    assert contents[1] == ("0001.txt", "value", 1)
+    assert cache.get_details(os.path.join(data_folder, "0013.txt")) == [
+        {"line": "file_13", "number": 0,
+         "filename": os.path.join(data_folder, "0013.txt")},
+        {"line": "value", "number": 1,
+         "filename": os.path.join(data_folder, "0013.txt")}]
+
+    # Modify, break, and delete some files.
+    with open(os.path.join(data_folder, "0001.txt"), "wt") as fh:
+        fh.write("changed")
+    with open(os.path.join(data_folder, "0002.txt"), "wt") as fh:
+        fh.write("fail")
+    os.remove(os.path.join(data_folder, "0003.txt"))
+    for filename in ["0001.txt", "0002.txt"]:
+        os.utime(os.path.join(data_folder, filename), (1E9, 1E9))
+
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter("always")
+        cache = TextFileCache(cache_file, data_folder, processes=processes)
+    assert cache.file_count == 43
+    assert cache.index_count == 85
+    assert cache.get_details(os.path.join(data_folder, "0001.txt")) == [
+        {"line": "changed", "number": 0,
+         "filename": os.path.join(data_folder, "0001.txt")}]
+    assert cache.get_details(os.path.join(data_folder, "0002.txt")) == []
+
+
+def test_update_only_hashes_changed_files(tmpdir, monkeypatch):
+    """
+    Unchanged files are detected by their size and modification time.
+    Files with a new modification time are hashed only once.
+    """
+    data_folder = os.path.join(str(tmpdir), "data")
+    os.makedirs(data_folder)
+    cache_file = os.path.join(str(tmpdir), "cache.sqlite")
+    _write_files(data_folder, 20)
+
+    hashed_files = []
+    get_crc32 = file_info_cache.get_crc32
+
+    def counting_get_crc32(filename):
+        hashed_files.append(os.path.basename(filename))
+        return get_crc32(filename)
+
+    monkeypatch.setattr(file_info_cache, "get_crc32", counting_get_crc32)
+
+    cache = TextFileCache(cache_file, data_folder)
+    assert len(hashed_files) == 20
+    contents = _get_contents(cache)
+
+    # Nothing changed.
+    hashed_files[:] = []
+    cache.update()
+    assert hashed_files == []
+
+    # Only the modification time changes. Does not result in a reindexing
+    # and the new time is stored.
+    os.utime(os.path.join(data_folder, "0005.txt"), (1E9, 1E9))
+    cache.update()
+    assert hashed_files == ["0005.txt"]
+    assert _get_contents(cache) == contents
+    hashed_files[:] = []
+    cache = TextFileCache(cache_file, data_folder)
+    assert hashed_files == []
+
+    # Different size: reindexed without comparing hashes first.
+    with open(os.path.join(data_folder, "0006.txt"), "wt") as fh:
+        fh.write("longer file_6\nvalue")
+    cache.update()
+    assert hashed_files == ["0006.txt"]
+    assert ("0006.txt", "longer file_6", 0) in _get_contents(cache)
+    assert cache.file_count == 20
+
+
+def test_update_detects_modifications_within_a_float_tick(tmpdir, capsys):
+    """
+    Modification times are compared in nanoseconds so a file rewritten with
+    the same size within the resolution of float seconds is reindexed.
+    Databases of older versions with float modification times are
+    rebuilt.
+    """
+    data_folder = os.path.join(str(tmpdir), "data")
+    os.makedirs(data_folder)
+    cache_file = os.path.join(str(tmpdir), "cache.sqlite")
+    _write_files(data_folder, 2)
+    filename = os.path.join(data_folder, "0001.txt")
+
+    # Both times are the same as float seconds.
+    mtime_ns = 10 ** 18
+    assert mtime_ns / 1E9 == (mtime_ns + 1) / 1E9
+    os.utime(filename, ns=(mtime_ns, mtime_ns))
+    cache = TextFileCache(cache_file, data_folder)
+
+    with open(filename, "wt") as fh:
+        fh.write("file_x\nvalue")
+    os.utime(filename, ns=(mtime_ns + 1, mtime_ns + 1))
+    cache.update()
+    assert ("0001.txt", "file_x", 0) in _get_contents(cache)
+
+    # Old databases are rebuilt.
+    cache.db_cursor.execute(
+        "ALTER TABLE files RENAME COLUMN last_modified_ns TO last_modified;")
+    cache.db_conn.commit()
+    cache.db_conn.close()
+    capsys.readouterr()
+    cache = TextFileCache(cache_file, data_folder)
+    assert "is not valid anymore" in capsys.readouterr()[0]
+    assert cache.file_count == 2
+    assert ("0001.txt", "file_x", 0) in _get_contents(cache)
+
+
+def test_journal_skips_unchanged_folders(tmpdir, monkeypatch):
+    """
+    Folders not modified since the last update are not listed again.
+    """
+    # Trust all modification times for the test.
+    monkeypatch.setattr(file_info_cache, "JOURNAL_TIME_TOLERANCE", -1E9)
+
+    data_folder = os.path.join(str(tmpdir), "data")
+    os.makedirs(data_folder)
+    cache_file = os.path.join(str(tmpdir), "cache.sqlite")
+    _write_files(data_folder, 5)
+
+    listings = []
+
+    class JournaledTextFileCache(TextFileCache):
+        def __init__(self, *args, **kwargs):
+            self.monitored_folders = {"text": [data_folder]}
+            super(JournaledTextFileCache, self).__init__(*args, **kwargs)
+
+        def _find_files_text(self):
+            listings.append(1)
+            return super(JournaledTextFileCache, self)._find_files_text()
+
+    cache = JournaledTextFileCache(cache_file, data_folder)
+    assert len(listings) == 1
+    assert cache.file_count == 5
+
+    cache = JournaledTextFileCache(cache_file, data_folder)
+    assert len(listings) == 1
+    assert sorted(cache.files["text"]) == ["%04i.txt" % _i for _i in
+                                           range(5)]
+
+    # Adding a file modifies the folder.
+    _write_files(data_folder, 6)
+    os.utime(data_folder, (1E9, 1E9))
+    cache = JournaledTextFileCache(cache_file, data_folder)
+    assert len(listings) == 2
+    assert cache.file_count == 6
+
+    # Files modified in place are only found without the journal.
+    with open(os.path.join(data_folder, "0001.txt"), "wt") as fh:
+        fh.write("changed")
+    cache.update()
+    assert len(listings) == 2
+    assert ("0001.txt", "changed", 0) not in _get_contents(cache)
+    cache.update(use_journal=False)
+    assert len(listings) == 3
+    assert ("0001.txt", "changed", 0) in _get_contents(cache)
+
+    # Databases without a journal are still valid.
+    cache.db_cursor.execute("DROP TABLE journal;")
+    cache.db_conn.commit()
+    assert cache._validate_database() is True
@@ -10,9 +10,15 @@ Test suite for the parallel helper methods.
     (http://www.gnu.org/copyleft/lesser.html)
 """
 import os
+import pytest
+import shutil
+import subprocess
+import sys
+import textwrap
 import warnings
 
-from lasif.tools.parallel_helpers import function_info, distribute_across_ranks
+from lasif.tools.parallel_helpers import function_info, \
+    distribute_across_ranks, BatchResults, FunctionInfo, _execute_pipelined
 
 
 def test_function_info_decorator():
@@ -118,7 +124,6 @@ def test_distribute_across_ranks(tmpdir):
         yield {"a": 4, "b": 0}  # results in None, an exception,
         # and a traceback.
         yield {"a": 1, "b": 1, "c": 1}  # results in 1 and two warnings.
-        raise StopIteration
 
     logfile = os.path.join(str(tmpdir), "log.txt")
 
@@ -129,8 +134,9 @@ def test_distribute_across_ranks(tmpdir):
     assert os.path.exists(logfile)
 
     # Sort them with the expected result to be able to compare them. The order
-    # is not guaranteed when using multiple processes.
-    results.sort(key=lambda x: x.result)
+    # is not guaranteed when using multiple processes. Failed items (None)
+    # come first.
+    results.sort(key=lambda x: (x.result is not None, x.result))
 
     assert results[0].result is None
     assert results[0].func_args == {"a": 4, "b": 0, "c": 0}
@@ -153,3 +159,236 @@ def test_distribute_across_ranks(tmpdir):
     assert results[2].warnings == []
     assert results[2].exception is None
     assert results[2].traceback is None
+
+
+def test_distribute_across_ranks_scheduling(tmpdir):
+    """
+    Both scheduling strategies must give the same results. Without MPI
+    this naturally only tests the serial path.
+    """
+    items = [{"a": _i, "b": 2} for _i in range(10)]
+    for scheduling in ("dynamic", "static"):
+        logfile = os.path.join(str(tmpdir), "%s.txt" % scheduling)
+        results = distribute_across_ranks(
+            function=__random_fct, items=items, get_name=lambda x: str(x),
+            logfile=logfile, scheduling=scheduling, chunk_size=3)
+        assert sorted(_i.result for _i in results) == \
+            [_i / 2 for _i in range(10)]
+        with open(logfile, "rt") as fh:
+            assert fh.read().count("SUCCESS") == 10
+
+    with pytest.raises(ValueError):
+        distribute_across_ranks(
+            function=__random_fct, items=items, get_name=lambda x: str(x),
+            logfile=os.path.join(str(tmpdir), "log.txt"),
+            scheduling="random")
+
+
+def test_distribute_across_ranks_backends(tmpdir):
+    """
+    All backends must produce the same results and logfiles.
+    """
+    items = [{"a": _i, "b": 0 if _i == 3 else 2} for _i in range(10)]
+    for backend in ("mpi", "process_pool", "serial"):
+        logfile = os.path.join(str(tmpdir), "%s.txt" % backend)
+        results = distribute_across_ranks(
+            function=__random_fct, items=items, get_name=lambda x: str(x),
+            logfile=logfile, backend=backend, processes=2)
+        assert len(results) == 10
+        failed = [_i for _i in results if _i.exception]
+        assert len(failed) == 1
+        assert failed[0].func_args == {"a": 3, "b": 0, "c": 0}
+        assert isinstance(failed[0].exception, ZeroDivisionError)
+        assert sorted(_i.result for _i in results if not _i.exception) == \
+            [_i / 2 for _i in range(10) if _i != 3]
+        with open(logfile, "rt") as fh:
+            log = fh.read()
+        assert log.count("SUCCESS") == 9
+        assert log.count("ZeroDivisionError") == 1
+
+    with pytest.raises(ValueError):
+        distribute_across_ranks(
+            function=__random_fct, items=items, get_name=lambda x: str(x),
+            logfile=os.path.join(str(tmpdir), "log.txt"), backend="threads")
+
+
+def _read_item(item):
+    """
+    Read-ahead stage reading the divisor from a file.
+    """
+    with open(item["filename"], "rt") as fh:
+        return {"a": item["a"], "b": int(fh.read())}
+
+
+def _write_result(info):
+    """
+    Write-behind stage writing the result to a file.
+    """
+    with open("%s.result" % info.func_args["a"], "wt") as fh:
+        fh.write(str(info.result))
+    return info._replace(result="written")
+
+
+def test_distribute_across_ranks_pipelined(tmpdir, monkeypatch):
+    """
+    Items can be generated lazily and the work can be pipelined with
+    read-ahead and write-behind stages.
+    """
+    monkeypatch.chdir(str(tmpdir))
+    for _i in range(10):
+        with open("%i.in" % _i, "wt") as fh:
+            fh.write("0" if _i == 3 else "2")
+
+    generated = []
+
+    def input_generator():
+        for _i in range(11):
+            generated.append(_i)
+            yield {"a": _i, "filename": "%i.in" % _i}
+
+    for backend in ("mpi", "process_pool", "serial"):
+        generated[:] = []
+        logfile = "%s.txt" % backend
+        results = distribute_across_ranks(
+            function=__random_fct, items=input_generator(),
+            get_name=lambda x: str(x["a"]), logfile=logfile,
+            backend=backend, processes=2, read_ahead=_read_item,
+            write_behind=_write_result)
+        assert generated == list(range(11))
+        assert len(results) == 11
+        failed = sorted([_i for _i in results if _i.exception],
+                        key=lambda x: x.func_args["a"])
+        # Division by zero and a missing input file.
+        assert isinstance(failed[0].exception, ZeroDivisionError)
+        assert isinstance(failed[1].exception, IOError)
+        assert failed[1].func_args == {"a": 10, "filename": "10.in"}
+        assert [_i.result for _i in results if not _i.exception] == \
+            ["written"] * 9
+        for _i in range(10):
+            if _i == 3:
+                assert not os.path.exists("3.result")
+                continue
+            with open("%i.result" % _i, "rt") as fh:
+                assert float(fh.read()) == _i / 2
+            os.remove("%i.result" % _i)
+        with open(logfile, "rt") as fh:
+            assert fh.read().count("SUCCESS") == 9
+
+
+def _fail(data):
+    """
+    Helper function raising for every item.
+    """
+    raise ValueError("failed")
+
+
+def test_execute_pipelined_drops_read_ahead_data_of_failed_items():
+    """
+    Failed items do not keep the data returned by the read-ahead stage.
+    """
+    items = [{"data": "%i.in" % _i} for _i in range(3)]
+
+    def read_ahead(item):
+        return {"data": b"0" * 100000}
+
+    for write_behind in (None, lambda x: x._replace(result="written")):
+        results = list(_execute_pipelined(_fail, items, read_ahead,
+                                          write_behind))
+        assert [_i.func_args for _i in results] == items
+        assert all(isinstance(_i.exception, ValueError) for _i in results)
+
+
+def _divide_batch(values, b):
+    """
+    Helper function dividing a batch of values at once.
+    """
+    warnings.warn("Batch Warning")
+    results = BatchResults()
+    for a in values:
+        if a < 0:
+            results.append(FunctionInfo(
+                func_args={"a": a}, result=None, warnings=[],
+                exception=ValueError("negative"), traceback="ValueError"))
+        else:
+            results.append(FunctionInfo(
+                func_args={"a": a}, result=a / b, warnings=[],
+                exception=None, traceback=None))
+    return results
+
+
+def test_distribute_across_ranks_batches(tmpdir, capsys):
+    """
+    The items of batches are logged and counted one by one.
+    """
+    items = [{"values": [1, -1, 2], "b": 2}, {"values": [3], "b": 2}]
+    for backend in ("mpi", "process_pool", "serial"):
+        logfile = os.path.join(str(tmpdir), "%s.txt" % backend)
+        results = distribute_across_ranks(
+            function=_divide_batch, items=items,
+            get_name=lambda x: str(x.get("a", x.get("values"))),
+            logfile=logfile, backend=backend, processes=2)
+        assert sorted(_i.result for _j in results for _i in _j.result
+                      if not _i.exception) == [0.5, 1.0, 1.5]
+        out, _ = capsys.readouterr()
+        # Progress and summary count the items, not the batches.
+        assert "Finished processing 4 items." in out
+        assert "4 items have been processed." in out
+        assert "of 2 items" not in out
+        assert "1 files failed being processed." in out
+        assert "0 files raised warnings" in out
+        assert "3 files have been processed without errors" in out
+        with open(logfile, "rt") as fh:
+            log = fh.read()
+        assert log.count("Batch Warning") == 2
+        assert log.count("SUCCESS") == 3
+        assert "Item: -1\nValueError" in log
+
+
+# Script making consecutive calls under MPI. Each call must only return the
+# results of its own items.
+_CONSECUTIVE_CALLS_SCRIPT = textwrap.dedent("""
+    import os
+    import sys
+
+    from mpi4py import MPI
+
+    from lasif.tools.parallel_helpers import distribute_across_ranks
+
+
+    def tag(call, index):
+        return (call, index)
+
+
+    logfile = os.path.join(sys.argv[1], "log_%i.txt" % MPI.COMM_WORLD.rank)
+    for call in range(4):
+        items = [{"call": call, "index": _i} for _i in range(23)]
+        results = distribute_across_ranks(
+            function=tag, items=items, get_name=lambda x: str(x),
+            logfile=logfile, chunk_size=1)
+        if MPI.COMM_WORLD.rank == 0:
+            assert sorted(_i.result for _i in results) == \\
+                [(call, _i) for _i in range(23)], results
+            print("Call %i: %i results" % (call, len(results)))
+""")
+
+
+@pytest.mark.skipif(not shutil.which("mpirun"),
+                    reason="mpirun is not available")
+def test_distribute_across_ranks_consecutive_calls_with_mpi(tmpdir):
+    """
+    Consecutive calls with the dynamic scheduling under MPI each return
+    exactly their own items.
+    """
+    script = os.path.join(str(tmpdir), "script.py")
+    with open(script, "wt") as fh:
+        fh.write(_CONSECUTIVE_CALLS_SCRIPT)
+    # Open MPI otherwise refuses to start more ranks than cores or to run
+    # as root, e.g. in containers. Other MPI implementations ignore these.
+    env = dict(os.environ, OMPI_MCA_rmaps_base_oversubscribe="1",
+               OMPI_ALLOW_RUN_AS_ROOT="1",
+               OMPI_ALLOW_RUN_AS_ROOT_CONFIRM="1")
+    output = subprocess.check_output(
+        ["mpirun", "-n", "3", sys.executable, script, str(tmpdir)],
+        stderr=subprocess.STDOUT, env=env).decode()
+    for call in range(4):
+        assert "Call %i: 23 results" % call in output
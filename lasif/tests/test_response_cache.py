@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the caches of the instrument correction.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import inspect
+import os
+import shutil
+
+import numpy as np
+import obspy
+
+from lasif.tools import response_cache
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(
+    inspect.currentframe()))), "data")
+
+
+def test_cached_response_removal(tmpdir, monkeypatch):
+    """
+    The cached instrument correction is identical to the one of ObsPy and
+    the response spectra are reused from disk by other processes.
+    """
+    folder = os.path.join(str(tmpdir), "StationXML")
+    os.makedirs(folder)
+    filename = os.path.join(folder, "IU.ANMO.xml")
+    shutil.copy(os.path.join(
+        data_dir, "station_files", "stationxml",
+        "IRIS_single_channel_with_response.xml"), filename)
+    cache_folder = os.path.join(str(tmpdir), "response_spectra")
+    pre_filt = (0.005, 0.01, 0.1, 0.2)
+
+    np.random.seed(12345)
+    tr = obspy.Trace(data=np.random.randn(1013), header={
+        "network": "IU", "station": "ANMO", "location": "10",
+        "channel": "BHZ", "delta": 0.5,
+        "starttime": obspy.UTCDateTime(2013, 1, 1)})
+
+    expected = tr.copy()
+    expected.remove_response(
+        inventory=obspy.read_inventory(filename), output="VEL",
+        pre_filt=pre_filt, zero_mean=False, taper=False)
+
+    cache = response_cache.ResponseCache(cache_folder)
+    corrected = cache.remove_response(tr.copy(), filename, pre_filt=pre_filt)
+    np.testing.assert_allclose(corrected.data, expected.data)
+    assert len(os.listdir(cache_folder)) == 1
+
+    # The parsed file and the spectrum are now kept in memory.
+    assert cache.get_station_file(filename) is \
+        cache.get_station_file(filename)
+    assert len(cache._spectra) == 1
+
+    # A new cache loads the spectrum from disk.
+    def fail(*args, **kwargs):
+        raise AssertionError("Spectrum must not be computed again.")
+
+    new_cache = response_cache.ResponseCache(cache_folder)
+    monkeypatch.setattr(new_cache, "_compute_spectrum", fail)
+    corrected = new_cache.remove_response(tr.copy(), filename,
+                                          pre_filt=pre_filt)
+    np.testing.assert_allclose(corrected.data, expected.data)
+
+    # Other processing setups result in other spectra.
+    cache.remove_response(tr.copy(), filename, pre_filt=pre_filt,
+                          water_level=None)
+    short_tr = tr.copy()
+    short_tr.data = short_tr.data[:500]
+    cache.remove_response(short_tr, filename, pre_filt=pre_filt)
+    assert len(os.listdir(cache_folder)) == 3
@@ -13,10 +13,14 @@ from glob import glob
 import inspect
 import os
 from io import StringIO
+import shutil
 
 import numpy as np
+import pytest
 
-from lasif.file_handling.ses3d_file_parser import is_SES3D, read_SES3D
+from lasif.file_handling.ses3d_file_parser import is_SES3D, read_SES3D, \
+    read_SES3D_header, read_waveform_file, convert_folder_to_binary, \
+    get_binary_sidecar_filename
 
 
 # Most generic way to get the actual data directory.
@@ -124,7 +128,7 @@ def test_readingSES3DFileFromStringIO():
     Same as test_readingSES3DFile() but with the data given as a StringIO.
     """
     filename = os.path.join(data_dir, "File_phi")
-    with open(filename, "rb") as open_file:
+    with open(filename, "r") as open_file:
         file_object = StringIO(open_file.read())
     st = read_SES3D(file_object)
     file_object.close()
@@ -212,3 +216,103 @@ def test_OtherComponentsAreNotInverted():
         3.39320707E-07, 3.44629825E-07, 3.50957549E-07, 3.57983453E-07,
         3.65361842E-07, 3.72732785E-07])
     np.testing.assert_almost_equal(tr_r.data[-10:], r_data)
+
+
+def test_reading_header_only_stops_after_the_header():
+    """
+    The header is read without touching the samples.
+    """
+    filename = os.path.join(data_dir, "File_phi")
+    with open(filename, "rb") as fh:
+        header = read_SES3D_header(fh)
+        # The first sample is next.
+        assert float(fh.readline()) == 0.0
+    assert header == read_SES3D_header(filename)
+
+    tr = read_SES3D(filename, headonly=True)[0]
+    assert header["channel"] == tr.stats.channel == "Y"
+    assert header["npts"] == tr.stats.npts == 3300
+    assert header["delta"] == tr.stats.delta
+    assert header["ses3d"] == dict(tr.stats.ses3d)
+
+
+def test_samples_are_parsed_like_python_floats(tmpdir):
+    """
+    The bulk parser returns exactly the values of Python's float() and
+    fails for samples that are not numbers.
+    """
+    filename = os.path.join(data_dir, "File_theta")
+    with open(filename, "r") as fh:
+        lines = fh.readlines()
+    np.testing.assert_array_equal(
+        read_SES3D(filename)[0].data,
+        np.array([float(_i) for _i in lines[7:]], dtype=np.float32))
+
+    broken_file = os.path.join(str(tmpdir), "broken")
+    with open(broken_file, "w") as fh:
+        fh.writelines(lines[:8] + ["   NaN-ish\n"] + lines[8:])
+    with pytest.raises(ValueError):
+        read_SES3D(broken_file)
+
+
+def test_binary_sidecars(tmpdir):
+    """
+    Converted files are read from their binary sidecars until the file
+    changes.
+    """
+    folder = str(tmpdir)
+    for name in ["File_theta", "File_phi", "File_r"]:
+        shutil.copy(os.path.join(data_dir, name), folder)
+    with open(os.path.join(folder, "other"), "w") as fh:
+        fh.write("something else\n")
+    expected = read_SES3D(os.path.join(folder, "File_phi"))
+
+    assert convert_folder_to_binary(folder) == 3
+    assert convert_folder_to_binary(folder) == 0
+    assert sorted(os.listdir(os.path.join(folder, ".binary"))) == [
+        "File_phi.bin", "File_r.bin", "File_theta.bin"]
+
+    filename = os.path.join(folder, "File_phi")
+    sidecar = get_binary_sidecar_filename(filename)
+
+    def modify_sidecar(data):
+        with open(sidecar, "rb") as fh:
+            header = fh.read(16)
+        with open(sidecar, "wb") as fh:
+            fh.write(header)
+            fh.write(data.astype("<f4").tobytes())
+
+    # Make sure the sidecar is used.
+    data = expected[0].data.copy()
+    data[0] = 1.0
+    modify_sidecar(data)
+    tr = read_waveform_file(filename)[0]
+    assert tr.stats._format == "SES3D"
+    assert tr.stats.npts == expected[0].stats.npts
+    assert tr.stats.ses3d == expected[0].stats.ses3d
+    np.testing.assert_array_equal(tr.data[1:], expected[0].data[1:])
+    assert tr.data[0] == 1.0
+
+    # Sidecars with a wrong sample count are ignored.
+    modify_sidecar(data[:-1])
+    np.testing.assert_array_equal(read_SES3D(filename)[0].data,
+                                  expected[0].data)
+    assert convert_folder_to_binary(folder) == 1
+
+    # A changed file is parsed again and converted again.
+    os.utime(filename, ns=(0, 0))
+    np.testing.assert_array_equal(read_SES3D(filename)[0].data,
+                                  expected[0].data)
+    assert convert_folder_to_binary(folder) == 1
+    np.testing.assert_array_equal(read_SES3D(filename)[0].data,
+                                  expected[0].data)
+
+    # Also if it keeps its modification time but changes its size.
+    stat = os.stat(filename)
+    with open(filename, "a") as fh:
+        fh.write("\n")
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    modify_sidecar(data)
+    np.testing.assert_array_equal(read_SES3D(filename)[0].data,
+                                  expected[0].data)
+    assert convert_folder_to_binary(folder) == 1
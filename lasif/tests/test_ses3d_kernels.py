@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the summation and smoothing of SES3D kernels.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from lasif.ses3d_models import RawSES3DModelHandler
+from lasif.tests.testing_helpers import get_ses3d_model_values, \
+    write_ses3d_model
+from lasif.tools import ses3d_kernels
+
+
+COMPONENTS = ["grad_cp_", "grad_csh_", "grad_csv_", "grad_rho_"]
+
+
+def test_box_files(tmpdir):
+    """
+    Box files are read and written as single Fortran records.
+    """
+    filename = os.path.join(str(tmpdir), "box")
+    data = np.arange(24, dtype=np.float64).reshape((2, 3, 4))
+    ses3d_kernels.write_box_file(filename, data)
+    assert os.path.getsize(filename) == 24 * 4 + 8
+    assert os.listdir(str(tmpdir)) == ["box"]
+    np.testing.assert_equal(ses3d_kernels.read_box_file(filename),
+                            data.ravel(order="F"))
+
+    with open(filename, "ab") as fh:
+        fh.write(b"1234")
+    with pytest.raises(ValueError):
+        ses3d_kernels.read_box_file(filename)
+
+
+def test_summing_and_smoothing_subdomains(tmpdir):
+    """
+    Summing and smoothing subdomain by subdomain equals doing it on the
+    whole grid.
+    """
+    folders = [os.path.join(str(tmpdir), _i)
+               for _i in ("a", "b", "sum", "smooth")]
+    for folder in folders:
+        os.makedirs(folder)
+    write_ses3d_model(folders[0], COMPONENTS)
+    write_ses3d_model(folders[1], COMPONENTS)
+    handler = RawSES3DModelHandler(folders[0], domain=None,
+                                   model_type="kernel")
+    shutil.copy(handler.boxfile, folders[2])
+    shutil.copy(handler.boxfile, folders[3])
+
+    for subdomain in range(len(handler.setup["subdomains"])):
+        ses3d_kernels.sum_kernel_subdomain(
+            subdomain, {
+                os.path.basename(info["filenames"][subdomain]):
+                [os.path.join(_i, os.path.basename(
+                    info["filenames"][subdomain])) for _i in folders[:2]]
+                for info in handler.components.values()}, folders[2])
+    summed = RawSES3DModelHandler(folders[2], domain=None,
+                                  model_type="kernel")
+    summed.parse_component("grad_csh")
+    np.testing.assert_equal(summed.parsed_components["grad_csh"],
+                            2.0 * get_ses3d_model_values(1))
+
+    for subdomain in range(len(handler.setup["subdomains"])):
+        ses3d_kernels.smooth_kernel_subdomain(
+            subdomain, folders[2], folders[3],
+            horizontal_smoothing_in_degree=1.0, vertical_smoothing_in_km=50.0)
+    smoothed = RawSES3DModelHandler(folders[3], domain=None,
+                                    model_type="kernel")
+    smoothed.parse_component("grad_csh")
+
+    expected = 2.0 * get_ses3d_model_values(1).astype(np.float64)
+    for axis, weights in enumerate(ses3d_kernels.get_smoothing_weights(
+            summed, horizontal_smoothing_in_degree=1.0,
+            vertical_smoothing_in_km=50.0)):
+        assert (weights > 0).sum() < weights.size
+        expected = np.moveaxis(np.tensordot(weights, expected,
+                                            axes=(1, axis)), 0, axis)
+    np.testing.assert_allclose(smoothed.parsed_components["grad_csh"],
+                               expected, rtol=1E-6)
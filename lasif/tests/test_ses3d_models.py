@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the raw SES3D model handler.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from lasif.ses3d_models import RawSES3DModelHandler
+from lasif.tests.testing_helpers import SES3D_LPD, \
+    get_ses3d_model_values, write_ses3d_model
+
+
+def test_lazily_reading_ses3d_models(tmpdir):
+    """
+    Depth slices and profiles are read without parsing the whole model and
+    match the parsed model.
+    """
+    folder = str(tmpdir)
+    components = ["lambda", "mu", "rhoinv", "B"]
+    write_ses3d_model(folder, components)
+
+    handler = RawSES3DModelHandler(folder, domain=None)
+    assert handler.lagrange_polynomial_degree == SES3D_LPD
+    assert sorted(handler.components.keys()) == sorted(components)
+    shape = (handler.setup["point_count_in_x"],
+             handler.setup["point_count_in_y"],
+             handler.setup["point_count_in_z"])
+    assert shape == (25, 9, 25)
+
+    # Slices through the boxes and at their boundaries.
+    for depth_index in (0, 5, 12, 24):
+        data = handler.get_depth_slice("mu", depth_index)
+        np.testing.assert_equal(
+            data, get_ses3d_model_values(1)[:, :, depth_index])
+    profile = handler.get_depth_profile("lambda", 10.0, 15.0)
+    assert len(profile["values"]) == len(profile["depths"]) == 25
+    x_index = handler.get_closest_gll_index("latitude", 10.0)
+    y_index = handler.get_closest_gll_index("longitude", 15.0)
+    np.testing.assert_equal(profile["values"],
+                            get_ses3d_model_values(0)[x_index, y_index])
+    vp_slice = handler.get_depth_slice("vp", 7)
+    assert handler.parsed_components == {}
+
+    handler.parse_component("vp")
+    assert sorted(handler.parsed_components.keys()) == \
+        ["lambda", "mu", "rhoinv", "vp"]
+    np.testing.assert_equal(handler.parsed_components["lambda"],
+                            get_ses3d_model_values(0))
+    np.testing.assert_allclose(handler.parsed_components["vp"][:, :, 7],
+                               vp_slice)
+    np.testing.assert_equal(handler.get_depth_slice("mu", 5),
+                            get_ses3d_model_values(1)[:, :, 5])
+
+    with pytest.raises(ValueError):
+        handler.get_depth_slice("grad_cp", 0)
+
+
+def test_depth_slice_pyramid(tmpdir):
+    """
+    Handlers with a cache folder serve depth slices, their statistics, and
+    depth profiles from pyramids that are rebuilt when the model changes.
+    """
+    folder = os.path.join(str(tmpdir), "model")
+    cache_folder = os.path.join(str(tmpdir), "cache")
+    os.makedirs(folder)
+    # Large enough along x for two levels.
+    elements = (17, 2, 3)
+    write_ses3d_model(folder, ["lambda", "mu", "rhoinv", "B"], elements)
+    expected = get_ses3d_model_values(1, elements)
+
+    handler = RawSES3DModelHandler(folder, domain=None,
+                                   cache_folder=cache_folder)
+    assert handler.depth_slice_level_count == 2
+    np.testing.assert_equal(handler.get_depth_slice("mu", 7),
+                            expected[:, :, 7])
+    assert handler.get_depth_slice_pyramid("mu").level_count == 2
+    np.testing.assert_equal(handler.get_depth_slice("mu", 7, level=1),
+                            expected[::2, ::2, 7])
+    # Levels are clipped.
+    np.testing.assert_equal(handler.get_depth_slice("mu", 7, level=5),
+                            expected[::2, ::2, 7])
+    statistics = handler.get_depth_slice_statistics("mu", 7)
+    assert statistics["min"] == expected[:, :, 7].min()
+    assert statistics["max"] == expected[:, :, 7].max()
+    assert statistics["median"] == np.median(expected[:, :, 7])
+    profile = handler.get_depth_profile("mu", 10.0, 15.0)
+    x_index = handler.get_closest_gll_index("latitude", 10.0)
+    y_index = handler.get_closest_gll_index("longitude", 15.0)
+    np.testing.assert_equal(profile["values"], expected[x_index, y_index])
+    # Derived components work as well.
+    np.testing.assert_allclose(
+        handler.get_depth_slice("vsh", 3),
+        np.sqrt(expected[:, :, 3] *
+                get_ses3d_model_values(2, elements)[:, :, 3]) /
+        1000.0, rtol=1E-6)
+    assert handler.parsed_components == {}
+    assert sorted(os.listdir(cache_folder)) == [
+        "mu.json", "mu_level_0.npy", "mu_level_1.npy",
+        "vsh.json", "vsh_level_0.npy", "vsh_level_1.npy"]
+
+    # A new handler reuses the pyramids.
+    handler = RawSES3DModelHandler(folder, domain=None,
+                                   cache_folder=cache_folder)
+    handler._depth_slice_pyramid_store.build = None
+    assert handler.get_depth_slice_pyramid("mu").level_count == 2
+
+    # Changing the model invalidates them.
+    filename = os.path.join(folder, "mu0")
+    os.utime(filename, (0, 0))
+    handler = RawSES3DModelHandler(folder, domain=None,
+                                   cache_folder=cache_folder)
+    handler._depth_slice_pyramid_store.build = lambda *args, **kwargs: 1
+    assert handler.get_depth_slice_pyramid("mu") == 1
+
+    # Even if rewritten within the resolution of float seconds.
+    mtime_ns = 10 ** 18
+    assert mtime_ns / 1E9 == (mtime_ns + 1) / 1E9
+    os.utime(filename, ns=(mtime_ns, mtime_ns))
+    handler = RawSES3DModelHandler(folder, domain=None,
+                                   cache_folder=cache_folder)
+    handler.get_depth_slice_pyramid("mu")
+    os.utime(filename, ns=(mtime_ns + 1, mtime_ns + 1))
+    handler = RawSES3DModelHandler(folder, domain=None,
+                                   cache_folder=cache_folder)
+    handler._depth_slice_pyramid_store.build = lambda *args, **kwargs: 1
+    assert handler.get_depth_slice_pyramid("mu") == 1
+
+    with pytest.raises(ValueError):
+        handler.get_depth_slice_pyramid("grad_cp")
+
+
+def test_depth_slice_pyramids_of_other_components_while_building(tmpdir):
+    """
+    Building the pyramid of one component does not block access to the
+    pyramids of the other components.
+    """
+    folder = os.path.join(str(tmpdir), "model")
+    os.makedirs(folder)
+    write_ses3d_model(folder, ["lambda", "mu", "rhoinv", "B"])
+    expected = get_ses3d_model_values(1)
+    handler = RawSES3DModelHandler(
+        folder, domain=None, cache_folder=os.path.join(str(tmpdir), "cache"))
+    handler.get_depth_slice_pyramid("mu")
+
+    store = handler._depth_slice_pyramid_store
+    build = store.build
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_build(*args, **kwargs):
+        started.set()
+        assert finish.wait(10)
+        return build(*args, **kwargs)
+
+    store.build = slow_build
+    thread = threading.Thread(target=handler.get_depth_slice_pyramid,
+                              args=("B",))
+    thread.start()
+    try:
+        assert started.wait(10)
+        np.testing.assert_equal(handler.get_depth_slice("mu", 3),
+                                expected[:, :, 3])
+        handler.get_depth_slice_statistics("mu", 3)
+        # Other pyramids can be built at the same time.
+        store.build = build
+        assert handler.get_depth_slice_pyramid("lambda") is not None
+        assert "B" not in handler._depth_slice_pyramids
+    finally:
+        finish.set()
+        thread.join()
+    assert "B" in handler._depth_slice_pyramids
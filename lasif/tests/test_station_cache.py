@@ -375,3 +375,61 @@ def test_station_cache_readonly_mode(tmpdir):
                                  read_only=True)
     new = station_cache.get_values()
     assert original == new
+
+
+def test_bulk_channel_lookup(tmpdir):
+    """
+    Resolving many channels at once yields the same as looking them up one
+    by one. The time interval indices exist.
+    """
+    # Most generic way to get the actual data directory.
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(
+        inspect.currentframe()))), "data", "station_files")
+
+    directory = str(tmpdir)
+    cache_file = os.path.join(directory, "cache.sqlite")
+    seed_directory = os.path.join(directory, "SEED")
+    resp_directory = os.path.join(directory, "RESP")
+    stationxml_directory = os.path.join(directory, "StationXML")
+    os.makedirs(seed_directory)
+    os.makedirs(resp_directory)
+    for filename in ["dataless.IU_PAB", "dataless.BW_FURT"]:
+        shutil.copy(os.path.join(data_dir, "seed", filename),
+                    os.path.join(seed_directory, filename))
+
+    station_cache = StationCache(cache_file, directory, seed_directory,
+                                 resp_directory, stationxml_directory,
+                                 read_only=False)
+    indices = [_i[0] for _i in station_cache.db_cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND "
+        "tbl_name='indices';")]
+    assert sorted(indices) == ["channel_id_start_date_end_date",
+                               "start_date_end_date"]
+
+    # The IU.PAB channel ends in 2009.
+    channel_ids = ["IU.PAB.00.BHE", "BW.FURT..EHE", "BW.FURT..EHZ",
+                   "AA.BB..CC"]
+    times = [obspy.UTCDateTime(1980, 1, 1), obspy.UTCDateTime(2005, 1, 1),
+             obspy.UTCDateTime(2012, 1, 1).timestamp]
+    channels = [(channel_id, t) for channel_id in channel_ids
+                for t in times]
+    results = station_cache.get_station_files_and_coordinates(channels)
+    assert len(results) == len(channels)
+
+    all_channels = [station_cache.get_all_channels_at_time(_i)
+                    for _i in times]
+    for _i, ((channel_id, t), result) in enumerate(zip(channels, results)):
+        filename = station_cache.get_station_filename(channel_id, t)
+        if filename is None:
+            assert result is None
+            continue
+        assert result["filename"] == filename
+        coordinates = dict(result)
+        del coordinates["filename"]
+        assert coordinates == all_channels[_i % len(times)][channel_id]
+    assert sum(_i is not None for _i in results) == 5
+    assert results[-1] is None
+
+    # Many channels are resolved in batches.
+    assert station_cache.get_station_files_and_coordinates(
+        channels * 100) == results * 100
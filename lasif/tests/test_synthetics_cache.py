@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test cases for the materialized cache of the final synthetics.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import numpy as np
+import obspy
+from obspy.core.util import AttribDict
+
+from lasif.tools.synthetics_cache import SyntheticsCache
+
+
+def test_synthetics_cache_stores_complete_headers(tmpdir):
+    """
+    Synthetics read from the cache have the same headers as the stored
+    ones. Synthetics with headers that cannot be stored are not cached.
+    """
+    cache = SyntheticsCache(str(tmpdir))
+    st = obspy.Stream()
+    for channel in ["MXN", "MXE"]:
+        tr = obspy.Trace(data=np.arange(10, dtype=np.float32), header={
+            "network": "XX", "station": "STA", "channel": channel,
+            "starttime": obspy.UTCDateTime(2010, 3, 24, 14, 11, 31, 123456),
+            "delta": 0.13})
+        tr.stats._format = "SES3D"
+        tr.stats.ses3d = AttribDict({"receiver_latitude": np.float64(1.5),
+                                     "rotation_axis": [0.0, 1.0, 0.0]})
+        tr.stats.processing = ["Rotated to the physical domain."]
+        st.append(tr)
+
+    assert cache.put("EVENT", "ITERATION_1", "XX.STA", "key", st)
+    assert cache.get("EVENT", "ITERATION_1", "XX.STA", "other") is None
+    cached = cache.get("EVENT", "ITERATION_1", "XX.STA", "key")
+    assert len(cached) == 2
+    for tr, cached_tr in zip(st, cached):
+        assert cached_tr.stats == tr.stats
+        assert isinstance(cached_tr.stats.ses3d, AttribDict)
+        np.testing.assert_array_equal(cached_tr.data, tr.data)
+
+    st[1].stats.ses3d.other = object()
+    assert not cache.put("EVENT", "ITERATION_1", "XX.STB", "key", st)
+    assert not os.path.exists(os.path.join(str(tmpdir), "EVENT",
+                                           "ITERATION_1", "XX.STB.json"))
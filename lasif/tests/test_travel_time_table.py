@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the travel time table.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+from obspy.taup import TauPyModel
+import os
+
+from lasif.tools.travel_time_table import TravelTimeTable
+
+
+def _get_table(phase, filename=None):
+    # Coarse grid to keep the tests fast.
+    return TravelTimeTable(phase=phase, filename=filename,
+                           depth_spacing_in_km=50.0,
+                           distance_spacing_in_deg=1.0,
+                           max_depth_in_km=100.0)
+
+
+def test_travel_time_table_against_taup():
+    """
+    The interpolated times should be very close to the TauP times.
+    """
+    model = TauPyModel("ak135")
+    depths = np.array([0.0, 12.3, 33.0, 74.1, 99.0])
+    distances = np.array([0.7, 15.2, 37.9, 64.4, 89.5])
+
+    for phase in ["P", "ttp"]:
+        table = _get_table(phase)
+        times = table.get_first_arrival(depths, distances)
+        assert times.shape == (5,)
+        for depth, distance, time in zip(depths, distances, times):
+            tts = model.get_travel_times(source_depth_in_km=depth,
+                                         distance_in_degree=distance,
+                                         phase_list=[phase])
+            expected = min(_i.time for _i in tts)
+            # Generous tolerance due to the very coarse depth grid.
+            np.testing.assert_allclose(time, expected, atol=1.0)
+
+        # Scalar input returns a float.
+        assert isinstance(table.get_first_arrival(33.0, 37.9), float)
+        np.testing.assert_allclose(table.get_first_arrival(33.0, 37.9),
+                                   times[2])
+
+
+def test_travel_time_table_rows_against_taup():
+    """
+    The tabulated rows are computed with ObsPy's TauP internals. They must
+    be identical to the TauP times at the grid points, including the
+    distances without an arrival.
+    """
+    model = TauPyModel("ak135")
+    for phase in ["P", "ttp"]:
+        table = _get_table(phase)
+        table.get_first_arrival(table.depths, 10.0)
+        assert table.computed.all()
+        for _i, depth in enumerate(table.depths):
+            for distance in [0.0, 10.0, 45.0, 97.0, 130.0, 180.0]:
+                _j = int(np.argmin(np.abs(table.distances - distance)))
+                tts = model.get_travel_times(source_depth_in_km=depth,
+                                             distance_in_degree=distance,
+                                             phase_list=[phase])
+                if phase != "ttp":
+                    tts = [_k for _k in tts if _k.purist_name == phase]
+                if not tts:
+                    assert np.isnan(table.times[_i, _j])
+                    continue
+                np.testing.assert_allclose(
+                    table.times[_i, _j], min(_k.time for _k in tts),
+                    rtol=1E-6)
+
+
+def test_travel_time_table_missing_phases():
+    """
+    Distances without a direct P wave result in NaN, the ``"ttp"`` phase
+    always exists.
+    """
+    assert np.isnan(_get_table("P").get_first_arrival(10.0, 130.0))
+    assert not np.isnan(_get_table("ttp").get_first_arrival(10.0, 130.0))
+
+    # Sources deeper than the table are calculated directly.
+    time = _get_table("P").get_first_arrival(600.0, 40.0)
+    tts = TauPyModel("ak135").get_travel_times(
+        source_depth_in_km=600.0, distance_in_degree=40.0, phase_list=["P"])
+    np.testing.assert_allclose(time, tts[0].time)
+
+
+def test_travel_time_table_persistence(tmpdir):
+    """
+    Computed depths are stored and reused.
+    """
+    filename = os.path.join(str(tmpdir), "table.npz")
+    table = _get_table("P", filename=filename)
+    assert not os.path.exists(filename)
+    assert not table.computed.any()
+
+    time = table.get_first_arrival(20.0, 50.0)
+    assert os.path.exists(filename)
+    np.testing.assert_equal(table.computed, [True, True, False])
+
+    new_table = _get_table("P", filename=filename)
+    np.testing.assert_equal(new_table.computed, [True, True, False])
+    np.testing.assert_equal(new_table.times, table.times)
+    assert new_table.get_first_arrival(20.0, 50.0) == time
+
+    # A table with a different grid or phase does not use the file.
+    assert not _get_table("ttp", filename=filename).computed.any()
+    assert not TravelTimeTable(phase="P", filename=filename).computed.any()
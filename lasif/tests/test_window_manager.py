@@ -13,7 +13,8 @@ from obspy import UTCDateTime
 import os
 import pytest
 
-from lasif.window_manager import Window, WindowCollection
+from lasif.window_manager import (Window, WindowCollection,
+                                  WindowGroupManager)
 
 
 def test_window_class_initialization():
@@ -293,3 +294,72 @@ def test_delete_windows(tmpdir):
                      endtime=UTCDateTime(2013, 1, 1, 0, 1),
                      tolerance=0.02)
     assert len(wc) == 1
+
+
+def test_window_group_manager_store(tmpdir):
+    """
+    All windows of an event and iteration are kept in a single database.
+    Existing XML files are imported and windows can be exported again.
+    """
+    tmpdir = str(tmpdir)
+    directory = os.path.join(tmpdir, "windows")
+    os.makedirs(directory)
+
+    # Windows from an older project.
+    for channel_id in ["AA.BB..HHE", "AA.BB..HHZ", "AA.CC..HHZ"]:
+        wc = WindowCollection(
+            os.path.join(directory, "window_%s.xml" % channel_id),
+            event_name="SomeEvent", channel_id=channel_id,
+            synthetics_tag="A")
+        wc.add_window(starttime=UTCDateTime(2012, 1, 1),
+                      endtime=UTCDateTime(2012, 1, 1, 0, 1, 0, 123456),
+                      weight=0.5, taper="cosine", taper_percentage=0.08,
+                      misfit_type="some misfit")
+        wc.write()
+    legacy = WindowCollection(os.path.join(directory,
+                                           "window_AA.BB..HHE.xml"))
+
+    wm = WindowGroupManager(directory, "A", "SomeEvent")
+    assert wm.list() == ["AA.BB..HHE", "AA.BB..HHZ", "AA.CC..HHZ"]
+    assert len(wm) == 3
+    assert wm.get("AA.BB..HHE").windows == legacy.windows
+    assert sorted(_i.channel_id for _i in
+                  wm.get_windows_for_station("AA.BB")) == [
+        "AA.BB..HHE", "AA.BB..HHZ"]
+    assert list(wm.get_all_windows().keys()) == wm.list()
+
+    # Changes are written to the database and not to the files.
+    wc = wm.get("AA.CC..HHZ")
+    wc.add_window(starttime=UTCDateTime(2013, 1, 1),
+                  endtime=UTCDateTime(2013, 1, 1, 0, 1))
+    wc.write()
+    assert len(WindowGroupManager(directory, "A", "SomeEvent").get(
+        "AA.CC..HHZ")) == 2
+    assert len(WindowCollection(os.path.join(
+        directory, "window_AA.CC..HHZ.xml"))) == 1
+
+    # Replace the windows of whole stations at once.
+    wm.replace_windows(
+        {"AA.BB..HHN": [(UTCDateTime(2014, 1, 1),
+                         UTCDateTime(2014, 1, 1, 0, 1))]},
+        stations=["AA.BB"])
+    assert wm.list() == ["AA.BB..HHN", "AA.CC..HHZ"]
+
+    wm.delete_windows_for_station("AA.CC")
+    wm.delete_windows_for_channel("AA.BB..HHN")
+    assert wm.list() == []
+
+    # Export and import.
+    wm.replace_windows({"AA.BB..HHE": legacy.windows})
+    export_directory = os.path.join(tmpdir, "export")
+    os.makedirs(export_directory)
+    assert wm.export_xml(export_directory) == 1
+    assert os.listdir(export_directory) == ["window_AA.BB..HHE.xml"]
+    exported = WindowCollection(os.path.join(export_directory,
+                                             "window_AA.BB..HHE.xml"))
+    assert exported.windows == legacy.windows
+    assert exported.event_name == "SomeEvent"
+
+    wm.delete_windows_for_channel("AA.BB..HHE")
+    assert wm.import_xml(export_directory) == 1
+    assert wm.get("AA.BB..HHE").windows == legacy.windows
@@ -10,10 +10,14 @@ Test suite for the window selection.
     (http://www.gnu.org/copyleft/gpl.html)
 """
 import inspect
+import numpy as np
 import obspy
 import os
+import pytest
 
-from lasif.window_selection import select_windows
+from lasif import LASIFError
+from lasif.tools.travel_time_table import TravelTimeTable
+from lasif.window_selection import select_windows, _sliding_cross_correlation
 
 # Data path.
 DATA = os.path.join(os.path.dirname(os.path.abspath(
@@ -69,3 +73,66 @@ def test_select_windows():
                          obspy.UTCDateTime(2000, 8, 21, 17, 19, 24, 800000))]
 
     assert windows == expected_windows
+
+
+def test_select_windows_without_first_arrival():
+    """
+    A missing first arrival results in a clear error.
+    """
+    data_trace = obspy.read(os.path.join(DATA, "LA.AA10..BHZ.mseed"))[0]
+    synthetic_trace = obspy.read(os.path.join(DATA, "LA.AA10_.___.z.bz2"))[0]
+    # There is no direct P wave at an epicentral distance of 146 degree.
+    table = TravelTimeTable(phase="P", depth_spacing_in_km=50.0,
+                            distance_spacing_in_deg=1.0,
+                            max_depth_in_km=100.0)
+
+    with pytest.raises(LASIFError) as err:
+        select_windows(
+            data_trace=data_trace, synthetic_trace=synthetic_trace,
+            event_latitude=44.87, event_longitude=8.48,
+            event_depth_in_km=15.0, station_latitude=-30.0,
+            station_longitude=150.0, minimum_period=40.0,
+            maximum_period=100.0, travel_time_table=table)
+    assert "No 'P' arrival for channel LA.AA10..BHZ" in str(err.value)
+
+
+def test_sliding_cross_correlation():
+    """
+    The vectorized sliding cross correlation must agree with correlating
+    each window separately.
+    """
+    data_trace = obspy.read(os.path.join(DATA, "LA.AA10..BHZ.mseed"))[0]
+    data = data_trace.data
+    synthetic = np.roll(data, 7) * 0.5 + np.sin(np.arange(len(data)) * 0.1)
+    window_length = 41
+    taper = np.hanning(window_length)
+    window_starts = np.arange(0, len(data) - window_length + 1, 3)
+
+    time_shift, max_cc_value, synthetic_ptp = _sliding_cross_correlation(
+        data, synthetic, taper, window_starts, chunk_size=100)
+
+    for i, start in enumerate(window_starts):
+        data_window = data[start: start + window_length] * taper
+        synthetic_window = synthetic[start: start + window_length] * taper
+        cc = np.correlate(data_window, synthetic_window, mode="full")
+        assert time_shift[i] == cc.argmax() - window_length + 1
+        np.testing.assert_allclose(
+            max_cc_value[i], cc.max() / np.sqrt(
+                (synthetic_window ** 2).sum() * (data_window ** 2).sum()))
+        np.testing.assert_allclose(synthetic_ptp[i],
+                                   np.ptp(synthetic_window))
+
+
+def test_sliding_cross_correlation_without_windows():
+    """
+    Traces shorter than a window and empty window starts result in no
+    windows instead of an error.
+    """
+    data = np.arange(10.0)
+    for window_starts in (np.array([0, 1]), np.array([], dtype=np.int64)):
+        for values in _sliding_cross_correlation(
+                data, data, np.ones(20), window_starts):
+            assert len(values) == 0
+    for values in _sliding_cross_correlation(
+            data, data, np.ones(5), np.array([], dtype=np.int64)):
+        assert len(values) == 0
@@ -12,6 +12,7 @@ Utility functionality for the LASIF test suite.
 from collections import namedtuple
 import copy
 import inspect
+import math
 import matplotlib as mpl
 import matplotlib.pylab as plt
 from matplotlib.testing.compare import compare_images as mpl_compare_images
@@ -112,6 +113,156 @@ def cli(communicator, request, capsys):
     return request
 
 
+# Lagrange polynomial degree of the SES3D test models.
+SES3D_LPD = 4
+# Number of elements along each axis in every box of the SES3D test models.
+SES3D_ELEMENTS = (3, 2, 3)
+# Number of boxes along each axis of the SES3D test models.
+SES3D_BOXES = (2, 1, 2)
+
+
+def get_ses3d_model_values(component_number, elements=SES3D_ELEMENTS):
+    """
+    The value at every point of the test model encodes its indices.
+    """
+    x, y, z = [np.arange(_i * _j * SES3D_LPD + 1)
+               for _i, _j in zip(elements, SES3D_BOXES)]
+    return (x[:, None, None] * 10000 + y[None, :, None] * 100 +
+            z[None, None, :] + component_number * 1E6).astype(np.float32)
+
+
+def write_ses3d_model(folder, components, elements=SES3D_ELEMENTS):
+    """
+    Writes a raw SES3D model split into multiple boxes whose values are
+    given by :func:`get_ses3d_model_values`.
+    """
+    lines = ["header"] * 14
+    lines += [str(np.prod(SES3D_BOXES))] + [str(_i) for _i in SES3D_BOXES]
+    lines.append("-" * 10)
+
+    number = 0
+    for bx in range(SES3D_BOXES[0]):
+        for by in range(SES3D_BOXES[1]):
+            for bz in range(SES3D_BOXES[2]):
+                box = (bx, by, bz)
+                # Neighbouring boxes share their first and last element index
+                # in the boxfile.
+                bounds = [(_b * (_e - 1), (_b + 1) * (_e - 1))
+                          for _b, _e in zip(box, elements)]
+                lines.append(str(number + 1))
+                lines.append(" ".join(str(_i + 1) for _i in box))
+                lines.extend("%i %i" % _i for _i in bounds)
+                lines.append("%f %f" % (math.radians(40 + bx * 5),
+                                        math.radians(45 + bx * 5)))
+                lines.append("%f %f" % (math.radians(10), math.radians(20)))
+                lines.append("%f %f" % (5.5E6 + bz * 4E5, 5.9E6 + bz * 4E5))
+                lines.append("-" * 10)
+
+                # Global point indices of all points of all elements.
+                indices = []
+                for axis in range(3):
+                    element = np.arange(elements[axis])[:, None]
+                    point = np.arange(SES3D_LPD + 1)[None, :]
+                    indices.append((box[axis] * elements[axis] + element) *
+                                   SES3D_LPD + point)
+                gx, gy, gz = indices
+                # The z axis is stored upside down.
+                gz = (2 * box[2] + 1) * elements[2] * SES3D_LPD - gz
+                for _i, component in enumerate(components):
+                    values = get_ses3d_model_values(_i, elements)
+                    data = values[
+                        gx[:, None, None, :, None, None],
+                        gy[None, :, None, None, :, None],
+                        gz[None, None, :, None, None, :]]
+                    marker = np.array([data.nbytes], dtype=np.int32)
+                    with open(os.path.join(folder, "%s%i" % (
+                            component, number)), "wb") as fh:
+                        fh.write(marker.tobytes())
+                        fh.write(data.astype(np.float32).tobytes(order="F"))
+                        fh.write(marker.tobytes())
+                number += 1
+
+    with open(os.path.join(folder, "boxfile"), "wt") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+def fake_processed_data_of_synthetic_project(comm, iteration):
+    """
+    Writes the slightly shifted and perturbed synthetics of all stations of
+    all events of an iteration of a synthetic project as its processed
+    data. The preprocessing filters the data but not the synthetics so the
+    time frequency misfit would reject all windows otherwise.
+    """
+    rng = np.random.RandomState(123456)
+    for event_name in sorted(iteration.events.keys()):
+        path = comm.waveforms.get_waveform_folder(
+            event_name, "processed", iteration.processing_tag)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for station in sorted(iteration.events[event_name]["stations"]):
+            st = comm.waveforms.get_waveforms_synthetic(
+                event_name, station, iteration.long_name)
+            for tr in st:
+                tr.stats.channel = "BH" + tr.stats.channel[-1]
+                tr.data = np.roll(tr.data, 2) + rng.normal(
+                    0.0, 0.02 * np.abs(tr.data).max(), tr.stats.npts)
+                tr.write(os.path.join(path, tr.id), format="mseed")
+
+
+def add_windows_to_synthetic_project(
+        comm, iteration,
+        misfit_type="TimeFrequencyPhaseMisfitFichtner2008"):
+    """
+    Adds one window to the vertical component of every station of all
+    events of an iteration of a synthetic project. Returns the windows of
+    each event and station in the form expected by
+    ``calculate_adjoint_sources_for_station()``.
+    """
+    windows = {}
+    for event_name in sorted(iteration.events.keys()):
+        origin_time = comm.events.get(event_name)["origin_time"]
+        window_manager = comm.windows.get(event_name, iteration)
+        for station in sorted(iteration.events[event_name]["stations"]):
+            channel_id = "%s..BHZ" % station
+            collection = window_manager.get(channel_id)
+            collection.add_window(origin_time + 100, origin_time + 450,
+                                  misfit_type=misfit_type)
+            collection.write()
+            windows[(event_name, station)] = {
+                channel_id: collection.windows}
+    return windows
+
+
+def pop_adjoint_sources(comm, iteration, windows):
+    """
+    Returns copies of the stored adjoint source samples and misfit values
+    of the given windows keyed by event, channel, and window and removes
+    them from the stores. Windows without an adjoint source are skipped.
+
+    :param windows: The windows as returned by
+        :func:`add_windows_to_synthetic_project`.
+    """
+    adjoint_sources = {}
+    for (event_name, _), channels in windows.items():
+        store = comm.adjoint_sources.get_store(event_name, iteration.name)
+        for channel_id, channel_windows in channels.items():
+            for window in channel_windows:
+                key = (channel_id, window.starttime, window.endtime,
+                       window.taper, window.taper_percentage,
+                       window.misfit_type)
+                adsrc = store.get(*key)
+                if adsrc is None:
+                    continue
+                # UTCDateTime objects are not hashable.
+                adjoint_sources[(event_name, channel_id,
+                                 str(window.starttime),
+                                 str(window.endtime))] = (
+                    np.array(adsrc["adjoint_source"]),
+                    adsrc["misfit_value"])
+                store.delete(*key)
+    return adjoint_sources
+
+
 def images_are_identical(image_name, temp_dir, dpi=None, tol=5):
     """
     Partially copied from ObsPy
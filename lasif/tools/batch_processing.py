@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Signal processing of many traces at once.
+
+The traces of an event mostly share their sampling rate and length and
+are all processed with the same parameters. The functions in this module
+thus operate on 2-D arrays with one trace per row and cache the filters
+and tapers so they are only designed once per process.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import functools
+import itertools
+import warnings
+
+import numpy as np
+from scipy import signal
+
+
+@functools.lru_cache(maxsize=None)
+def design_decimation_filter(sampling_rate, freqmax):
+    """
+    Custom Chebychev type two lowpass filter useful for decimation
+    filtering. Returns the ``(b, a)`` coefficients.
+
+    This filter is stable up to a reduction in frequency with a factor of
+    10. If more reduction is desired, simply decimate in steps.
+
+    Partly based on a filter in ObsPy.
+
+    :param sampling_rate: The sampling rate of the data.
+    :param freqmax: The desired lowpass frequency.
+    """
+    # rp - maximum ripple of passband, rs - attenuation of stopband
+    rp, rs, order = 1, 96, 1e99
+    ws = freqmax / (sampling_rate * 0.5)  # stop band frequency
+    wp = ws  # pass band frequency
+
+    while True:
+        if order <= 12:
+            break
+        wp *= 0.99
+        order, wn = signal.cheb2ord(wp, ws, rp, rs, analog=0)
+
+    return signal.cheby2(order, rs, wn, btype="low", analog=0, output="ba")
+
+
+@functools.lru_cache(maxsize=None)
+def design_bandpass_filter(freqmin, freqmax, sampling_rate, corners):
+    """
+    Second-order sections of the Butterworth bandpass filter also used by
+    :meth:`obspy.core.trace.Trace.filter`.
+
+    Like ObsPy, a highpass at ``freqmin`` is designed instead if ``freqmax``
+    is at or above the Nyquist frequency. :func:`bandpass` warns about it.
+
+    :param freqmin: Pass band low corner frequency.
+    :param freqmax: Pass band high corner frequency.
+    :param sampling_rate: The sampling rate of the data.
+    :param corners: The filter order.
+    """
+    nyquist = 0.5 * sampling_rate
+    if freqmin / nyquist > 1.0:
+        raise ValueError("The low corner frequency of the bandpass must be "
+                         "below the Nyquist frequency.")
+    if _is_above_nyquist(freqmax, sampling_rate):
+        return signal.iirfilter(corners, freqmin / nyquist,
+                                btype="highpass", ftype="butter",
+                                output="sos")
+    return signal.iirfilter(corners, [freqmin / nyquist, freqmax / nyquist],
+                            btype="band", ftype="butter", output="sos")
+
+
+def _is_above_nyquist(freqmax, sampling_rate):
+    """
+    Whether the high corner frequency of a bandpass is at or above the
+    Nyquist frequency by the same criterion as ObsPy.
+
+    >>> _is_above_nyquist(0.5, 1.0)
+    True
+    >>> _is_above_nyquist(0.4, 1.0)
+    False
+    """
+    return freqmax / (0.5 * sampling_rate) - 1.0 > -1E-6
+
+
+@functools.lru_cache(maxsize=None)
+def get_taper(npts, sampling_rate, max_percentage, taper_type):
+    """
+    The taper applied by :meth:`obspy.core.trace.Trace.taper` to a trace
+    with the given number of samples.
+
+    >>> get_taper(10, 1.0, 0.2, "hann")[[0, 1, 2, 5, 9]]
+    array([0. , 0.5, 1. , 1. , 0. ])
+
+    :param npts: The number of samples.
+    :param sampling_rate: The sampling rate of the data.
+    :param max_percentage: Decimal percentage of the taper at each end.
+    :param taper_type: The type of the taper.
+    """
+    import obspy
+
+    tr = obspy.Trace(data=np.ones(npts),
+                     header={"sampling_rate": sampling_rate})
+    taper = tr.taper(max_percentage=max_percentage, type=taper_type).data
+    taper.flags.writeable = False
+    return taper
+
+
+def group_traces(traces, keys=None):
+    """
+    Groups traces with the same sampling rate and number of samples so they
+    can be processed as one 2-D array. Returns lists of indices.
+
+    Traces can additionally be grouped by any other hashable and sortable
+    key, e.g. their processing parameters.
+
+    >>> import obspy
+    >>> traces = [obspy.Trace(np.ones(_i), header={"delta": _j})
+    ...           for _i, _j in [(10, 1.0), (20, 1.0), (10, 1.0),
+    ...                          (10, 0.5)]]
+    >>> group_traces(traces)
+    [[0, 2], [1], [3]]
+    >>> group_traces(traces, keys=["a", "a", "b", "a"])
+    [[0], [2], [1], [3]]
+
+    :param traces: List of traces.
+    :param keys: Optional list of additional keys, one for each trace.
+    """
+    def key(index):
+        return (traces[index].stats.sampling_rate,
+                traces[index].stats.npts,
+                keys[index] if keys is not None else None)
+
+    indices = sorted(range(len(traces)), key=key)
+    return [list(_i[1]) for _i in itertools.groupby(indices, key)]
+
+
+def decimate(data, sampling_rate, dt):
+    """
+    Decimates the traces with the integer factor closest to the desired
+    sampling interval after a zerophase decimation filter. Large reductions
+    are performed in steps. Returns the decimated data and the new sampling
+    rate.
+
+    :param data: 2-D array with one trace per row.
+    :param sampling_rate: The sampling rate of the traces.
+    :param dt: The desired sampling interval.
+    """
+    while True:
+        decimation_factor = int(dt / (1.0 / sampling_rate))
+        # Decimate in steps for large sample rate reductions.
+        if decimation_factor > 8:
+            decimation_factor = 8
+        if decimation_factor <= 1:
+            break
+        new_nyquist = sampling_rate / 2.0 / float(decimation_factor)
+        b, a = design_decimation_filter(sampling_rate, new_nyquist)
+        # Apply twice to get rid of the phase distortion.
+        data = signal.filtfilt(b, a, data, axis=-1)
+        data = np.ascontiguousarray(data[:, ::decimation_factor])
+        sampling_rate = sampling_rate / float(decimation_factor)
+    return data, sampling_rate
+
+
+def detrend_and_taper(data, sampling_rate, max_percentage=0.05,
+                      taper_type="hann"):
+    """
+    Removes the linear trend and the mean of the traces and tapers them in
+    place.
+
+    :param data: 2-D floating point array with one trace per row.
+    :param sampling_rate: The sampling rate of the traces.
+    :param max_percentage: Decimal percentage of the taper at each end.
+    :param taper_type: The type of the taper.
+    """
+    data[:] = signal.detrend(data, type="linear", axis=-1)
+    data -= data.mean(axis=-1)[:, np.newaxis]
+    data *= get_taper(data.shape[-1], sampling_rate, max_percentage,
+                      taper_type)
+    return data
+
+
+def bandpass(data, sampling_rate, freqmin, freqmax, corners=4):
+    """
+    Causal Butterworth bandpass filter applied to all traces.
+
+    :param data: 2-D array with one trace per row.
+    :param sampling_rate: The sampling rate of the traces.
+    :param freqmin: Pass band low corner frequency.
+    :param freqmax: Pass band high corner frequency.
+    :param corners: The filter order.
+    """
+    # Warn on every call as the filter itself is cached.
+    if _is_above_nyquist(freqmax, sampling_rate):
+        warnings.warn(
+            "Selected high corner frequency (%s) of bandpass is at or above "
+            "Nyquist (%s). Applying a high-pass instead." % (
+                freqmax, 0.5 * sampling_rate))
+    sos = design_bandpass_filter(freqmin, freqmax, sampling_rate, corners)
+    return signal.sosfilt(sos, data, axis=-1)
+
+
+def lanczos_resample(data, old_starts, old_dt, new_start, new_dt, new_npts,
+                     a=12, window="blackman"):
+    """
+    Lanczos resampling of all traces to the same time samples. Same as
+    :meth:`obspy.core.trace.Trace.interpolate` with ``method="lanczos"``.
+
+    :param data: 2-D array with one trace per row.
+    :param old_starts: The start times of the traces as POSIX timestamps.
+    :param old_dt: The sampling interval of the traces.
+    :param new_start: The start time of the resampled traces as a POSIX
+        timestamp.
+    :param new_dt: The new sampling interval.
+    :param new_npts: The new number of samples.
+    :param a: The width of the window in samples on either side.
+    :param window: The window used to taper the sinc function.
+    """
+    from obspy.signal.interpolation import lanczos_interpolation
+
+    output = np.empty((len(data), new_npts), dtype=np.float64)
+    for row, old_start, trace in zip(output, old_starts, data):
+        row[:] = lanczos_interpolation(
+            np.require(trace, dtype=np.float64), old_start, old_dt,
+            new_start, new_dt, new_npts, a=a, window=window)
+    return output
@@ -63,6 +63,14 @@ Example implementation:
             # Do somethings to get the values.
             return [[400, 300, "jpeg"]]
 
+Optionally, a subclass can define a ``monitored_folders`` dictionary mapping
+filetypes to the list of folders the 'find files' method lists
+(non-recursively). The files of these filetypes are then journaled: if none
+of the folders has been modified since the last update, their files are
+neither listed nor checked again. Modifications of files in place, which do
+not change the modification time of their folder, are only detected with
+``update(use_journal=False)``.
+
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
@@ -74,8 +82,12 @@ Example implementation:
 
 from binascii import crc32
 
+import collections
+import itertools
+import multiprocessing
 import os
 import progressbar
+import json
 import sqlite3
 import time
 import warnings
@@ -84,15 +96,63 @@ from lasif import LASIFWarning
 
 
 # Table definition of the 'files' table. Used for creating and validating
-# the table.
+# the table. Modification times are stored in integer nanoseconds as float
+# seconds cannot resolve modifications in quick succession. Databases of
+# older versions storing them as float seconds are rebuilt.
 FILES_TABLE_DEFINITION = (
     ("id", "INTEGER"),
     ("filename", "TEXT"),
     ("filesize", "INTEGER"),
-    ("last_modified", "REAL"),
+    ("last_modified_ns", "INTEGER"),
     ("crc32_hash", "INTEGER")
 )
 
+# Table definition of the 'journal' table storing the state of the monitored
+# folders of every filetype.
+JOURNAL_TABLE_DEFINITION = (
+    ("filetype", "TEXT"),
+    ("folder_mtimes_ns", "TEXT"),
+    ("recorded", "REAL"),
+    ("manifest", "TEXT")
+)
+
+# Folders modified less than this many seconds before they have been listed
+# are always listed again as files might have been added within the
+# resolution of the modification times.
+JOURNAL_TIME_TOLERANCE = 2.0
+
+# Files are indexed in parallel if more files than this have to be indexed.
+PARALLEL_INDEXING_THRESHOLD = 100
+
+# Number of files written to the database at once when indexing.
+INDEXING_BATCH_SIZE = 5000
+
+# The cache currently indexing files in parallel. It is set before the worker
+# processes are forked so they do not have to unpickle it.
+_INDEXING_CACHE = None
+
+
+def _index_file_in_worker(args):
+    return _INDEXING_CACHE._index_file(*args)
+
+
+def get_crc32(filename, block_size=2 ** 20):
+    """
+    Computes the CRC32 hash of a file without reading it completely into
+    memory.
+
+    :param filename: The file to hash.
+    :param block_size: Number of bytes read at once.
+    """
+    value = 0
+    with open(filename, "rb") as open_file:
+        while True:
+            data = open_file.read(block_size)
+            if not data:
+                break
+            value = crc32(data, value)
+    return value
+
 
 class FileInfoCache(object):
     """
@@ -102,12 +162,19 @@ class FileInfoCache(object):
     """
 
     def __init__(self, cache_db_file, root_folder,
-                 read_only, pretty_name, show_progress=True):
+                 read_only, pretty_name, show_progress=True,
+                 processes=None):
+        """
+        :param processes: The number of processes used to index files.
+            Defaults to the number of CPUs. Files are always indexed in the
+            current process when running with more than one MPI rank.
+        """
         self.cache_db_file = cache_db_file
         self.root_folder = root_folder
         self.read_only = read_only
         self.show_progress = show_progress
         self.pretty_name = pretty_name
+        self.processes = processes
 
         # Will be filled in _init_database() method.
         self.db_cursor = None
@@ -192,7 +259,9 @@ class FileInfoCache(object):
         """
         query = "SELECT name FROM sqlite_master WHERE type = 'table';"
         tables = [_i[0] for _i in self.db_cursor.execute(query).fetchall()]
-        if sorted(tables) != sorted(["files", "sqlite_sequence", "indices"]):
+        # Databases without the journal are still valid.
+        if sorted(set(tables) - set(["journal"])) != \
+                sorted(["files", "sqlite_sequence", "indices"]):
             return False
 
         # Check the indices table.
@@ -207,6 +276,14 @@ class FileInfoCache(object):
         if f_t != FILES_TABLE_DEFINITION:
             return False
 
+        # Check the journal table.
+        if "journal" in tables:
+            j_t = self.db_cursor.execute(
+                "PRAGMA table_info(journal);").fetchall()
+            j_t = tuple([(_i[1], _i[2]) for _i in j_t])
+            if j_t != JOURNAL_TABLE_DEFINITION:
+                return False
+
         return True
 
     def _init_database(self):
@@ -296,6 +373,16 @@ class FileInfoCache(object):
         """ % ",\n".join(["%s %s" % _i for _i in self.index_values])
 
         self.db_cursor.execute(sql_create_index_table)
+
+        sql_create_journal_table = """
+            CREATE TABLE IF NOT EXISTS journal (
+                %s PRIMARY KEY,
+                %s
+            );
+        """ % ("%s %s" % JOURNAL_TABLE_DEFINITION[0],
+               ",".join("%s %s" % (_i[0], _i[1]) for _i in
+                        JOURNAL_TABLE_DEFINITION[1:]))
+        self.db_cursor.execute(sql_create_journal_table)
         self.db_conn.commit()
 
     def _update_indices(self):
@@ -304,40 +391,99 @@ class FileInfoCache(object):
 
         get_indices_query = """
             SELECT name FROM sqlite_master
-            WHERE type='index';"""
+            WHERE type='index' AND tbl_name='indices';"""
+
+        # Tuples of columns result in composite indices.
+        required = collections.OrderedDict(
+            ("_".join(_i), ", ".join(_i)) if isinstance(_i, tuple)
+            else (_i, _i) for _i in self.indices)
 
         indices = [_i[0] for _i in
                    self.db_cursor.execute(get_indices_query).fetchall()]
-        if indices == self.indices:
+        if indices == list(required.keys()):
             return
 
         # Drop all indices no.
         for index in indices:
-            if index in self.indices:
+            if index in required:
                 continue
             query = "DROP INDEX %s;" % index
             self.db_conn.execute(query)
             self.db_conn.commit()
 
-        for index in self.indices:
+        for index, columns in required.items():
             if index in indices:
                 continue
-            query = "CREATE INDEX %s on indices(%s);" % (index, index)
+            query = "CREATE INDEX %s on indices(%s);" % (index, columns)
             self.db_conn.execute(query)
             self.db_conn.commit()
 
-    def _get_all_files_by_filename(self):
+    @staticmethod
+    def _get_folder_mtimes(folders):
+        """
+        Returns the modification times of the given folders in
+        nanoseconds. None for not existing folders.
+        """
+        mtimes = []
+        for folder in folders:
+            try:
+                mtimes.append(os.stat(folder).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def _get_all_files_by_filename(self, use_journal=True):
         """
         Find all files for all filetypes by filename.
+
+        Filetypes whose monitored folders did not change since the last
+        update are not listed again but taken from the journal.
+
+        Returns the set of unchanged filetypes and a dictionary with the
+        new journal entries of the others.
+
+        :param use_journal: If False, all files are listed.
         """
+        monitored_folders = getattr(self, "monitored_folders", {})
+
+        journal = {}
+        if use_journal:
+            for filetype, folder_mtimes, recorded, manifest in \
+                    self.db_cursor.execute("SELECT * FROM journal"):
+                journal[filetype] = (json.loads(folder_mtimes), recorded,
+                                     manifest)
+
         self.files = {}
+        unchanged = set()
+        journal_updates = {}
         for filetype in self.filetypes:
+            folders = monitored_folders.get(filetype)
+            if folders:
+                # Taken before listing the files so any modification
+                # while listing will be noticed the next time.
+                recorded = time.time()
+                folder_mtimes = self._get_folder_mtimes(folders)
+                entry = journal.get(filetype)
+                if entry and entry[0] == folder_mtimes and all(
+                        entry[1] - _i / 1E9 > JOURNAL_TIME_TOLERANCE
+                        for _i in folder_mtimes if _i is not None):
+                    self.files[filetype] = json.loads(entry[2])
+                    unchanged.add(filetype)
+                    continue
+
             get_file_fct = "_find_files_%s" % filetype
             # Paths are relative to the root folder.
             self.files[filetype] = [
                 os.path.relpath(_i, self.root_folder) for _i in
                 getattr(self, get_file_fct)()]
 
+            if folders:
+                journal_updates[filetype] = (
+                    json.dumps(folder_mtimes), recorded,
+                    json.dumps(self.files[filetype]))
+
+        return unchanged, journal_updates
+
     def _get_all_files_from_database(self):
         """
         Find all files that actually have indexes by querying the database.
@@ -353,86 +499,111 @@ class FileInfoCache(object):
         for key, value in self.files.items():
             self.files[key] = list(filenames.intersection(set(value)))
 
-    def update(self):
+    def _stat_files(self, filenames):
+        """
+        Returns a dictionary mapping the given filenames relative to the
+        root folder to tuples of (size in bytes, last modification time in
+        nanoseconds).
+        Every folder is scanned only once with :func:`os.scandir`.
+        Files that no longer exist are omitted.
+
+        :param filenames: Filenames relative to the root folder.
+        """
+        names_by_folder = collections.defaultdict(set)
+        for filename in filenames:
+            folder, name = os.path.split(filename)
+            names_by_folder[folder].add(name)
+
+        stats = {}
+        for folder, names in names_by_folder.items():
+            try:
+                entries = os.scandir(os.path.join(self.root_folder, folder))
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name not in names:
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    stats[os.path.join(folder, entry.name)] = \
+                        (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def update(self, use_journal=True):
         """
         Updates the database.
+
+        Files whose size and modification time did not change are assumed
+        to be unchanged. Files with only a new modification time are hashed
+        and only reindexed if their contents actually changed. The new
+        modification time is stored in any case.
+
+        :param use_journal: If False, folders will be checked even if the
+            journal states they have not been modified.
         """
         # Get all files first.
-        self._get_all_files_by_filename()
+        unchanged, journal_updates = \
+            self._get_all_files_by_filename(use_journal=use_journal)
+
+        # Nothing to do.
+        if len(unchanged) == len(self.filetypes):
+            self._get_all_files_from_database()
+            return
 
         # Get all files currently in the database and reshape into a
         # dictionary. The dictionary key is the filename and the value a tuple
-        # of (id, last_modified, crc32 hash).
-        db_files = self.db_cursor.execute("SELECT * FROM files").fetchall()
-        db_files = {_i[1]: (_i[0], _i[3], _i[4]) for _i in db_files}
-
-        # Count all files
-        filecount = 0
-        for filetype in self.filetypes:
-            filecount += len(self.files[filetype])
-
-        # XXX: Check which files have the correct mtime outside the loop.
-        # Then the case when the caches already exist should be much faster
-        # (and the average case as well...)
-
-        # Use a progressbar if the filecount is large so something appears on
-        # screen.
-        pbar = None
-        update_interval = 1
-        current_file_count = 0
-        start_time = time.time()
-        try:
-            # Store the old working directory and change to the root folder
-            # to get relative pathnames.
-            org_directory = os.getcwd()
-            os.chdir(self.root_folder)
-
-            # Now update all filetypes separately.
-            for filetype in self.filetypes:
-                for filename in self.files[filetype]:
-                    current_file_count += 1
-                    # Only show the progressbar if more then 3.5 seconds have
-                    # passed.
-                    if not pbar and self.show_progress and \
-                            (time.time() - start_time > 3.5):
-                        widgets = [
-                            "Updating %s: " % self.pretty_name,
-                            progressbar.Percentage(),
-                            progressbar.Bar(), "", progressbar.ETA()]
-                        pbar = progressbar.ProgressBar(
-                            widgets=widgets, maxval=filecount).start()
-                        update_interval = max(int(filecount / 100), 1)
-                        pbar.update(current_file_count)
-                    if pbar and not current_file_count % update_interval:
-                        pbar.update(current_file_count)
-                    if filename in db_files:
-                        # Delete the file from the list of files to keep
-                        # track of files no longer available.
-                        this_file = db_files[filename]
-                        del db_files[filename]
-                        abs_filename = os.path.abspath(filename)
-
-                        last_modified = os.path.getmtime(abs_filename)
-                        # If the last modified time is identical to a
-                        # second, do nothing.
-                        if abs(last_modified - this_file[1]) < 1.0:
-                            continue
-                        # Otherwise check the hash.
-                        with open(abs_filename, "rb") as open_file:
-                            hash_value = crc32(open_file.read())
-                        if hash_value == this_file[2]:
-                            # XXX: Update last modified times, otherwise it
-                            # will hash again and again.
-                            continue
-                        self._update_file(abs_filename, filetype,
-                                          this_file[0])
-                    else:
-                        self._update_file(os.path.abspath(filename),
-                                          filetype)
-        finally:
-            os.chdir(org_directory)
-        if pbar:
-            pbar.finish()
+        # of (id, (filesize, last modified time), crc32 hash).
+        db_files = self.db_cursor.execute(
+            "SELECT id, filename, filesize, last_modified_ns, crc32_hash "
+            "FROM files").fetchall()
+        db_files = {_i[1]: (_i[0], (_i[2], _i[3]), _i[4]) for _i in db_files}
+
+        # Files of unchanged filetypes are kept as they are.
+        for filetype in unchanged:
+            for filename in self.files[filetype]:
+                db_files.pop(filename, None)
+        changed = [_i for _i in self.filetypes if _i not in unchanged]
+
+        stats = self._stat_files(itertools.chain.from_iterable(
+            self.files[_i] for _i in changed))
+
+        # Files to (re)index as a list of tuples of (absolute filename,
+        # filetype, id or None for new files).
+        to_be_indexed = []
+        # Files with a new modification time but identical contents as a
+        # list of tuples of (last modified time, id).
+        touched = []
+
+        for filetype in changed:
+            for filename in self.files[filetype]:
+                if filename not in stats:
+                    continue
+                abs_filename = os.path.join(self.root_folder, filename)
+                if filename not in db_files:
+                    to_be_indexed.append((abs_filename, filetype, None))
+                    continue
+
+                # Delete the file from the list of files to keep track of
+                # files no longer available.
+                this_file = db_files.pop(filename)
+                if stats[filename] == this_file[1]:
+                    continue
+                # Files with the same size might still be unchanged.
+                if stats[filename][0] == this_file[1][0] and \
+                        get_crc32(abs_filename) == this_file[2]:
+                    touched.append((stats[filename][1], this_file[0]))
+                    continue
+                to_be_indexed.append((abs_filename, filetype, this_file[0]))
+
+        # Store the new modification times so these files are not hashed
+        # again.
+        self.db_cursor.executemany(
+            "UPDATE files SET last_modified_ns = ? WHERE id = ?;", touched)
+
+        self._index_files(to_be_indexed)
 
         # Remove all files no longer part of the cache DB.
         if db_files:
@@ -440,9 +611,14 @@ class FileInfoCache(object):
                 print(("Removing %i no longer existing files from the "
                        "cache database. This might take a while ..." %
                        len(db_files)))
-            query = "DELETE FROM files WHERE filename IN (%s);" % \
-                ",".join(["'%s'" % _i for _i in db_files])
-            self.db_cursor.execute(query)
+            self.db_cursor.executemany(
+                "DELETE FROM files WHERE filename = ?;",
+                [(_i,) for _i in db_files])
+
+        self.db_cursor.executemany(
+            "INSERT OR REPLACE INTO journal(%s) VALUES (?, ?, ?, ?);" %
+            ", ".join(_i[0] for _i in JOURNAL_TABLE_DEFINITION),
+            [(key,) + value for key, value in journal_updates.items()])
         self.db_conn.commit()
 
         # Update the self.files dictionary, this time from the database.
@@ -453,27 +629,22 @@ class FileInfoCache(object):
         Returns a list of dictionaries containing all indexed values for every
         file together with the filename.
         """
-        try:
-            org_directory = os.getcwd()
-            os.chdir(self.root_folder)
-
-            # Assemble the query. Use a simple join statement.
-            sql_query = """
-            SELECT %s, files.filename
-            FROM indices
-            INNER JOIN files
-            ON indices.filepath_id=files.id
-            """ % ", ".join(["indices.%s" % _i[0] for _i in self.index_values])
-
-            all_values = []
-            indices = [_i[0] for _i in self.index_values]
-
-            for _i in self.db_cursor.execute(sql_query):
-                values = {key: value for (key, value) in zip(indices, _i)}
-                values["filename"] = os.path.abspath(_i[-1])
-                all_values.append(values)
-        finally:
-            os.chdir(org_directory)
+        # Assemble the query. Use a simple join statement.
+        sql_query = """
+        SELECT %s, files.filename
+        FROM indices
+        INNER JOIN files
+        ON indices.filepath_id=files.id
+        """ % ", ".join(["indices.%s" % _i[0] for _i in self.index_values])
+
+        all_values = []
+        indices = [_i[0] for _i in self.index_values]
+
+        for _i in self.db_cursor.execute(sql_query):
+            values = {key: value for (key, value) in zip(indices, _i)}
+            values["filename"] = os.path.abspath(os.path.join(
+                self.root_folder, _i[-1]))
+            all_values.append(values)
 
         return all_values
 
@@ -507,82 +678,169 @@ class FileInfoCache(object):
 
         return all_values
 
-    def _update_file(self, filename, filetype, filepath_id=None):
+    def _get_indexing_processes(self, file_count):
         """
-        Updates or creates a new entry for the given file. If id is given, it
-        will be interpreted as an update, otherwise as a fresh record.
+        Returns the number of processes used to index the given number of
+        files. 1 means indexing in the current process.
         """
-        abs_filename = filename
-        rel_filename = os.path.relpath(abs_filename, self.root_folder)
-        # Remove all old indices for the file if it is an update.
-        if filepath_id is not None:
-            self.db_cursor.execute("DELETE FROM indices WHERE "
-                                   "filepath_id = %i" % filepath_id)
-            self.db_conn.commit()
-
-        # Get all indices from the file.
-        try:
-            indices = getattr(self, "_extract_index_values_%s" %
-                                    filetype)(abs_filename)
-        except Exception as e:
-            msg = "Failed to index '%s' of type '%s' due to: %s" % (
-                abs_filename, filetype, str(e)
-            )
-            warnings.warn(msg, LASIFWarning)
-
-            # If it is an update, also remove the file from the file list.
-            if filepath_id is not None:
-                self.db_cursor.execute(
-                    "DELETE FROM files WHERE filename='%s';" % rel_filename)
-                self.db_conn.commit()
+        if file_count < PARALLEL_INDEXING_THRESHOLD:
+            return 1
+        # Never fork within MPI runs.
+        from mpi4py import MPI
+        if MPI.COMM_WORLD.size > 1:
+            return 1
+        processes = self.processes or multiprocessing.cpu_count()
+        return max(1, min(processes, file_count))
+
+    def _index_file(self, filename, filetype, filepath_id=None):
+        """
+        Extracts all indices from a single file and hashes it. Does not
+        touch the database so it can run in worker processes.
 
-            return
+        Returns a dictionary with the indices, the file information,
+        any raised warnings, and an error message if the file cannot be
+        indexed.
+        """
+        info = {"filename": filename, "filetype": filetype,
+                "filepath_id": filepath_id, "indices": None, "error": None}
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            try:
+                info["indices"] = getattr(
+                    self, "_extract_index_values_%s" % filetype)(filename)
+            except Exception as e:
+                info["error"] = \
+                    "Failed to index '%s' of type '%s' due to: %s" % (
+                        filename, filetype, str(e))
+        info["warnings"] = [(_i.message, _i.category) for _i in w]
+
+        if info["error"] is None and not info["indices"]:
+            info["error"] = (
+                "Could not extract any index from file '%s' of type '%s'. "
+                "The file will be skipped." % (filename, filetype))
+
+        if info["error"] is None:
+            info["filehash"] = get_crc32(filename)
+            stat = os.stat(filename)
+            info["last_modified_ns"] = stat.st_mtime_ns
+            info["filesize"] = stat.st_size
+        return info
+
+    def _index_files(self, files):
+        """
+        Indexes the given files and writes them to the database.
 
-        if not indices:
-            msg = ("Could not extract any index from file '%s' of type '%s'. "
-                   "The file will be skipped." % (abs_filename, filetype))
-            warnings.warn(msg, LASIFWarning)
+        The indices are extracted in a pool of worker processes if there are
+        many files. The results are written in batches with a single
+        transaction per batch.
 
-            # If it is an update, also remove the file from the file list.
-            if filepath_id is not None:
-                self.db_cursor.execute(
-                    "DELETE FROM files WHERE filename='%s';" % rel_filename)
-                self.db_conn.commit()
+        :param files: List of tuples of (absolute filename, filetype, id of
+            the file in the database or None for new files).
+        """
+        global _INDEXING_CACHE
 
+        if not files:
             return
 
-        # Get the hash
-        with open(abs_filename, "rb") as open_file:
-            filehash = crc32(open_file.read())
-
-        # Add or update the file.
-        if filepath_id is not None:
-            self.db_cursor.execute(
-                "UPDATE files SET last_modified=%f, "
-                "filesize=%i, "
-                "crc32_hash=%i WHERE id=%i;" % (os.path.getmtime(abs_filename),
-                                                os.path.getsize(abs_filename),
-                                                filehash, filepath_id))
-            self.db_conn.commit()
+        processes = self._get_indexing_processes(len(files))
+
+        pbar = None
+        if self.show_progress and len(files) >= PARALLEL_INDEXING_THRESHOLD:
+            widgets = [
+                "Indexing %i files of %s with %i process%s: " % (
+                    len(files), self.pretty_name, processes,
+                    "es" if processes > 1 else ""),
+                progressbar.Percentage(),
+                progressbar.Bar(), "", progressbar.ETA()]
+            pbar = progressbar.ProgressBar(
+                widgets=widgets, maxval=len(files)).start()
+
+        pool = None
+        if processes > 1:
+            _INDEXING_CACHE = self
+            pool = multiprocessing.get_context("fork").Pool(processes)
+            results = pool.imap_unordered(
+                _index_file_in_worker, files,
+                chunksize=max(1, min(100, len(files) // (4 * processes))))
         else:
-            self.db_cursor.execute(
-                "INSERT into files(filename, last_modified, filesize, "
-                " crc32_hash) VALUES"
-                "('%s', %f, %i, %i);" % (
-                    rel_filename, os.path.getmtime(abs_filename),
-                    os.path.getsize(abs_filename), filehash))
-            self.db_conn.commit()
-            filepath_id = self.db_cursor.lastrowid
+            results = (self._index_file(*_i) for _i in files)
 
-        # Append the file's path id to every index.
-        for index in indices:
-            index.append(filepath_id)
+        try:
+            batch = []
+            for _i, info in enumerate(results):
+                batch.append(info)
+                if len(batch) >= INDEXING_BATCH_SIZE:
+                    self._write_indices(batch)
+                    batch = []
+                if pbar:
+                    pbar.update(_i + 1)
+            self._write_indices(batch)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+                _INDEXING_CACHE = None
+        if pbar:
+            pbar.finish()
 
-        sql_insert_string = "INSERT INTO indices(%s, filepath_id) VALUES(%s);"
+    def _write_indices(self, batch):
+        """
+        Writes the results of :meth:`_index_file` for a batch of files to
+        the database within a single transaction.
+        """
+        if not batch:
+            return
 
-        self.db_conn.executemany(sql_insert_string % (
-            ",".join([_i[0] for _i in self.index_values]),
-            ",".join(["?"] * (len(indices[0])))),
-            indices)
+        for info in batch:
+            for message, category in info["warnings"]:
+                warnings.warn(message, category)
+            if info["error"] is not None:
+                warnings.warn(info["error"], LASIFWarning)
+
+        # Files being reindexed lose all their old indices. Files that can
+        # no longer be indexed are removed completely.
+        updated = [_i for _i in batch if _i["filepath_id"] is not None]
+        self.db_cursor.executemany(
+            "DELETE FROM indices WHERE filepath_id = ?;",
+            [(_i["filepath_id"],) for _i in updated])
+        self.db_cursor.executemany(
+            "DELETE FROM files WHERE id = ?;",
+            [(_i["filepath_id"],) for _i in updated
+             if _i["error"] is not None])
+
+        batch = [_i for _i in batch if _i["error"] is None]
+
+        self.db_cursor.executemany(
+            "UPDATE files SET last_modified_ns = ?, filesize = ?, "
+            "crc32_hash = ? WHERE id = ?;",
+            [(_i["last_modified_ns"], _i["filesize"], _i["filehash"],
+              _i["filepath_id"]) for _i in batch
+             if _i["filepath_id"] is not None])
+
+        # Ids of new rows are always larger than all existing ids as the
+        # table uses AUTOINCREMENT.
+        new_files = [_i for _i in batch if _i["filepath_id"] is None]
+        if new_files:
+            max_id = self.db_cursor.execute(
+                "SELECT MAX(id) FROM files;").fetchone()[0] or 0
+            self.db_cursor.executemany(
+                "INSERT INTO files(filename, last_modified_ns, filesize, "
+                "crc32_hash) VALUES (?, ?, ?, ?);",
+                [(os.path.relpath(_i["filename"], self.root_folder),
+                  _i["last_modified_ns"], _i["filesize"], _i["filehash"])
+                 for _i in new_files])
+            ids = dict((_i[1], _i[0]) for _i in self.db_cursor.execute(
+                "SELECT id, filename FROM files WHERE id > ?;", (max_id,)))
+            for info in new_files:
+                info["filepath_id"] = ids[os.path.relpath(
+                    info["filename"], self.root_folder)]
+
+        sql_insert_string = "INSERT INTO indices(%s, filepath_id) VALUES(%s);"
+        self.db_cursor.executemany(
+            sql_insert_string % (
+                ",".join([_i[0] for _i in self.index_values]),
+                ",".join(["?"] * (len(self.index_values) + 1))),
+            [list(index) + [info["filepath_id"]] for info in batch
+             for index in info["indices"]])
 
         self.db_conn.commit()
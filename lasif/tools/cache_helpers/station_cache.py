@@ -28,11 +28,23 @@ from .file_info_cache import FileInfoCache
 TOL_DEGREES = 0.01
 TOL_METERS = 1000.0
 
+# Number of (channel id, time) pairs resolved with a single query. Keeps the
+# number of bound parameters below SQLite's limit.
+CHANNEL_QUERY_BATCH_SIZE = 250
+
 
 class StationCacheError(LASIFError):
     pass
 
 
+def _to_timestamp(time):
+    try:
+        time = time.timestamp
+    except AttributeError:
+        pass
+    return int(time)
+
+
 class StationCache(FileInfoCache):
     """
     Cache for Station files.
@@ -55,7 +67,9 @@ class StationCache(FileInfoCache):
             ("elevation_in_m", "REAL"),
             ("local_depth_in_m", "REAL")]
 
-        self.indices = ["channel_id"]
+        # Interval indices for the lookups of channels at a certain time.
+        self.indices = [("channel_id", "start_date", "end_date"),
+                        ("start_date", "end_date")]
         self.filetypes = ["seed", "resp", "stationxml"]
 
         self.seed_folder = seed_folder
@@ -160,21 +174,17 @@ class StationCache(FileInfoCache):
         no coordinates but at least, it will assure that the channel
         actually has an available response information.
         """
-        try:
-            time = time.timestamp
-        except AttributeError:
-            pass
-        time = int(time)
+        time = _to_timestamp(time)
 
         query = """
         SELECT channel_id, latitude, longitude, elevation_in_m,
             local_depth_in_m
         FROM indices
-        WHERE start_date <= %i
-          AND (end_date IS NULL OR end_date >= %i)
-        """ % (time, time)
+        WHERE start_date <= ?
+          AND (end_date IS NULL OR end_date >= ?)
+        """
 
-        results = self.db_cursor.execute(query).fetchall()
+        results = self.db_cursor.execute(query, (time, time)).fetchall()
 
         return {_i[0]: {
             "latitude": _i[1],
@@ -226,21 +236,19 @@ class StationCache(FileInfoCache):
         :param channel_id: The channel id.
         :param time: The time as a timestamp.
         """
-        try:
-            time = time.timestamp
-        except AttributeError:
-            pass
-        time = int(time)
+        time = _to_timestamp(time)
         sql_query = """
         SELECT files.filename FROM indices
         INNER JOIN files
         ON indices.filepath_id=files.id
-        WHERE (indices.channel_id = '%s') AND (indices.start_date < %i) AND
-            ((indices.end_date IS NULL) OR (indices.end_date > %i))
+        WHERE (indices.channel_id = ?) AND (indices.start_date < ?) AND
+            ((indices.end_date IS NULL) OR (indices.end_date > ?))
+        ORDER BY indices.id
         LIMIT 1;
-        """ % (channel_id, time, time)
+        """
         try:
-            result = self.db_cursor.execute(sql_query).fetchone()
+            result = self.db_cursor.execute(
+                sql_query, (channel_id, time, time)).fetchone()
         except sqlite3.Error:
             return None
         if result is None:
@@ -248,23 +256,66 @@ class StationCache(FileInfoCache):
         else:
             return os.path.normpath(os.path.join(self.root_folder, result[0]))
 
+    def get_station_files_and_coordinates(self, channels):
+        """
+        Resolves the station files and coordinates of many channels at once.
+
+        Same semantics as :meth:`.get_station_filename` but each batch of
+        channels is resolved with a single query.
+
+        :param channels: List of tuples of channel ids and times. The times
+            can be timestamps or :class:`~obspy.core.utcdatetime.UTCDateTime`
+            objects.
+        :returns: A list with one entry per channel. Each entry is a
+            dictionary with the ``"filename"`` and the coordinates or
+            ``None`` if no station file is available.
+        """
+        results = [None] * len(channels)
+        for offset in range(0, len(channels), CHANNEL_QUERY_BATCH_SIZE):
+            batch = channels[offset: offset + CHANNEL_QUERY_BATCH_SIZE]
+            sql_query = """
+            WITH requests(request_id, channel_id, time) AS (VALUES %s)
+            SELECT requests.request_id, files.filename, indices.latitude,
+                indices.longitude, indices.elevation_in_m,
+                indices.local_depth_in_m, MIN(indices.id)
+            FROM requests
+            INNER JOIN indices
+            ON (indices.channel_id = requests.channel_id) AND
+                (indices.start_date < requests.time) AND
+                ((indices.end_date IS NULL) OR
+                 (indices.end_date > requests.time))
+            INNER JOIN files
+            ON indices.filepath_id=files.id
+            GROUP BY requests.request_id;
+            """ % ", ".join(["(?, ?, ?)"] * len(batch))
+            arguments = []
+            for _i, (channel_id, time) in enumerate(batch):
+                arguments.extend([offset + _i, channel_id,
+                                  _to_timestamp(time)])
+            for row in self.db_cursor.execute(sql_query, arguments):
+                results[row[0]] = {
+                    "filename": os.path.normpath(
+                        os.path.join(self.root_folder, row[1])),
+                    "latitude": row[2],
+                    "longitude": row[3],
+                    "elevation_in_m": row[4],
+                    "local_depth_in_m": row[5]}
+        return results
+
     def get_channel_info(self, channel_id, time):
         """
         Returns some information for a certain channel and a certain time.
         """
-        try:
-            time = time.timestamp
-        except AttributeError:
-            pass
-        time = int(time)
+        time = _to_timestamp(time)
         sql_query = """
         SELECT id FROM indices
-        WHERE (channel_id = '%s') AND (start_date <=  %i) AND
-            ((end_date IS NULL) OR (end_date >= %i))
+        WHERE (channel_id = ?) AND (start_date <= ?) AND
+            ((end_date IS NULL) OR (end_date >= ?))
         LIMIT 1;
-        """ % (channel_id, time, time)
+        """
         # XXX: test
-        result = self.db_cursor.execute(sql_query).fetchone()
+        result = self.db_cursor.execute(
+            sql_query, (channel_id, time, time)).fetchone()
         return result
 
     def station_info_available(self, channel_id, time):
@@ -275,17 +326,14 @@ class StationCache(FileInfoCache):
         :param channel_id: The channel id.
         :param time: The time as a timestamp.
         """
-        try:
-            time = time.timestamp
-        except AttributeError:
-            pass
-        time = int(time)
+        time = _to_timestamp(time)
         sql_query = """
         SELECT id FROM indices
-        WHERE (channel_id = '%s') AND (start_date <=  %i) AND
-            ((end_date IS NULL) OR (end_date >= %i))
+        WHERE (channel_id = ?) AND (start_date <= ?) AND
+            ((end_date IS NULL) OR (end_date >= ?))
         LIMIT 1;
-        """ % (channel_id, time, time)
-        if self.db_cursor.execute(sql_query).fetchone():
+        """
+        if self.db_cursor.execute(sql_query,
+                                  (channel_id, time, time)).fetchone():
             return True
         return False
@@ -13,10 +13,10 @@ Cache taking care of a single waveform directory.
 
 import glob
 
-import obspy
 import os
 import warnings
 
+from lasif.file_handling.ses3d_file_parser import read_waveform_file
 from .file_info_cache import FileInfoCache
 
 
@@ -55,6 +55,10 @@ class WaveformCache(FileInfoCache):
         self.waveform_folder = waveform_folder
         self.synthetic_info = synthetic_info
 
+        # Waveform files are usually only added or removed, so unchanged
+        # folders do not have to be checked again.
+        self.monitored_folders = {"waveform": [self.waveform_folder]}
+
         super(WaveformCache, self).__init__(cache_db_file=cache_db_file,
                                             root_folder=root_folder,
                                             read_only=read_only,
@@ -90,6 +94,26 @@ class WaveformCache(FileInfoCache):
 
         return all_values
 
+    def get_file_hashes_for_station(self, network, station):
+        """
+        Returns a dictionary mapping the absolute filenames of all files of
+        a station to the CRC32 hashes of their content.
+
+        :type network: str
+        :param network: The network id.
+        :type station: str
+        :param station: The station id.
+        """
+        query = """
+        SELECT DISTINCT files.filename, files.crc32_hash
+        FROM files
+        INNER JOIN indices
+        ON files.id=indices.filepath_id
+        WHERE indices.network=? AND indices.station=?
+        """
+        return {os.path.abspath(os.path.join(self.root_folder, _i[0])): _i[1]
+                for _i in self.db_cursor.execute(query, (network, station))}
+
     def _find_files_waveform(self):
         return glob.glob(os.path.join(self.waveform_folder, "*"))
 
@@ -119,7 +143,7 @@ class WaveformCache(FileInfoCache):
                     None, None, None, None]]
 
         try:
-            st = obspy.read(filename, headonly=True)
+            st = read_waveform_file(filename, headonly=True)
         except BaseException:
             warnings.warn("Could not read waveform file '%s'." % filename)
             return None
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution store of the depth slices of a model.
+
+Browsing a model slice by slice requires each slice to be assembled from
+all boxes of the model. :class:`DepthSlicePyramid` stores every depth slice
+of a component once in depth-major order so a slice is a contiguous block
+of a memory-mapped file. Decimated copies of all slices make up the coarser
+levels of the pyramid; level ``n`` contains every ``2 ** n``-th point along
+both horizontal axes and is meant for quick previews. The minimum, maximum,
+and median of every full resolution slice are stored alongside.
+
+Each component is stored as one ``.npy`` file per level and a ``.json``
+file with the statistics and the key the pyramid has been created with.
+Pyramids with a different key are rebuilt.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# Increase whenever the layout of the pyramids changes.
+FORMAT_VERSION = 1
+
+# Levels are added until both horizontal axes of a level have at most this
+# many points.
+MAX_COARSEST_LEVEL_SIZE = 128
+
+
+def get_level_count(shape, max_size=MAX_COARSEST_LEVEL_SIZE):
+    """
+    Number of levels of a pyramid of slices with the given horizontal shape.
+
+    >>> get_level_count((100, 50))
+    1
+    >>> get_level_count((1001, 300))
+    4
+    """
+    count = 1
+    while max(shape) > max_size:
+        shape = [(_i + 1) // 2 for _i in shape]
+        count += 1
+    return count
+
+
+def get_files_key(filenames):
+    """
+    Key identifying the current state of a set of files. Modification
+    times are compared in nanoseconds so files rewritten in quick
+    succession get a new key.
+
+    :param filenames: The files.
+    """
+    state = [FORMAT_VERSION]
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        state.append([filename, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+class DepthSlicePyramid(object):
+    """
+    The depth slices of a single component at all levels.
+
+    :param levels: List of memory-mapped arrays, one per level, with shape
+        (depth, x, y).
+    :param statistics: Dictionary with the ``"min"``, ``"max"``, and
+        ``"median"`` of each full resolution depth slice.
+    """
+    def __init__(self, levels, statistics):
+        self.levels = levels
+        self.statistics = statistics
+
+    @property
+    def level_count(self):
+        return len(self.levels)
+
+    def get_slice(self, depth_index, level=0):
+        """
+        Returns a single depth slice.
+
+        :param depth_index: The index of the depth.
+        :param level: The level of the slice. Coarser levels are clipped to
+            the coarsest one.
+        """
+        return self.levels[min(level, self.level_count - 1)][depth_index]
+
+    def get_profile(self, x_index, y_index):
+        """
+        Returns the values at all depths of a point of the full resolution
+        level.
+
+        :param x_index: The index of the point along x.
+        :param y_index: The index of the point along y.
+        """
+        return np.array(self.levels[0][:, x_index, y_index])
+
+    def get_statistics(self, depth_index):
+        """
+        Returns the minimum, maximum, and median of a depth slice.
+
+        :param depth_index: The index of the depth.
+        """
+        return {key: value[depth_index]
+                for key, value in self.statistics.items()}
+
+
+class DepthSlicePyramidStore(object):
+    """
+    Folder of depth slice pyramids of the components of a single model.
+    """
+    def __init__(self, folder):
+        """
+        :param folder: The folder storing the pyramids.
+        """
+        self.folder = folder
+
+    def _get_filenames(self, component):
+        basename = os.path.join(self.folder, component.replace(" ", "_"))
+        return basename + "_level_%i" + os.path.extsep + "npy", \
+            basename + os.path.extsep + "json"
+
+    def get(self, component, key):
+        """
+        Returns the :class:`DepthSlicePyramid` of a component or ``None``
+        if it does not exist or has been built with a different key.
+
+        :param component: The name of the component.
+        :param key: The key the pyramid must have been built with.
+        """
+        data_files, header_file = self._get_filenames(component)
+        try:
+            with open(header_file, "rt") as fh:
+                header = json.load(fh)
+            if header["key"] != key:
+                return None
+            levels = [np.load(data_files % _i, mmap_mode="r")
+                      for _i in range(header["level_count"])]
+            statistics = {_k: np.array(_v)
+                          for _k, _v in header["statistics"].items()}
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return DepthSlicePyramid(levels=levels, statistics=statistics)
+
+    def build(self, component, key, shape, get_slice):
+        """
+        Builds, stores, and returns the :class:`DepthSlicePyramid` of a
+        component. Only a single depth slice is kept in memory at any time.
+
+        :param component: The name of the component.
+        :param key: The key identifying the model files.
+        :param shape: The shape of the component as (x, y, depth).
+        :param get_slice: Function returning the full resolution slice at a
+            depth index as an array of shape (x, y).
+        """
+        data_files, header_file = self._get_filenames(component)
+        if not os.path.exists(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                # Another process might have created it in the meanwhile.
+                if not os.path.exists(self.folder):
+                    raise
+
+        # Write atomically as other processes might read it. The header is
+        # removed first and written last so it only refers to complete data.
+        if os.path.exists(header_file):
+            os.remove(header_file)
+        suffix = "_%i.tmp" % os.getpid()
+
+        level_count = get_level_count(shape[:2])
+        levels = []
+        for _i in range(level_count):
+            step = 2 ** _i
+            levels.append(np.lib.format.open_memmap(
+                data_files % _i + suffix, mode="w+", dtype=np.float32,
+                shape=(shape[2], (shape[0] + step - 1) // step,
+                       (shape[1] + step - 1) // step)))
+
+        statistics = {"min": [], "max": [], "median": []}
+        for depth_index in range(shape[2]):
+            data = get_slice(depth_index)
+            for _i, level in enumerate(levels):
+                level[depth_index] = data[::2 ** _i, ::2 ** _i]
+            statistics["min"].append(float(data.min()))
+            statistics["max"].append(float(data.max()))
+            statistics["median"].append(float(np.median(data)))
+
+        for level in levels:
+            level.flush()
+        del levels, level
+        for _i in range(level_count):
+            os.rename(data_files % _i + suffix, data_files % _i)
+
+        with open(header_file + suffix, "wt") as fh:
+            json.dump({"key": key, "level_count": level_count,
+                       "statistics": statistics}, fh)
+        os.rename(header_file + suffix, header_file)
+
+        return self.get(component, key)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Helpers for embarrassingly parallel calculations using MPI. All functions
-works just fine when running on one core and not started with MPI.
+Helpers for embarrassingly parallel calculations using MPI or a local pool
+of processes. All functions works just fine when running on one core and not
+started with MPI.
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2014-2015
@@ -12,6 +13,7 @@ works just fine when running on one core and not started with MPI.
 """
 import collections
 import colorama
+import contextlib
 import functools
 import inspect
 import itertools
@@ -22,6 +24,8 @@ import warnings
 
 from mpi4py import MPI
 
+from lasif import LASIFWarning
+
 
 class FunctionInfo(collections.namedtuple(
     "FunctionInfo", ["func_args", "result", "warnings", "exception",
@@ -35,6 +39,78 @@ class FunctionInfo(collections.namedtuple(
     pass
 
 
+class BatchResults(list):
+    """
+    List of :class:`FunctionInfo` objects returned by a function processing
+    a batch of items at once, one for each item of the batch. The items are
+    logged and counted one by one.
+    """
+    pass
+
+
+class ItemWarning(LASIFWarning):
+    """
+    Warning raised while processing a single item of a batch. ``index`` is
+    the position of the item in the batch.
+    """
+    def __init__(self, index, message):
+        super(ItemWarning, self).__init__(index, message)
+        self.index = index
+        self.message = message
+
+    def __str__(self):
+        return str(self.message)
+
+
+@contextlib.contextmanager
+def item_warnings(*indices):
+    """
+    Context manager raising all warnings of the enclosed code again as
+    :class:`ItemWarning` objects for the items of a batch with the given
+    indices. Functions processing a batch of items at once use it so the
+    warnings can be attributed to the items with :func:`split_warnings`.
+
+    >>> with warnings.catch_warnings(record=True) as w:
+    ...     warnings.simplefilter("always")
+    ...     with item_warnings(1, 2):
+    ...         warnings.warn("Warning")
+    >>> [(_i.message.index, str(_i.message)) for _i in w]
+    [(1, 'Warning'), (2, 'Warning')]
+    """
+    try:
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            yield
+    finally:
+        # Warnings are raised again even if an exception occurred.
+        for warning in w:
+            for index in indices:
+                warnings.warn_explicit(
+                    ItemWarning(index, warning.message), ItemWarning,
+                    warning.filename, warning.lineno)
+
+
+def split_warnings(warning_list, count):
+    """
+    Splits the warnings recorded while processing a batch of ``count``
+    items into one list per item and a list of the remaining warnings not
+    belonging to any item.
+
+    :param warning_list: List of recorded :class:`warnings.WarningMessage`
+        objects.
+    :param count: The number of items of the batch.
+    """
+    item_warning_lists = [[] for _ in range(count)]
+    remaining = []
+    for warning in warning_list:
+        if isinstance(warning.message, ItemWarning) and \
+                0 <= warning.message.index < count:
+            item_warning_lists[warning.message.index].append(warning)
+        else:
+            remaining.append(warning)
+    return item_warning_lists, remaining
+
+
 def function_info(traceback_limit=10):
     """
     Decorator collecting information during the execution of a function.
@@ -63,7 +139,7 @@ def function_info(traceback_limit=10):
     >>> info.func_args
     {'a': 4, 'b': 1}
     >>> info.result
-    4
+    4.0
 
     ``warnings`` is empty if no warning has been raised. Otherwise it will
     collect all warnings.
@@ -124,105 +200,570 @@ def _execute_wrapped_function(func, parameters):
     return function_info()(func)(**parameters)
 
 
-def distribute_across_ranks(function, items, get_name, logfile):
+# The available backends to distribute the work.
+BACKENDS = ("mpi", "process_pool", "serial")
+
+# Number of items read ahead and results waiting to be written behind by
+# each worker when the work is pipelined.
+PIPELINE_DEPTH = 4
+
+# Number of items handed out at once if the total number of items is not
+# known upfront.
+STREAMING_CHUNK_SIZE = 8
+
+# MPI message tags used by the dynamic scheduler. Workers send their results
+# (and thus ask for more work) with the first, the master answers with the
+# next chunk of work with the second.
+_TAG_RESULTS = 1
+_TAG_WORK = 2
+
+
+def _get_chunk_size(remaining, worker_count, chunk_size=None):
     """
-    Calls a function once for each item.
+    Determines how many items the next chunk handed to a worker contains.
+
+    Without a fixed ``chunk_size`` this uses guided self-scheduling: each
+    chunk is a fraction of the remaining work. Chunks are large at the
+    beginning to keep the communication overhead small and get smaller
+    towards the end so that no rank is left with a big pile of work while
+    all others are already done.
+
+    >>> _get_chunk_size(1000, 4)
+    125
+    >>> _get_chunk_size(3, 4)
+    1
+    >>> _get_chunk_size(0, 4)
+    0
+    >>> _get_chunk_size(1000, 4, chunk_size=10)
+    10
+    >>> _get_chunk_size(5, 4, chunk_size=10)
+    5
+    """
+    if remaining <= 0:
+        return 0
+    if chunk_size:
+        return min(chunk_size, remaining)
+    return max(1, remaining // (2 * worker_count))
 
-    It will be distributed across MPI ranks if launched with MPI.
 
-    :param function: The function to be executed for each item.
-    :param items: The function will be executed once for each item. It
-        expects a list of dictionaries so that ``function(**item)`` can work.
-        Only rank 0 needs to pass this. It will be ignored coming from other
-        ranks.
-    :param get_name: Function to extract a name for each item to be able to
-        produce better logfiles.
-    :param logfile: The logfile to write.
+def _write_behind(write_behind, info):
+    """
+    Helper function passing the result of a function execution to the
+    write stage of the pipeline. A failure to write is recorded in the
+    returned :class:`FunctionInfo` object.
+    """
+    if info.exception:
+        return info
+    try:
+        return write_behind(info)
+    except Exception as e:
+        return info._replace(result=None, exception=e,
+                             traceback=traceback.format_exc())
+
+
+def _strip_read_ahead(item, info):
+    """
+    Returns the :class:`FunctionInfo` object of a failed item with the
+    arguments the item had before the read-ahead stage so data read ahead
+    is not kept around. Successful items are returned unchanged as the
+    write-behind stage takes care of them.
+
+    >>> info = FunctionInfo(func_args={"a": "data"}, result=None,
+    ...     warnings=[], exception=ValueError(), traceback="")
+    >>> _strip_read_ahead({"a": "file"}, info).func_args
+    {'a': 'file'}
     """
-    def split(container, count):
+    if not info.exception:
+        return info
+    return info._replace(func_args=dict(info.func_args, **item))
+
+
+def _execute_pipelined(function, items, read_ahead=None, write_behind=None):
+    """
+    Executes the function for each item and yields the resulting
+    :class:`FunctionInfo` objects in order.
+
+    If given, ``read_ahead(item)`` is called on a background thread for up
+    to :data:`PIPELINE_DEPTH` items ahead of the current one and returns
+    the item the function is called with. ``write_behind(info)`` is called
+    on another background thread with the result of every function
+    execution and returns the final :class:`FunctionInfo` object. Up to
+    :data:`PIPELINE_DEPTH` results wait to be written. The items are
+    always iterated in the calling thread. Failed items are returned with
+    the arguments they had before the read-ahead stage.
+
+    >>> list(_execute_pipelined(lambda a: a * 2, [{"a": 1}, {"a": 2}],
+    ...     read_ahead=lambda x: {"a": x["a"] + 1},
+    ...     write_behind=lambda x: x._replace(result=-x.result)))[1].result
+    -6
+    """
+    if read_ahead is None and write_behind is None:
+        for item in items:
+            yield _execute_wrapped_function(function, item)
+        return
+
+    import concurrent.futures
+
+    items = iter(items)
+    pending_reads = collections.deque()
+    pending_writes = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as reader, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+
+        def read_more():
+            while len(pending_reads) < PIPELINE_DEPTH:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                pending_reads.append((item, reader.submit(
+                    read_ahead, item) if read_ahead else None))
+
+        read_more()
+        while pending_reads:
+            item, future = pending_reads.popleft()
+            read_more()
+            try:
+                read_item = future.result() if future is not None else item
+            except Exception as e:
+                info = FunctionInfo(func_args=item, result=None, warnings=[],
+                                    exception=e,
+                                    traceback=traceback.format_exc())
+            else:
+                info = _execute_wrapped_function(function, read_item)
+
+            if write_behind is None:
+                yield _strip_read_ahead(item, info)
+                continue
+
+            pending_writes.append((item, writer.submit(
+                _write_behind, write_behind, info)))
+            while pending_writes and (
+                    len(pending_writes) > PIPELINE_DEPTH or
+                    pending_writes[0][1].done()):
+                item, future = pending_writes.popleft()
+                yield _strip_read_ahead(item, future.result())
+
+        while pending_writes:
+            item, future = pending_writes.popleft()
+            yield _strip_read_ahead(item, future.result())
+
+
+def _get_length(items):
+    """
+    Returns the number of items or ``None`` if it is not known upfront.
+    """
+    try:
+        return len(items)
+    except TypeError:
+        return None
+
+
+def _print_progress(count, total_length):
+    if total_length is None:
+        print("%i items have been processed." % count)
+    else:
+        print("%i of %i items have been processed." % (count, total_length))
+
+
+class _ResultLogger(object):
+    """
+    Writes the results of the function executions to the logfile as soon as
+    they are available and keeps track of how many succeeded, failed, or
+    raised warnings.
+    """
+    def __init__(self, logfile, get_name):
+        self.logfile = logfile
+        self.get_name = get_name
+        self.results = []
+        # Batches count with their single items.
+        self.item_count = 0
+        self._batched = False
+        self.successful_file_count = 0
+        self.warning_file_count = 0
+        self.failed_file_count = 0
+        self._fh = open(logfile, "wt")
+
+    def log(self, results):
+        """
+        Log a list of :class:`FunctionInfo` objects.
+        """
+        for result in results:
+            if isinstance(result.result, BatchResults):
+                self._batched = True
+                # Warnings not belonging to any item of the batch are only
+                # written to the logfile.
+                self._fh.write("\n============\nBatch: %s" %
+                               self.get_name(result.func_args))
+                for w in result.warnings:
+                    self._fh.write("\nWarning: %s\n" % str(w))
+                for item in result.result:
+                    self._log_item(item)
+            else:
+                self._log_item(result)
+        # Flush so the progress can be followed in the logfile.
+        self._fh.flush()
+        self.results.extend(results)
+
+    def _log_item(self, result):
+        self._fh.write("\n============\nItem: %s" %
+                       self.get_name(result.func_args))
+        self.item_count += 1
+        if result.exception:
+            self._fh.write("\n")
+            self._fh.write(result.traceback)
+            self.failed_file_count += 1
+        elif result.warnings:
+            for w in result.warnings:
+                self._fh.write("\nWarning: %s\n" % str(w))
+            self.warning_file_count += 1
+        else:
+            self._fh.write(" - SUCCESS")
+            self.successful_file_count += 1
+
+    def print_progress(self, total_length):
         """
-        Simple and elegant function splitting a container into count
-        equal chunks.
-
-        Order is not preserved but for the use case at hand this is
-        potentially an advantage as data sitting in the same folder thus
-        have a higher at being processed at the same time thus the disc
-        head does not have to jump around so much. Of course very
-        architecture dependent.
+        Print how many items have been logged. ``total_length`` counts the
+        work items so it is not printed once batches have been logged.
         """
-        return [container[_i::count] for _i in range(count)]
+        _print_progress(self.item_count,
+                        None if self._batched else total_length)
+
+    def close(self):
+        """
+        Close the logfile and print a summary.
+        """
+        self._fh.close()
+
+        print("\nFinished processing %i items. See the logfile for "
+              "details.\n" % self.item_count)
+        print("\t%s%i files failed being processed.%s" %
+              (colorama.Fore.RED, self.failed_file_count,
+               colorama.Fore.RESET))
+        print("\t%s%i files raised warnings while being processed.%s" %
+              (colorama.Fore.YELLOW, self.warning_file_count,
+               colorama.Fore.RESET))
+        print("\t%s%i files have been processed without errors or "
+              "warnings%s" % (colorama.Fore.GREEN, self.successful_file_count,
+                              colorama.Fore.RESET))
+
+        print("\nLogfile written to '%s'." % os.path.relpath(self.logfile))
+
+
+def _split(container, count):
+    """
+    Simple and elegant function splitting a container into count
+    equal chunks.
+
+    Order is not preserved but for the use case at hand this is
+    potentially an advantage as data sitting in the same folder thus
+    have a higher at being processed at the same time thus the disc
+    head does not have to jump around so much. Of course very
+    architecture dependent.
+    """
+    return [container[_i::count] for _i in range(count)]
+
+
+def _distribute_static(function, items, get_name, logfile, read_ahead=None,
+                       write_behind=None):
+    """
+    Splits the items into one equal chunk per rank upfront and gathers all
+    results at the end.
+    """
+    comm = MPI.COMM_WORLD
 
     # Rank zero collects what needs to be done and distributes it across
     # all cores.
-    if MPI.COMM_WORLD.rank == 0:
+    if comm.rank == 0:
+        items = list(items)
         total_length = len(items)
-        items = split(items, MPI.COMM_WORLD.size)
+        items = _split(items, comm.size)
     else:
         items = None
 
-    # Now each rank knows what it has to process. This still works
-    # nicely with only one core, the overhead is negligible.
-    items = MPI.COMM_WORLD.scatter(items, root=0)
+    # Now each rank knows what it has to process.
+    items = comm.scatter(items, root=0)
 
     results = []
+    for _i, result in enumerate(_execute_pipelined(
+            function, items, read_ahead, write_behind)):
+        results.append(result)
 
-    for _i, item in enumerate(items):
-        results.append(_execute_wrapped_function(function, item))
-
-        if MPI.COMM_WORLD.rank == 0:
-            print(("Approximately %i of %i items have been processed." % (
-                min((_i + 1) * MPI.COMM_WORLD.size, total_length),
-                total_length))
-    # print(results)
+        if comm.rank == 0:
+            print("Approximately %i of %i items have been processed." % (
+                min((_i + 1) * comm.size, total_length), total_length))
 
-    results=MPI.COMM_WORLD.gather(results, root=0)
+    results = comm.gather(results, root=0)
 
-    if MPI.COMM_WORLD.rank != 0:
+    if comm.rank != 0:
         return
 
-    results=list(itertools.chain.from_iterable(results))
+    logger = _ResultLogger(logfile, get_name)
+    try:
+        logger.log(list(itertools.chain.from_iterable(results)))
+    finally:
+        logger.close()
+    return logger.results
 
-    successful_file_count=0
-    warning_file_count=0
-    failed_file_count=0
-    total_file_count=len(results)
 
-    # Log the results.
-    with open(logfile, "wt") as fh:
-        for result in results:
-            fh.write("\n============\nItem: %s" % get_name(result.func_args))
-            has_exception=False
-            has_warning=False
-            if result.exception:
-                has_exception=True
-                fh.write("\n")
-                fh.write(result.traceback)
-            elif result.warnings:
-                has_warning=True
-                for w in result.warnings:
-                    fh.write("\nWarning: %s\n" % str(w))
-            else:
-                fh.write(" - SUCCESS")
+def _distribute_dynamic(function, items, get_name, logfile, chunk_size,
+                        read_ahead=None, write_behind=None):
+    """
+    Master/worker scheduling. Rank 0 hands out chunks of items to the
+    other ranks whenever they ask for more work and logs the results they
+    send back with each request.
+
+    Items that are not a sequence are only generated once a worker asks
+    for them.
+
+    Each call communicates on its own duplicate of the world communicator
+    so messages of consecutive calls cannot be mixed up.
+    """
+    comm = MPI.COMM_WORLD.Dup()
+    try:
+        return _schedule_dynamic(comm, function, items, get_name, logfile,
+                                 chunk_size, read_ahead, write_behind)
+    finally:
+        comm.Free()
+
 
-            if has_exception:
-                failed_file_count += 1
-            elif has_warning:
-                warning_file_count += 1
+def _schedule_dynamic(comm, function, items, get_name, logfile, chunk_size,
+                      read_ahead=None, write_behind=None):
+    """
+    Runs the master/worker scheduling of :func:`_distribute_dynamic` on the
+    given communicator.
+    """
+    worker_count = comm.size - 1
+
+    # Worker ranks: Send the results of the last chunk (nothing at the
+    # beginning) and receive the next chunk until there is nothing left.
+    if comm.rank != 0:
+        results = []
+        while True:
+            comm.send(results, dest=0, tag=_TAG_RESULTS)
+            chunk = comm.recv(source=0, tag=_TAG_WORK)
+            if chunk is None:
+                break
+            results = list(_execute_pipelined(function, chunk, read_ahead,
+                                              write_behind))
+        return
+
+    total_length = _get_length(items)
+    if total_length is None:
+        items = iter(items)
+        chunk_size = chunk_size or STREAMING_CHUNK_SIZE
+    position = 0
+    active_workers = worker_count
+    status = MPI.Status()
+
+    logger = _ResultLogger(logfile, get_name)
+    try:
+        while active_workers:
+            results = comm.recv(source=MPI.ANY_SOURCE, tag=_TAG_RESULTS,
+                                status=status)
+            if results:
+                logger.log(results)
+                logger.print_progress(total_length)
+
+            if total_length is None:
+                chunk = list(itertools.islice(items, chunk_size))
             else:
-                successful_file_count += 1
-
-        print(("\nFinished processing %i items. See the logfile for "
-              "details.\n" % total_file_count))
-        print(("\t%s%i files failed being processed.%s" %
-              (colorama.Fore.RED, failed_file_count,
-               colorama.Fore.RESET)))
-        print(("\t%s%i files raised warnings while being processed.%s" %
-              (colorama.Fore.YELLOW, warning_file_count,
-               colorama.Fore.RESET)))
-        print(("\t%s%i files have been processed without errors or warnings%s" %
-              (colorama.Fore.GREEN, successful_file_count,
-               colorama.Fore.RESET)))
-
-        print(("\nLogfile written to '%s'." % os.path.relpath(logfile)))
-
-    return results
+                count = _get_chunk_size(total_length - position,
+                                        worker_count, chunk_size)
+                chunk = items[position:position + count]
+                position += count
+            if not chunk:
+                # Tells the worker to stop.
+                chunk = None
+                active_workers -= 1
+            comm.send(chunk, dest=status.Get_source(), tag=_TAG_WORK)
+    finally:
+        logger.close()
+
+    return logger.results
+
+
+def _distribute_serial(function, items, get_name, logfile, read_ahead=None,
+                       write_behind=None):
+    """
+    Processes all items one after the other in the current process.
+    """
+    total_length = _get_length(items)
+    logger = _ResultLogger(logfile, get_name)
+    try:
+        for result in _execute_pipelined(function, items, read_ahead,
+                                         write_behind):
+            logger.log([result])
+            logger.print_progress(total_length)
+    finally:
+        logger.close()
+    return logger.results
+
+
+def _execute_chunk(function, chunk, read_ahead=None, write_behind=None):
+    """
+    Helper function executing a chunk of items in a pool process.
+    """
+    return list(_execute_pipelined(function, chunk, read_ahead,
+                                   write_behind))
+
+
+def _distribute_process_pool(function, items, get_name, logfile, processes,
+                             chunk_size=None, read_ahead=None,
+                             write_behind=None):
+    """
+    Processes the items with a pool of local processes. Results are logged
+    in the order in which they finish.
+
+    The items are handed to the pool in chunks and only a few chunks per
+    process are submitted at any time so items can be generated while the
+    pool is already working.
+    """
+    import concurrent.futures
+    import multiprocessing
+
+    # Prefer forking as the project specific functions are not importable
+    # by name and thus only available in forked processes.
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        context = None
+
+    if not chunk_size:
+        chunk_size = STREAMING_CHUNK_SIZE \
+            if read_ahead or write_behind else 1
+    max_pending = 2 * (processes or multiprocessing.cpu_count())
+
+    total_length = _get_length(items)
+    items = iter(items)
+    logger = _ResultLogger(logfile, get_name)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, mp_context=context) as executor:
+            futures = {}
+            while True:
+                while len(futures) < max_pending:
+                    chunk = list(itertools.islice(items, chunk_size))
+                    if not chunk:
+                        break
+                    futures[executor.submit(
+                        _execute_chunk, function, chunk, read_ahead,
+                        write_behind)] = chunk
+                if not futures:
+                    break
+                done, _ = concurrent.futures.wait(
+                    futures,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    chunk = futures.pop(future)
+                    try:
+                        results = future.result()
+                    # Happens if the result cannot be pickled or the worker
+                    # process died.
+                    except Exception as e:
+                        results = [FunctionInfo(
+                            func_args=item, result=None, warnings=[],
+                            exception=e, traceback=traceback.format_exc())
+                            for item in chunk]
+                    logger.log(results)
+                    logger.print_progress(total_length)
+    finally:
+        logger.close()
+    return logger.results
+
+
+def distribute_across_ranks(function, items, get_name, logfile,
+                            scheduling="dynamic", chunk_size=None,
+                            backend="mpi", processes=None, read_ahead=None,
+                            write_behind=None):
+    """
+    Calls a function once for each item.
+
+    Three backends are available:
+
+    * ``"mpi"``: The work is distributed across MPI ranks if launched with
+      MPI, otherwise all items are processed in serial.
+    * ``"process_pool"``: The work is distributed across a pool of
+      processes on the local machine. Must not be launched with MPI.
+    * ``"serial"``: All items are processed one after the other in the
+      current process. Must not be launched with MPI.
+
+    The ``"mpi"`` backend has two scheduling strategies:
+
+    * ``"dynamic"``: Rank 0 acts as the master and hands out chunks of
+      items to all other ranks as soon as these finished their previous
+      chunk. The results are sent back with every request for more work
+      and written to the logfile as they arrive. This balances the load if
+      the items take very different amounts of time to process.
+    * ``"static"``: The items are split into equally sized chunks upfront,
+      one for each rank. The results are only collected once every rank is
+      done.
+
+    All backends write the same logfile and print the same summary.
+
+    Each rank or process can additionally pipeline its work: the
+    ``read_ahead`` stage prepares the next items on a background thread,
+    e.g. reads their input files, while the current item is processed. The
+    ``write_behind`` stage receives the results on another background
+    thread, e.g. to write output files. Both are connected to the
+    computation by queues holding at most :data:`PIPELINE_DEPTH` items.
+
+    :param function: The function to be executed for each item.
+    :param items: The function will be executed once for each item. It
+        expects a list or any other iterable of dictionaries so that
+        ``function(**item)`` can work. Items of iterables are only generated
+        once they are needed with the ``"mpi"`` backend and its dynamic
+        scheduling and with the ``"process_pool"`` and ``"serial"``
+        backends. Only rank 0 needs to pass this. It will be ignored coming
+        from other ranks.
+    :param get_name: Function to extract a name for each item to be able to
+        produce better logfiles.
+    :param logfile: The logfile to write.
+    :param scheduling: ``"dynamic"`` or ``"static"``.
+    :param chunk_size: Fixed number of items handed out per request with
+        the dynamic scheduling and the ``"process_pool"`` backend. If not
+        given, the chunks shrink as the remaining work shrinks. Iterables
+        and pipelined work are handed out in chunks of
+        :data:`STREAMING_CHUNK_SIZE` items.
+    :param backend: ``"mpi"``, ``"process_pool"``, or ``"serial"``.
+    :param processes: The number of processes for the ``"process_pool"``
+        backend. Defaults to the number of cores of the machine.
+    :param read_ahead: Function called with each item on a background
+        thread before it is processed. Returns the item passed to
+        ``function``. Failed items are logged with their arguments before
+        this stage.
+    :param write_behind: Function called with the :class:`FunctionInfo`
+        object of each successful execution on a background thread.
+        Returns the :class:`FunctionInfo` object to be logged. Exceptions
+        are logged as failures of the item.
+
+    Functions processing a batch of items at once can return a
+    :class:`BatchResults` list. The items of the batch are then logged and
+    counted in the summary one by one with ``get_name`` being called with
+    their ``func_args``. Warnings of single items are best recorded with
+    :func:`item_warnings` and attributed with :func:`split_warnings`.
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend '%s'. Must be one of: %s" % (
+            backend, ", ".join(BACKENDS)))
+    if scheduling not in ("dynamic", "static"):
+        raise ValueError("Unknown scheduling '%s'. Must be 'dynamic' or "
+                         "'static'." % scheduling)
+
+    if MPI.COMM_WORLD.size > 1:
+        if backend != "mpi":
+            raise ValueError("The '%s' backend cannot be used when running "
+                             "with MPI." % backend)
+        if scheduling == "static":
+            return _distribute_static(function, items, get_name, logfile,
+                                      read_ahead, write_behind)
+        return _distribute_dynamic(function, items, get_name, logfile,
+                                   chunk_size, read_ahead, write_behind)
+
+    if backend == "process_pool":
+        return _distribute_process_pool(function, items, get_name, logfile,
+                                        processes, chunk_size, read_ahead,
+                                        write_behind)
+    return _distribute_serial(function, items, get_name, logfile,
+                              read_ahead, write_behind)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Caches for the instrument correction.
+
+Parsing SEED and especially StationXML files takes longer than the actual
+instrument correction and the same file is needed for every component of a
+station and for every event. :class:`ResponseCache` keeps the most recently
+parsed station files in memory and stores the inverted and pre-filtered
+response spectra on disk so they are only computed once for each channel
+epoch and processing setup.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+
+# Number of parsed station files kept in memory per process.
+STATION_FILE_CACHE_SIZE = 64
+
+# Number of response spectra kept in memory per process.
+RESPONSE_SPECTRUM_CACHE_SIZE = 256
+
+# One response cache per folder and process.
+_RESPONSE_CACHES = {}
+
+
+def get_response_cache(folder=None):
+    """
+    Returns the response cache for the given folder in the current process.
+    Response spectra are only kept in memory if no folder is given.
+
+    :param folder: The folder storing the response spectra.
+    """
+    key = (folder, os.getpid())
+    if key not in _RESPONSE_CACHES:
+        _RESPONSE_CACHES[key] = ResponseCache(folder)
+    return _RESPONSE_CACHES[key]
+
+
+class _LRUDict(collections.OrderedDict):
+    """
+    Ordered dictionary discarding the least recently used items.
+    """
+    def __init__(self, size_limit):
+        self.size_limit = size_limit
+        super(_LRUDict, self).__init__()
+
+    def get_item(self, key):
+        value = self[key]
+        self.move_to_end(key)
+        return value
+
+    def set_item(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.size_limit:
+            self.popitem(last=False)
+
+
+class ResponseCache(object):
+    """
+    In-process LRU cache of parsed station files and of response spectra
+    backed by files in a folder.
+
+    Station files are identified by their name, size, and modification
+    time so changed files are parsed again.
+    """
+    def __init__(self, folder=None):
+        """
+        :param folder: The folder storing the response spectra. They are
+            only kept in memory if not given.
+        """
+        self.folder = folder
+        if self.folder and not os.path.exists(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                # Another process might have created it in the meanwhile.
+                if not os.path.exists(self.folder):
+                    raise
+        self._station_files = _LRUDict(STATION_FILE_CACHE_SIZE)
+        self._spectra = _LRUDict(RESPONSE_SPECTRUM_CACHE_SIZE)
+
+    @staticmethod
+    def _get_file_key(filename):
+        stat = os.stat(filename)
+        return (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+    def get_station_file(self, filename):
+        """
+        Returns the parsed station file. SEED files result in a
+        :class:`~obspy.io.xseed.Parser` object, StationXML files in a
+        :class:`~obspy.core.inventory.Inventory` object.
+
+        :param filename: The station file.
+        """
+        key = self._get_file_key(filename)
+        try:
+            return self._station_files.get_item(key)
+        except KeyError:
+            pass
+
+        if "/SEED/" in filename:
+            from obspy.io.xseed import Parser
+            parsed = Parser(filename)
+        else:
+            import obspy
+            parsed = obspy.read_inventory(filename, format="stationxml")
+        self._station_files.set_item(key, parsed)
+        return parsed
+
+    def get_response(self, filename, channel_id, time):
+        """
+        Returns the :class:`~obspy.core.inventory.response.Response` and the
+        start and end date of the epoch of a channel.
+
+        :param filename: The station file.
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA.
+        :param time: The time at which to get the response.
+        """
+        parsed = self.get_station_file(filename)
+        if "/SEED/" in filename:
+            for channel in parsed.get_inventory()["channels"]:
+                if channel["channel_id"] != channel_id or \
+                        channel["start_date"] > time or \
+                        (channel["end_date"] and channel["end_date"] < time):
+                    continue
+                return (parsed.get_response_for_channel(channel_id, time),
+                        channel["start_date"], channel["end_date"])
+        else:
+            network, station, location, channel_code = channel_id.split(".")
+            inv = parsed.select(network=network, station=station,
+                                location=location, channel=channel_code,
+                                time=time)
+            for channel in [c for n in inv for s in n for c in s]:
+                return channel.response, channel.start_date, \
+                    channel.end_date
+        raise ValueError("No response for channel '%s' at %s in '%s'." % (
+            channel_id, time, filename))
+
+    def get_response_spectrum(self, filename, channel_id, time, npts, dt,
+                              output="VEL", pre_filt=None, water_level=60.0):
+        """
+        Returns the inverted response spectrum multiplied with the
+        frequency domain pre-filter exactly as applied by
+        :meth:`obspy.core.trace.Trace.remove_response`, or ``None`` for
+        polynomial responses.
+
+        The spectra are keyed by the station file, the channel, its epoch,
+        the FFT length, the sampling interval, the output units, the
+        pre-filter, and the water level.
+
+        :param filename: The station file.
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA.
+        :param time: A time within the epoch of the channel.
+        :param npts: The number of samples of the data.
+        :param dt: The sampling interval of the data.
+        :param output: The output units.
+        :param pre_filt: The four corner frequencies of the pre-filter.
+        :param water_level: The water level in dB.
+        """
+        from obspy.signal.util import _npts2nfft
+
+        nfft = _npts2nfft(npts)
+        response, start_date, end_date = self.get_response(
+            filename, channel_id, time)
+
+        key = self._get_file_key(filename) + (
+            channel_id, str(start_date), str(end_date), nfft, float(dt),
+            output, tuple(pre_filt) if pre_filt else None, water_level)
+        try:
+            return self._spectra.get_item(key)
+        except KeyError:
+            pass
+
+        spectrum_file = None
+        if self.folder:
+            spectrum_file = os.path.join(
+                self.folder, "%s.npy" % hashlib.sha1(
+                    repr(key).encode("utf-8")).hexdigest())
+            if os.path.exists(spectrum_file):
+                spectrum = np.load(spectrum_file)
+                self._spectra.set_item(key, spectrum)
+                return spectrum
+
+        spectrum = self._compute_spectrum(response, nfft, dt, output,
+                                          pre_filt, water_level)
+        if spectrum_file and spectrum is not None:
+            # Write atomically as other processes might read it.
+            temp_file = "%s_%i.tmp.npy" % (spectrum_file[:-4], os.getpid())
+            np.save(temp_file, spectrum)
+            os.rename(temp_file, spectrum_file)
+        self._spectra.set_item(key, spectrum)
+        return spectrum
+
+    @staticmethod
+    def _compute_spectrum(response, nfft, dt, output, pre_filt,
+                          water_level):
+        from obspy.signal.invsim import cosine_sac_taper, invert_spectrum
+
+        if not response.response_stages or \
+                type(response.response_stages[0]).__name__ == \
+                "PolynomialResponseStage":
+            return None
+
+        freq_response, freqs = response.get_evalresp_response(
+            dt, nfft, output=output)
+        if water_level is None:
+            freq_response[0] = 0.0
+            freq_response[1:] = 1.0 / freq_response[1:]
+        else:
+            invert_spectrum(freq_response, water_level)
+        if pre_filt:
+            freq_response *= cosine_sac_taper(freqs, flimit=pre_filt)
+        return freq_response
+
+    def remove_response(self, tr, filename, output="VEL", pre_filt=None,
+                        water_level=60.0):
+        """
+        Removes the instrument response of a trace in place. Same as
+        :meth:`obspy.core.trace.Trace.remove_response` without the time
+        domain pre-processing but using cached responses.
+
+        :param tr: The trace.
+        :param filename: The station file.
+        :param output: The output units.
+        :param pre_filt: The four corner frequencies of the pre-filter.
+        :param water_level: The water level in dB.
+        """
+        from obspy.signal.util import _npts2nfft
+
+        npts = len(tr.data)
+        spectrum = self.get_response_spectrum(
+            filename, tr.id, tr.stats.starttime, npts, tr.stats.delta,
+            output=output, pre_filt=pre_filt, water_level=water_level)
+        if spectrum is None:
+            # Polynomial responses are cheap to remove.
+            response = self.get_response(filename, tr.id,
+                                         tr.stats.starttime)[0]
+            tr.stats.response = response
+            tr.remove_response(output=output, pre_filt=pre_filt,
+                               water_level=water_level, zero_mean=False,
+                               taper=False)
+            return tr
+
+        data = np.fft.rfft(tr.data.astype(np.float64), n=_npts2nfft(npts))
+        data *= spectrum
+        data[-1] = abs(data[-1]) + 0.0j
+        tr.data = np.fft.irfft(data)[0:npts]
+        return tr
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Summation and smoothing of SES3D kernels.
+
+SES3D writes one file per subdomain (box) and parameter. Each file is a
+single Fortran record with the float32 values of all GLL points of all
+elements of the box. The kernels of all events share the same boxes so
+summing them does not require any knowledge of the layout: the boxes are
+memory-mapped and accumulated one after the other.
+
+Smoothing acts on the GLL grid of the whole model with a separable Gaussian
+along its three axes. Each box is smoothed on its own by reading the box
+and the halo of neighbouring points within the truncation radius of the
+Gaussian. The functions summing and smoothing a single box are independent
+of each other so they can be distributed across ranks or processes.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import numpy as np
+
+
+def read_box_file(filename):
+    """
+    Memory-maps the values of a box file as a flat float32 array.
+
+    :param filename: The box file.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as fh:
+        marker = np.fromfile(fh, dtype=np.int32, count=1)
+    if size < 8 or len(marker) != 1 or marker[0] != size - 8:
+        msg = "'%s' is not a single Fortran record." % filename
+        raise ValueError(msg)
+    return np.memmap(filename, dtype=np.float32, mode="r", offset=4,
+                     shape=((size - 8) // 4,))
+
+
+def write_box_file(filename, data):
+    """
+    Writes the values of a box as a single Fortran record. The file is
+    written to a temporary file first and then moved.
+
+    :param filename: The box file.
+    :param data: The values of the box. Multi-dimensional arrays are
+        written in Fortran order.
+    """
+    data = np.require(data, dtype=np.float32)
+    marker = np.array([data.nbytes], dtype=np.int32)
+    temp_filename = filename + "_%i.tmp" % os.getpid()
+    with open(temp_filename, "wb") as fh:
+        fh.write(marker.tobytes())
+        fh.write(data.tobytes(order="F"))
+        fh.write(marker.tobytes())
+    os.rename(temp_filename, filename)
+
+
+def points_to_box(data, lpd):
+    """
+    Converts the values at the GLL points of a box without duplicates to
+    the layout of the box files. It is the inverse of
+    :meth:`lasif.ses3d_models.RawSES3DModelHandler._read_single_box`.
+
+    Returns an array with shape (nx, ny, nz, lpd + 1, lpd + 1, lpd + 1).
+
+    :param data: The values with shape (nx * lpd + 1, ny * lpd + 1,
+        nz * lpd + 1).
+    :param lpd: The Lagrange polynomial degree.
+
+    >>> data = np.arange(5 * 3 * 3).reshape((5, 3, 3))
+    >>> box = points_to_box(data, lpd=2)
+    >>> box.shape
+    (2, 1, 1, 3, 3, 3)
+    >>> # Points on the element boundary appear in both elements.
+    >>> bool(box[0, 0, 0, 2, 1, 1] == box[1, 0, 0, 0, 1, 1] == data[2, 1, 1])
+    True
+    """
+    indices = []
+    for axis, count in enumerate(data.shape):
+        element_count = (count - 1) // lpd
+        index = np.arange(element_count)[:, None] * lpd + \
+            np.arange(lpd + 1)[None, :]
+        # The z axis is stored upside down.
+        if axis == 2:
+            index = count - 1 - index
+        indices.append(index)
+    x, y, z = indices
+    return data[x[:, None, None, :, None, None],
+                y[None, :, None, None, :, None],
+                z[None, None, :, None, None, :]]
+
+
+def get_gaussian_smoothing_weights(coordinates, sigma, truncate=3.0):
+    """
+    Weights of a Gaussian smoothing along an axis with arbitrarily spaced
+    points. Row ``i`` contains the weights of all points for the smoothed
+    value at point ``i``. Weights beyond ``truncate`` standard deviations
+    are zero and every row sums up to one.
+
+    :param coordinates: The coordinates of the points.
+    :param sigma: The standard deviation of the Gaussian in units of the
+        coordinates.
+    :param truncate: Truncate the Gaussian at this many standard
+        deviations.
+
+    >>> weights = get_gaussian_smoothing_weights(np.arange(10.0), 1.0)
+    >>> bool(np.allclose(weights.sum(axis=1), 1.0))
+    True
+    >>> print(weights[0, 3] > 0.0, weights[0, 4])
+    True 0.0
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    distance = np.abs(coordinates[:, None] - coordinates[None, :])
+    weights = np.exp(-0.5 * (distance / sigma) ** 2)
+    weights[distance > truncate * sigma] = 0.0
+    weights /= weights.sum(axis=1)[:, None]
+    return weights
+
+
+def get_smoothing_weights(handler, horizontal_smoothing_in_degree=None,
+                          vertical_smoothing_in_km=None):
+    """
+    Returns the smoothing weights along the x, y, and z axis of the GLL grid
+    of a model. Axes without smoothing have ``None``.
+
+    :param handler: The
+        :class:`~lasif.ses3d_models.RawSES3DModelHandler` of the model.
+    :param horizontal_smoothing_in_degree: The standard deviation of the
+        Gaussian along the latitude and longitude axes of the grid.
+    :param vertical_smoothing_in_km: The standard deviation of the Gaussian
+        along the depth axis of the grid.
+    """
+    # The x axis runs from north to south.
+    coordinates = (handler.collocation_points_lats[::-1],
+                   handler.collocation_points_lngs,
+                   handler.collocation_points_depth)
+    sigmas = (horizontal_smoothing_in_degree,
+              horizontal_smoothing_in_degree,
+              vertical_smoothing_in_km)
+    return [get_gaussian_smoothing_weights(_c, _s) if _s else None
+            for _c, _s in zip(coordinates, sigmas)]
+
+
+def sum_kernel_subdomain(subdomain, filenames, output_folder):
+    """
+    Sums the box files of a single subdomain of the kernels of multiple
+    events. The values are accumulated in double precision with only one
+    box in memory at any time.
+
+    :param subdomain: The index of the subdomain.
+    :param filenames: Dictionary mapping the name of each output box file
+        to the corresponding box files of all events.
+    :param output_folder: The folder to write the summed box files to.
+    """
+    for output_filename, input_filenames in sorted(filenames.items()):
+        total = None
+        for filename in input_filenames:
+            data = read_box_file(filename)
+            if total is None:
+                total = np.zeros(data.shape, dtype=np.float64)
+            elif data.shape != total.shape:
+                msg = ("Box file '%s' of subdomain %i has a different size "
+                       "than the ones of the other events." % (
+                           filename, subdomain))
+                raise ValueError(msg)
+            np.add(total, data, out=total)
+            del data
+        write_box_file(os.path.join(output_folder, output_filename), total)
+
+
+def smooth_kernel_subdomain(subdomain, input_folder, output_folder,
+                            horizontal_smoothing_in_degree=None,
+                            vertical_smoothing_in_km=None):
+    """
+    Smooths all components of a single subdomain of a kernel.
+
+    Only the subdomain and its halo are read from the input kernel. The
+    smoothed box files are written with the same names to the output
+    folder.
+
+    :param subdomain: The index of the subdomain.
+    :param input_folder: The folder with the kernel and its boxfile.
+    :param output_folder: The folder to write the smoothed box files to.
+    :param horizontal_smoothing_in_degree: The standard deviation of the
+        Gaussian along the latitude and longitude axes of the grid.
+    :param vertical_smoothing_in_km: The standard deviation of the Gaussian
+        along the depth axis of the grid.
+    """
+    from lasif.ses3d_models import RawSES3DModelHandler
+
+    handler = RawSES3DModelHandler(input_folder, domain=None,
+                                   model_type="kernel")
+    weights = get_smoothing_weights(
+        handler, horizontal_smoothing_in_degree=horizontal_smoothing_in_degree,
+        vertical_smoothing_in_km=vertical_smoothing_in_km)
+    lpd = handler.lagrange_polynomial_degree
+    domain = handler.setup["subdomains"][subdomain]
+
+    # Range of the subdomain and of its halo along each axis.
+    ranges = []
+    halo_ranges = []
+    for axis, axis_weights in zip("xyz", weights):
+        start = lpd * domain["boundaries_%s" % axis][0]
+        stop = lpd * (domain["boundaries_%s" % axis][1] + 1) + 1
+        ranges.append((start, stop))
+        if axis_weights is None:
+            halo_ranges.append((start, stop))
+            continue
+        columns = np.nonzero(axis_weights[start:stop].any(axis=0))[0]
+        halo_ranges.append((columns[0], columns[-1] + 1))
+
+    for component, info in sorted(handler.components.items()):
+        data = handler.get_region(component, *halo_ranges).astype(np.float64)
+        for axis, axis_weights in enumerate(weights):
+            if axis_weights is None:
+                continue
+            (start, stop), (h_start, h_stop) = \
+                ranges[axis], halo_ranges[axis]
+            data = np.moveaxis(np.tensordot(
+                axis_weights[start:stop, h_start:h_stop], data,
+                axes=(1, axis)), 0, axis)
+        write_box_file(
+            os.path.join(output_folder,
+                         os.path.basename(info["filenames"][subdomain])),
+            points_to_box(data, lpd))
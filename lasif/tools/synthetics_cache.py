@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Materialized cache of the final synthetics.
+
+Reading synthetics involves reading all files of a station, mapping and
+rotating SES3D components, and applying the project's
+``process_synthetics`` function. The window selection, the adjoint sources,
+the misfit GUI, and the plotting all do this over and over again for the
+same stations. :class:`SyntheticsCache` stores the final synthetics of each
+station so they only have to be assembled once.
+
+Every station is stored as a ``.npy`` file with the concatenated data of all
+traces and a ``.json`` file with the complete trace headers and the key the
+data has been created with. The data is memory-mapped when read. Entries
+with a different key are simply overwritten. Synthetics with headers that
+cannot be stored as JSON are not cached.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import collections.abc
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# Increase whenever the way the synthetics are assembled or stored changes.
+FORMAT_VERSION = 2
+
+# Header entries derived from the others when the traces are created again.
+_DERIVED_STATS = ("endtime", "npts", "sampling_rate")
+
+
+def get_file_hash(filename, block_size=2 ** 20):
+    """
+    SHA1 hash of a file's content.
+
+    :param filename: The file to hash.
+    :param block_size: Number of bytes read at once.
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as fh:
+        while True:
+            data = fh.read(block_size)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def get_key(*values):
+    """
+    Key of an entry from any number of values with a stable representation.
+
+    >>> get_key("a", 1, [2.0, None]) == get_key("a", 1, [2.0, None])
+    True
+    >>> get_key("a", 1) == get_key("a", 2)
+    False
+    """
+    return hashlib.sha1(json.dumps(
+        [FORMAT_VERSION] + list(values), sort_keys=True,
+        default=str).encode("utf-8")).hexdigest()
+
+
+def _encode_stats_value(value):
+    """
+    JSON representation of a value of a trace header. Raises a
+    ``TypeError`` for values that cannot be represented.
+
+    >>> import obspy
+    >>> _encode_stats_value({"a": [np.float32(1.5)]})
+    {'__type__': 'AttribDict', 'value': {'a': [1.5]}}
+    >>> _encode_stats_value(obspy.UTCDateTime(ns=123))
+    {'__type__': 'UTCDateTime', 'value': 123}
+    """
+    import obspy
+
+    if isinstance(value, obspy.UTCDateTime):
+        return {"__type__": "UTCDateTime", "value": value.ns}
+    if isinstance(value, collections.abc.Mapping):
+        return {"__type__": "AttribDict",
+                "value": {str(key): _encode_stats_value(item)
+                          for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return [_encode_stats_value(_i) for _i in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError("Header value %r cannot be stored." % (value,))
+
+
+def _decode_stats_value(value):
+    """
+    Inverse of :func:`_encode_stats_value`.
+
+    >>> _decode_stats_value(_encode_stats_value({"a": [1, "b"]}))
+    AttribDict({'a': [1, 'b']})
+    """
+    import obspy
+    from obspy.core.util import AttribDict
+
+    if isinstance(value, list):
+        return [_decode_stats_value(_i) for _i in value]
+    if not isinstance(value, dict):
+        return value
+    if value["__type__"] == "UTCDateTime":
+        return obspy.UTCDateTime(ns=value["value"])
+    return AttribDict({key: _decode_stats_value(item)
+                       for key, item in value["value"].items()})
+
+
+class SyntheticsCache(object):
+    """
+    Folder of materialized synthetics per event, iteration, and station.
+    """
+    def __init__(self, folder):
+        """
+        :param folder: The folder storing the synthetics.
+        """
+        self.folder = folder
+
+    def _get_filenames(self, event_name, long_iteration_name, station_id):
+        basename = os.path.join(self.folder, event_name, long_iteration_name,
+                                station_id)
+        return basename + os.path.extsep + "npy", \
+            basename + os.path.extsep + "json"
+
+    def get(self, event_name, long_iteration_name, station_id, key):
+        """
+        Returns the stored synthetics as a
+        :class:`~obspy.core.stream.Stream` object or ``None`` if they do not
+        exist or have been stored with a different key.
+
+        The data of the traces is memory-mapped copy-on-write so it can be
+        modified in memory without changing the stored data.
+
+        :param event_name: The name of the event.
+        :param long_iteration_name: The long name of the iteration.
+        :param station_id: The id of the station in the form ``NET.STA``.
+        :param key: The key the synthetics must have been stored with.
+        """
+        import obspy
+
+        data_file, header_file = self._get_filenames(
+            event_name, long_iteration_name, station_id)
+        try:
+            with open(header_file, "rt") as fh:
+                header = json.load(fh)
+            if header["key"] != key:
+                return None
+            data = np.load(data_file, mmap_mode="c")
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        st = obspy.Stream()
+        offset = 0
+        for trace in header["traces"]:
+            npts = trace["npts"]
+            tr_data = data[offset:offset + npts]
+            if tr_data.dtype != np.dtype(trace["dtype"]):
+                tr_data = tr_data.astype(trace["dtype"])
+            st.append(obspy.Trace(data=tr_data, header=_decode_stats_value(
+                trace["stats"])))
+            offset += npts
+        return st
+
+    def put(self, event_name, long_iteration_name, station_id, key, st):
+        """
+        Stores the synthetics of a station. Returns ``False`` without
+        storing anything if a trace header contains values that cannot be
+        stored, ``True`` otherwise.
+
+        :param event_name: The name of the event.
+        :param long_iteration_name: The long name of the iteration.
+        :param station_id: The id of the station in the form ``NET.STA``.
+        :param key: The key identifying the inputs of the synthetics.
+        :param st: The final synthetics as a
+            :class:`~obspy.core.stream.Stream` object.
+        """
+        traces = []
+        for tr in st:
+            stats = dict((key, value) for key, value in tr.stats.items()
+                         if key not in _DERIVED_STATS)
+            try:
+                stats = _encode_stats_value(stats)
+            except TypeError:
+                return False
+            traces.append({"npts": len(tr.data), "dtype": tr.data.dtype.str,
+                           "stats": stats})
+
+        data_file, header_file = self._get_filenames(
+            event_name, long_iteration_name, station_id)
+        folder = os.path.dirname(data_file)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Another process might have created it in the meanwhile.
+                if not os.path.exists(folder):
+                    raise
+
+        dtype = np.result_type(*[tr.data for tr in st]) if len(st) \
+            else np.float64
+        data = np.concatenate([np.require(tr.data, dtype=dtype)
+                               for tr in st]) if len(st) \
+            else np.empty(0, dtype=dtype)
+
+        # Write atomically as other processes might read it. The header is
+        # removed first and written last so it only refers to complete data.
+        if os.path.exists(header_file):
+            os.remove(header_file)
+        suffix = "_%i.tmp" % os.getpid()
+        np.save(data_file + suffix + ".npy", data)
+        os.rename(data_file + suffix + ".npy", data_file)
+        with open(header_file + suffix, "wt") as fh:
+            json.dump({"key": key, "traces": traces}, fh)
+        os.rename(header_file + suffix, header_file)
+        return True
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent lookup table of first arrival travel times.
+
+Computing travel times with TauP for every single channel is expensive and
+by far the slowest part of setting up the data preprocessing and the window
+selection. The same source depths are used over and over again so this
+module tabulates the first arrival of a phase on a grid of source depths and
+epicentral distances and interpolates in it.
+
+Depth rows are only computed once they are actually needed and are stored
+in the project's cache folder so they are shared between runs.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013-2015
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import numpy as np
+
+
+class TravelTimeTable(object):
+    """
+    Table of first arrival travel times of a phase indexed by source depth
+    and epicentral distance.
+
+    If an arrival with a purist name equal to the phase name exists, the
+    first of these is used, otherwise the first of all arrivals. This
+    results in the direct P wave for ``"P"`` and in the first arriving P
+    wave of any kind for ``"ttp"``.
+
+    >>> table = TravelTimeTable(phase="P")
+    >>> print("%.1f" % table.get_first_arrival(10.0, 30.0))
+    368.7
+    >>> table.get_first_arrival(10.0, [30.0, 60.0, 120.0]).round(1)
+    array([368.7, 606.7,   nan])
+    """
+    def __init__(self, model="ak135", phase="P", filename=None,
+                 depth_spacing_in_km=5.0, distance_spacing_in_deg=0.5,
+                 max_depth_in_km=800.0):
+        """
+        :param model: The name of the 1D Earth model.
+        :param phase: The name of the phase.
+        :param filename: File to store the table in. It will be kept in
+            memory only if not given.
+        :param depth_spacing_in_km: Spacing of the depth grid in km.
+        :param distance_spacing_in_deg: Spacing of the distance grid in
+            degree.
+        :param max_depth_in_km: The maximum depth of the grid. Deeper
+            sources are calculated directly with TauP.
+        """
+        self.model_name = model
+        self.phase = phase
+        self.filename = filename
+
+        self.depths = np.arange(
+            0.0, max_depth_in_km + depth_spacing_in_km / 2.0,
+            depth_spacing_in_km)
+        self.distances = np.arange(
+            0.0, 180.0 + distance_spacing_in_deg / 2.0,
+            distance_spacing_in_deg)
+
+        # Not yet computed rows are marked by the computed array, missing
+        # arrivals by NaN.
+        self.times = np.empty((len(self.depths), len(self.distances)),
+                              dtype=np.float64)
+        self.times[:] = np.nan
+        self.computed = np.zeros(len(self.depths), dtype=bool)
+
+        self.__model = None
+
+        if self.filename and os.path.exists(self.filename):
+            self._load()
+
+    def __str__(self):
+        return ("Travel time table for phase '%s' in model '%s' "
+                "(%i of %i depths computed)" % (
+                    self.phase, self.model_name, self.computed.sum(),
+                    len(self.depths)))
+
+    @property
+    def model(self):
+        if self.__model is None:
+            from obspy.taup import TauPyModel
+            self.__model = TauPyModel(self.model_name)
+        return self.__model
+
+    def _read_compatible(self):
+        """
+        Returns the times and the computed rows from the file or None if
+        the file does not exist or belongs to a different table.
+        """
+        try:
+            with np.load(self.filename) as f:
+                if str(f["model"]) != self.model_name or \
+                        str(f["phase"]) != self.phase or \
+                        not np.array_equal(f["depths"], self.depths) or \
+                        not np.array_equal(f["distances"], self.distances):
+                    return None
+                return f["times"], f["computed"]
+        except Exception:
+            return None
+
+    def _load(self):
+        contents = self._read_compatible()
+        if contents is None:
+            return
+        self.times[:], self.computed[:] = contents
+
+    def _save(self):
+        """
+        Writes the table. Rows computed by other processes in the meantime
+        are kept. The file is replaced atomically.
+        """
+        if not self.filename:
+            return
+        contents = self._read_compatible() if os.path.exists(
+            self.filename) else None
+        if contents is not None:
+            times, computed = contents
+            missing = computed & ~self.computed
+            self.times[missing] = times[missing]
+            self.computed |= missing
+
+        temp_filename = "%s_%i.tmp.npz" % (
+            os.path.splitext(self.filename)[0], os.getpid())
+        np.savez(temp_filename, model=self.model_name, phase=self.phase,
+                 depths=self.depths, distances=self.distances,
+                 times=self.times, computed=self.computed)
+        os.rename(temp_filename, self.filename)
+
+    def _pick_arrival(self, arrivals):
+        if not arrivals:
+            return np.nan
+        purist = [_i for _i in arrivals if _i.purist_name == self.phase]
+        return min(_i.time for _i in (purist or arrivals))
+
+    def _compute_row(self, depth_index):
+        """
+        Computes all distances for one source depth. Depth correcting the
+        model and setting up the phases is only done once per row.
+
+        This mirrors what :meth:`obspy.taup.TauPyModel.get_travel_times`
+        does internally and thus uses some of ObsPy's TauP internals. The
+        test suite compares the rows with TauP.
+        """
+        from obspy.taup.helper_classes import TauModelError
+        from obspy.taup.seismic_phase import SeismicPhase
+        from obspy.taup.utils import parse_phase_list
+
+        tau_model = self.model.model.depth_correct(
+            self.depths[depth_index])
+        phases = []
+        for name in parse_phase_list([self.phase]):
+            try:
+                phases.append(SeismicPhase(name, tau_model))
+            except TauModelError:
+                # TauP also skips phases not existing for a given source
+                # depth.
+                continue
+
+        for _j, distance in enumerate(self.distances):
+            arrivals = []
+            for phase in phases:
+                arrivals.extend(phase.calc_time(distance))
+            self.times[depth_index, _j] = self._pick_arrival(arrivals)
+        self.computed[depth_index] = True
+
+    def _calculate_exactly(self, depth_in_km, distance_in_degree):
+        return self._pick_arrival(self.model.get_travel_times(
+            source_depth_in_km=depth_in_km,
+            distance_in_degree=distance_in_degree,
+            phase_list=[self.phase]))
+
+    def get_first_arrival(self, depth_in_km, distance_in_degree):
+        """
+        Returns the travel time of the first arrival in seconds.
+
+        Both arguments can be scalars or arrays which are broadcast against
+        each other. The times are bilinearly interpolated in the table.
+        Points at which not all surrounding grid points have an arrival,
+        e.g. close to a shadow zone, and sources deeper than the table are
+        calculated directly with TauP. NaN denotes that the phase does not
+        exist.
+
+        :param depth_in_km: The source depth in km.
+        :param distance_in_degree: The epicentral distance in degree.
+        """
+        depth, distance = np.broadcast_arrays(
+            np.asarray(depth_in_km, dtype=np.float64),
+            np.asarray(distance_in_degree, dtype=np.float64))
+        shape = depth.shape
+        depth = depth.ravel()
+        distance = distance.ravel()
+
+        in_table = (depth >= self.depths[0]) & \
+            (depth <= self.depths[-1]) & \
+            (distance >= self.distances[0]) & \
+            (distance <= self.distances[-1])
+
+        d_delta = self.depths[1] - self.depths[0]
+        x_delta = self.distances[1] - self.distances[0]
+        d_idx = np.clip(((depth[in_table] - self.depths[0]) //
+                         d_delta).astype(np.int64), 0, len(self.depths) - 2)
+        x_idx = np.clip(((distance[in_table] - self.distances[0]) //
+                         x_delta).astype(np.int64),
+                        0, len(self.distances) - 2)
+
+        # Fill the missing depth rows.
+        required = np.unique(np.concatenate([d_idx, d_idx + 1]))
+        required = required[~self.computed[required]]
+        for _i in required:
+            self._compute_row(_i)
+        if len(required):
+            self._save()
+
+        corners = np.array([self.times[d_idx, x_idx],
+                            self.times[d_idx, x_idx + 1],
+                            self.times[d_idx + 1, x_idx],
+                            self.times[d_idx + 1, x_idx + 1]])
+        d_frac = (depth[in_table] - self.depths[d_idx]) / d_delta
+        x_frac = (distance[in_table] - self.distances[x_idx]) / x_delta
+        weights = np.array([(1.0 - d_frac) * (1.0 - x_frac),
+                            (1.0 - d_frac) * x_frac,
+                            d_frac * (1.0 - x_frac),
+                            d_frac * x_frac])
+
+        result = np.empty(len(depth), dtype=np.float64)
+        result[:] = np.nan
+        result[in_table] = (weights * corners).sum(axis=0)
+
+        # Directly calculate everything outside of the table and cells at
+        # the edges of the region in which the phase exists. If none of the
+        # grid points has an arrival, the phase does not exist.
+        exact = ~in_table
+        exact[in_table] = np.isnan(corners).any(axis=0) & \
+            ~np.isnan(corners).all(axis=0)
+        for _i in np.where(exact)[0]:
+            result[_i] = self._calculate_exactly(depth[_i], distance[_i])
+
+        if not shape:
+            return float(result[0])
+        return result.reshape(shape)
@@ -23,6 +23,13 @@ each defining a single window with an associated misfit and adjoint source.
 Windows are serialized at the :class:`~WindowCollection` level so remember
 to call :meth:`~WindowCollection.write` when adding/removing/changing windows.
 
+All windows of one event and iteration are stored in a single SQLite
+database managed by :class:`~WindowStore` with one row per window. Looking up
+the windows of a channel or a station is thus an indexed query instead of
+parsing one XML file per channel. The XML format described below is still
+used to import and export windows. Existing XML window files are imported
+when the database is created.
+
 One thing to keep in mind is that a window can be in several "states" for
 lack of a better word. Each an every window will always be defined by a
 start time, an end time, a weight normalized between 0.0 and 1.0, a tapering
@@ -82,17 +89,174 @@ All other parameters are optional and misfit specific.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
+import collections
 from glob import iglob
 from obspy import UTCDateTime
 from lxml import etree
 from lxml.builder import E
 import os
+import sqlite3
 
 from lasif import LASIFAdjointSourceCalculationError
 
 # XXX: Change this!
 DEFAULT_AD_SRC_TYPE = "TimeFrequencyPhaseMisfitFichtner2008"
 
+# Name of the window database in each window directory.
+WINDOW_STORE_FILENAME = "windows.sqlite"
+
+
+def _channel2station(channel_id):
+    return ".".join(channel_id.split(".")[:2])
+
+
+class WindowStore(object):
+    """
+    SQLite database with all windows of one event and one iteration.
+
+    Each window is one row with its channel and station id, its start and
+    end time in nanoseconds, weight, taper, taper percentage, and misfit
+    type. Windows keep the order in which they have been added.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), "windows.sqlite")
+    >>> store = WindowStore(filename)
+    >>> store.replace_windows({"BW.ALTM..HHZ": [Window(
+    ...     UTCDateTime(2012, 1, 1), UTCDateTime(2012, 1, 1, 0, 1), 1.0,
+    ...     "cosine", 0.05)]})
+    >>> store.list_channels()
+    ['BW.ALTM..HHZ']
+    >>> store.get_windows("BW.ALTM..HHZ")[0]["endtime"]
+    UTCDateTime(2012, 1, 1, 0, 1)
+    """
+    def __init__(self, filename):
+        """
+        :param filename: The database file. Will be created if it does not
+            exist.
+        """
+        self.filename = filename
+        self.db_conn = sqlite3.connect(filename, timeout=60.0)
+        self.db_cursor = self.db_conn.cursor()
+        with self.db_conn:
+            self.db_cursor.execute("""
+                CREATE TABLE IF NOT EXISTS windows (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT NOT NULL,
+                    station_id TEXT NOT NULL,
+                    starttime_ns INTEGER NOT NULL,
+                    endtime_ns INTEGER NOT NULL,
+                    weight REAL NOT NULL,
+                    taper TEXT NOT NULL,
+                    taper_percentage REAL NOT NULL,
+                    misfit_type TEXT
+                );""")
+            self.db_cursor.execute(
+                "CREATE INDEX IF NOT EXISTS windows_channel_id "
+                "ON windows(channel_id);")
+            self.db_cursor.execute(
+                "CREATE INDEX IF NOT EXISTS windows_station_id "
+                "ON windows(station_id);")
+
+    def __del__(self):
+        try:
+            self.db_conn.close()
+        except Exception:
+            pass
+
+    def _query(self, where="", arguments=()):
+        """
+        Returns the windows matching the where clause as an ordered
+        dictionary of lists of window dictionaries per channel.
+        """
+        windows = collections.OrderedDict()
+        for row in self.db_cursor.execute(
+                "SELECT channel_id, starttime_ns, endtime_ns, weight, taper, "
+                "taper_percentage, misfit_type FROM windows %s "
+                "ORDER BY channel_id, id;" % where, arguments):
+            windows.setdefault(row[0], []).append({
+                "starttime": UTCDateTime(ns=row[1]),
+                "endtime": UTCDateTime(ns=row[2]),
+                "weight": row[3],
+                "taper": row[4],
+                "taper_percentage": row[5],
+                "misfit_type": row[6]})
+        return windows
+
+    def list_channels(self):
+        """
+        Returns a sorted list of all channel ids with windows.
+        """
+        return [_i[0] for _i in self.db_cursor.execute(
+            "SELECT DISTINCT channel_id FROM windows ORDER BY channel_id;")]
+
+    def get_windows(self, channel_id):
+        """
+        Returns a list of window dictionaries for one channel.
+
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA
+        """
+        return self._query("WHERE channel_id = ?", (channel_id,)).get(
+            channel_id, [])
+
+    def get_windows_for_station(self, station_id):
+        """
+        Returns the lists of window dictionaries per channel for one
+        station.
+
+        :param station_id: The station id in the form NET.STA
+        """
+        return self._query("WHERE station_id = ?", (station_id,))
+
+    def get_all_windows(self):
+        """
+        Returns the lists of window dictionaries of all channels.
+        """
+        return self._query()
+
+    def replace_windows(self, windows, stations=()):
+        """
+        Replaces the windows of channels and stations in one transaction.
+
+        :param windows: A dictionary with lists of
+            :class:`~lasif.window_manager.Window` objects per channel id.
+            Existing windows of these channels are replaced. An empty list
+            deletes the windows of the channel.
+        :param stations: Station ids of which all windows are deleted before
+            the new windows are inserted.
+        """
+        with self.db_conn:
+            self.db_cursor.executemany(
+                "DELETE FROM windows WHERE station_id = ?;",
+                [(_i,) for _i in stations])
+            self.db_cursor.executemany(
+                "DELETE FROM windows WHERE channel_id = ?;",
+                [(_i,) for _i in windows.keys()])
+            self.db_cursor.executemany(
+                "INSERT INTO windows (channel_id, station_id, starttime_ns, "
+                "endtime_ns, weight, taper, taper_percentage, misfit_type) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                [(channel_id, _channel2station(channel_id), w.starttime.ns,
+                  w.endtime.ns, w.weight, w.taper, w.taper_percentage,
+                  w.misfit_type)
+                 for channel_id in sorted(windows.keys())
+                 for w in windows[channel_id]])
+
+    def delete_windows_for_channel(self, channel_id):
+        """
+        Deletes all windows of one channel.
+
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA
+        """
+        self.replace_windows({channel_id: []})
+
+    def delete_windows_for_station(self, station_id):
+        """
+        Deletes all windows of one station.
+
+        :param station_id: The station id in the form NET.STA
+        """
+        self.replace_windows({}, stations=[station_id])
+
 
 class WindowGroupManager(object):
     """
@@ -115,9 +279,16 @@ class WindowGroupManager(object):
         self._event_name = event_name
         self.comm = comm
 
+        store_filename = os.path.join(self._directory, WINDOW_STORE_FILENAME)
+        is_new = not os.path.exists(store_filename)
+        self._store = WindowStore(store_filename)
+        # Take over the windows of projects still using the XML files.
+        if is_new:
+            self.import_xml()
+
     def __iter__(self):
-        for channel_id in self.list():
-            yield self.get(channel_id)
+        for window_collection in self.get_all_windows().values():
+            yield window_collection
 
     def __len__(self):
         return len(self.list())
@@ -133,13 +304,21 @@ class WindowGroupManager(object):
 
     def list(self):
         """
-        Returns a list of station ids with windows.
+        Returns a list of channel ids with windows.
         """
-        windows = []
-        for filename in iglob(os.path.join(self._directory, "window_*.xml")):
-            windows.append(os.path.basename(filename).lstrip("window_")
-                           .rstrip(".xml"))
-        return sorted(windows)
+        return self._store.list_channels()
+
+    def _get_collection(self, channel_id, windows=None):
+        collection = WindowCollection(
+            filename=self._get_window_filename(channel_id),
+            windows=[], comm=self.comm, event_name=self._event_name,
+            channel_id=channel_id, synthetics_tag=self._synthetic_tag,
+            store=self._store)
+        if windows is None:
+            windows = self._store.get_windows(channel_id)
+        for w in windows:
+            collection.add_window(**w)
+        return collection
 
     def get(self, channel_id):
         """
@@ -147,13 +326,7 @@ class WindowGroupManager(object):
 
         :param channel_id: The id of the channel in the form NET.STA.LOC.CHA
         """
-        windowfile = self._get_window_filename(channel_id)
-        if not os.path.exists(windowfile):
-            return WindowCollection(
-                filename=windowfile, comm=self.comm,
-                event_name=self._event_name, channel_id=channel_id,
-                synthetics_tag=self._synthetic_tag)
-        return WindowCollection(filename=windowfile, comm=self.comm)
+        return self._get_collection(channel_id)
 
     def get_windows_for_station(self, station_id):
         """
@@ -161,37 +334,102 @@ class WindowGroupManager(object):
 
         :param station_id: The id of the station in the form NET.STA
         """
-        channels = [_i for _i in self.list()
-                    if _i.startswith(station_id + ".")]
-        windows = []
-        for channel_id in channels:
-            windows.append(self.get(channel_id))
-        return windows
+        return [self._get_collection(channel_id, windows)
+                for channel_id, windows in
+                self._store.get_windows_for_station(station_id).items()]
+
+    def get_all_windows(self):
+        """
+        Get the window collection objects of all channels with a single
+        query.
+
+        :returns: An ordered dictionary of window collections keyed by
+            channel id.
+        """
+        return collections.OrderedDict(
+            (channel_id, self._get_collection(channel_id, windows))
+            for channel_id, windows in
+            self._store.get_all_windows().items())
+
+    def replace_windows(self, windows, stations=()):
+        """
+        Replaces the windows of many channels at once.
+
+        :param windows: A dictionary with lists of (starttime, endtime)
+            tuples or :class:`~Window` objects per channel id. All existing
+            windows of these channels are replaced.
+        :param stations: Station ids of which all existing windows will be
+            deleted.
+        """
+        new_windows = {}
+        for channel_id, channel_windows in windows.items():
+            collection = self._get_collection(channel_id, windows=[])
+            for w in channel_windows:
+                if isinstance(w, Window):
+                    collection.add_window(
+                        starttime=w.starttime, endtime=w.endtime,
+                        weight=w.weight, taper=w.taper,
+                        taper_percentage=w.taper_percentage,
+                        misfit_type=w.misfit_type)
+                else:
+                    collection.add_window(starttime=w[0], endtime=w[1])
+            new_windows[channel_id] = collection.windows
+        self._store.replace_windows(new_windows, stations=stations)
 
     def delete_windows_for_channel(self, channel_id):
         """
-        Deletes all windows for a certain channel by removing the window
-        file for the channel.
+        Deletes all windows for a certain channel.
 
         :param channel_id: The channel id for the windows to delete in the
             form NET.STA.LOC.CHA
         """
-        windowfile = self._get_window_filename(channel_id)
-        if os.path.exists(windowfile):
-            os.remove(windowfile)
+        self._store.delete_windows_for_channel(channel_id)
 
     def delete_windows_for_station(self, station_id):
         """
-        Deletes all windows for a certain station by removing all window
-        files for the station.
+        Deletes all windows for a certain station.
 
         :param station_id: The station id for the windows to delete in the
             form NET.STA
         """
-        channel_ids = [_i for _i in self.list()
-                       if _i.startswith(station_id + ".")]
-        for channel in channel_ids:
-            self.delete_windows_for_channel(channel)
+        self._store.delete_windows_for_station(station_id)
+
+    def import_xml(self, directory=None):
+        """
+        Imports window XML files. The windows of all channels with a file
+        are replaced.
+
+        :param directory: The directory with the ``window_*.xml`` files.
+            Defaults to the window directory of the event and iteration.
+        :returns: The number of imported files.
+        """
+        directory = directory or self._directory
+        windows = {}
+        for filename in iglob(os.path.join(directory, "window_*.xml")):
+            collection = WindowCollection(filename=filename)
+            windows[collection.channel_id] = collection.windows
+        self._store.replace_windows(windows)
+        return len(windows)
+
+    def export_xml(self, directory=None):
+        """
+        Exports the windows to one XML file per channel.
+
+        :param directory: The directory for the ``window_*.xml`` files.
+            Defaults to the window directory of the event and iteration.
+        :returns: The number of written files.
+        """
+        directory = directory or self._directory
+        window_collections = self.get_all_windows()
+        for channel_id, collection in window_collections.items():
+            filename = os.path.join(directory, "window_%s.xml" % channel_id)
+            if os.path.exists(filename):
+                os.remove(filename)
+            WindowCollection(
+                filename=filename, windows=collection.windows,
+                event_name=self._event_name, channel_id=channel_id,
+                synthetics_tag=self._synthetic_tag).write()
+        return len(window_collections)
 
     def _get_window_filename(self, channel_id):
         return os.path.join(self._directory, "window_%s.xml" % channel_id)
@@ -204,12 +442,23 @@ class WindowCollection(object):
     """
 
     def __init__(self, filename, windows=None, event_name=None,
-                 channel_id=None, synthetics_tag=None, comm=None):
-        if windows and os.path.exists(filename):
+                 channel_id=None, synthetics_tag=None, comm=None,
+                 store=None):
+        """
+        :param filename: The XML file of the windows.
+        :param windows: The windows if the file does not yet exist.
+        :param event_name: The name of the event.
+        :param channel_id: The channel id in the form NET.STA.LOC.CHA
+        :param synthetics_tag: The iteration name.
+        :param comm: The communicator instance.
+        :param store: A :class:`~WindowStore`. If given, the windows are
+            written to it instead of to the XML file.
+        """
+        if store is None and windows and os.path.exists(filename):
             raise ValueError("An existing file and new windows is not "
                              "allowed. Either only a file or windows and a "
                              "non-existing file")
-        if not os.path.exists(filename) and \
+        if (store is not None or not os.path.exists(filename)) and \
                 None in [event_name, channel_id, synthetics_tag]:
             raise ValueError("If the file does not yet exist, "
                              "'event_name', 'channel_id', "
@@ -220,9 +469,10 @@ class WindowCollection(object):
         self.channel_id = channel_id
         self.synthetics_tag = synthetics_tag
         self.comm = comm
+        self.store = store
         self.windows = []
 
-        if os.path.exists(filename):
+        if store is None and os.path.exists(filename):
             self._parse()
         else:
             if windows:
@@ -397,10 +647,15 @@ class WindowCollection(object):
 
     def write(self):
         """
-        Writes the window group to the specified filename.
+        Writes the window group to the window store or, without a store, to
+        the specified filename.
 
         Will delete a possibly exiting file if the collection has no windows.
         """
+        if self.store is not None:
+            self.store.replace_windows({self.channel_id: self.windows})
+            return
+
         # A window collection that has no windows will attempt to remove its
         # own file if it has no windows without emitting a warnings.
         if not self.windows:
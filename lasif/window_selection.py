@@ -26,6 +26,8 @@ from obspy import geodetics
 import obspy.signal.filter
 from scipy.signal import argrelextrema
 
+from lasif import LASIFError
+
 
 def flatnotmasked_contiguous(time_windows):
     """
@@ -203,21 +205,81 @@ def _plot_mask(new_mask, old_mask, name=None):
     plt.gca().xaxis.set_ticklabels([])
 
 
-def _window_generator(data_length, window_width):
-    """
-    Simple generator yielding start and stop indices for sliding windows.
+# Maximum number of elements of the temporary 2-D arrays of the sliding
+# cross correlation. Longer traces are processed in chunks of windows.
+MAX_CHUNK_ELEMENTS = 2 ** 22
+
 
-    :param data_length: The complete length of the data series over which to
-        slide the window.
-    :param window_width: The desired window width.
+def _sliding_cross_correlation(data, synthetic, taper, window_starts,
+                               chunk_size=None):
     """
-    window_start = 0
-    while True:
-        window_end = window_start + window_width
-        if window_end > data_length:
-            break
-        yield (window_start, window_end, window_start + window_width // 2)
-        window_start += 1
+    Cross correlates tapered windows of data and synthetics for all given
+    window start indices at once.
+
+    The correlations are computed by batched FFTs of strided views of the
+    traces and are identical to ``np.correlate(data_window,
+    synthetic_window, mode="full")`` up to round-off.
+
+    >>> data = np.array([0.0, 0.0, 1.0, 2.0, 1.0, 0.0, 0.0])
+    >>> synthetic = np.array([0.0, 1.0, 2.0, 1.0, 0.0, 0.0, 0.0])
+    >>> shift, cc, ptp = _sliding_cross_correlation(
+    ...     data, synthetic, np.ones(5), np.array([0, 1]))
+    >>> shift
+    array([1, 1])
+    >>> cc.round(3)
+    array([1., 1.])
+
+    :param data: The data.
+    :param synthetic: The synthetics.
+    :param taper: The taper applied to each window. Its length determines
+        the length of the windows.
+    :param window_starts: Indices of the first samples of the windows.
+    :param chunk_size: Number of windows correlated at once. Chosen to bound
+        the memory usage if not given.
+    :returns: The time shifts of the synthetics relative to the data in
+        samples, the normalized maximum cross correlation coefficients, and
+        the peak to peak amplitudes of the tapered synthetic windows.
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+    from scipy.fft import next_fast_len
+
+    window_length = len(taper)
+    time_shift = np.zeros(len(window_starts), dtype=np.int64)
+    max_cc_value = np.zeros(len(window_starts), dtype=np.float64)
+    synthetic_ptp = np.zeros(len(window_starts), dtype=np.float64)
+    # Traces shorter than a window have no windows.
+    if not len(window_starts) or len(data) < window_length:
+        return time_shift[:0], max_cc_value[:0], synthetic_ptp[:0]
+
+    nfft = next_fast_len(2 * window_length - 1, real=True)
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // nfft)
+
+    data_windows = sliding_window_view(
+        np.asarray(data, dtype=np.float64), window_length)
+    synthetic_windows = sliding_window_view(
+        np.asarray(synthetic, dtype=np.float64), window_length)
+
+    for i in range(0, len(window_starts), chunk_size):
+        chunk = slice(i, i + chunk_size)
+        d = data_windows[window_starts[chunk]] * taper
+        s = synthetic_windows[window_starts[chunk]] * taper
+
+        # Circular cross correlation without wrap around. Negative lags are
+        # at the end, reorder to the output of np.correlate().
+        cc = np.fft.irfft(np.fft.rfft(d, n=nfft, axis=1) *
+                          np.conj(np.fft.rfft(s, n=nfft, axis=1)),
+                          n=nfft, axis=1)
+        cc = np.concatenate([cc[:, nfft - window_length + 1:],
+                             cc[:, :window_length]], axis=1)
+
+        time_shift[chunk] = cc.argmax(axis=1) - window_length + 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            max_cc_value[chunk] = cc.max(axis=1) / np.sqrt(
+                (s ** 2).sum(axis=1) * (d ** 2).sum(axis=1))
+        synthetic_ptp[chunk] = np.ptp(s, axis=1)
+
+    return time_shift, max_cc_value, synthetic_ptp
 
 
 def _log_window_selection(tr_id, msg):
@@ -230,9 +292,9 @@ def _log_window_selection(tr_id, msg):
     print("[Window selection for %s] %s" % (tr_id, msg))
 
 
-# Dictionary to cache the TauPyModel so there is no need to reinitialize it
-# each time which is a fairly expensive operation.
-TAUPY_MODEL_CACHE = {}
+# Dictionary to cache the travel time table used if none is passed to
+# select_windows() so it is at least shared within a process.
+TRAVEL_TIME_TABLE_CACHE = {}
 
 
 def select_windows(data_trace, synthetic_trace, event_latitude,
@@ -244,7 +306,7 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
                    threshold_correlation=0.75, min_length_period=1.5,
                    min_peaks_troughs=2, max_energy_ratio=10.0,
                    min_envelope_similarity=0.2,
-                   verbose=False, plot=False):
+                   verbose=False, plot=False, travel_time_table=None):
     """
     Window selection algorithm for picking windows suitable for misfit
     calculation based on phase differences.
@@ -310,6 +372,12 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
     :type verbose: bool
     :param plot: Create a plot of the algortihm while it does its work.
     :type plot: bool
+    :param travel_time_table: Table to look up the time of the first
+        arrival in. Must be for the ``"ttp"`` phase. An in-memory table
+        will be used if not given. A :class:`~lasif.LASIFError` is raised
+        if the table has no arrival for the station.
+    :type travel_time_table:
+        :class:`~lasif.tools.travel_time_table.TravelTimeTable`
     """
     # Shortcuts to frequently accessed variables.
     data_starttime = data_trace.stats.starttime
@@ -321,10 +389,12 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
     times = data_trace.times()
 
     # Fill cache if necessary.
-    if not TAUPY_MODEL_CACHE:
-        from obspy.taup import TauPyModel  # NOQA
-        TAUPY_MODEL_CACHE["model"] = TauPyModel("AK135")
-    model = TAUPY_MODEL_CACHE["model"]
+    if travel_time_table is None:
+        if not TRAVEL_TIME_TABLE_CACHE:
+            from lasif.tools.travel_time_table import TravelTimeTable
+            TRAVEL_TIME_TABLE_CACHE["table"] = TravelTimeTable(
+                model="ak135", phase="ttp")
+        travel_time_table = TRAVEL_TIME_TABLE_CACHE["table"]
 
     # -------------------------------------------------------------------------
     # Geographical calculations and the time of the first arrival.
@@ -336,16 +406,17 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
         station_latitude, station_longitude, event_latitude,
         event_longitude)[0] / 1000.0
 
-    # Get only a couple of P phases which should be the first arrival
-    # for every epicentral distance. Its quite a bit faster than calculating
-    # the arrival times for every phase.
+    # Only a couple of P phases which should be the first arrival for every
+    # epicentral distance are tabulated.
     # Assumes the first sample is the centroid time of the event.
-    tts = model.get_travel_times(source_depth_in_km=event_depth_in_km,
-                                 distance_in_degree=dist_in_deg,
-                                 phase_list=["ttp"])
-    # Sort just as a safety measure.
-    tts = sorted(tts, key=lambda x: x.time)
-    first_tt_arrival = tts[0].time
+    first_tt_arrival = travel_time_table.get_first_arrival(
+        event_depth_in_km, dist_in_deg)
+    if np.isnan(first_tt_arrival):
+        raise LASIFError(
+            "No '%s' arrival for channel %s at an epicentral distance of "
+            "%.2f degree and a source depth of %.1f km." % (
+                travel_time_table.phase, data_trace.id, dist_in_deg,
+                event_depth_in_km))
 
     # -------------------------------------------------------------------------
     # Window settings
@@ -565,36 +636,29 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
     max_cc_coeff = np.ma.zeros(npts, dtype="float32")
     max_cc_coeff.mask = True
 
-    for start_idx, end_idx, midpoint_idx in _window_generator(npts,
-                                                              window_length):
-        if not min_idx < midpoint_idx < max_idx:
-            continue
-
-        # Slice windows. Create a copy to be able to taper without affecting
-        # the original time series.
-        data_window = data[start_idx: end_idx].copy() * taper
-        synthetic_window = \
-            synth[start_idx: end_idx].copy() * taper
-
-        # Elimination Stage 2: Skip windows that have essentially no energy
-        # to avoid instabilities. No windows can be picked in these.
-        if synthetic_window.ptp() < synth.ptp() * 0.001:
-            time_windows.mask[midpoint_idx] = True
-            continue
-
-        # Calculate the time shift. Here this is defined as the shift of the
-        # synthetics relative to the data. So a value of 2, for instance, means
-        # that the synthetics are 2 timesteps later then the data.
-        cc = np.correlate(data_window, synthetic_window, mode="full")
-
-        time_shift = cc.argmax() - window_length + 1
-        # Express the time shift in fraction of the minimum period.
-        sliding_time_shift[midpoint_idx] = (time_shift * dt) / minimum_period
-
-        # Normalized cross correlation.
-        max_cc_value = cc.max() / np.sqrt((synthetic_window ** 2).sum() *
-                                          (data_window ** 2).sum())
-        max_cc_coeff[midpoint_idx] = max_cc_value
+    # All windows with a midpoint between the travel time limits.
+    window_starts = np.arange(npts - window_length + 1)
+    midpoints = window_starts + window_length // 2
+    in_range = (min_idx < midpoints) & (midpoints < max_idx)
+    window_starts = window_starts[in_range]
+    midpoints = midpoints[in_range]
+
+    # Calculate the time shifts. Here this is defined as the shift of the
+    # synthetics relative to the data. So a value of 2, for instance, means
+    # that the synthetics are 2 timesteps later then the data.
+    time_shift, max_cc_value, synthetic_ptp = _sliding_cross_correlation(
+        data, synth, taper, window_starts)
+
+    # Elimination Stage 2: Skip windows that have essentially no energy
+    # to avoid instabilities. No windows can be picked in these.
+    no_energy = synthetic_ptp < np.ptp(synth) * 0.001
+    time_windows.mask[midpoints[no_energy]] = True
+
+    # Express the time shift in fraction of the minimum period.
+    sliding_time_shift[midpoints[~no_energy]] = \
+        (time_shift[~no_energy] * dt) / minimum_period
+    # Normalized cross correlation.
+    max_cc_coeff[midpoints[~no_energy]] = max_cc_value[~no_energy]
 
     if plot:
         plt.subplot2grid(grid, (9, 0), rowspan=1)
@@ -850,7 +914,7 @@ def select_windows(data_trace, synthetic_trace, event_latitude,
             continue
 
         # Check that amplitudes in the data are above the noise
-        if noise_absolute / data[j.start: j.stop].ptp() > \
+        if noise_absolute / np.ptp(data[j.start: j.stop]) > \
                 max_noise_window:
             if verbose:
                 _log_window_selection(